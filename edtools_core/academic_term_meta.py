@@ -0,0 +1,139 @@
+"""
+Metadatos de Academic Term usados por la integración Moodle, cacheados por período.
+
+Antes cada fila de un import releía el Academic Term (`get_doc`) y volvía a parsear la etiqueta
+`YYYY (Spring A)` para el nombre de categoría, el term id antiguo y las fechas del curso.
+
+- `parse_term_label`: derivaciones de la etiqueta (sin BD; memoizado en el proceso).
+- `get_term_meta`: fechas, formatos y derivaciones de un Academic Term existente (hash Redis
+  `edtools_academic_term_meta`, con caché local por request). Se invalida en on_update /
+  on_trash / after_rename del Academic Term.
+"""
+
+import calendar
+import datetime
+import re
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+import frappe
+from frappe.utils import getdate
+
+_CACHE_KEY = "edtools_academic_term_meta"
+
+# Código de categoría hija en Moodle: YYYY + código (ej. 202601)
+TERM_CODE_BY_LABEL = {
+    "Spring A": "01",
+    "Spring B": "02",
+    "Summer A": "03",
+    "Summer B": "04",
+    "Fall A": "05",
+    "Fall B": "06",
+}
+
+# Sufijos del formato antiguo de Moodle (pre Spring B 2026).
+# Ej: 202532=Spring A, 202545=Summer B, 202622=Fall A (año siguiente para Fall).
+OLD_TERM_SUFFIX_BY_LABEL = {
+    "Spring A": "32",
+    "Spring B": "35",
+    "Summer A": "42",
+    "Summer B": "45",
+    "Fall A": "22",   # usa año+1: 2025 Fall A -> 202622
+    "Fall B": "25",   # usa año+1: 2025 Fall B -> 202625
+}
+
+_TERM_LABEL_RE = re.compile(r"(\d{4})\s*\((Spring A|Spring B|Summer A|Summer B|Fall A|Fall B)\)")
+
+
+class TermLabel(NamedTuple):
+    year: str
+    season: str
+    code: str
+    category_name: str
+    old_term_id: str
+
+
+@lru_cache(maxsize=512)
+def parse_term_label(term_label: Optional[str]) -> Optional[TermLabel]:
+    """Parsea `YYYY (Spring A)`. Retorna None si la etiqueta no tiene ese formato."""
+    m = _TERM_LABEL_RE.fullmatch((term_label or "").strip())
+    if not m:
+        return None
+    year, season = m.group(1), m.group(2)
+    old_year = int(year) + 1 if season in ("Fall A", "Fall B") else int(year)
+    code = TERM_CODE_BY_LABEL[season]
+    return TermLabel(
+        year=year,
+        season=season,
+        code=code,
+        category_name=f"{year}{code}",
+        old_term_id=f"{old_year}{OLD_TERM_SUFFIX_BY_LABEL[season]}",
+    )
+
+
+def get_old_moodle_term_id(academic_term: Optional[str]) -> Optional[str]:
+    """Term id antiguo de Moodle; `moodle_old_term_ids` en site_config tiene prioridad por período."""
+    if not academic_term or not str(academic_term).strip():
+        return None
+    term = str(academic_term).strip()
+    custom = frappe.conf.get("moodle_old_term_ids") or {}
+    if isinstance(custom, dict) and term in custom:
+        return str(custom[term]).strip()
+    parsed = parse_term_label(term)
+    return parsed.old_term_id if parsed else None
+
+
+def _noon_utc_timestamp(d: datetime.date) -> int:
+    return int(calendar.timegm(datetime.datetime.combine(d, datetime.time(12, 0)).timetuple()))
+
+
+def _build_term_meta(academic_term: str) -> Optional[dict]:
+    row = frappe.db.get_value(
+        "Academic Term",
+        academic_term,
+        ["name", "academic_year", "term_name", "term_start_date", "term_end_date"],
+        as_dict=True,
+    )
+    if not row:
+        return None
+    start = getdate(row.term_start_date) if row.term_start_date else None
+    end = getdate(row.term_end_date) if row.term_end_date else None
+    parsed = parse_term_label(row.name)
+    return {
+        "name": row.name,
+        "academic_year": row.academic_year,
+        "term_name": row.term_name,
+        "start": start,
+        "end": end,
+        # YYYY-MM-DD (Moodle) y M/D/YY (shortname del curso, formato cliente)
+        "start_ymd": start.strftime("%Y-%m-%d") if start else None,
+        "start_mdy": f"{start.month}/{start.day}/{str(start.year)[2:]}" if start else None,
+        # Timestamps a mediodía UTC (startdate/enddate del curso Moodle)
+        "startdate": _noon_utc_timestamp(start) if start else None,
+        "enddate": _noon_utc_timestamp(end) if end else None,
+        "category_name": parsed.category_name if parsed else None,
+    }
+
+
+def get_term_meta(academic_term: Optional[str]) -> Optional[frappe._dict]:
+    """
+    Metadatos del Academic Term (None si no existe):
+    name, academic_year, term_name, start, end, start_ymd, start_mdy, startdate, enddate,
+    category_name (YYYYMM o None si la etiqueta no es válida) y old_term_id.
+    """
+    if not academic_term:
+        return None
+    academic_term = str(academic_term)
+    meta = frappe.cache.hget(_CACHE_KEY, academic_term)
+    if meta is None:
+        meta = _build_term_meta(academic_term)
+        if meta is None:
+            return None
+        frappe.cache.hset(_CACHE_KEY, academic_term, meta)
+    # old_term_id fuera de la caché: el override de site_config puede cambiar sin tocar el término
+    return frappe._dict(meta, old_term_id=get_old_moodle_term_id(academic_term))
+
+
+def invalidate(doc=None, method=None, *args, **kwargs):
+    """doc_event de Academic Term (on_update / on_trash / after_rename): descarta la caché."""
+    frappe.cache.delete_value(_CACHE_KEY)
@@ -5,6 +5,7 @@ import json
 import frappe
 import requests
 from urllib.parse import quote
+from edtools_core import grading_scale_cache
 from edtools_core.fees_events import ensure_local_lang_for_num2words
 from edtools_core.moodle_sync import sync_student_enrollment_to_moodle
 from frappe import _
@@ -1037,16 +1038,7 @@ def get_student_average(student, program=None, academic_year=None, academic_term
     grade = None
     grading_scale = results[0].get("grading_scale") if results else None
     if grading_scale:
-        grade_intervals = frappe.db.get_list(
-            "Grading Scale Interval",
-            filters={"parent": grading_scale},
-            fields=["grade_code", "threshold"],
-            order_by="threshold desc",
-        )
-        for interval in grade_intervals:
-            if average_percentage >= flt(interval.threshold):
-                grade = interval.grade_code
-                break
+        grade = grading_scale_cache.get_grade(grading_scale, average_percentage) or None
 
     return {
         "average_score": round(average_score, 2),
@@ -1064,15 +1056,7 @@ def get_student_average(student, program=None, academic_year=None, academic_term
 
 def _get_grading_scale_intervals(grading_scale):
     """Intervals for a Grading Scale (child table Grading Scale Interval)."""
-    grading_scale = (grading_scale or "").strip()
-    if not grading_scale:
-        return []
-    return frappe.get_all(
-        "Grading Scale Interval",
-        filters={"parent": grading_scale},
-        fields=["grade_code", "threshold"],
-        order_by="threshold desc",
-    )
+    return grading_scale_cache.get_intervals(grading_scale)
 
 
 @frappe.whitelist()
@@ -1116,25 +1100,10 @@ def get_score_for_grade_code(grading_scale, grade_code, maximum_score):
     if maximum_score <= 0:
         return None
 
-    rows = frappe.get_all(
-        "Grading Scale Interval",
-        filters={"parent": grading_scale, "grade_code": code},
-        fields=["threshold"],
-        order_by="threshold asc",
-    )
-    if not rows:
-        for row in frappe.get_all(
-            "Grading Scale Interval",
-            filters={"parent": grading_scale},
-            fields=["grade_code", "threshold"],
-        ):
-            if cstr(row.grade_code).strip().upper() == code.upper():
-                rows = [{"threshold": row.threshold}]
-                break
-    if not rows:
+    threshold = grading_scale_cache.letter_min_threshold(grading_scale, code)
+    if threshold is None:
         return None
 
-    threshold = flt(rows[0].threshold)
     raw = threshold / 100.0 * maximum_score
     precision = cint(frappe.get_system_settings("float_precision")) or 3
     return flt(raw, precision)
@@ -2370,7 +2339,7 @@ def enroll_students(docname):
             )
             
             # 🔥 1️⃣ Sincronizar con Moodle
-            sync_student_enrollment_to_moodle(
+            sync_result = sync_student_enrollment_to_moodle(
                 student=student.student,
                 academic_year=doc.academic_year,
                 academic_term=doc.academic_term,
@@ -2384,6 +2353,8 @@ def enroll_students(docname):
                 "program_enrollment": student.program_enrollment,
                 "course": doc.course
             })
+            if frappe.get_meta("Course Enrollment").has_field("moodle_course_id"):
+                enrollment.moodle_course_id = sync_result.get("moodle_course_id")
             enrollment.insert(ignore_permissions=True)
             
             student.status = "Enrolled"
@@ -2655,19 +2626,28 @@ def webhook_create_moodle_categories(academic_year=None):
 
 
 @frappe.whitelist()
-def upload_grades_file(file_url, grading_scale=None):
+def upload_grades_file(file_url, grading_scale=None, background=0, overwrite_checkpoint=0):
     """
     Importación masiva de notas desde Excel/CSV vía API.
 
     Flujo recomendado: primero subir el archivo con POST /api/method/upload_file,
     luego llamar a este método con el file_url devuelto.
 
+    Por defecto se procesa dentro del request y devuelve el resultado (los archivos grandes pueden
+    cortar por timeout). Con background=1 corre como job en background (el mismo del formulario
+    Grade Import: reanudable, con checkpoints) y el avance se consulta con
+    `edtools_core.grade_import_job.get_import_status`. El job usa el Single "Grade Import": si ahí
+    quedó una importación interrumpida que se puede reanudar, no se reemplaza salvo
+    overwrite_checkpoint=1.
+
     Args:
         file_url: URL del archivo subido (ej. /files/notas.xlsx).
         grading_scale: Nombre de la escala de calificaciones (opcional).
+        background: 0 (por defecto) procesa en el request; 1 encola el job.
+        overwrite_checkpoint: con background=1, descarta una importación interrumpida pendiente.
 
     Returns:
-        dict con success, validation_errors, summary, errors.
+        dict con success, validation_errors, summary, errors (y queued/job_id si background).
     """
     from edtools_core.grade_import import process_grades, _resolve_file_path
 
@@ -2690,6 +2670,34 @@ def upload_grades_file(file_url, grading_scale=None):
         }
 
     grading_scale = (grading_scale or "").strip() or None
+    if cint(background):
+        from edtools_core.grade_import_job import has_resumable_checkpoint, start_import
+
+        if not cint(overwrite_checkpoint) and has_resumable_checkpoint():
+            return {
+                "success": False,
+                "validation_errors": [
+                    {
+                        "row": None,
+                        "message": _(
+                            "Hay una importación de notas interrumpida que se puede reanudar desde Grade Import. "
+                            "Reanúdala o envía overwrite_checkpoint=1 para descartarla."
+                        ),
+                    }
+                ],
+                "summary": None,
+                "errors": [],
+            }
+        queued = start_import(file_url, grading_scale)
+        return {
+            "success": True,
+            "queued": True,
+            "job_id": queued["job_id"],
+            "validation_errors": [],
+            "summary": None,
+            "errors": [],
+        }
+
     result = process_grades(file_path, grading_scale, progress_callback=None)
     return {
         "success": result.get("success", False),
@@ -2706,6 +2714,8 @@ def import_grade_single(**kwargs):
 
     Diseñado para que el Monitor de Moodle (u otro integrador) itere y envíe
     un registro por petición, con feedback inmediato por estudiante.
+    Para cursos mapeados a Moodle es preferible el pull por curso
+    (`edtools_core.moodle_grade_pull.start_grade_pull`).
 
     Campos (POST JSON o args):
         - student_id (obligatorio): ID del estudiante (ej. EDU-STU-2025-02806).
@@ -2793,7 +2803,7 @@ def reactivate_moodle_courses(student_id, moodle_course_ids):
     """
     import json as _json
     from edtools_core.moodle_integration import suspend_user_enrolment_in_course
-    from edtools_core.moodle_users import get_user_by_email
+    from edtools_core.moodle_sync import get_student_moodle_user_id
 
     if not frappe.db.exists("Student", student_id):
         frappe.throw(f"Estudiante {student_id} no encontrado")
@@ -2812,11 +2822,9 @@ def reactivate_moodle_courses(student_id, moodle_course_ids):
     if not email:
         frappe.throw(f"User {student_doc.user} no tiene email")
 
-    moodle_user = get_user_by_email(email.strip().lower())
-    if not moodle_user:
+    moodle_user_id = get_student_moodle_user_id(student_id, email)
+    if not moodle_user_id:
         frappe.throw(f"No se encontró usuario en Moodle con email {email}")
-
-    moodle_user_id = int(moodle_user["id"])
     results = []
     for cid in moodle_course_ids:
         try:
@@ -2849,5 +2857,6 @@ def unenrol_from_moodle(course_enrollment):
         student=doc.student,
         course=doc.course,
         academic_term=academic_term,
+        moodle_course_id=cint(doc.get("moodle_course_id")) or None,
     )
     return result
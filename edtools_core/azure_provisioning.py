@@ -11,6 +11,8 @@ from typing import Optional
 import frappe
 from frappe import _
 
+from edtools_core import service_guard
+
 
 DOMAIN = "cucusa.org"
 
@@ -149,13 +151,12 @@ def get_azure_user_id(email: str) -> Optional[str]:
 	if is_sandbox_mode():
 		return None
 	import urllib.parse
-	import requests
 	token = _get_graph_token()
 	# GET /users/{id|userPrincipalName} acepta el UPN con @
 	encoded = urllib.parse.quote(email, safe="")
 	url = f"https://graph.microsoft.com/v1.0/users/{encoded}"
 	try:
-		resp = requests.get(url, headers={
+		resp = _graph_request("GET", url, headers={
 			"Authorization": f"Bearer {token}",
 			"Content-Type": "application/json",
 		}, timeout=15)
@@ -165,6 +166,8 @@ def get_azure_user_id(email: str) -> Optional[str]:
 			_log_azure_response("get_azure_user_id", resp, extra=f"email={email}")
 		resp.raise_for_status()
 		return resp.json().get("id")
+	except service_guard.ServiceUnavailable:
+		raise
 	except Exception as e:
 		frappe.logger().error(f"Azure get_azure_user_id falló para {email}: {e}")
 		return None
@@ -189,7 +192,6 @@ def create_azure_user(
 		frappe.logger().info(msg)
 		return f"sandbox-{email.replace('@', '-at-')}"
 
-	import requests
 	token = _get_graph_token()
 	url = "https://graph.microsoft.com/v1.0/users"
 	mail_nickname = email.split("@")[0]
@@ -206,7 +208,7 @@ def create_azure_user(
 		"surname": last_name or "",
 	}
 	print(f"[Azure DEBUG] POST {url} | userPrincipalName={email}", flush=True)
-	resp = requests.post(url, json=payload, headers={
+	resp = _graph_request("POST", url, json=payload, headers={
 		"Authorization": f"Bearer {token}",
 		"Content-Type": "application/json",
 	}, timeout=30)
@@ -247,7 +249,6 @@ def assign_microsoft_license(user_id: str, sku_id: Optional[str] = None) -> None
 		frappe.logger().info(msg)
 		return
 
-	import requests
 	token = _get_graph_token()
 	headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
@@ -260,7 +261,7 @@ def assign_microsoft_license(user_id: str, sku_id: Optional[str] = None) -> None
 			f"https://graph.microsoft.com/v1.0/groups/{students_prospect_group_id}/members/{user_id}/$ref"
 		)
 		print(f"[Azure DEBUG] DELETE {delete_url} | user_id={user_id}", flush=True)
-		del_resp = requests.delete(delete_url, headers=headers, timeout=30)
+		del_resp = _graph_request("DELETE", delete_url, headers=headers, timeout=30)
 		_log_azure_response(
 			"remove_from_students_prospect_group",
 			del_resp,
@@ -278,7 +279,7 @@ def assign_microsoft_license(user_id: str, sku_id: Optional[str] = None) -> None
 			f"[Azure DEBUG] POST {post_url} | user_id={user_id} | students_group_id={students_group_id}",
 			flush=True,
 		)
-		post_resp = requests.post(post_url, json=body, headers=headers, timeout=30)
+		post_resp = _graph_request("POST", post_url, json=body, headers=headers, timeout=30)
 
 		# Idempotencia: ya era miembro
 		if post_resp.status_code == 400:
@@ -317,7 +318,7 @@ def assign_microsoft_license(user_id: str, sku_id: Optional[str] = None) -> None
 		"removeLicenses": [],
 	}
 	print(f"[Azure DEBUG] POST {url} | user_id={user_id} | sku={sku}", flush=True)
-	resp = requests.post(url, json=payload, headers=headers, timeout=30)
+	resp = _graph_request("POST", url, json=payload, headers=headers, timeout=30)
 	_log_azure_response("assign_microsoft_license", resp, extra=f"user_id={user_id}")
 	if resp.status_code == 400:
 		body = resp.json() if resp.text else {}
@@ -369,7 +370,6 @@ def remove_user_from_licensed_students_group(user_id: str) -> None:
 		frappe.logger().warning("Azure license revoke: falta AZURE_PROVISIONING_STUDENTS_GROUP_ID")
 		return
 
-	import requests
 
 	token = _get_graph_token()
 	headers = {"Authorization": f"Bearer {token}"}
@@ -377,7 +377,7 @@ def remove_user_from_licensed_students_group(user_id: str) -> None:
 		f"https://graph.microsoft.com/v1.0/groups/{students_group_id}/members/{user_id}/$ref"
 	)
 	print(f"[Azure DEBUG] DELETE {url} | revoke licensed group", flush=True)
-	resp = requests.delete(url, headers=headers, timeout=30)
+	resp = _graph_request("DELETE", url, headers=headers, timeout=30)
 	_log_azure_response(
 		"remove_from_students_group_license",
 		resp,
@@ -400,13 +400,12 @@ def add_user_to_students_prospect_group_after_withdraw(user_id: str) -> None:
 	if not prospect_id:
 		return
 
-	import requests
 
 	token = _get_graph_token()
 	headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 	url = f"https://graph.microsoft.com/v1.0/groups/{prospect_id}/members/$ref"
 	body = {"@odata.id": f"https://graph.microsoft.com/v1.0/directoryObjects/{user_id}"}
-	resp = requests.post(url, json=body, headers=headers, timeout=30)
+	resp = _graph_request("POST", url, json=body, headers=headers, timeout=30)
 	if resp.status_code == 400:
 		try:
 			post_body = resp.json() if resp.text else {}
@@ -435,6 +434,26 @@ def revoke_student_license_by_group_membership(user_id: str) -> None:
 
 
 def sync_student_azure_license_by_status(doc, method=None):
+	"""
+	Wrapper doc_event: toma el estado previo de frappe.flags (ver validations/student.py)
+	y delega en `sync_student_azure_license`.
+	"""
+	sync_student_azure_license(
+		student=doc.name,
+		user=getattr(doc, "user", None),
+		old_status=getattr(frappe.flags, "student_old_status_before_save", None),
+		new_status=getattr(doc, "student_status", None),
+	)
+
+
+def sync_student_azure_license(
+	*,
+	student: str,
+	user: Optional[str],
+	old_status: Optional[str],
+	new_status: Optional[str],
+	raise_errors: bool = False,
+) -> None:
 	"""
 	Sincroniza membresía de grupo M365 según cambio de student_status:
 	- Pasa a Retirado (Withdrawn / Retired / Retirado): quita del grupo con licencia.
@@ -442,20 +461,22 @@ def sync_student_azure_license_by_status(doc, method=None):
 
 	No revoca en LOA u otros estados. Si Azure o sync están desactivados, no hace nada.
 	Errores: solo Error Log; no bloquea el guardado del Student.
+	Recibe el estado previo explícito para poder ejecutarse en background (student_status_sync);
+	con raise_errors=True el error se propaga para que el Integration Outbox lo reintente.
 	"""
 	if not is_provisioning_enabled() or not _license_sync_by_status_enabled():
 		return
 
-	new_status = (getattr(doc, "student_status", None) or "").strip()
-	old_status = (getattr(frappe.flags, "student_old_status_before_save", None) or "").strip()
+	new_status = (new_status or "").strip()
+	old_status = (old_status or "").strip()
 
 	if old_status == new_status:
 		return
 
-	if not getattr(doc, "user", None) or not str(doc.user).strip():
+	if not user or not str(user).strip():
 		return
 
-	email = frappe.db.get_value("User", doc.user, "email")
+	email = frappe.db.get_value("User", user, "email")
 	if not email or not str(email).strip():
 		return
 	email = str(email).strip().lower()
@@ -468,7 +489,7 @@ def sync_student_azure_license_by_status(doc, method=None):
 			frappe.log_error(
 				title="Azure license sync: usuario no encontrado en Entra ID",
 				message=(
-					f"Student {doc.name} | email={email} | {old_status!r} -> {new_status!r}\n"
+					f"Student {student} | email={email} | {old_status!r} -> {new_status!r}\n"
 					"Revise UPN y permisos Graph."
 				),
 			)
@@ -476,11 +497,11 @@ def sync_student_azure_license_by_status(doc, method=None):
 
 		if new_status in STATUS_WITHDRAWN_LICENSE and old_status not in STATUS_WITHDRAWN_LICENSE:
 			print(
-				f"[Azure] Revocando membresía grupo licenciado | student={doc.name} | {old_status!r} -> {new_status!r}",
+				f"[Azure] Revocando membresía grupo licenciado | student={student} | {old_status!r} -> {new_status!r}",
 				flush=True,
 			)
 			frappe.logger().info(
-				f"Azure license revoke: {doc.name} {old_status!r} -> {new_status!r} email={email}"
+				f"Azure license revoke: {student} {old_status!r} -> {new_status!r} email={email}"
 			)
 			if is_sandbox_mode():
 				return
@@ -489,30 +510,46 @@ def sync_student_azure_license_by_status(doc, method=None):
 
 		if new_status == "Active" and old_status in STATUS_WITHDRAWN_LICENSE:
 			print(
-				f"[Azure] Restaurando membresía grupo licenciado | student={doc.name} | {old_status!r} -> Active",
+				f"[Azure] Restaurando membresía grupo licenciado | student={student} | {old_status!r} -> Active",
 				flush=True,
 			)
 			frappe.logger().info(
-				f"Azure license restore: {doc.name} {old_status!r} -> Active email={email}"
+				f"Azure license restore: {student} {old_status!r} -> Active email={email}"
 			)
 			if is_sandbox_mode():
 				return
 			assign_microsoft_license(azure_id)
 			return
 
+	except service_guard.ServiceUnavailable as e:
+		# Graph degradado: no es un error del estudiante; el outbox lo reintenta más tarde
+		frappe.logger().warning(f"Azure license sync diferido: {student} | {e}")
+		if raise_errors:
+			raise
 	except Exception as e:
 		frappe.log_error(
 			title="Azure license sync por student_status",
 			message=(
-				f"Student {doc.name} | {old_status!r} -> {new_status!r} | email={email}\n"
+				f"Student {student} | {old_status!r} -> {new_status!r} | email={email}\n"
 				f"{e}\n{frappe.get_traceback()}"
 			),
 		)
+		if raise_errors:
+			raise
+
+
+def _graph_request(method: str, url: str, **kwargs):
+	"""
+	Llamada HTTP a Microsoft Graph / login con rate limit y circuit breaker compartidos
+	(service_guard, endpoint "graph"). Con el circuito abierto lanza ServiceUnavailable sin esperar.
+	"""
+	import requests
+
+	return service_guard.call("graph", lambda: requests.request(method, url, **kwargs))
 
 
 def _get_graph_token() -> str:
 	"""Obtiene token OAuth2 para Microsoft Graph (Client Credentials)."""
-	import requests
 	tenant_id = _get_config("tenant_id")
 	client_id = _get_config("client_id")
 	client_secret = _get_config("client_secret")
@@ -529,7 +566,7 @@ def _get_graph_token() -> str:
 		"scope": "https://graph.microsoft.com/.default",
 	}
 	print(f"[Azure DEBUG] POST token | tenant={tenant_id}", flush=True)
-	resp = requests.post(url, data=data, timeout=30)
+	resp = _graph_request("POST", url, data=data, timeout=30)
 	_log_azure_response("token", resp, extra=f"tenant={tenant_id}")
 	resp.raise_for_status()
 	return resp.json().get("access_token", "")
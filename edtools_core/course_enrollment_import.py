@@ -15,14 +15,16 @@ import frappe
 from frappe import _
 from frappe.utils import getdate, nowdate
 
+from edtools_core import course_key_index
+from edtools_core.academic_term_meta import get_term_meta
 from edtools_core.grade_import import (
 	SEMESTER_SUFFIX_TO_TERM,
 	_find_column_index,
-	_resolve_course,
 	_resolve_file_path,
-	get_student_name_by_id,
+	resolve_student_ids,
 	semester_to_academic_year_and_term,
 )
+from edtools_core.moodle_metrics import moodle_operation
 
 REQUIRED_COLUMNS = ["ID", "SEMESTER", "COURSE"]
 OPTIONAL_COLUMNS = ["ENROLLMENT DATE"]
@@ -207,7 +209,7 @@ def validate_import_format(file_path: str) -> tuple[bool, list[dict[str, Any]]]:
 				parsed = semester_to_academic_year_and_term(semester)
 				if parsed:
 					_year_part, term_name = parsed
-					if not frappe.db.exists("Academic Term", term_name):
+					if not get_term_meta(term_name):
 						errors.append(
 							{
 								"row": row_num,
@@ -347,6 +349,68 @@ def get_unique_program_enrollment(student: str, academic_year: str) -> tuple[str
 	return pe.get("name"), pe.get("academic_year"), None
 
 
+def group_import_rows(
+	data_rows: list[dict[str, Any]],
+	default_date: str,
+) -> tuple[dict[tuple[str, str, str], list[tuple[int, str, str, str]]], list[dict[str, Any]]]:
+	"""
+	Resuelve período, curso y estudiante de cada fila (solo lecturas) y agrupa por curso/período.
+
+	Retorna (groups {(course, year, term_label): [(row_num, student, student_raw, enroll_date)]},
+	errores [{"row", "message", "student_id", "course_input", "course", "academic_term"}]).
+	"""
+	groups: dict[tuple[str, str, str], list[tuple[int, str, str, str]]] = defaultdict(list)
+	errors: list[dict[str, Any]] = []
+	# Todos los IDs del archivo en unas pocas consultas (ver grade_import.resolve_student_ids)
+	student_map = resolve_student_ids(row.get("ID") for row in data_rows)
+	for i, row in enumerate(data_rows):
+		row_num = i + 2
+		student_raw = (row.get("ID") or "").strip()
+		course_code = (row.get("COURSE") or "").strip()
+		semester = (row.get("SEMESTER") or "").strip().replace(" ", "")
+		parsed = semester_to_academic_year_and_term(semester)
+		if not parsed:
+			errors.append(
+				{"row": row_num, "message": _("SEMESTER inválido"), "student_id": student_raw, "course_input": course_code}
+			)
+			continue
+		year, term_name = parsed
+		term_label = SEMESTER_SUFFIX_TO_TERM.get(semester[-2:], "")
+		course_frappe, conflict = course_key_index.lookup(course_code) if course_code else (None, [])
+		if not course_frappe:
+			errors.append(
+				{
+					"row": row_num,
+					"message": _("Curso ambiguo: {0} coincide con varios cursos ({1})").format(
+						course_code, ", ".join(conflict)
+					)
+					if conflict
+					else _("Curso no existe: {0}").format(course_code),
+					"student_id": student_raw,
+					"course_input": course_code,
+					"academic_term": term_name,
+				}
+			)
+			continue
+		student_name = student_map.get(student_raw)
+		if not student_name:
+			errors.append(
+				{
+					"row": row_num,
+					"message": _("Estudiante no encontrado: {0}").format(student_raw),
+					"student_id": student_raw,
+					"course_input": course_code,
+					"course": course_frappe,
+					"academic_term": term_name,
+				}
+			)
+			continue
+		enroll_date = coerce_enrollment_date_str(row.get("ENROLLMENT DATE")) or default_date
+		groups[(course_frappe, year, term_label)].append((row_num, student_name, student_raw, enroll_date))
+	return groups, errors
+
+
+@moodle_operation("course_enrollment_import")
 def process_enrollments(
 	file_path: str,
 	default_enrollment_date: str | None = None,
@@ -412,60 +476,23 @@ def process_enrollments(
 	coerced_default = coerce_enrollment_date_str(default_enrollment_date)
 	default_date = coerced_default or nowdate()
 
-	groups: dict[tuple[str, str, str], list[tuple[int, str, str, str]]] = defaultdict(list)
-	for i, row in enumerate(data_rows):
-		row_num = i + 2
-		semester = (row.get("SEMESTER") or "").strip().replace(" ", "")
-		parsed = semester_to_academic_year_and_term(semester)
-		if not parsed:
-			msg = _("SEMESTER inválido")
-			out["errors"].append({"row": row_num, "message": msg})
-			_add_result(
-				row=row_num,
-				student_id=(row.get("ID") or "").strip(),
-				course_input=(row.get("COURSE") or "").strip(),
-				status="ErrorValidacion",
-				detail=msg,
-			)
-			continue
-		year, term_name = parsed
-		term_label = SEMESTER_SUFFIX_TO_TERM.get(semester[-2:], "")
-		course_code = (row.get("COURSE") or "").strip()
-		course_frappe = _resolve_course(course_code)
-		if not course_frappe:
-			msg = _("Curso no existe: {0}").format(course_code)
-			out["errors"].append({"row": row_num, "message": msg})
-			_add_result(
-				row=row_num,
-				student_id=(row.get("ID") or "").strip(),
-				course_input=course_code,
-				academic_term=term_name,
-				status="ErrorValidacion",
-				detail=msg,
-			)
-			continue
-		student_raw = (row.get("ID") or "").strip()
-		student_name = get_student_name_by_id(student_raw)
-		if not student_name:
-			msg = _("Estudiante no encontrado: {0}").format(student_raw)
-			out["errors"].append({"row": row_num, "message": msg})
-			_add_result(
-				row=row_num,
-				student_id=student_raw,
-				course_input=course_code,
-				course=course_frappe,
-				academic_term=term_name,
-				status="ErrorValidacion",
-				detail=msg,
-			)
-			continue
-		enroll_date = coerce_enrollment_date_str(row.get("ENROLLMENT DATE")) or default_date
-		key = (course_frappe, year, term_label)
-		groups[key].append((row_num, student_name, student_raw, enroll_date))
+	groups, row_errors = group_import_rows(data_rows, default_date)
+	for e in row_errors:
+		out["errors"].append({"row": e["row"], "message": e["message"]})
+		_add_result(
+			row=e["row"],
+			student_id=e.get("student_id", ""),
+			course_input=e.get("course_input", ""),
+			course=e.get("course", ""),
+			academic_term=e.get("academic_term", ""),
+			status="ErrorValidacion",
+			detail=e["message"],
+		)
 
 	ce_meta = frappe.get_meta("Course Enrollment")
 	has_custom_term = ce_meta.has_field("custom_academic_term")
 	has_custom_year = ce_meta.has_field("custom_academic_year")
+	has_moodle_course_id = ce_meta.has_field("moodle_course_id")
 
 	created_or_updated_sg = set()
 	total_ok = 0
@@ -481,6 +508,8 @@ def process_enrollments(
 		if progress_callback:
 			progress_callback(min(prog_i, prog_total), prog_total, msg)
 
+	# Fase 1 (hilo principal): curso Moodle, Student Group, instructores y filas pendientes por grupo
+	prepared: list[dict[str, Any]] = []
 	for course_frappe, year, term_label in group_keys:
 		term_name = f"{year} ({term_label})"
 		rows = groups[(course_frappe, year, term_label)]
@@ -507,7 +536,7 @@ def process_enrollments(
 				student_names,
 			)
 			created_or_updated_sg.add(sg_name)
-			enroll_moodle_instructors_from_student_group(
+			_already_instructors, enrolled_ids = enroll_moodle_instructors_from_student_group(
 				sg_name,
 				moodle_course_id,
 				log_context="Course Enrollment Import",
@@ -538,6 +567,7 @@ def process_enrollments(
 			seen_student_last_row[student_name] = (row_num, student_name, enroll_date)
 		unique_rows = list(seen_student_last_row.values())
 
+		pending: list[tuple[int, str, str, str, Any]] = []
 		for row_num, student_name, enroll_date in unique_rows:
 			_bump(_("Inscribiendo: {0} — {1}").format(student_name, term_name))
 
@@ -581,16 +611,106 @@ def process_enrollments(
 				)
 				continue
 
+			pending.append((row_num, student_name, enroll_date, pe_name, pe_year))
+
+		if pending:
+			prepared.append(
+				{
+					"key": (course_frappe, year, term_label),
+					"course": course_frappe,
+					"year": year,
+					"term_name": term_name,
+					"moodle_course_id": moodle_course_id,
+					"enrolled_ids": enrolled_ids,
+					"pending": pending,
+				}
+			)
+
+	# Fase 2: usuarios Moodle de todos los grupos en bloque y matrículas de cada curso en paralelo
+	# (solo HTTP en los hilos; toda escritura en BD queda en el hilo principal).
+	moodle_results_by_group: dict[tuple, dict[str, dict]] = {}
+	if prepared:
+		from edtools_core.course_enrollment_moodle import (
+			build_student_enrolment_outcome,
+			refresh_stale_student_users,
+			resolve_moodle_student_users,
+			student_enrolment_rows,
+		)
+		from edtools_core.moodle_integration import enrol_users_concurrently
+
+		all_students = _unique_preserve_order([p[1] for grp in prepared for p in grp["pending"]])
+		user_by_student, user_errors = resolve_moodle_student_users(
+			all_students, log_context="Course Enrollment Import"
+		)
+
+		group_users: dict[tuple, dict[str, int]] = {}
+		for grp in prepared:
+			group_users[grp["key"]] = {
+				p[1]: user_by_student[p[1]] for p in grp["pending"] if p[1] in user_by_student
+			}
+
+		def _enrol_groups(users_by_key: dict[tuple, dict[str, int]]) -> dict[tuple, list[dict]]:
+			course_id_by_key = {grp["key"]: grp["moodle_course_id"] for grp in prepared}
+			enrol_jobs = {
+				key: student_enrolment_rows(users, course_id_by_key[key]) for key, users in users_by_key.items()
+			}
 			try:
-				from edtools_core.moodle_sync import sync_student_enrollment_to_moodle
+				return enrol_users_concurrently(enrol_jobs)
+			except Exception as e:
+				# Ej. circuito Moodle abierto: todas las filas quedan como ErrorMoodle
+				return {
+					key: [{"user_id": r[0], "course_id": r[1], "error": str(e)} for r in rows]
+					for key, rows in enrol_jobs.items()
+				}
 
-				sync_student_enrollment_to_moodle(
-					student=student_name,
-					academic_year=year,
-					academic_term=term_name,
-					course=course_frappe,
+		enrol_results = _enrol_groups(group_users)
+		# userids de la caché que ya no existen en Moodle: se resuelven de nuevo y se matriculan otra vez
+		fresh, fresh_errors = refresh_stale_student_users(
+			user_by_student,
+			[r for rows in enrol_results.values() for r in rows],
+			log_context="Course Enrollment Import",
+		)
+		user_errors.update(fresh_errors)
+		retry_users = {
+			key: {s: fresh[s] for s in users if s in fresh} for key, users in group_users.items()
+		}
+		retry_users = {key: users for key, users in retry_users.items() if users}
+		retry_results = _enrol_groups(retry_users) if retry_users else {}
+
+		for grp in prepared:
+			key = grp["key"]
+			moodle_results_by_group[key] = {
+				**{p[1]: user_errors[p[1]] for p in grp["pending"] if p[1] in user_errors},
+				**build_student_enrolment_outcome(
+					group_users[key],
+					grp["moodle_course_id"],
+					enrol_results.get(key) or [],
+					enrolled_ids=grp["enrolled_ids"],
+				),
+			}
+			if key in retry_users:
+				moodle_results_by_group[key].update(
+					build_student_enrolment_outcome(
+						retry_users[key],
+						grp["moodle_course_id"],
+						retry_results.get(key) or [],
+						enrolled_ids=grp["enrolled_ids"],
+					)
 				)
-			except Exception as moodle_err:
+
+	# Fase 3: Course Enrollments (hilo principal)
+	for grp in prepared:
+		course_frappe = grp["course"]
+		year = grp["year"]
+		term_name = grp["term_name"]
+		moodle_course_id = grp["moodle_course_id"]
+		pending = grp["pending"]
+		moodle_results = moodle_results_by_group.get(grp["key"]) or {}
+
+		for row_num, student_name, enroll_date, pe_name, pe_year in pending:
+			sync_result = moodle_results.get(student_name) or {"error": _("Sin resultado de Moodle")}
+			if sync_result.get("error"):
+				moodle_err = sync_result["error"]
 				msg = _("Moodle: {0}").format(str(moodle_err)[:180])
 				out["errors"].append(
 					{
@@ -629,6 +749,8 @@ def process_enrollments(
 					ce_props["custom_academic_year"] = year
 				if has_custom_term:
 					ce_props["custom_academic_term"] = term_name
+				if has_moodle_course_id:
+					ce_props["moodle_course_id"] = sync_result.get("moodle_course_id") or moodle_course_id
 				enrollment = frappe.get_doc(ce_props)
 				enrollment.insert(ignore_permissions=True)
 				enrollment.submit()
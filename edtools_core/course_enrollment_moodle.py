@@ -3,11 +3,7 @@
 
 from __future__ import annotations
 
-import calendar
-import datetime
-
 import frappe
-from frappe.utils import getdate
 
 
 def prepare_moodle_course_for_enrollment_tool(
@@ -34,7 +30,6 @@ def prepare_moodle_course_for_enrollment_tool(
 		ensure_academic_term_category,
 		ensure_academic_year_category,
 		ensure_course,
-		get_term_category_name,
 	)
 
 	moodle_year_category_id = ensure_academic_year_category(str(academic_year))
@@ -54,6 +49,56 @@ def prepare_moodle_course_for_enrollment_tool(
 			indicator="blue",
 		)
 
+	payload = build_moodle_course_payload(str(academic_term), course)
+	moodle_course_id = ensure_course(
+		category_id=moodle_term_category_id,
+		term_category_name=payload["term_category_name"],
+		term_idnumber=payload["term_idnumber"],
+		term_start_date_str=payload["term_start_date_str"],
+		course_fullname=payload["fullname"],
+		course_shortname=payload["shortname"],
+		course_idnumber=payload["idnumber"],
+		startdate=payload["startdate"],
+		enddate=payload["enddate"],
+	)
+	if show_progress_msgs:
+		frappe.msgprint(
+			f"Moodle OK: Course '{payload['course_name']}' (id={moodle_course_id})",
+			indicator="blue",
+		)
+
+	return int(moodle_course_id)
+
+
+def get_term_dates(academic_term: str) -> dict:
+	"""Fechas del Academic Term: start/end (date), start_str (M/D/YY) y timestamps a mediodía UTC."""
+	from edtools_core.academic_term_meta import get_term_meta
+
+	term = get_term_meta(academic_term) or {}
+	if not term.get("start"):
+		frappe.throw("No se encontró term_start_date para el Academic Term seleccionado")
+	if not term.get("end"):
+		frappe.throw("No se encontró term_end_date para el Academic Term seleccionado")
+	return {
+		"start": term["start"],
+		"end": term["end"],
+		"start_str": term["start_mdy"],
+		"startdate": term["startdate"],
+		"enddate": term["enddate"],
+	}
+
+
+def build_moodle_course_payload(academic_term: str, course: str, *, term_dates: dict | None = None) -> dict:
+	"""
+	Datos del curso Moodle de un Course en un Academic Term (idnumber, fullname, shortname, fechas).
+
+	Compartido por `prepare_moodle_course_for_enrollment_tool` y el Term Rollover (creación masiva).
+	:param term_dates: resultado de `get_term_dates` (para no releer el término por curso)
+	"""
+	from edtools_core.moodle_integration import get_term_category_name
+
+	term_dates = term_dates or get_term_dates(academic_term)
+
 	course_doc = frappe.get_doc("Course", course)
 	course_name = (course_doc.course_name or course or "").strip()
 	course_shortname = (getattr(course_doc, "short_name", None) or "").strip()
@@ -64,50 +109,24 @@ def prepare_moodle_course_for_enrollment_tool(
 		course_name.split(" - ", 1)[1].strip() if " - " in course_name else course_name
 	)
 
-	term_start_date = frappe.db.get_value("Academic Term", academic_term, "term_start_date")
-	if not term_start_date:
-		frappe.throw("No se encontró term_start_date para el Academic Term seleccionado")
-	term_start_date = getdate(term_start_date)
-	term_start_date_str = f"{term_start_date.month}/{term_start_date.day}/{str(term_start_date.year)[2:]}"
-
-	term_end_date = frappe.db.get_value("Academic Term", academic_term, "term_end_date")
-	if not term_end_date:
-		frappe.throw("No se encontró term_end_date para el Academic Term seleccionado")
-	term_end_date = getdate(term_end_date)
-
-	term_start_date_noon = datetime.datetime.combine(term_start_date, datetime.time(12, 0))
-	term_end_date_noon = datetime.datetime.combine(term_end_date, datetime.time(12, 0))
-	startdate_timestamp = int(calendar.timegm(term_start_date_noon.timetuple()))
-	enddate_timestamp = int(calendar.timegm(term_end_date_noon.timetuple()))
-
 	term_category_name = get_term_category_name(str(academic_term))
 	term_idnumber = str(academic_term)
-
-	moodle_course_idnumber = f"{term_category_name}::{course_name}"
-
 	moodle_fullname = (
-		f"{term_category_name},{course_shortname}, 1, {course_title} {term_idnumber} {term_start_date_str}"
-	)
-	moodle_course_shortname = moodle_fullname
-
-	moodle_course_id = ensure_course(
-		category_id=moodle_term_category_id,
-		term_category_name=term_category_name,
-		term_idnumber=term_idnumber,
-		term_start_date_str=term_start_date_str,
-		course_fullname=moodle_fullname,
-		course_shortname=moodle_course_shortname,
-		course_idnumber=moodle_course_idnumber,
-		startdate=startdate_timestamp,
-		enddate=enddate_timestamp,
+		f"{term_category_name},{course_shortname}, 1, {course_title} {term_idnumber} {term_dates['start_str']}"
 	)
-	if show_progress_msgs:
-		frappe.msgprint(
-			f"Moodle OK: Course '{course_name}' (id={moodle_course_id})",
-			indicator="blue",
-		)
-
-	return int(moodle_course_id)
+	return {
+		"course": course,
+		"course_name": course_name,
+		"course_shortcode": course_shortname,
+		"term_category_name": term_category_name,
+		"term_idnumber": term_idnumber,
+		"term_start_date_str": term_dates["start_str"],
+		"idnumber": f"{term_category_name}::{course_name}",
+		"fullname": moodle_fullname,
+		"shortname": moodle_fullname,
+		"startdate": term_dates["startdate"],
+		"enddate": term_dates["enddate"],
+	}
 
 
 def enroll_moodle_instructors_from_student_group(
@@ -122,7 +141,7 @@ def enroll_moodle_instructors_from_student_group(
 	:return: (already_enrolled_labels, enrolled_user_ids actualizado)
 	"""
 	from edtools_core.moodle_integration import (
-		enrol_user_in_course,
+		enrol_users_in_course,
 		get_enrolled_user_ids,
 		MOODLE_ROLE_EDITING_TEACHER,
 	)
@@ -134,40 +153,70 @@ def enroll_moodle_instructors_from_student_group(
 		return already_enrolled_instructors, enrolled_ids
 
 	try:
-		from edtools_core.moodle_users import ensure_moodle_user_instructor
+		from edtools_core.moodle_users import ensure_moodle_users_instructor
 
 		group_doc = frappe.get_doc("Student Group", student_group)
 		if not group_doc.get("instructors"):
 			return already_enrolled_instructors, enrolled_ids
 
+		label_by_instructor = {}
 		for row in group_doc.instructors:
-			if not row.get("instructor"):
-				continue
-			try:
-				instructor = frappe.get_doc("Instructor", row.instructor)
-				moodle_user = ensure_moodle_user_instructor(instructor)
-				uid = moodle_user["id"]
-				instructor_label = getattr(row, "instructor_name", None) or row.instructor
-				if uid in enrolled_ids:
-					already_enrolled_instructors.append(instructor_label)
-				else:
-					result = enrol_user_in_course(
-						user_id=uid,
-						course_id=moodle_course_id,
-						roleid=MOODLE_ROLE_EDITING_TEACHER,
-					)
-					if result.get("already_enrolled"):
-						already_enrolled_instructors.append(instructor_label)
-					else:
-						enrolled_ids.add(uid)
-			except Exception as instr_err:
+			if row.get("instructor"):
+				label_by_instructor[row.instructor] = getattr(row, "instructor_name", None) or row.instructor
+		users = ensure_moodle_users_instructor(
+			[frappe.get_doc("Instructor", name) for name in label_by_instructor]
+		)
+
+		to_enrol: dict[int, str] = {}
+		for name, result in users.items():
+			if result.get("error"):
 				frappe.log_error(
 					title="Moodle: error al asegurar usuario de instructor",
 					message=(
 						f"{log_context} | Student Group {student_group} | "
-						f"Instructor {row.instructor}: {instr_err}"
+						f"Instructor {name}: {result['error']}"
 					),
 				)
+				continue
+			uid = int(result["user"]["id"])
+			if uid in enrolled_ids:
+				already_enrolled_instructors.append(label_by_instructor[name])
+			else:
+				to_enrol[uid] = name
+
+		if to_enrol:
+			results = enrol_users_in_course(
+				moodle_course_id,
+				[(uid, MOODLE_ROLE_EDITING_TEACHER, 0) for uid in to_enrol],
+			)
+			# userid cacheado que ya no existe en Moodle (usuario borrado/recreado): se resuelve sin caché y se reintenta
+			stale = [to_enrol[r["user_id"]] for r in results if r.get("invalid_user")]
+			if stale:
+				fresh = ensure_moodle_users_instructor(
+					[frappe.get_doc("Instructor", name) for name in stale], refresh=True
+				)
+				retry = {int(res["user"]["id"]): name for name, res in fresh.items() if res.get("user")}
+				if retry:
+					results = [r for r in results if to_enrol[r["user_id"]] not in retry.values()]
+					to_enrol.update(retry)
+					results += enrol_users_in_course(
+						moodle_course_id,
+						[(uid, MOODLE_ROLE_EDITING_TEACHER, 0) for uid in retry],
+					)
+			for r in results:
+				name = to_enrol[r["user_id"]]
+				if r.get("error"):
+					frappe.log_error(
+						title="Moodle: error al asegurar usuario de instructor",
+						message=(
+							f"{log_context} | Student Group {student_group} | "
+							f"Instructor {name}: {r['error']}"
+						),
+					)
+				elif r.get("already_enrolled"):
+					already_enrolled_instructors.append(label_by_instructor[name])
+				else:
+					enrolled_ids.add(r["user_id"])
 	except Exception as e:
 		frappe.log_error(
 			title="Moodle: error al cargar instructores del Student Group",
@@ -175,3 +224,131 @@ def enroll_moodle_instructors_from_student_group(
 		)
 
 	return already_enrolled_instructors, enrolled_ids
+
+
+def resolve_moodle_student_users(
+	students: list[str],
+	*,
+	log_context: str = "Course Enrollment",
+	refresh: bool = False,
+) -> tuple[dict[str, int], dict[str, dict]]:
+	"""
+	Busca/crea en bloque el usuario Moodle de cada estudiante (~3 llamadas para toda la lista).
+	refresh=True ignora la caché de usuarios Moodle.
+
+	:return: (user_by_student {student: userid}, errors {student: {"error": str}})
+	"""
+	from edtools_core.moodle_users import ensure_moodle_users
+
+	errors: dict[str, dict] = {}
+	user_by_student: dict[str, int] = {}
+
+	student_docs = []
+	for student in students:
+		student_doc = frappe.get_doc("Student", student)
+		if not student_doc.user or not str(student_doc.user).strip():
+			errors[student] = {
+				"error": (
+					f"El estudiante {student} no tiene User vinculado. "
+					"En Moodle el usuario se crea con el email del User; vincula el campo 'User ID' en el Student."
+				)
+			}
+			continue
+		student_docs.append(student_doc)
+
+	try:
+		users = ensure_moodle_users(student_docs, refresh=refresh)
+	except Exception as e:
+		users = {d.name: {"error": str(e)} for d in student_docs}
+	for student, result in users.items():
+		if result.get("error"):
+			errors[student] = {"error": result["error"]}
+			frappe.log_error(
+				title="Moodle: error al asegurar usuario de estudiante",
+				message=f"{log_context} | Student {student}: {result['error']}",
+			)
+			continue
+		user_by_student[student] = int(result["user"]["id"])
+	return user_by_student, errors
+
+
+def refresh_stale_student_users(
+	user_by_student: dict[str, int],
+	results: list[dict],
+	*,
+	log_context: str = "Course Enrollment",
+) -> tuple[dict[str, int], dict[str, dict]]:
+	"""
+	Estudiantes cuya matrícula falló porque su userid Moodle (de la caché) ya no existe: usuario
+	borrado o recreado en Moodle. Los resuelve de nuevo sin caché para reintentar la matrícula.
+
+	:return: (user_by_student, errors) solo de esos estudiantes
+	"""
+	stale_uids = {r["user_id"] for r in results if r.get("invalid_user")}
+	stale = [student for student, uid in user_by_student.items() if uid in stale_uids]
+	if not stale:
+		return {}, {}
+	return resolve_moodle_student_users(stale, log_context=log_context, refresh=True)
+
+
+def student_enrolment_rows(user_by_student: dict[str, int], moodle_course_id: int) -> list[tuple]:
+	"""Filas (user_id, course_id, roleid, suspend) para `enrol_users` / `enrol_users_concurrently`."""
+	from edtools_core.moodle_integration import MOODLE_ROLE_STUDENT
+
+	return [(uid, int(moodle_course_id), MOODLE_ROLE_STUDENT, 0) for uid in user_by_student.values()]
+
+
+def build_student_enrolment_outcome(
+	user_by_student: dict[str, int],
+	moodle_course_id: int,
+	results: list[dict],
+	*,
+	enrolled_ids: set | None = None,
+) -> dict[str, dict]:
+	"""Traduce el resultado de `enrol_users` a {student: {"moodle_user_id", ...} | {"error"}}."""
+	enrolled_ids = enrolled_ids if enrolled_ids is not None else set()
+	out: dict[str, dict] = {}
+	result_by_uid = {r["user_id"]: r for r in results}
+	for student, uid in user_by_student.items():
+		result = result_by_uid.get(uid) or {}
+		if result.get("error"):
+			out[student] = {"error": result["error"]}
+			continue
+		out[student] = {
+			"moodle_user_id": uid,
+			"moodle_course_id": int(moodle_course_id),
+			"already_enrolled": bool(result.get("already_enrolled")) or uid in enrolled_ids,
+		}
+		enrolled_ids.add(uid)
+	return out
+
+
+def enroll_moodle_students_in_course(
+	students: list[str],
+	moodle_course_id: int,
+	*,
+	enrolled_ids: set | None = None,
+	log_context: str = "Course Enrollment",
+) -> dict[str, dict]:
+	"""
+	Asegura el usuario Moodle de cada estudiante y los matricula en el curso con
+	enrol_manual_enrol_users masivo (bloques de 100 filas, no una llamada por estudiante).
+
+	:param enrolled_ids: userids ya matriculados en el curso (para reportar "ya estaba matriculado")
+	:return: {student: {"moodle_user_id", "already_enrolled"} | {"error": str}}
+	"""
+	from edtools_core.moodle_integration import enrol_users
+
+	user_by_student, out = resolve_moodle_student_users(students, log_context=log_context)
+	if not user_by_student:
+		return out
+
+	results = enrol_users(student_enrolment_rows(user_by_student, moodle_course_id))
+	out.update(build_student_enrolment_outcome(user_by_student, moodle_course_id, results, enrolled_ids=enrolled_ids))
+
+	fresh, fresh_errors = refresh_stale_student_users(user_by_student, results, log_context=log_context)
+	out.update(fresh_errors)
+	if fresh:
+		results = enrol_users(student_enrolment_rows(fresh, moodle_course_id))
+		out.update(build_student_enrolment_outcome(fresh, moodle_course_id, results, enrolled_ids=enrolled_ids))
+	return out
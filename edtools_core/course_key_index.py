@@ -0,0 +1,247 @@
+"""
+Índice persistente de claves de Course para los imports (notas / matrículas).
+
+`grade_import._resolve_course` probaba varias consultas exactas por fila y, si fallaban, cargaba
+toda la tabla Course (caché solo del request) y normalizaba en Python. Este índice vive en un hash
+Redis (`edtools_course_key_index`), compartido entre requests y jobs:
+
+- `c:<clave>` -> Courses cuyo código coincide (short_name, course_code o, sin short_name, el código
+  que se usa para el shortname Moodle: course_name antes de " - ").
+- `n:<clave>` -> Courses por name / course_name.
+- `r:<course>` -> claves del curso (para quitarlas al editarlo).
+
+Clave = `_normalize_course_key` (sin acentos, solo alfanuméricos, mayúsculas). Se construye la
+primera vez que se consulta, se mantiene en Course on_update / on_trash (after_rename reconstruye;
+siempre después del commit del Course) y se reconstruye a diario. Una clave con varios cursos es
+un conflicto: no se elige ninguno.
+"""
+
+import json
+from functools import partial
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import frappe
+
+_INDEX_KEY = "edtools_course_key_index"
+_BUILT_FIELD = "__built__"
+
+
+def _redis_key() -> str:
+    return frappe.cache.make_key(_INDEX_KEY)
+
+
+def _execute(*ops) -> List[Any]:
+    """Comandos Redis crudos (valores JSON, sin el pickle de RedisWrapper) en un pipeline."""
+    pipe = frappe.cache.pipeline()
+    for name, *args in ops:
+        getattr(pipe, name)(*args)
+    return pipe.execute()
+
+
+def _is_built() -> bool:
+    return bool(_execute(("hexists", _redis_key(), _BUILT_FIELD))[0])
+
+
+def _code_fields() -> List[str]:
+    meta = frappe.get_meta("Course")
+    return [f for f in ("short_name", "course_code") if meta.has_field(f)]
+
+
+def _norm(value: Any) -> str:
+    from edtools_core.grade_import import _normalize_course_key
+
+    return _normalize_course_key(str(value or ""))
+
+
+def course_keys(course: Dict[str, Any]) -> Dict[str, set]:
+    """{"c": claves de código, "n": claves de nombre} de un Course (dict con name, course_name y códigos)."""
+    codes = {course.get(f) for f in ("short_name", "course_code")}
+    course_name = (course.get("course_name") or "").strip()
+    if not course.get("short_name") and course_name:
+        # Mismo código que usa build_moodle_course_payload para el shortname Moodle
+        codes.add(course_name.split(" - ", 1)[0])
+    return {
+        "c": {k for k in map(_norm, codes) if k},
+        "n": {k for k in map(_norm, (course.get("name"), course_name)) if k},
+    }
+
+
+def _fields_of(keys: Dict[str, set]) -> List[str]:
+    return [f"{tier}:{key}" for tier in ("c", "n") for key in sorted(keys[tier])]
+
+
+def _load_courses() -> List[Dict[str, Any]]:
+    return frappe.get_all(
+        "Course",
+        fields=list(dict.fromkeys(["name", "course_name", *_code_fields()])),
+        limit_page_length=0,
+    )
+
+
+def rebuild_index() -> Dict[str, int]:
+    """Reconstruye el índice completo. Retorna {"courses", "keys", "conflicts"}."""
+    entries: Dict[str, List[str]] = {}
+    reverse: Dict[str, List[str]] = {}
+    for course in _load_courses():
+        fields = _fields_of(course_keys(course))
+        reverse[course.name] = fields
+        for field in fields:
+            entries.setdefault(field, []).append(course.name)
+
+    key = _redis_key()
+    pipe = frappe.cache.pipeline()
+    pipe.delete(key)
+    mapping = {field: json.dumps(sorted(names)) for field, names in entries.items()}
+    mapping.update({f"r:{name}": json.dumps(fields) for name, fields in reverse.items()})
+    for start in range(0, len(mapping), 1000):
+        pipe.hset(key, mapping=dict(list(mapping.items())[start : start + 1000]))
+    pipe.hset(key, _BUILT_FIELD, "1")
+    pipe.execute()
+    return {
+        "courses": len(reverse),
+        "keys": len(entries),
+        "conflicts": sum(1 for names in entries.values() if len(names) > 1),
+    }
+
+
+def _ensure_built() -> None:
+    if not _is_built():
+        rebuild_index()
+
+
+def _read(fields: Iterable[str]) -> Dict[str, List[str]]:
+    fields = list(dict.fromkeys(fields))
+    if not fields:
+        return {}
+    values = _execute(("hmget", _redis_key(), fields))[0]
+    return {field: json.loads(value) for field, value in zip(fields, values) if value}
+
+
+_UPDATE_RETRIES = 5
+
+
+def _update_course(name: str) -> None:
+    """
+    Sincroniza las claves del curso con su estado actual en la BD (borrado: solo quitar).
+
+    Corre después del commit del Course. Lectura-modificación-escritura bajo WATCH/MULTI: si otro
+    proceso toca el índice en medio, se reintenta; si no se logra, se descarta el índice y la
+    próxima consulta lo reconstruye completo.
+    """
+    from redis.exceptions import WatchError
+
+    fields = list(dict.fromkeys(["name", "course_name", *_code_fields()]))
+    course = frappe.db.get_value("Course", name, fields, as_dict=True)
+    new_fields = _fields_of(course_keys(course)) if course else []
+    key = _redis_key()
+    for _attempt in range(_UPDATE_RETRIES):
+        with frappe.cache.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if not pipe.hexists(key, _BUILT_FIELD):
+                    # Aún no construido: la primera consulta lo arma completo
+                    return
+                raw_old = pipe.hget(key, f"r:{name}")
+                old_fields = json.loads(raw_old) if raw_old else []
+                touched = list(dict.fromkeys(old_fields + new_fields))
+                current = {
+                    field: json.loads(value)
+                    for field, value in zip(touched, pipe.hmget(key, touched) if touched else [])
+                    if value
+                }
+                pipe.multi()
+                for field in touched:
+                    names = [n for n in current.get(field, []) if n != name]
+                    if field in new_fields:
+                        names = sorted(names + [name])
+                    if names:
+                        pipe.hset(key, field, json.dumps(names))
+                    else:
+                        pipe.hdel(key, field)
+                if new_fields:
+                    pipe.hset(key, f"r:{name}", json.dumps(new_fields))
+                else:
+                    pipe.hdel(key, f"r:{name}")
+                pipe.execute()
+                return
+            except WatchError:
+                continue
+    _execute(("delete", key))
+
+
+def on_course_update(doc, method=None):
+    """doc_event Course on_update: actualiza solo las claves del curso, tras el commit."""
+    frappe.db.after_commit.add(partial(_update_course, doc.name))
+
+
+def on_course_trash(doc, method=None):
+    """doc_event Course on_trash (tras el commit, el curso ya no está en la BD)."""
+    frappe.db.after_commit.add(partial(_update_course, doc.name))
+
+
+def on_course_rename(doc, method=None, *args, **kwargs):
+    """doc_event Course after_rename: las listas guardan el name anterior; se reconstruye tras el commit."""
+    frappe.db.after_commit.add(partial(_execute, ("delete", _redis_key())))
+
+
+def scheduled_rebuild() -> None:
+    """scheduler (diario): corrige desvíos por ediciones concurrentes o cambios fuera del ORM."""
+    rebuild_index()
+
+
+def _moodle_code(value: str) -> str:
+    """Código del curso si el valor viene en formato Moodle (YYYYMM::code, YYYYMM,code, o TERMID-code-1)."""
+    from edtools_core.moodle_course_index import _split_term_and_code
+
+    _term, code = _split_term_and_code(value)
+    return _norm(code)
+
+
+def lookup(course_code: str, course_title: Optional[str] = None) -> Tuple[Optional[str], List[str]]:
+    """
+    Resuelve un código/título de archivo a Course.
+
+    Orden: código (c:) y nombre (n:) del valor, luego el código Moodle embebido, luego el título.
+    Retorna (course, []) si hay una sola coincidencia, (None, [candidatos]) si la primera clave
+    que coincide es ambigua y (None, []) si no hay coincidencias.
+    """
+    _ensure_built()
+    input_key = _norm(course_code)
+    moodle_key = _moodle_code(course_code or "")
+    title_key = _norm(course_title)
+    order = []
+    for key in (input_key, moodle_key, title_key):
+        if key:
+            order += [f"c:{key}", f"n:{key}"]
+    found = _read(order)
+    for field in order:
+        names = found.get(field)
+        if not names:
+            continue
+        if len(names) == 1:
+            return names[0], []
+        return None, names
+    return None, []
+
+
+def get_conflicts() -> List[Dict[str, Any]]:
+    """Claves que apuntan a más de un Course: [{"key", "kind": "code"|"name", "courses"}]."""
+    _ensure_built()
+    out = []
+    for raw_field, raw_value in (_execute(("hgetall", _redis_key()))[0] or {}).items():
+        field = raw_field.decode() if isinstance(raw_field, bytes) else raw_field
+        if not field.startswith(("c:", "n:")):
+            continue
+        names = json.loads(raw_value)
+        if len(names) > 1:
+            out.append({"key": field[2:], "kind": "code" if field[0] == "c" else "name", "courses": names})
+    return sorted(out, key=lambda c: (c["kind"], c["key"]))
+
+
+@frappe.whitelist()
+def get_course_key_conflicts(rebuild=0):
+    """Reporte de claves de curso ambiguas (opcionalmente reconstruye el índice antes)."""
+    frappe.only_for(("System Manager", "Education Manager"))
+    if frappe.utils.cint(rebuild):
+        rebuild_index()
+    return get_conflicts()
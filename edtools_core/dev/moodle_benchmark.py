@@ -0,0 +1,253 @@
+"""
+Benchmark de la integración Moodle contra el stub local (`moodle_stub`), sin red.
+
+Ejecuta `process_enrollments` (Course Enrollment Import) con un archivo sintético de N filas y
+una muestra de `sync_student_enrollment_to_moodle`, y reporta tiempo total y llamadas por
+wsfunction. Al terminar hace rollback de la BD y limpia las cachés Redis que tocó (usuarios
+Moodle por email, árbol de categorías, circuito), así que no deja datos del stub en el sitio.
+
+Solo corre con developer_mode o allow_tests (sitios de CI/pruebas):
+
+    bench --site test.localhost execute edtools_core.dev.moodle_benchmark.run \\
+        --kwargs '{"rows": 10000, "courses": 40, "semester": "202601", "latency_ms": 20}'
+
+Crea sus propios datos dentro de la transacción que se descarta al final (Academic Year y Term
+del semestre si faltan, Courses, un Program y Students con User y Program Enrollment enviado), así
+que corre igual en un sitio de CI vacío.
+"""
+
+import csv
+import math
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import frappe
+
+from edtools_core.dev.moodle_stub import MoodleStub, StubConfig, start_server
+
+
+@contextmanager
+def _env(**values):
+    previous = {key: os.environ.get(key) for key in values}
+    os.environ.update({key: str(value) for key, value in values.items()})
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def _ensure_period(academic_year: str, academic_term: str, term_label: str) -> None:
+    """Academic Year (año calendario) y Academic Term del semestre, si no existen."""
+    if not frappe.db.exists("Academic Year", academic_year):
+        frappe.get_doc(
+            {
+                "doctype": "Academic Year",
+                "academic_year_name": academic_year,
+                "year_start_date": f"{academic_year}-01-01",
+                "year_end_date": f"{academic_year}-12-31",
+            }
+        ).insert(ignore_permissions=True)
+    if not frappe.db.exists("Academic Term", academic_term):
+        frappe.get_doc(
+            {
+                "doctype": "Academic Term",
+                "academic_year": academic_year,
+                "term_name": term_label,
+                "term_start_date": f"{academic_year}-01-01",
+                "term_end_date": f"{academic_year}-12-31",
+            }
+        ).insert(ignore_permissions=True)
+
+
+def _sample_data(
+    rows: int, courses: int, academic_year: str, academic_term: str
+) -> tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Courses y Students (con User y Program Enrollment enviado) propios del benchmark.
+
+    Crea ceil(rows / courses) estudiantes para que cada fila sea un par estudiante-curso distinto.
+    Todo queda en la transacción en curso (run hace rollback al terminar).
+    """
+    tag = frappe.generate_hash(length=6).upper()
+    course_names = [
+        frappe.get_doc({"doctype": "Course", "course_name": f"BENCH{tag}{i:03d} - Benchmark {i}"})
+        .insert(ignore_permissions=True)
+        .name
+        for i in range(courses)
+    ]
+    program = frappe.get_doc({"doctype": "Program", "program_name": f"Benchmark {tag}"}).insert(
+        ignore_permissions=True
+    )
+
+    students: List[Dict[str, Any]] = []
+    for i in range(math.ceil(rows / courses)):
+        email = f"bench.{tag.lower()}.{i}@example.com"
+        # User propio: el override de Student solo lo enlaza (sin welcome ni Azure)
+        frappe.get_doc(
+            {
+                "doctype": "User",
+                "email": email,
+                "first_name": "Benchmark",
+                "last_name": f"{tag} {i}",
+                "user_type": "Website User",
+                "send_welcome_email": 0,
+            }
+        ).insert(ignore_permissions=True)
+        student = frappe.get_doc(
+            {
+                "doctype": "Student",
+                "first_name": "Benchmark",
+                "last_name": f"{tag} {i}",
+                "student_email_id": email,
+            }
+        ).insert(ignore_permissions=True)
+        frappe.get_doc(
+            {
+                "doctype": "Program Enrollment",
+                "student": student.name,
+                "program": program.name,
+                "academic_year": academic_year,
+                "academic_term": academic_term,
+                "enrollment_date": f"{academic_year}-01-01",
+            }
+        ).insert(ignore_permissions=True).submit()
+        students.append(frappe._dict(name=student.name, user=student.user or email))
+    return students, course_names
+
+
+def _write_import_file(students: List[Dict[str, Any]], courses: List[str], rows: int, semester: str) -> str:
+    """CSV con el formato del Course Enrollment Import (ID, SEMESTER, COURSE)."""
+    fd, path = tempfile.mkstemp(prefix="edtools_moodle_bench_", suffix=".csv")
+    with os.fdopen(fd, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ID", "SEMESTER", "COURSE"])
+        for i in range(rows):
+            # Recorre estudiante x curso sin repetir pares hasta agotar las combinaciones
+            student = students[i % len(students)]
+            course = courses[(i // len(students)) % len(courses)]
+            writer.writerow([student.name, semester, course])
+    return path
+
+
+def _cleanup_caches(emails: List[str]) -> None:
+    from edtools_core import academic_term_meta, service_guard
+    from edtools_core.moodle_integration import invalidate_category_cache
+    from edtools_core.moodle_users import _USER_CACHE_PREFIX, _normalize_email
+
+    invalidate_category_cache()
+    academic_term_meta.invalidate()
+    for email in emails:
+        frappe.cache.delete_value(f"{_USER_CACHE_PREFIX}{_normalize_email(email)}")
+    service_guard.record_success("moodle")
+
+
+def run(
+    rows: int = 1000,
+    courses: int = 10,
+    semester: str = "202601",
+    latency_ms: float = 0,
+    jitter_ms: float = 0,
+    fail_rate: float = 0,
+    error_rate: float = 0,
+    sync_samples: int = 20,
+    seed: Optional[int] = 1,
+) -> Dict[str, Any]:
+    """Corre el benchmark y retorna (e imprime) tiempos y llamadas por fase."""
+    if not (frappe.conf.get("developer_mode") or frappe.conf.get("allow_tests")):
+        frappe.throw("El benchmark solo corre en sitios con developer_mode o allow_tests")
+
+    from edtools_core import course_key_index
+    from edtools_core.course_enrollment_import import process_enrollments
+    from edtools_core.grade_import import SEMESTER_SUFFIX_TO_TERM, semester_to_academic_year_and_term
+    from edtools_core.moodle_sync import sync_student_enrollment_to_moodle
+
+    rows, courses, sync_samples = int(rows), max(int(courses), 1), int(sync_samples)
+    semester = str(semester).strip().replace(" ", "")
+    parsed = semester_to_academic_year_and_term(semester)
+    if not parsed:
+        frappe.throw(f"Semestre inválido: {semester}")
+    academic_year, academic_term = parsed
+
+    stub = MoodleStub(
+        StubConfig(
+            latency_ms=float(latency_ms),
+            jitter_ms=float(jitter_ms),
+            fail_rate=float(fail_rate),
+            error_rate=float(error_rate),
+            seed=seed,
+        )
+    )
+    server, stub, url = start_server(stub)
+    report: Dict[str, Any] = {
+        "rows": rows,
+        "stub": {"latency_ms": latency_ms, "fail_rate": fail_rate, "error_rate": error_rate},
+    }
+    emails: List[str] = []
+    path = None
+    mute_emails = frappe.flags.mute_emails
+    frappe.flags.mute_emails = True
+    try:
+        # Datos propios en esta transacción (rollback en el finally). Los Courses nuevos entran al
+        # índice de claves recién al commit, así que se reconstruye aquí y otra vez al limpiar.
+        _ensure_period(academic_year, academic_term, SEMESTER_SUFFIX_TO_TERM[semester[-2:]])
+        students, course_names = _sample_data(rows, courses, academic_year, academic_term)
+        course_key_index.rebuild_index()
+        emails = [s.user for s in students]
+        path = _write_import_file(students, course_names, rows, semester)
+        report.update(students=len(students), courses=len(course_names))
+
+        # Sin rate limit (el stub no lo necesita) y apuntando al stub; cachés limpias para medir en frío
+        with _env(MOODLE_URL=url, MOODLE_TOKEN=stub.config.token, MOODLE_RATE_LIMIT_PER_SEC=0):
+            _cleanup_caches(emails)
+
+            started = time.monotonic()
+            result = process_enrollments(path)
+            summary = result.get("summary") or {}
+            report["import"] = {
+                "seconds": round(time.monotonic() - started, 2),
+                "summary": summary,
+                "errors": len(result.get("errors") or []),
+                "moodle": stub.stats(),
+            }
+
+            stub.reset()
+            _cleanup_caches(emails)
+            started = time.monotonic()
+            sync_errors = 0
+            for i in range(min(sync_samples, len(students))):
+                try:
+                    sync_student_enrollment_to_moodle(
+                        student=students[i].name,
+                        academic_year=academic_year,
+                        academic_term=academic_term,
+                        course=course_names[i % len(course_names)],
+                    )
+                except Exception:
+                    sync_errors += 1
+            elapsed = time.monotonic() - started
+            samples = min(sync_samples, len(students))
+            report["enrollment_sync"] = {
+                "samples": samples,
+                "seconds": round(elapsed, 2),
+                "ms_per_enrollment": round(elapsed * 1000 / samples, 1) if samples else None,
+                "errors": sync_errors,
+                "moodle": stub.stats(),
+            }
+    finally:
+        server.shutdown()
+        frappe.db.rollback()
+        frappe.flags.mute_emails = mute_emails
+        _cleanup_caches(emails)
+        course_key_index.rebuild_index()
+        if path:
+            os.unlink(path)
+
+    print(frappe.as_json(report))
+    return report
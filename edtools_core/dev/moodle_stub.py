@@ -0,0 +1,493 @@
+"""
+Servidor Moodle Web Services de prueba (WSGI, sin dependencias): para benchmarks y pruebas de
+integración sin red ni Moodle real.
+
+Implementa, con estado en memoria, las wsfunctions que usa EdTools:
+
+- Categorías: core_course_get_categories, core_course_create_categories
+- Cursos: core_course_get_courses_by_field, core_course_create_courses
+- Usuarios: core_user_get_users, core_user_get_users_by_field, core_user_create_users,
+  core_user_update_users
+- Matrículas: enrol_manual_enrol_users, enrol_manual_unenrol_users,
+  core_enrol_get_enrolled_users, core_enrol_get_users_courses
+- Notas: gradereport_user_get_grade_items
+
+Reproduce lo que el código de EdTools espera de Moodle: errores como JSON con "exception"
+(HTTP 200), lotes atómicos (una fila inválida rechaza el bloque), "Duplicate idnumber" y
+"El nombre corto (...) ya ha sido utilizado".
+
+Inyección de fallos y latencia (`StubConfig`): latencia fija + jitter, tasa de HTTP 503
+(`fail_rate`) y de respuestas JSON con excepción (`error_rate`), opcionalmente solo para
+algunas wsfunctions.
+
+Endpoints de control: GET /__stats (llamadas por wsfunction), POST /__reset (estado y
+contadores), POST /__config (JSON con campos de StubConfig).
+
+Uso:
+    python -m edtools_core.dev.moodle_stub --port 8765 --latency-ms 80 --fail-rate 0.01
+    MOODLE_URL=http://127.0.0.1:8765/webservice/rest/server.php MOODLE_TOKEN=stub-token
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from socketserver import ThreadingMixIn
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+DEFAULT_TOKEN = "stub-token"
+REST_PATH = "/webservice/rest/server.php"
+
+
+@dataclass
+class StubConfig:
+    token: str = DEFAULT_TOKEN
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    fail_rate: float = 0.0
+    error_rate: float = 0.0
+    # Vacío = la inyección aplica a todas las wsfunctions
+    fail_functions: List[str] = field(default_factory=list)
+    seed: Optional[int] = None
+
+
+class MoodleError(Exception):
+    def __init__(self, message: str, errorcode: str = "invalidparameter", exception: str = "moodle_exception"):
+        super().__init__(message)
+        self.errorcode = errorcode
+        self.exception = exception
+
+    def as_response(self) -> Dict[str, Any]:
+        return {"exception": self.exception, "errorcode": self.errorcode, "message": str(self)}
+
+
+def unflatten(pairs: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """`users[0][email]=x` -> {"users": [{"email": "x"}]} (claves numéricas -> listas ordenadas)."""
+    root: Dict[str, Any] = {}
+    for key, value in pairs:
+        parts = re.findall(r"[^\[\]]+", key)
+        if not parts:
+            continue
+        node = root
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+
+    def _listify(node: Any) -> Any:
+        if not isinstance(node, dict):
+            return node
+        converted = {k: _listify(v) for k, v in node.items()}
+        if converted and all(k.isdigit() for k in converted):
+            return [converted[k] for k in sorted(converted, key=int)]
+        return converted
+
+    return _listify(root)
+
+
+def _int(value: Any, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class MoodleStub:
+    """Estado en memoria + despacho de wsfunctions. Thread-safe (un lock para el estado)."""
+
+    def __init__(self, config: Optional[StubConfig] = None):
+        self.config = config or StubConfig()
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config.seed)
+        self.reset()
+
+    # ---------------------------------------------------------------- estado
+
+    def reset(self) -> None:
+        with self._lock:
+            self.categories: Dict[int, Dict[str, Any]] = {}
+            self.courses: Dict[int, Dict[str, Any]] = {}
+            self.users: Dict[int, Dict[str, Any]] = {}
+            # (userid, courseid) -> {"roleid", "suspend"}
+            self.enrolments: Dict[Tuple[int, int], Dict[str, int]] = {}
+            # (userid, courseid) -> nota 0..100 del total del curso
+            self.grades: Dict[Tuple[int, int], float] = {}
+            self._next_id = {"category": 1, "course": 2, "user": 3}
+            self.calls: Dict[str, int] = {}
+            self.injected = {"http_503": 0, "exception": 0}
+            # Categoría raíz "Miscellaneous" como en un Moodle recién instalado
+            self.categories[1] = {"id": 1, "name": "Miscellaneous", "idnumber": "", "parent": 0}
+            self._next_id["category"] = 2
+
+    def _new_id(self, kind: str) -> int:
+        new_id = self._next_id[kind]
+        self._next_id[kind] += 1
+        return new_id
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": dict(sorted(self.calls.items())),
+                "total_calls": sum(self.calls.values()),
+                "injected": dict(self.injected),
+                "categories": len(self.categories),
+                "courses": len(self.courses),
+                "users": len(self.users),
+                "enrolments": len(self.enrolments),
+            }
+
+    def set_grade(self, userid: int, courseid: int, grade: float) -> None:
+        with self._lock:
+            self.grades[(int(userid), int(courseid))] = float(grade)
+
+    # ---------------------------------------------------------------- despacho
+
+    def call(self, wsfunction: str, params: Dict[str, Any]) -> Any:
+        handler: Optional[Callable[[Dict[str, Any]], Any]] = getattr(self, f"ws_{wsfunction}", None)
+        with self._lock:
+            self.calls[wsfunction] = self.calls.get(wsfunction, 0) + 1
+            if handler is None:
+                return MoodleError(
+                    "Can't find data record in database table external_functions.", "invalidrecord",
+                    "dml_missing_record_exception",
+                ).as_response()
+            try:
+                return handler(params)
+            except MoodleError as e:
+                return e.as_response()
+
+    def _should_inject(self, wsfunction: str, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        if self.config.fail_functions and wsfunction not in self.config.fail_functions:
+            return False
+        return self._random.random() < rate
+
+    # ---------------------------------------------------------------- categorías
+
+    def ws_core_course_get_categories(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [dict(c) for c in self.categories.values()]
+
+    def ws_core_course_create_categories(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        rows = params.get("categories") or []
+        taken = {c["idnumber"] for c in self.categories.values() if c["idnumber"]}
+        for row in rows:
+            idnumber = (row.get("idnumber") or "").strip()
+            if idnumber and idnumber in taken:
+                raise MoodleError(f"Duplicate idnumber: {idnumber}", "idnumbertaken")
+            parent = _int(row.get("parent"))
+            if parent and parent not in self.categories:
+                raise MoodleError("Invalid parent category", "invalidrecord")
+            taken.add(idnumber)
+        created = []
+        for row in rows:
+            cat_id = self._new_id("category")
+            self.categories[cat_id] = {
+                "id": cat_id,
+                "name": row.get("name") or "",
+                "idnumber": (row.get("idnumber") or "").strip(),
+                "parent": _int(row.get("parent")),
+            }
+            created.append({"id": cat_id, "name": self.categories[cat_id]["name"]})
+        return created
+
+    # ---------------------------------------------------------------- cursos
+
+    def _course_out(self, course: Dict[str, Any]) -> Dict[str, Any]:
+        return {**course, "categoryid": course["category"], "displayname": course["fullname"]}
+
+    def ws_core_course_get_courses_by_field(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        fieldname = params.get("field") or ""
+        value = params.get("value") or ""
+        if not fieldname:
+            found = list(self.courses.values())
+        elif fieldname == "id":
+            found = [self.courses[_int(value)]] if _int(value) in self.courses else []
+        elif fieldname == "ids":
+            ids = {_int(v) for v in str(value).split(",")}
+            found = [c for cid, c in self.courses.items() if cid in ids]
+        elif fieldname == "category":
+            found = [c for c in self.courses.values() if c["category"] == _int(value)]
+        elif fieldname in ("shortname", "idnumber"):
+            found = [c for c in self.courses.values() if c[fieldname] == value]
+        else:
+            raise MoodleError(f"Invalid field: {fieldname}")
+        return {"courses": [self._course_out(c) for c in found], "warnings": []}
+
+    def ws_core_course_create_courses(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        rows = params.get("courses") or []
+        shortnames = {c["shortname"] for c in self.courses.values()}
+        idnumbers = {c["idnumber"] for c in self.courses.values() if c["idnumber"]}
+        for row in rows:
+            shortname = (row.get("shortname") or "").strip()
+            idnumber = (row.get("idnumber") or "").strip()
+            if not shortname or not (row.get("fullname") or "").strip():
+                raise MoodleError("Invalid parameter value detected")
+            if _int(row.get("categoryid")) not in self.categories:
+                raise MoodleError("Can't find data record in database table course_categories.", "invalidrecord")
+            if shortname in shortnames:
+                raise MoodleError(f"El nombre corto ({shortname}) ya ha sido utilizado", "shortnametaken")
+            if idnumber and idnumber in idnumbers:
+                raise MoodleError(f"Duplicate idnumber: {idnumber}", "courseidnumbertaken")
+            shortnames.add(shortname)
+            idnumbers.add(idnumber)
+        created = []
+        for row in rows:
+            course_id = self._new_id("course")
+            self.courses[course_id] = {
+                "id": course_id,
+                "fullname": row.get("fullname"),
+                "shortname": row.get("shortname").strip(),
+                "idnumber": (row.get("idnumber") or "").strip(),
+                "category": _int(row.get("categoryid")),
+                "startdate": _int(row.get("startdate")),
+                "enddate": _int(row.get("enddate")),
+            }
+            created.append({"id": course_id, "shortname": self.courses[course_id]["shortname"]})
+        return created
+
+    # ---------------------------------------------------------------- usuarios
+
+    def _users_by(self, fieldname: str, values: List[str]) -> List[Dict[str, Any]]:
+        if fieldname not in ("id", "email", "username", "idnumber"):
+            raise MoodleError(f"Invalid field: {fieldname}")
+        wanted = {str(v).strip().lower() for v in values}
+        return [
+            dict(u) for u in self.users.values() if str(u.get(fieldname) or "").strip().lower() in wanted
+        ]
+
+    def ws_core_user_get_users(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        users = list(self.users.values())
+        for criterion in params.get("criteria") or []:
+            users = [u for u in users if u in self._users_by(criterion.get("key"), [criterion.get("value")])]
+        return {"users": [dict(u) for u in users], "warnings": []}
+
+    def ws_core_user_get_users_by_field(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return self._users_by(params.get("field") or "", params.get("values") or [])
+
+    def ws_core_user_create_users(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        rows = params.get("users") or []
+        usernames = {u["username"] for u in self.users.values()}
+        for row in rows:
+            username = (row.get("username") or "").strip().lower()
+            if not username or not (row.get("email") or "").strip():
+                raise MoodleError("Invalid parameter value detected")
+            if username in usernames:
+                raise MoodleError(f"Username already exists: {username}", "invalidparameter")
+            usernames.add(username)
+        created = []
+        for row in rows:
+            user_id = self._new_id("user")
+            self.users[user_id] = {
+                "id": user_id,
+                "username": row["username"].strip().lower(),
+                "email": row["email"].strip().lower(),
+                "firstname": row.get("firstname") or "",
+                "lastname": row.get("lastname") or "",
+                "idnumber": (row.get("idnumber") or "").strip(),
+                "auth": row.get("auth") or "manual",
+                "suspended": 0,
+            }
+            created.append({"id": user_id, "username": self.users[user_id]["username"]})
+        return created
+
+    def ws_core_user_update_users(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        warnings = []
+        for row in params.get("users") or []:
+            user = self.users.get(_int(row.get("id")))
+            if not user:
+                warnings.append({"item": "user", "itemid": _int(row.get("id")), "warningcode": "invaliduserid"})
+                continue
+            for key, value in row.items():
+                if key == "id":
+                    continue
+                user[key] = _int(value) if key == "suspended" else value
+        return {"warnings": warnings}
+
+    # ---------------------------------------------------------------- matrículas
+
+    def ws_enrol_manual_enrol_users(self, params: Dict[str, Any]) -> None:
+        rows = params.get("enrolments") or []
+        for row in rows:
+            if _int(row.get("userid")) not in self.users:
+                raise MoodleError("Invalid user", "invaliduser")
+            if _int(row.get("courseid")) not in self.courses:
+                raise MoodleError("Can't find data record in database table course.", "invalidrecord")
+        for row in rows:
+            key = (_int(row.get("userid")), _int(row.get("courseid")))
+            self.enrolments[key] = {"roleid": _int(row.get("roleid"), 5), "suspend": _int(row.get("suspend"))}
+        return None
+
+    def ws_enrol_manual_unenrol_users(self, params: Dict[str, Any]) -> None:
+        rows = params.get("enrolments") or []
+        for row in rows:
+            if _int(row.get("userid")) not in self.users or _int(row.get("courseid")) not in self.courses:
+                raise MoodleError("Invalid enrolment", "invalidrecord")
+        for row in rows:
+            self.enrolments.pop((_int(row.get("userid")), _int(row.get("courseid"))), None)
+        return None
+
+    def ws_core_enrol_get_enrolled_users(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        course_id = _int(params.get("courseid"))
+        if course_id not in self.courses:
+            raise MoodleError("Can't find data record in database table course.", "invalidrecord")
+        options = {o.get("name"): o.get("value") for o in params.get("options") or []}
+        only_active = _int(options.get("onlyactive"))
+        out = []
+        for (uid, cid), enrolment in self.enrolments.items():
+            if cid != course_id:
+                continue
+            user = self.users[uid]
+            if only_active and (enrolment["suspend"] or user.get("suspended")):
+                continue
+            out.append({"id": uid, "email": user["email"], "roles": [{"roleid": enrolment["roleid"]}]})
+        return out
+
+    def ws_core_enrol_get_users_courses(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        user_id = _int(params.get("userid"))
+        if user_id not in self.users:
+            raise MoodleError("Invalid user", "invaliduser")
+        return [
+            self._course_out(self.courses[cid]) for (uid, cid) in self.enrolments if uid == user_id
+        ]
+
+    # ---------------------------------------------------------------- notas
+
+    def ws_gradereport_user_get_grade_items(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        course_id = _int(params.get("courseid"))
+        if course_id not in self.courses:
+            raise MoodleError("Can't find data record in database table course.", "invalidrecord")
+        only_user = _int(params.get("userid"))
+        usergrades = []
+        for (uid, cid), enrolment in self.enrolments.items():
+            if cid != course_id or enrolment["roleid"] != 5 or (only_user and uid != only_user):
+                continue
+            grade = self.grades.get((uid, cid))
+            usergrades.append(
+                {
+                    "courseid": cid,
+                    "userid": uid,
+                    "userfullname": f"{self.users[uid]['firstname']} {self.users[uid]['lastname']}".strip(),
+                    "gradeitems": [
+                        {
+                            "id": cid,
+                            "itemtype": "course",
+                            "graderaw": grade,
+                            "grademin": 0,
+                            "grademax": 100,
+                        }
+                    ],
+                }
+            )
+        return {"usergrades": usergrades, "warnings": []}
+
+    # ---------------------------------------------------------------- WSGI
+
+    def _json(self, start_response, payload: Any, status: str = "200 OK") -> List[bytes]:
+        body = json.dumps(payload).encode()
+        start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO") or "/"
+        method = environ.get("REQUEST_METHOD", "GET")
+        length = _int(environ.get("CONTENT_LENGTH"))
+        body = environ["wsgi.input"].read(length).decode() if length else ""
+
+        if path == "/__stats":
+            return self._json(start_response, self.stats())
+        if path == "/__reset" and method == "POST":
+            self.reset()
+            return self._json(start_response, {"ok": True})
+        if path == "/__config" and method == "POST":
+            for key, value in (json.loads(body or "{}")).items():
+                if hasattr(self.config, key):
+                    setattr(self.config, key, value)
+            return self._json(start_response, {"ok": True})
+        if path != REST_PATH:
+            return self._json(start_response, {"error": "not found"}, "404 Not Found")
+
+        pairs = parse_qsl(body, keep_blank_values=True) + parse_qsl(environ.get("QUERY_STRING") or "")
+        params = unflatten(pairs)
+        wsfunction = params.pop("wsfunction", "")
+        token = params.pop("wstoken", "")
+        params.pop("moodlewsrestformat", None)
+
+        delay = self.config.latency_ms + (self._random.uniform(0, self.config.jitter_ms) if self.config.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        with self._lock:
+            inject_503 = self._should_inject(wsfunction, self.config.fail_rate)
+            inject_error = not inject_503 and self._should_inject(wsfunction, self.config.error_rate)
+            if inject_503:
+                self.injected["http_503"] += 1
+            elif inject_error:
+                self.injected["exception"] += 1
+        if inject_503:
+            return self._json(start_response, {"error": "injected"}, "503 Service Unavailable")
+        if token != self.config.token:
+            return self._json(
+                start_response,
+                MoodleError("Invalid token - token not found", "invalidtoken", "moodle_exception").as_response(),
+            )
+        if inject_error:
+            return self._json(start_response, MoodleError("Injected failure", "injectedfailure").as_response())
+        return self._json(start_response, self.call(wsfunction, params))
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(stub: Optional[MoodleStub] = None, host: str = "127.0.0.1", port: int = 0):
+    """Levanta el stub en un hilo daemon. Retorna (server, stub, url); cerrar con server.shutdown()."""
+    stub = stub or MoodleStub()
+    server = make_server(host, port, stub, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    threading.Thread(target=server.serve_forever, name="moodle-stub", daemon=True).start()
+    return server, stub, f"http://{host}:{server.server_port}{REST_PATH}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Servidor Moodle Web Services de prueba")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--token", default=DEFAULT_TOKEN)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--fail-function", action="append", default=[])
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    stub = MoodleStub(
+        StubConfig(
+            token=args.token,
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            fail_rate=args.fail_rate,
+            error_rate=args.error_rate,
+            fail_functions=args.fail_function,
+            seed=args.seed,
+        )
+    )
+    server = make_server(args.host, args.port, stub, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    print(f"Moodle stub en http://{args.host}:{args.port}{REST_PATH} (token {args.token})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -86,6 +86,24 @@ frappe.ui.form.on("Course Enrollment Import", {
 			}
 		).addClass("btn-primary");
 
+		frm.add_custom_button(__("Simular (llamadas a Moodle)"), function () {
+			if (!frm.doc.excel_file) {
+				frappe.msgprint(__("Por favor adjunta un archivo Excel o CSV."), {
+					indicator: "red",
+				});
+				return;
+			}
+			frm.call({
+				method: "plan_import",
+				doc: frm.doc,
+				freeze: true,
+				freeze_message: __("Calculando plan..."),
+				callback: function (r) {
+					if (r.message) show_moodle_plan(r.message);
+				},
+			});
+		});
+
 		frm.add_custom_button(
 			__("Limpiar resultados"),
 			function () {
@@ -108,3 +126,50 @@ frappe.ui.form.on("Course Enrollment Import", {
 		);
 	},
 });
+
+function show_moodle_plan(plan) {
+	var esc = frappe.utils.escape_html;
+	var rows = (plan.by_wsfunction || [])
+		.map(function (r) {
+			return (
+				"<tr><td>" + esc(r.wsfunction) + "</td>" +
+				"<td>" + r.calls + (r.max_calls > r.calls ? " (" + __("hasta") + " " + r.max_calls + ")" : "") + "</td>" +
+				"<td>" + (r.fallback_calls || "—") + "</td>" +
+				"<td>" + Math.round(r.avg_ms) + (r.measured ? "" : " *") + "</td>" +
+				"<td>" + (r.estimated_ms / 1000).toFixed(1) + "</td></tr>"
+			);
+		})
+		.join("");
+	var warnings = (plan.warnings || [])
+		.map(function (w) {
+			return "<li>" + esc(w) + "</li>";
+		})
+		.join("");
+	var counts = plan.rows || {};
+	frappe.msgprint({
+		title: __("Plan de llamadas a Moodle (simulación)"),
+		indicator: plan.fallback_calls ? "orange" : "blue",
+		wide: true,
+		message:
+			"<p>" +
+			__("Filas a inscribir: {0}; duplicados: {1}; con error: {2}", [
+				counts.pending || 0,
+				counts.duplicates || 0,
+				counts.errors || 0,
+			]) +
+			"</p><p><strong>" +
+			__("Llamadas: {0} (hasta {1}); duración estimada: {2} s (hasta {3} s)", [
+				plan.total_calls,
+				plan.max_calls,
+				plan.estimated_seconds,
+				plan.max_estimated_seconds,
+			]) +
+			"</strong></p>" +
+			'<table class="table table-bordered table-condensed"><thead><tr>' +
+			"<th>wsfunction</th><th>" + __("Llamadas") + "</th><th>" + __("Fallback") + "</th>" +
+			"<th>ms/" + __("llamada") + "</th><th>" + __("Seg. estimados") + "</th>" +
+			"</tr></thead><tbody>" + rows + "</tbody></table>" +
+			'<p class="text-muted small">* ' + __("sin métricas recientes: latencia por defecto") + "</p>" +
+			(warnings ? "<p><strong>" + __("Avisos") + "</strong></p><ul>" + warnings + "</ul>" : ""),
+	});
+}
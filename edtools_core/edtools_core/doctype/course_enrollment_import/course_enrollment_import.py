@@ -21,8 +21,7 @@ class CourseEnrollmentImport(Document):
 		self.save()
 		return {"ok": True}
 
-	@frappe.whitelist()
-	def process_import(self):
+	def _get_file_path(self) -> str:
 		file_url = (self.get("excel_file") or "").strip()
 		if not file_url:
 			frappe.throw(_("Por favor adjunta un archivo Excel (.xlsx) o CSV."))
@@ -34,7 +33,21 @@ class CourseEnrollmentImport(Document):
 					"No se encontró el archivo en el servidor. Si lo subiste como privado, se soporta; vuelve a intentar o recarga el archivo."
 				)
 			)
+		return file_path
+
+	@frappe.whitelist()
+	def plan_import(self):
+		"""Simulación: llamadas a Moodle que haría la importación y duración estimada (no guarda nada)."""
+		from edtools_core.moodle_sync_planner import plan_enrollment_import
 
+		return plan_enrollment_import(
+			self._get_file_path(),
+			default_enrollment_date=coerce_enrollment_date_str(self.get("enrollment_date")),
+		)
+
+	@frappe.whitelist()
+	def process_import(self):
+		file_path = self._get_file_path()
 		default_date = coerce_enrollment_date_str(self.get("enrollment_date"))
 
 		def _progress(current, total, message):
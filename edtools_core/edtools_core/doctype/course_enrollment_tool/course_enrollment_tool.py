@@ -5,6 +5,8 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import nowdate
 
+from edtools_core.moodle_metrics import moodle_operation
+
 class CourseEnrollmentTool(Document):
 	
 	@frappe.whitelist()
@@ -87,6 +89,7 @@ class CourseEnrollmentTool(Document):
 
 
 	@frappe.whitelist()
+	@moodle_operation("enrollment_tool")
 	def enroll_students(self):
 		"""
 		Recorre la tabla y crea los Course Enrollments con validaciones robustas.
@@ -162,6 +165,9 @@ class CourseEnrollmentTool(Document):
 		# Asegurar que tenemos fecha, si no, usar hoy
 		enroll_date = self.enrollment_date or nowdate()
 
+		ce_meta = frappe.get_meta("Course Enrollment")
+		pending_rows = []
+
 		for idx, row in enumerate(self.students):
 			# Solo procesar los Pendientes o con Error previo
 			if row.status == "Enrolled":
@@ -187,7 +193,6 @@ class CourseEnrollmentTool(Document):
 					"course": self.course,
 					"docstatus": 1,
 				}
-				ce_meta = frappe.get_meta("Course Enrollment")
 				if self.academic_term and ce_meta.has_field("custom_academic_term"):
 					filters["custom_academic_term"] = self.academic_term
 				else:
@@ -205,35 +210,58 @@ class CourseEnrollmentTool(Document):
 					})
 					continue
 
-				# A.1 Sincronizar con Moodle: usuario (crear si no existe) y matrícula en el curso
-				try:
-					from edtools_core.moodle_sync import sync_student_enrollment_to_moodle
-					sync_result = sync_student_enrollment_to_moodle(
-						student=row.student,
-						academic_year=self.academic_year,
-						academic_term=self.academic_term,
-						course=self.course,
-					)
-					if sync_result.get("already_enrolled"):
-						already_enrolled_students.append(
-							getattr(row, "student_full_name", None) or row.student
-						)
-				except Exception as moodle_err:
-					row.status = "Error"
-					error_msg = str(moodle_err)[:140]
-					row.error_log = error_msg
-					errors += 1
-					results.append({
-						"student": row.student,
-						"status": "❌ Error Moodle",
-						"message": error_msg
-					})
-					frappe.log_error(
-						"CET Moodle Sync",
-						f"Moodle sync failed for {row.student}: {moodle_err}",
-					)
-					continue
+				pending_rows.append(row)
 
+			except Exception as e:
+				row.status = "Error"
+				error_msg = str(e)[:140]
+				row.error_log = error_msg
+				errors += 1
+				results.append({
+					"student": row.student,
+					"status": "❌ Error",
+					"message": error_msg
+				})
+				frappe.log_error(
+					"CET Enroll Error",
+					f"Error enrolling {row.student}: {str(e)}",
+				)
+
+		# A.1 Sincronizar con Moodle: usuarios (crear si no existen) y matrícula masiva en el curso
+		moodle_results = {}
+		if pending_rows:
+			from edtools_core.course_enrollment_moodle import enroll_moodle_students_in_course
+
+			moodle_results = enroll_moodle_students_in_course(
+				[row.student for row in pending_rows],
+				moodle_course_id,
+				enrolled_ids=enrolled_ids,
+				log_context="Course Enrollment Tool",
+			)
+
+		for row in pending_rows:
+			sync_result = moodle_results.get(row.student) or {"error": "Sin resultado de Moodle"}
+			if sync_result.get("error"):
+				row.status = "Error"
+				error_msg = str(sync_result["error"])[:140]
+				row.error_log = error_msg
+				errors += 1
+				results.append({
+					"student": row.student,
+					"status": "❌ Error Moodle",
+					"message": error_msg
+				})
+				frappe.log_error(
+					"CET Moodle Sync",
+					f"Moodle sync failed for {row.student}: {sync_result['error']}",
+				)
+				continue
+			if sync_result.get("already_enrolled"):
+				already_enrolled_students.append(
+					getattr(row, "student_full_name", None) or row.student
+				)
+
+			try:
 				# B. Crear el documento Course Enrollment
 				# Obtener el programa desde el Program Enrollment
 				program_enrollment_doc = frappe.get_doc("Program Enrollment", row.program_enrollment)
@@ -249,6 +277,9 @@ class CourseEnrollmentTool(Document):
 					"custom_academic_year": self.academic_year,
 					"custom_academic_term": self.academic_term
 				})
+				# ID del curso Moodle: evita volver a buscarlo al suspender (LOA) o desmatricular
+				if ce_meta.has_field("moodle_course_id"):
+					enrollment.moodle_course_id = sync_result.get("moodle_course_id") or moodle_course_id
 				
 				enrollment.insert(ignore_permissions=True)
 				enrollment.submit()
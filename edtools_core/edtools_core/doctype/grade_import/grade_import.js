@@ -6,81 +6,85 @@ frappe.ui.form.on("Grade Import", {
 		frm.disable_save();
 		frm.page.clear_user_actions();
 
-		frm.add_custom_button(
-			__("Procesar importación"),
-			function () {
-				if (!frm.doc.excel_file) {
-					frappe.msgprint(__("Por favor adjunta un archivo Excel o CSV."), {
-						indicator: "red",
-					});
-					return;
-				}
-				frappe.confirm(
-					__(
-						"Se validará el archivo y se crearán/actualizarán grupos de estudiantes, planes de evaluación y resultados. ¿Continuar?"
-					),
-					function () {
-						var progress_dialog = null;
-						var progress_handler = function (data) {
-							if (!progress_dialog || !progress_dialog.$wrapper) return;
-							var pct = (data && data.progress != null) ? data.progress : 0;
-							var msg = (data && data.message) ? data.message : "";
-							progress_dialog.$wrapper.find(".progress-bar").css("width", pct + "%");
-							progress_dialog.$wrapper.find(".progress-message").text(msg);
-						};
+		const running = ["Queued", "Running"].includes(frm.doc.import_status);
+		const interrupted = ["Running", "Failed", "Cancelled"].includes(frm.doc.import_status);
 
-						progress_dialog = new frappe.ui.Dialog({
-							title: __("Importando notas"),
-							size: "sm",
-							primary_action_label: __("Cerrar"),
-							primary_action: function () {
-								progress_dialog.hide();
-							},
+		if (!running) {
+			frm.add_custom_button(
+				__("Procesar importación"),
+				function () {
+					if (!frm.doc.excel_file) {
+						frappe.msgprint(__("Por favor adjunta un archivo Excel o CSV."), {
+							indicator: "red",
 						});
-						progress_dialog.$body.append(
-							'<div class="progress" style="height: 24px; margin-bottom: 12px;">' +
-								'<div class="progress-bar progress-bar-striped progress-bar-animated" role="progressbar" style="width: 0%;">' +
-								"</div></div>" +
-								'<p class="progress-message text-muted small"></p>'
-						);
-						progress_dialog.show();
-						progress_dialog.$wrapper.find(".btn-primary").hide();
-
-						frappe.realtime.on("grade_import_progress", progress_handler);
+						return;
+					}
+					frappe.confirm(
+						__(
+							"Se validará el archivo y se crearán/actualizarán grupos de estudiantes, planes de evaluación y resultados en segundo plano. ¿Continuar?"
+						),
+						function () {
+							frm.call({
+								method: "process_import",
+								doc: frm.doc,
+								freeze: true,
+								freeze_message: __("Encolando importación..."),
+								callback: function () {
+									frappe.show_alert({
+										message: __("Importación encolada. Puedes cerrar esta página."),
+										indicator: "blue",
+									});
+									frm.reload_doc();
+								},
+							});
+						}
+					);
+				}
+			).addClass("btn-primary");
+		}
 
+		// Running sin job vivo (worker caído) también se puede reanudar; el servidor lo valida
+		if (interrupted) {
+			frm.add_custom_button(__("Reanudar importación"), function () {
+				frappe.confirm(
+					__("Se continuará la última importación saltando las filas ya aplicadas. ¿Continuar?"),
+					function () {
 						frm.call({
-							method: "process_import",
+							method: "resume_import",
 							doc: frm.doc,
 							freeze: true,
-							freeze_message: __("Validando y procesando notas..."),
-							callback: function (r) {
-								frappe.realtime.off("grade_import_progress", progress_handler);
-								if (progress_dialog && progress_dialog.$wrapper) {
-									progress_dialog.$wrapper.find(".progress-bar").css("width", "100%");
-									progress_dialog.$wrapper.find(".progress-message").text(__("Finalizado."));
-									progress_dialog.$wrapper.find(".btn-primary").show();
-								}
-								if (r.message && r.message.message) {
-									frappe.msgprint({
-										message: __("Importación finalizada. Revisa el bloque de resultados en el formulario."),
-										indicator: r.message.success ? "green" : "orange",
-										title: __("Resultado"),
-									});
-								}
+							callback: function () {
+								frappe.show_alert({ message: __("Importación reanudada."), indicator: "blue" });
 								frm.reload_doc();
 							},
-							error: function () {
-								frappe.realtime.off("grade_import_progress", progress_handler);
-								if (progress_dialog && progress_dialog.$wrapper) {
-									progress_dialog.$wrapper.find(".btn-primary").show();
-								}
+						});
+					}
+				);
+			});
+		}
+
+		if (running) {
+			frm.add_custom_button(__("Cancelar importación"), function () {
+				frappe.confirm(
+					__("La importación se detendrá en el próximo punto de control. Lo ya aplicado se conserva y se puede reanudar. ¿Cancelar?"),
+					function () {
+						frm.call({
+							method: "cancel_import",
+							doc: frm.doc,
+							callback: function () {
+								frappe.show_alert({ message: __("Cancelación solicitada."), indicator: "orange" });
 								frm.reload_doc();
 							},
 						});
 					}
 				);
-			}
-		).addClass("btn-primary");
+			});
+			frm.dashboard.show_progress(
+				__("Importación de notas"),
+				frm.doc.progress || 0,
+				frm.doc.progress_message || ""
+			);
+		}
 
 		frm.add_custom_button(
 			__("Limpiar resultados"),
@@ -102,5 +106,20 @@ frappe.ui.form.on("Grade Import", {
 				);
 			}
 		);
+
+		if (!frm._grade_import_listener) {
+			frm._grade_import_listener = true;
+			frappe.realtime.on("grade_import_progress", function (data) {
+				frm.dashboard.show_progress(
+					__("Importación de notas"),
+					data.progress || 0,
+					data.message || ""
+				);
+				if (data.finished) {
+					frm.dashboard.hide_progress();
+					frm.reload_doc();
+				}
+			});
+		}
 	},
 });
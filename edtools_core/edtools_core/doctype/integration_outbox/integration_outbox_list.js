@@ -0,0 +1,100 @@
+// Copyright (c) 2026, EdTools and contributors
+// For license information, please see license.txt
+
+const OUTBOX_METHOD = "edtools_core.integration_outbox";
+
+frappe.listview_settings["Integration Outbox"] = {
+	add_fields: ["status", "attempts", "next_attempt_at"],
+	get_indicator: function (doc) {
+		const colors = {
+			Pending: "blue",
+			Processing: "orange",
+			Done: "green",
+			Failed: "yellow",
+			Dead: "red",
+		};
+		return [__(doc.status), colors[doc.status] || "gray", "status,=," + doc.status];
+	},
+	onload: function (listview) {
+		listview.page.add_inner_button(__("Resumen"), function () {
+			frappe.call({
+				method: OUTBOX_METHOD + ".get_summary",
+				callback: function (r) {
+					show_outbox_summary(r.message || {});
+				},
+			});
+		});
+
+		listview.page.add_inner_button(__("Reintentar fallidos"), function () {
+			frappe.confirm(__("Se re-encolarán todas las operaciones Failed y Dead. ¿Continuar?"), function () {
+				frappe.call({
+					method: OUTBOX_METHOD + ".replay_failed",
+					callback: function (r) {
+						frappe.show_alert({
+							message: __("{0} operación(es) re-encoladas", [(r.message || {}).replayed || 0]),
+							indicator: "green",
+						});
+						listview.refresh();
+					},
+				});
+			});
+		});
+
+		listview.page.add_inner_button(__("Procesar ahora"), function () {
+			frappe.call({
+				method: OUTBOX_METHOD + ".process_now",
+				callback: function () {
+					frappe.show_alert({ message: __("Dispatcher encolado"), indicator: "blue" });
+				},
+			});
+		});
+
+		listview.page.add_actions_menu_item(__("Reintentar"), function () {
+			const names = listview.get_checked_items(true);
+			if (!names.length) return;
+			frappe.call({
+				method: OUTBOX_METHOD + ".replay",
+				args: { names: names },
+				callback: function (r) {
+					frappe.show_alert({
+						message: __("{0} operación(es) re-encoladas", [(r.message || {}).replayed || 0]),
+						indicator: "green",
+					});
+					listview.refresh();
+				},
+			});
+		});
+	},
+};
+
+function show_outbox_summary(data) {
+	const by_status = data.by_status || {};
+	const statuses = ["Pending", "Processing", "Failed", "Dead", "Done"];
+	let html = '<table class="table table-bordered"><tbody>';
+	statuses.forEach(function (s) {
+		html += "<tr><td>" + __(s) + "</td><td>" + (by_status[s] || 0) + "</td></tr>";
+	});
+	html += "</tbody></table>";
+
+	const oldest = data.oldest_pending_seconds || 0;
+	html +=
+		"<p>" +
+		__("Pendiente más antiguo: {0} min", [Math.round(oldest / 60)]) +
+		"</p>";
+
+	if ((data.failures || []).length) {
+		html += '<h5>' + __("Fallas por operación") + '</h5><table class="table table-bordered"><tbody>';
+		data.failures.forEach(function (f) {
+			html +=
+				"<tr><td>" +
+				frappe.utils.escape_html(f.operation) +
+				"</td><td>" +
+				__(f.status) +
+				"</td><td>" +
+				f.count +
+				"</td></tr>";
+		});
+		html += "</tbody></table>";
+	}
+	frappe.msgprint({ title: __("Integration Outbox"), message: html, wide: true });
+}
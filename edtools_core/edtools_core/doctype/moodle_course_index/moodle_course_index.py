@@ -0,0 +1,7 @@
+# Copyright (c) 2026, EdTools and contributors
+
+from frappe.model.document import Document
+
+
+class MoodleCourseIndex(Document):
+	pass
@@ -0,0 +1,27 @@
+// Copyright (c) 2026, EdTools and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("Moodle Enrolment Drift Report", {
+	refresh: function (frm) {
+		if (frm.is_new() || frm.doc.status === "Running") {
+			return;
+		}
+		frm.add_custom_button(__("Reconciliar"), function () {
+			if (!frm.doc.academic_term && !frm.doc.moodle_course_id) {
+				frappe.msgprint(__("Indica un Academic Term o un Moodle Course ID."), { indicator: "red" });
+				return;
+			}
+			frappe.confirm(
+				frm.doc.apply_fixes
+					? __("Se compararán las matrículas de Moodle con los Course Enrollments y se aplicarán las correcciones. ¿Continuar?")
+					: __("Se compararán las matrículas de Moodle con los Course Enrollments (solo reporte). ¿Continuar?"),
+				function () {
+					frm.call("run").then(function () {
+						frappe.show_alert({ message: __("Reconciliación encolada"), indicator: "blue" });
+						frm.reload_doc();
+					});
+				}
+			);
+		});
+	},
+});
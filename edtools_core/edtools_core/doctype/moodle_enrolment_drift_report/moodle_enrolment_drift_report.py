@@ -0,0 +1,14 @@
+# Copyright (c) 2026, EdTools and contributors
+
+import frappe
+from frappe.model.document import Document
+
+
+class MoodleEnrolmentDriftReport(Document):
+	@frappe.whitelist()
+	def run(self):
+		from edtools_core.moodle_reconciliation import enqueue_report
+
+		frappe.only_for(("System Manager", "Education Manager"))
+		enqueue_report(self.name)
+		return self.name
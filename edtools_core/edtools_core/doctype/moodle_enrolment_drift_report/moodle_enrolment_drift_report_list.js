@@ -0,0 +1,15 @@
+// Copyright (c) 2026, EdTools and contributors
+// For license information, please see license.txt
+
+frappe.listview_settings["Moodle Enrolment Drift Report"] = {
+	add_fields: ["status"],
+	get_indicator: function (doc) {
+		const colors = {
+			Queued: "blue",
+			Running: "orange",
+			Completed: "green",
+			Failed: "red",
+		};
+		return [__(doc.status), colors[doc.status] || "gray", "status,=," + doc.status];
+	},
+};
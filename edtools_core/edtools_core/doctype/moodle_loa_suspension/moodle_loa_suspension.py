@@ -0,0 +1,13 @@
+# Copyright (c) 2026, EdTools and contributors
+
+import frappe
+from frappe.model.document import Document
+
+
+class MoodleLOASuspension(Document):
+	pass
+
+
+def on_doctype_update():
+	# Consulta típica: cursos suspendidos (status) de un estudiante
+	frappe.db.add_index("Moodle LOA Suspension", ["student", "status"])
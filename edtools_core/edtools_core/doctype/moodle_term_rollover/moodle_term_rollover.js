@@ -0,0 +1,51 @@
+// Copyright (c) 2026, EdTools and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("Moodle Term Rollover", {
+	refresh: function (frm) {
+		frm.disable_save();
+		frm.add_custom_button(__("Aprovisionar cursos en Moodle"), function () {
+			if (!frm.doc.academic_term) {
+				frappe.msgprint(__("Selecciona un Academic Term."), { indicator: "red" });
+				return;
+			}
+			frappe.confirm(
+				__("Se crearán en Moodle todos los cursos del período que aún no existan. ¿Continuar?"),
+				function () {
+					frappe.call({
+						method: "edtools_core.moodle_term_rollover.start_rollover",
+						args: {
+							academic_term: frm.doc.academic_term,
+							source: frm.doc.source,
+							program: frm.doc.program,
+						},
+						freeze: true,
+						callback: function (r) {
+							const n = (r.message && r.message.courses) || 0;
+							frappe.show_alert({
+								message: __("Rollover encolado: {0} curso(s)", [n]),
+								indicator: "blue",
+							});
+							frm.reload_doc();
+						},
+					});
+				}
+			);
+		}).addClass("btn-primary");
+
+		if (!frm._rollover_listener) {
+			frm._rollover_listener = true;
+			frappe.realtime.on("moodle_term_rollover_progress", function (data) {
+				frm.dashboard.show_progress(
+					__("Term Rollover"),
+					data.progress || 0,
+					data.message || ""
+				);
+				if (data.progress >= 100) {
+					frm.dashboard.hide_progress();
+					frm.reload_doc();
+				}
+			});
+		}
+	},
+});
@@ -0,0 +1,38 @@
+// Copyright (c) 2026, EdTools and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Moodle API Metrics"] = {
+	filters: [
+		{
+			fieldname: "window_minutes",
+			label: __("Ventana"),
+			fieldtype: "Select",
+			options: [
+				{ value: "5", label: __("Últimos 5 min") },
+				{ value: "15", label: __("Últimos 15 min") },
+				{ value: "60", label: __("Última hora") },
+				{ value: "360", label: __("Últimas 6 horas") },
+				{ value: "1440", label: __("Últimas 24 horas") },
+			],
+			default: "15",
+		},
+		{
+			fieldname: "by_operation",
+			label: __("Por operación"),
+			fieldtype: "Check",
+			default: 1,
+		},
+	],
+	onload: function (report) {
+		report.page.add_inner_button(__("Reiniciar métricas"), function () {
+			frappe.confirm(__("Se borrarán las métricas acumuladas de Moodle. ¿Continuar?"), function () {
+				frappe.call({
+					method: "edtools_core.moodle_metrics.reset_moodle_metrics",
+					callback: function () {
+						report.refresh();
+					},
+				});
+			});
+		});
+	},
+};
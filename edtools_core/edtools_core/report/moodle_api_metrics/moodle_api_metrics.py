@@ -0,0 +1,62 @@
+# Copyright (c) 2026, EdTools and contributors
+# License: MIT
+
+import frappe
+from frappe.utils import cint
+
+from edtools_core.moodle_metrics import collect
+
+
+def execute(filters=None):
+	filters = frappe._dict(filters or {})
+	window = cint(filters.window_minutes) or 15
+	by_operation = cint(filters.by_operation)
+
+	rows = collect(window, by_operation=bool(by_operation))
+	data = [
+		{
+			**r,
+			"error_rate": (r["error_rate"] or 0) * 100,
+			"error_codes": ", ".join(f"{code} ({n})" for code, n in sorted(r["error_codes"].items(), key=lambda x: -x[1])),
+		}
+		for r in rows
+	]
+	return get_columns(by_operation), data, None, get_chart(rows)
+
+
+def get_columns(by_operation):
+	columns = []
+	if by_operation:
+		columns.append({"fieldname": "operation", "label": "Operation", "fieldtype": "Data", "width": 170})
+	return columns + [
+		{"fieldname": "wsfunction", "label": "WS Function", "fieldtype": "Data", "width": 260},
+		{"fieldname": "calls", "label": "Calls", "fieldtype": "Int", "width": 90},
+		{"fieldname": "calls_per_min", "label": "Calls/min", "fieldtype": "Float", "width": 90},
+		{"fieldname": "errors", "label": "Errors", "fieldtype": "Int", "width": 80},
+		{"fieldname": "error_rate", "label": "Error %", "fieldtype": "Percent", "width": 90},
+		{"fieldname": "avg_ms", "label": "Avg (ms)", "fieldtype": "Float", "width": 100},
+		{"fieldname": "p50_ms", "label": "p50 (ms)", "fieldtype": "Float", "width": 100},
+		{"fieldname": "p95_ms", "label": "p95 (ms)", "fieldtype": "Float", "width": 100},
+		{"fieldname": "p99_ms", "label": "p99 (ms)", "fieldtype": "Float", "width": 100},
+		{"fieldname": "bytes_out", "label": "Bytes Out", "fieldtype": "Int", "width": 110},
+		{"fieldname": "bytes_in", "label": "Bytes In", "fieldtype": "Int", "width": 110},
+		{"fieldname": "error_codes", "label": "Error Codes", "fieldtype": "Data", "width": 300},
+	]
+
+
+def get_chart(rows):
+	"""p95 de las 10 funciones con más llamadas."""
+	top = sorted(rows, key=lambda r: r["calls"], reverse=True)[:10]
+	if not top:
+		return None
+	labels = [f"{r['operation']} · {r['wsfunction']}" if r["operation"] else r["wsfunction"] for r in top]
+	return {
+		"data": {
+			"labels": labels,
+			"datasets": [
+				{"name": "p50 (ms)", "values": [r["p50_ms"] or 0 for r in top]},
+				{"name": "p95 (ms)", "values": [r["p95_ms"] or 0 for r in top]},
+			],
+		},
+		"type": "bar",
+	}
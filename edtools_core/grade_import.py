@@ -13,6 +13,8 @@ import frappe
 from frappe import _
 from frappe.utils import flt
 
+from edtools_core import grading_scale_cache
+
 # Columnas requeridas en el archivo (coincidencia flexible por nombre)
 REQUIRED_COLUMNS = ["ID", "SEMESTER", "COURSE", "FINAL GRADE"]
 OPTIONAL_COLUMNS = ["FULL NAME", "COURSE TITLE"]
@@ -254,15 +256,7 @@ def _grade_value_valid(grade: str, grading_scale_name: str) -> bool:
         return True
     except (TypeError, ValueError):
         pass
-    intervals = frappe.get_all(
-        "Grading Scale Interval",
-        filters={"parent": grading_scale_name},
-        fields=["grade_code"],
-    )
-    for d in intervals or []:
-        if (d.get("grade_code") or "").strip().upper() == grade.strip().upper():
-            return True
-    return False
+    return grading_scale_cache.has_letter(grading_scale_name, grade)
 
 
 def semester_to_academic_year_and_term(semester_code: str) -> tuple[str, str] | None:
@@ -286,70 +280,92 @@ def semester_to_academic_year_and_term(semester_code: str) -> tuple[str, str] |
 def letter_to_percentage(grading_scale_name: str, letter_grade: str) -> float | None:
     """
     Convierte una letra (A, A-, B+, etc.) al porcentaje mínimo de la escala.
-    Usado para calcular score = (percentage/100) * max_score.
+    Usado para calcular score = (percentage/100) * max_score. Escala cacheada (grading_scale_cache).
     """
-    intervals = frappe.get_all(
-        "Grading Scale Interval",
-        filters={"parent": grading_scale_name},
-        fields=["grade_code", "threshold"],
-        order_by="threshold desc",
-    )
-    if not intervals:
-        return None
-    letter_grade = (letter_grade or "").strip().upper()
-    for d in intervals or []:
-        code = (d.get("grade_code") or "").strip().upper()
-        if code == letter_grade:
-            return flt(d.get("threshold"), 2)
-    return None
+    return grading_scale_cache.letter_to_percentage(grading_scale_name, letter_grade)
 
 
 def get_student_name_by_id(student_id: str) -> str | None:
     """
     Resuelve el estudiante por ID (columna ID del Excel).
     Busca por Student.name o por custom field que almacene el ID si existe.
+    Para archivos completos usar `resolve_student_ids` (consultas por conjunto).
     """
     if not student_id or not (student_id or "").strip():
         return None
-    student_id = (student_id or "").strip()
-    if frappe.db.exists("Student", student_id):
-        return student_id
-    # Opcional: custom field en Student para ID numérico (ej. student_id_number)
+    return resolve_student_ids([student_id]).get((student_id or "").strip())
+
+
+# Valores por consulta IN al resolver identificadores de estudiante
+_STUDENT_ID_CHUNK = 500
+_EXCEL_NUMBER_RE = re.compile(r"^(\d+)\.0+$")
+
+
+def _student_id_fields() -> list[str]:
+    """Campos de Student que pueden guardar el ID del archivo (ej. custom student_id_number)."""
     meta = frappe.get_meta("Student")
-    for f in meta.fields or []:
-        if f.fieldtype in ("Data", "Int", "Small Text") and "id" in (f.fieldname or "").lower():
-            try:
-                name = frappe.db.get_value("Student", {f.fieldname: student_id}, "name")
-                if name:
-                    return name
-            except Exception:
-                pass
-    return None
+    return [
+        f.fieldname
+        for f in meta.fields or []
+        if f.fieldtype in ("Data", "Int", "Small Text") and "id" in (f.fieldname or "").lower()
+    ]
 
 
-def _normalize_course_code(code: str) -> str:
-    """Normaliza código de curso para búsqueda (quitar espacios extra, mantener formato)."""
-    if not code:
-        return ""
-    return " ".join((code or "").strip().split())
+def _student_id_keys(student_id: str) -> list[str]:
+    """Claves normalizadas de un ID: tal cual y, si Excel lo convirtió en número (12345.0), el entero."""
+    m = _EXCEL_NUMBER_RE.match(student_id)
+    return [student_id, m.group(1)] if m else [student_id]
+
 
+def _match_student_field(fieldname: str, pending: dict[str, list[str]], out: dict[str, str]) -> None:
+    """Una consulta IN (por bloque) contra `fieldname`; mueve de pending a out los resueltos."""
+    values = list(pending)
+    for start in range(0, len(values), _STUDENT_ID_CHUNK):
+        chunk = values[start : start + _STUDENT_ID_CHUNK]
+        try:
+            rows = frappe.get_all(
+                "Student",
+                filters={fieldname: ["in", chunk]},
+                fields=["name", fieldname],
+                order_by="creation asc",
+            )
+        except Exception:
+            return
+        for r in rows:
+            # Comparación sin distinguir mayúsculas (igual que la collation de la BD)
+            key = str(r.get(fieldname) or "").strip().lower()
+            for original in pending.pop(key, []):
+                out.setdefault(original, r.name)
 
-def _expand_course_code_without_spaces(code: str) -> str | None:
+
+def resolve_student_ids(student_ids) -> dict[str, str]:
     """
-    Convierte código sin espacios a formato con espacio antes de los dígitos.
-    Ej: STA530 -> STA 530, MIB650 -> MIB 650.
-    Permite recibir STA530 cuando el Course tiene short_name = "STA 530".
+    Resuelve en bloque los IDs de un archivo de import: {ID (sin espacios): Student.name}.
+
+    Mismo orden de búsqueda que `get_student_name_by_id` pero por conjunto: una consulta IN
+    por campo candidato (name, campos *id* de Student y student_email_id para IDs con @).
+    Los IDs que no aparecen en el resultado no existen.
     """
-    if not code or not isinstance(code, str):
-        return None
-    code = code.strip().replace(" ", "")
-    if not code:
-        return None
-    # Insertar espacio entre letras y dígitos: "STA530" -> "STA 530"
-    m = re.match(r"^([A-Za-z]+)(\d.*)$", code)
-    if m:
-        return f"{m.group(1)} {m.group(2)}".strip()
-    return None
+    ids = list(dict.fromkeys((str(i) or "").strip() for i in student_ids if i and str(i).strip()))
+    out: dict[str, str] = {}
+    if not ids:
+        return out
+
+    # clave normalizada (minúsculas) -> IDs originales del archivo
+    pending: dict[str, list[str]] = {}
+    for student_id in ids:
+        for key in _student_id_keys(student_id):
+            pending.setdefault(key.lower(), []).append(student_id)
+
+    for fieldname in ["name", *_student_id_fields()]:
+        if not pending:
+            break
+        _match_student_field(fieldname, pending, out)
+
+    emails = {key: originals for key, originals in pending.items() if "@" in key}
+    if emails and frappe.get_meta("Student").has_field("student_email_id"):
+        _match_student_field("student_email_id", emails, out)
+    return out
 
 
 def _normalize_course_key(value: str) -> str:
@@ -441,6 +457,13 @@ def _find_course_candidates(course_code: str, course_title: str | None = None, l
 
 
 def _course_not_found_message(course_code: str, course_title: str | None = None) -> str:
+    from edtools_core import course_key_index
+
+    _name, conflict = course_key_index.lookup(course_code, course_title)
+    if conflict:
+        return _("Curso ambiguo: {0} coincide con varios cursos ({1}). Corrija el código o el curso.").format(
+            course_code, ", ".join(conflict)
+        )
     candidates = _find_course_candidates(course_code, course_title=course_title, limit=5)
     if candidates:
         return _("Curso no existe: {0}. Posibles coincidencias: {1}").format(
@@ -453,87 +476,35 @@ def _course_not_found_message(course_code: str, course_title: str | None = None)
 
 def _resolve_course(course_code: str, course_title: str | None = None) -> str | None:
     """
-    Devuelve el name del Course en Frappe si existe (por short_name o por name).
+    Devuelve el name del Course en Frappe si existe (por short_name, course_code, name o título).
     Acepta códigos con o sin espacios: "STA 530" y "STA530" funcionan igual.
+
+    Usa el índice de claves normalizadas (`course_key_index`, O(1) por fila). Si la clave es
+    ambigua (varios Courses) retorna None; `_course_not_found_message` reporta el conflicto.
     """
     if not course_code:
         return None
-    stripped = course_code.strip()
-    normalized = _normalize_course_code(course_code)
-    compact = (course_code or "").replace(" ", "")
-    expanded = _expand_course_code_without_spaces(course_code)
+    from edtools_core import course_key_index
 
-    # 1) Buscar por short_name/course_code (si existen campos en el DocType)
-    meta = frappe.get_meta("Course")
-    code_fields = []
-    if meta.has_field("short_name"):
-        code_fields.append("short_name")
-    if meta.has_field("course_code"):
-        code_fields.append("course_code")
+    name, _conflict = course_key_index.lookup(course_code, course_title)
+    return name
 
-    input_key = _normalize_course_key(course_code)
-    title_key = _normalize_course_key(course_title or "")
 
-    if code_fields:
-        values_to_try = [stripped, normalized, compact]
-        if expanded and expanded not in values_to_try:
-            values_to_try.append(expanded)
-        for fieldname in code_fields:
-            for value in values_to_try:
-                if not value:
-                    continue
-                name = frappe.db.get_value("Course", {fieldname: value}, "name")
-                if name:
-                    return name
-
-    # 2) Búsqueda flexible: comparar short_name/course_code sin espacios y en mayúsculas
-    if code_fields and compact:
-        fields = ["name"] + code_fields
-        courses = frappe.get_all("Course", fields=fields)
-        for c in courses or []:
-            compact_upper = compact.upper()
-            for fieldname in code_fields:
-                raw = c.get(fieldname) or ""
-                normalized_code = str(raw).strip().replace(" ", "").upper()
-                if normalized_code == compact_upper:
-                    return c.get("name")
-                if input_key and _normalize_course_key(raw) == input_key:
-                    return c.get("name")
-
-    # 3) Buscar por course_name exacto (título) si existe el campo
-    if meta.has_field("course_name"):
-        for value in (stripped, normalized, (course_title or "").strip()):
-            if not value:
-                continue
-            name = frappe.db.get_value("Course", {"course_name": value}, "name")
-            if name:
-                return name
-
-    # 4) Búsqueda tolerante por claves normalizadas en toda la tabla
-    rows = _get_all_courses_for_lookup(code_fields)
-    for row in rows:
-        tokens = [row.get("name") or "", row.get("course_name") or ""]
-        for f in code_fields:
-            tokens.append(row.get(f) or "")
-        keys = {_normalize_course_key(t) for t in tokens if t}
-        if (input_key and input_key in keys) or (title_key and title_key in keys):
-            return row.get("name")
-
-    # 5) Buscar por name del registro
-    for value in (normalized, stripped, compact, expanded):
-        if value and frappe.db.exists("Course", value):
-            return value
-    return None
-
-
-def _ensure_student_in_group(student_group_name: str, student_name: str) -> bool:
+def _ensure_student_in_group(student_group_name: str, student_name: str, commit: bool = True) -> bool:
     """
     Garantiza que student_name exista en la tabla students del Student Group.
     Se usa justo antes de crear/guardar Assessment Result para evitar
     StudentNotInGroupError cuando el grupo existe pero no contiene al alumno.
+    commit=False: no confirma ni revierte la transacción (el import masivo usa savepoints por fila).
     """
     if not student_group_name or not student_name:
         return False
+    # Caso normal (get_or_create_student_group ya agregó a todos): una consulta, sin cargar el grupo
+    if frappe.db.exists(
+        "Student Group Student",
+        {"parent": student_group_name, "parenttype": "Student Group", "student": student_name},
+    ):
+        return True
     if not frappe.db.exists("Student Group", student_group_name):
         return False
     try:
@@ -561,10 +532,12 @@ def _ensure_student_in_group(student_group_name: str, student_name: str) -> bool
             },
         )
         sg.save(ignore_permissions=True)
-        frappe.db.commit()
+        if commit:
+            frappe.db.commit()
         return True
     except Exception:
-        frappe.db.rollback()
+        if commit:
+            frappe.db.rollback()
         return False
 
 
@@ -769,16 +742,126 @@ def get_or_create_assessment_plan(
         return None
 
 
+# Filas por sentencia UPDATE en SubmittedResultBatch.flush
+_BULK_UPDATE_CHUNK = 500
+
+
+def _bulk_update_by_name(doctype: str, values_by_name: dict[str, dict[str, Any]]) -> None:
+    """
+    UPDATE en bloque por name: un CASE por campo (válido en MariaDB y Postgres).
+    Actualiza modified/modified_by como frappe.db.set_value. No corre hooks del documento.
+    """
+    names = list(values_by_name)
+    if not names:
+        return
+    fields = list(values_by_name[names[0]])
+    params: list[Any] = []
+    sets = []
+    for field in fields:
+        sets.append(f"`{field}` = case `name`" + " when %s then %s" * len(names) + " end")
+        for name in names:
+            params += [name, values_by_name[name][field]]
+    params += [frappe.utils.now(), frappe.session.user, *names]
+    frappe.db.sql(
+        f"""
+        update `tab{doctype}`
+        set {", ".join(sets)}, `modified` = %s, `modified_by` = %s
+        where `name` in ({", ".join(["%s"] * len(names))})
+        """,
+        params,
+    )
+
+
+def _submitted_results_by_student(assessment_plan_name: str, criteria_name: str) -> dict[str, tuple[str, str | None]]:
+    """{student: (Assessment Result presentado, detalle del criterio o None)} del plan, en una consulta."""
+    rows = frappe.db.sql(
+        """
+        select ar.student, ar.name, ard.name as detail
+        from `tabAssessment Result` ar
+        left join `tabAssessment Result Detail` ard
+            on ard.parent = ar.name and ard.parenttype = 'Assessment Result'
+            and ard.assessment_criteria = %(criteria)s
+        where ar.assessment_plan = %(plan)s and ar.docstatus = 1
+        order by ar.creation asc
+        """,
+        {"plan": assessment_plan_name, "criteria": criteria_name},
+        as_dict=True,
+    )
+    out: dict[str, tuple[str, str | None]] = {}
+    for r in rows:
+        out.setdefault(r.student, (r.name, r.detail))
+    return out
+
+
+class SubmittedResultBatch:
+    """
+    Notas nuevas para Assessment Results ya presentados, aplicadas en bloque por el import masivo.
+
+    `find` busca el resultado presentado con una consulta por plan (no una por fila); `add` acumula
+    y `flush` escribe todo con un UPDATE por tabla y recién ahí limpia la caché del documento y
+    encola la notificación. Igual que la ruta fila a fila, escribe directo en la BD (sin hooks).
+    """
+
+    def __init__(self):
+        self._by_plan: dict[str, dict[str, tuple[str, str | None]]] = {}
+        self._pending: dict[str, dict[str, Any]] = {}
+
+    def find(self, assessment_plan_name: str, criteria_name: str, student_name: str) -> tuple[str, str | None] | None:
+        index = self._by_plan.get(assessment_plan_name)
+        if index is None:
+            index = self._by_plan[assessment_plan_name] = _submitted_results_by_student(
+                assessment_plan_name, criteria_name
+            )
+        return index.get(student_name)
+
+    def add(self, result_name: str, detail_name: str, score: float, grade: str, plan, student_name: str) -> None:
+        self._pending[result_name] = {
+            "result": result_name,
+            "detail": detail_name,
+            "score": score,
+            "grade": grade or "",
+            "plan": plan,
+            "student": student_name,
+        }
+
+    def flush(self) -> int:
+        """Aplica lo acumulado (dentro de la transacción en curso). Retorna la cantidad de resultados."""
+        from edtools_core.notifications.grades import queue_grade_after_assessment_result_update
+
+        rows = list(self._pending.values())
+        self._pending = {}
+        for start in range(0, len(rows), _BULK_UPDATE_CHUNK):
+            chunk = rows[start : start + _BULK_UPDATE_CHUNK]
+            _bulk_update_by_name(
+                "Assessment Result Detail",
+                {r["detail"]: {"score": r["score"], "grade": r["grade"]} for r in chunk},
+            )
+            _bulk_update_by_name(
+                "Assessment Result",
+                {r["result"]: {"total_score": r["score"], "grade": r["grade"]} for r in chunk},
+            )
+        for r in rows:
+            frappe.clear_document_cache("Assessment Result", r["result"])
+            queue_grade_after_assessment_result_update(r["plan"], r["student"], r["score"], via_submit=False)
+        return len(rows)
+
+
 def create_or_update_assessment_result(
     assessment_plan_name: str,
     student_name: str,
     score: float,
     grading_scale_name: str,
+    *,
+    commit: bool = True,
+    submitted_batch: SubmittedResultBatch | None = None,
 ) -> tuple[str | None, str | None, bool, bool]:
     """
     Crea o actualiza el Assessment Result para (assessment_plan, student) con un solo criterio Definitiva y score.
     Devuelve (name, error_message, created, updated_submitted).
     updated_submitted=True cuando se actualizó un resultado que ya estaba presentado (sin cancelar).
+
+    Import masivo: commit=False deja la transacción al llamador (commit por bloque, savepoint por fila)
+    y con submitted_batch la nota de un resultado presentado se acumula para `SubmittedResultBatch.flush`.
     """
     from edtools_core.notifications.grades import queue_grade_after_assessment_result_update
 
@@ -786,13 +869,11 @@ def create_or_update_assessment_result(
         from education.education.api import (
             get_assessment_result_doc,
             get_assessment_details,
-            get_grade,
         )
     except ImportError:
         from education.education.education.api import (
             get_assessment_result_doc,
             get_assessment_details,
-            get_grade,
         )
 
     details_list = get_assessment_details(assessment_plan_name)
@@ -805,34 +886,42 @@ def create_or_update_assessment_result(
     plan = frappe.get_doc("Assessment Plan", assessment_plan_name)
     # Comprobar primero si ya existe resultado presentado: así no llamamos a get_assessment_result_doc
     # y evitamos el msgprint "Result already Submitted" de Education; mostramos el dato en el resumen.
-    existing_submitted = frappe.get_all(
-        "Assessment Result",
-        filters={
-            "student": student_name,
-            "assessment_plan": assessment_plan_name,
-            "docstatus": 1,
-        },
-        limit=1,
-    )
+    if submitted_batch is not None:
+        existing_submitted = submitted_batch.find(assessment_plan_name, criteria_name, student_name)
+    else:
+        existing_submitted = None
+        rows = frappe.get_all(
+            "Assessment Result",
+            filters={
+                "student": student_name,
+                "assessment_plan": assessment_plan_name,
+                "docstatus": 1,
+            },
+            limit=1,
+        )
+        if rows:
+            details = frappe.get_all(
+                "Assessment Result Detail",
+                filters={"parent": rows[0]["name"], "assessment_criteria": criteria_name},
+                pluck="name",
+                limit=1,
+            )
+            existing_submitted = (rows[0]["name"], details[0] if details else None)
     if existing_submitted:
-        result_name = existing_submitted[0]["name"]
+        result_name, detail_name = existing_submitted
         grading_scale = plan.grading_scale or grading_scale_name
         score_val = flt(score, 2)
         percentage = (score_val / 100.0) * 100 if score_val else 0
-        grade_letter = get_grade(grading_scale, percentage)
-        details = frappe.get_all(
-            "Assessment Result Detail",
-            filters={"parent": result_name, "assessment_criteria": criteria_name},
-            fields=["name"],
-            limit=1,
-        )
-        if not details:
+        grade_letter = grading_scale_cache.get_grade(grading_scale, percentage)
+        if not detail_name:
             return None, _("No se encontró el criterio Definitiva en el resultado existente."), False, False
-        frappe.db.set_value("Assessment Result Detail", details[0]["name"], "score", score_val)
-        frappe.db.set_value("Assessment Result Detail", details[0]["name"], "grade", grade_letter or "")
-        frappe.db.set_value("Assessment Result", result_name, "total_score", score_val)
-        frappe.db.set_value("Assessment Result", result_name, "grade", grade_letter or "")
-        frappe.db.commit()
+        if submitted_batch is not None:
+            submitted_batch.add(result_name, detail_name, score_val, grade_letter, plan, student_name)
+            return result_name, None, False, True
+        frappe.db.set_value("Assessment Result Detail", detail_name, {"score": score_val, "grade": grade_letter or ""})
+        frappe.db.set_value("Assessment Result", result_name, {"total_score": score_val, "grade": grade_letter or ""})
+        if commit:
+            frappe.db.commit()
         frappe.clear_document_cache("Assessment Result", result_name)
         queue_grade_after_assessment_result_update(
             plan, student_name, score_val, via_submit=False
@@ -844,7 +933,7 @@ def create_or_update_assessment_result(
     is_new = doc.get("__islocal", False)
 
     # Asegurar pertenencia al grupo antes de guardar para evitar validación de Education.
-    if not _ensure_student_in_group(plan.student_group, student_name):
+    if not _ensure_student_in_group(plan.student_group, student_name, commit=commit):
         return None, _("No se pudo asociar el estudiante al grupo {0}.").format(plan.student_group), False, False
 
     # Borrador: rellenar campos y guardar/presentar
@@ -864,7 +953,8 @@ def create_or_update_assessment_result(
     doc.save(ignore_permissions=True)
     if doc.docstatus == 0:
         doc.submit()
-    frappe.db.commit()
+    if commit:
+        frappe.db.commit()
     queue_grade_after_assessment_result_update(
         plan, student_name, flt(score, 2), via_submit=True
     )
@@ -1143,21 +1233,64 @@ def process_grade_single(data: dict) -> dict[str, Any]:
     }
 
 
+# Filas por transacción en process_grades: al cerrar cada bloque se aplica el lote de resultados
+# presentados, se guarda el checkpoint y se hace commit (y se consulta la cancelación).
+GRADE_IMPORT_CHECKPOINT_ROWS = 500
+_ROW_SAVEPOINT = "grade_import_row"
+# Errores de procesamiento que se conservan en el checkpoint (para el resumen tras reanudar)
+_CHECKPOINT_MAX_ERRORS = 1000
+
+
+def new_grade_import_checkpoint() -> dict[str, Any]:
+    """
+    Checkpoint vacío: {"done": {grupo: filas aplicadas}, contadores, sg/ap, errores de procesamiento,
+    correos de notas pendientes}.
+    """
+    return {
+        "done": {},
+        "processed": 0,
+        "created": 0,
+        "updated": 0,
+        "updated_submitted": 0,
+        "student_groups": [],
+        "assessment_plans": [],
+        "errors": [],
+        "notifications": {},
+    }
+
+
 def process_grades(
     file_path: str,
     grading_scale_name: str | None = None,
     progress_callback: None | callable = None,
+    *,
+    checkpoint: dict[str, Any] | None = None,
+    on_checkpoint: None | callable = None,
+    should_cancel: None | callable = None,
 ) -> dict[str, Any]:
     """
     Ejecuta la importación: validación previa y, si pasa, creación de grupos, planes y resultados.
     - Si la validación de formato falla, devuelve success=False y validation_errors (no crea nada).
     - Si la validación pasa, procesa filas; filas con error (estudiante no encontrado, etc.) se omiten
       y se anotan en errors; se crean resultados para el resto.
+
+    Transacciones: las filas se escriben en bloques de GRADE_IMPORT_CHECKPOINT_ROWS (un commit por
+    bloque y al cambiar de grupo) con un savepoint por fila: una fila con error revierte solo lo suyo.
+
+    Reanudación (job de Grade Import): `checkpoint` (ver `new_grade_import_checkpoint`) indica cuántas
+    filas de cada grupo ya se aplicaron; esas se saltan. Al cerrar cada bloque se llama
+    `on_checkpoint(checkpoint)`, que debe hacer el commit (checkpoint y filas quedan en la misma
+    transacción); sin on_checkpoint se hace commit aquí. Si `should_cancel()` es verdadero se detiene
+    con cancelled=True.
+
+    Correos de notas: un correo agrupado por estudiante por importación. Los pendientes viajan en el
+    checkpoint (mismo commit que sus filas) y se envían una sola vez al terminar la corrida.
     Returns:
         {
             "success": bool,
+            "cancelled": bool,
             "validation_errors": [{"row": N, "message": "..."}],
-            "summary": {"student_groups_created": 0, "assessment_plans_created": 0, "assessment_results_created": 0, "assessment_results_updated": 0, "assessment_results_updated_submitted": 0, "rows_processed": 0, "rows_with_errors": 0},
+            "summary": {"student_groups_created": 0, "assessment_plans_created": 0, "assessment_results_created": 0, "assessment_results_updated": 0, "assessment_results_updated_submitted": 0, "rows_processed": 0, "rows_with_errors": 0, "rows_skipped_resumed": 0},
             "errors": [{"row": N, "message": "..."}],
         }
     """
@@ -1198,6 +1331,7 @@ def process_grades(
             "assessment_results_updated_submitted": 0,
             "rows_processed": 0,
             "rows_with_errors": 0,
+            "rows_skipped_resumed": 0,
         },
         "errors": [],
         "results": results,
@@ -1242,6 +1376,11 @@ def process_grades(
     # 2) Agrupar por (course, academic_year, academic_term)
     from collections import defaultdict
     groups = defaultdict(list)  # (course, year, term_label) -> [ (row_index, student_id, grade, course_code), ... ]
+    # Todos los IDs del archivo en unas pocas consultas; los no encontrados se reportan antes de escribir
+    student_map = resolve_student_ids(row.get("ID") for row in data_rows)
+    out["unresolved_student_ids"] = sorted(
+        {(row.get("ID") or "").strip() for row in data_rows} - set(student_map) - {""}
+    )
     for i, row in enumerate(data_rows):
         semester = (row.get("SEMESTER") or "").strip().replace(" ", "")
         parsed = semester_to_academic_year_and_term(semester)
@@ -1274,7 +1413,7 @@ def process_grades(
             )
             continue
         student_id = (row.get("ID") or "").strip()
-        student_name = get_student_name_by_id(student_id)
+        student_name = student_map.get(student_id)
         if not student_name:
             msg = _("Estudiante no encontrado: {0}").format(student_id)
             out["errors"].append({"row": i + 2, "message": msg})
@@ -1327,135 +1466,169 @@ def process_grades(
         groups[key].append((i + 2, student_name, score, course_frappe))
 
     # 3) Por cada grupo: Assessment Group leaf, Student Group, Assessment Plan, Assessment Results
-    from edtools_core.notifications.grades import flush_grade_notifications
+    from edtools_core.notifications.grades import (
+        discard_grade_notifications,
+        flush_grade_notifications,
+        pending_grade_notifications,
+        restore_grade_notifications,
+    )
+
+    cp = checkpoint if checkpoint is not None else new_grade_import_checkpoint()
+    submitted_batch = SubmittedResultBatch()
+    out["cancelled"] = False
+    skipped_resumed = 0
+    since_checkpoint = 0
+
+    def _processing_error(row_num, student_name, course_frappe, term_name, msg):
+        out["errors"].append({"row": row_num, "message": msg})
+        if len(cp["errors"]) < _CHECKPOINT_MAX_ERRORS:
+            cp["errors"].append({"row": row_num, "message": msg})
+        _add_result(
+            row=row_num,
+            student=student_name,
+            course=course_frappe,
+            academic_term=term_name,
+            status="ErrorProcesamiento",
+            detail=msg,
+        )
+
+    def _commit_checkpoint():
+        if on_checkpoint:
+            on_checkpoint(cp)
+        else:
+            frappe.db.commit()
+
+    def _save_checkpoint():
+        """Cierra el bloque: lote de presentados y checkpoint (con los correos pendientes), en el mismo commit."""
+        submitted_batch.flush()
+        # Los correos no se envían por bloque (serían varios por estudiante): quedan en el checkpoint
+        # junto con sus filas; si el job muere, al reanudar se recuperan
+        cp["notifications"] = pending_grade_notifications()
+        _commit_checkpoint()
+        return bool(should_cancel and should_cancel())
 
     frappe.flags.in_grade_import = True
     try:
-        created_sg = set()
-        created_ap = set()
-        total_processed = 0
-        total_created = 0
-        total_updated = 0
-        total_updated_submitted = 0
-        total_errors = len(out["errors"])
+        restore_grade_notifications(cp.get("notifications"))
+        # Errores de procesamiento de ejecuciones anteriores (las filas de validación se recalculan)
+        out["errors"].extend(cp["errors"])
+        total_processed = cp["processed"]
 
         for (course_frappe, year, term_label), rows in groups.items():
             term_name = f"{year} ({term_label})"
+            group_key = f"{course_frappe}|{year}|{term_label}"
+            # Una sola fila por estudiante por grupo: la última en el archivo gana (evita que una fila con 0 o vacía sobrescriba la nota correcta).
+            seen_student = {}
+            for row_num, student_name, score, __unused_course in rows:
+                seen_student[student_name] = (row_num, student_name, score, __unused_course)
+            unique_rows = list(seen_student.values())
+            done = cp["done"].get(group_key, 0)
+            if done >= len(unique_rows):
+                skipped_resumed += len(unique_rows)
+                continue
+            skipped_resumed += done
+            # get_or_create_* confirman por su cuenta: primero cerrar el bloque para que el checkpoint no quede atrás
+            if since_checkpoint:
+                since_checkpoint = 0
+                if _save_checkpoint():
+                    out["cancelled"] = True
+                    break
+
             if progress_callback:
                 progress_callback(total_processed, len(data_rows), _("Procesando grupo {0} - {1}").format(course_frappe, term_name))
             leaf = get_or_create_assessment_group_leaf(year, term_label)
             if not leaf:
-                for (row_num, __unused1, __unused2, __unused3) in rows:
-                    msg = _("No se pudo crear el grupo de evaluación para {0}.").format(term_name)
-                    out["errors"].append({"row": row_num, "message": msg})
-                    _add_result(
-                        row=row_num,
-                        student=__unused1,
-                        course=course_frappe,
-                        academic_term=term_name,
-                        status="ErrorProcesamiento",
-                        detail=msg,
-                    )
+                for (row_num, __unused1, __unused2, __unused3) in unique_rows[done:]:
+                    _processing_error(row_num, __unused1, course_frappe, term_name, _("No se pudo crear el grupo de evaluación para {0}.").format(term_name))
+                cp["done"][group_key] = len(unique_rows)
                 continue
             student_names = list({r[1] for r in rows})
             sg_name = get_or_create_student_group(course_frappe, year, term_name, student_names)
             if not sg_name:
-                for (row_num, __unused1, __unused2, __unused3) in rows:
-                    msg = _("No se pudo crear el grupo de estudiantes.")
-                    out["errors"].append({"row": row_num, "message": msg})
-                    _add_result(
-                        row=row_num,
-                        student=__unused1,
-                        course=course_frappe,
-                        academic_term=term_name,
-                        status="ErrorProcesamiento",
-                        detail=msg,
-                    )
+                for (row_num, __unused1, __unused2, __unused3) in unique_rows[done:]:
+                    _processing_error(row_num, __unused1, course_frappe, term_name, _("No se pudo crear el grupo de estudiantes."))
+                cp["done"][group_key] = len(unique_rows)
                 continue
-            if sg_name not in created_sg:
-                created_sg.add(sg_name)
+            if sg_name not in cp["student_groups"]:
+                cp["student_groups"].append(sg_name)
             course_doc = frappe.get_cached_doc("Course", course_frappe)
             scale = getattr(course_doc, "default_grading_scale", None) or grading_scale_name
             ap_name = get_or_create_assessment_plan(sg_name, leaf, course_frappe, scale, academic_term_name=term_name)
             if not ap_name:
-                for (row_num, __unused1, __unused2, __unused3) in rows:
-                    msg = _("No se pudo crear el plan de evaluación.")
-                    out["errors"].append({"row": row_num, "message": msg})
-                    _add_result(
-                        row=row_num,
-                        student=__unused1,
-                        course=course_frappe,
-                        academic_term=term_name,
-                        status="ErrorProcesamiento",
-                        detail=msg,
-                    )
+                for (row_num, __unused1, __unused2, __unused3) in unique_rows[done:]:
+                    _processing_error(row_num, __unused1, course_frappe, term_name, _("No se pudo crear el plan de evaluación."))
+                cp["done"][group_key] = len(unique_rows)
                 continue
-            if ap_name not in created_ap:
-                created_ap.add(ap_name)
-            # Una sola fila por estudiante por grupo: la última en el archivo gana (evita que una fila con 0 o vacía sobrescriba la nota correcta).
-            seen_student = {}
-            for row_num, student_name, score, __unused_course in rows:
-                seen_student[student_name] = (row_num, student_name, score, __unused_course)
-            unique_rows = list(seen_student.values())
-            for row_num, student_name, score, __unused_course in unique_rows:
+            if ap_name not in cp["assessment_plans"]:
+                cp["assessment_plans"].append(ap_name)
+            for idx in range(done, len(unique_rows)):
+                row_num, student_name, score, __unused_course = unique_rows[idx]
                 if progress_callback:
                     progress_callback(total_processed, len(data_rows), _("Procesando resultado: {0}").format(student_name))
-                ar_name, err, created, updated_submitted = create_or_update_assessment_result(ap_name, student_name, score, scale)
+                frappe.db.savepoint(_ROW_SAVEPOINT)
+                try:
+                    ar_name, err, created, updated_submitted = create_or_update_assessment_result(
+                        ap_name, student_name, score, scale, commit=False, submitted_batch=submitted_batch
+                    )
+                except Exception as e:
+                    ar_name, created, updated_submitted = None, False, False
+                    err = _("Error al guardar el resultado: {0}").format(str(e) or type(e).__name__)
                 if err:
-                    out["errors"].append({"row": row_num, "message": err})
+                    frappe.db.rollback(save_point=_ROW_SAVEPOINT)
+                    _processing_error(row_num, student_name, course_frappe, term_name, err)
+                else:
+                    total_processed += 1
+                    cp["processed"] = total_processed
+                    if created:
+                        cp["created"] += 1
+                        status = "Creado"
+                    else:
+                        cp["updated"] += 1
+                        status = "Actualizado"
+                        if updated_submitted:
+                            cp["updated_submitted"] += 1
+                            status = "ActualizadoSubmitted"
                     _add_result(
                         row=row_num,
                         student=student_name,
                         course=course_frappe,
                         academic_term=term_name,
-                        status="ErrorProcesamiento",
-                        detail=err,
+                        status=status,
+                        detail=ar_name or "",
                     )
-                else:
-                    total_processed += 1
-                    if created:
-                        total_created += 1
-                        _add_result(
-                            row=row_num,
-                            student=student_name,
-                            course=course_frappe,
-                            academic_term=term_name,
-                            status="Creado",
-                            detail=ar_name or "",
-                        )
-                    else:
-                        total_updated += 1
-                        if updated_submitted:
-                            total_updated_submitted += 1
-                            _add_result(
-                                row=row_num,
-                                student=student_name,
-                                course=course_frappe,
-                                academic_term=term_name,
-                                status="ActualizadoSubmitted",
-                                detail=ar_name or "",
-                            )
-                        else:
-                            _add_result(
-                                row=row_num,
-                                student=student_name,
-                                course=course_frappe,
-                                academic_term=term_name,
-                                status="Actualizado",
-                                detail=ar_name or "",
-                            )
-
-        out["summary"]["student_groups_created"] = len(created_sg)
-        out["summary"]["assessment_plans_created"] = len(created_ap)
-        out["summary"]["assessment_results_created"] = total_created
-        out["summary"]["assessment_results_updated"] = total_updated
-        out["summary"]["assessment_results_updated_submitted"] = total_updated_submitted
+                cp["done"][group_key] = idx + 1
+                since_checkpoint += 1
+                if since_checkpoint >= GRADE_IMPORT_CHECKPOINT_ROWS:
+                    since_checkpoint = 0
+                    if _save_checkpoint():
+                        out["cancelled"] = True
+                        break
+            if out["cancelled"]:
+                break
+        if not out["cancelled"]:
+            _save_checkpoint()
+        # Fin de la corrida (también al cancelar, para no perder los de lo ya aplicado): un correo
+        # agrupado por estudiante, encolado en el mismo commit que vacía los pendientes del checkpoint
+        flush_grade_notifications()
+        cp["notifications"] = {}
+        _commit_checkpoint()
+
+        out["summary"]["student_groups_created"] = len(cp["student_groups"])
+        out["summary"]["assessment_plans_created"] = len(cp["assessment_plans"])
+        out["summary"]["assessment_results_created"] = cp["created"]
+        out["summary"]["assessment_results_updated"] = cp["updated"]
+        out["summary"]["assessment_results_updated_submitted"] = cp["updated_submitted"]
         out["summary"]["rows_processed"] = total_processed
         out["summary"]["rows_with_errors"] = len(out["errors"])
+        out["summary"]["rows_skipped_resumed"] = skipped_resumed
         out["results"] = results
-        out["success"] = True
+        out["success"] = not out["cancelled"]
+    except BaseException:
+        # Las filas sin commit se revierten (y se reaplican al reanudar); los correos ya confirmados
+        # siguen en el checkpoint
+        discard_grade_notifications()
+        raise
     finally:
         frappe.flags.in_grade_import = False
-        flush_grade_notifications()
 
     return out
@@ -0,0 +1,278 @@
+"""
+Importación masiva de notas (Grade Import) como job en background, reanudable.
+
+`process_grades` dentro del request web cortaba por el timeout de gunicorn en los archivos de fin
+de término y dejaba resultados parciales sin forma de continuar. Aquí:
+
+- `start_import` guarda archivo/escala en el Single "Grade Import" y encola `run_import` (cola long).
+- `run_import` aplica las filas y cada GRADE_IMPORT_CHECKPOINT_ROWS guarda un checkpoint
+  (filas aplicadas por grupo curso/año/término, contadores) en el Single, en la misma transacción
+  que las filas. Ahí también revisa `cancel_requested`.
+- `resume_import` vuelve a encolar con el checkpoint guardado: las filas ya aplicadas se saltan.
+  Sirve tras cancelar, tras un error/timeout (status Failed) o si el worker murió (status Running
+  sin job en la cola). El checkpoint solo vale para el mismo archivo y escala.
+
+Progreso en el Single y por realtime (`grade_import_progress`).
+"""
+
+import json
+import os
+from typing import Any, Dict, Optional
+
+import frappe
+from frappe import _
+from frappe.utils import cint, now_datetime
+
+SETTINGS_DOCTYPE = "Grade Import"
+_JOB_ID = "edtools_grade_import"
+_PROGRESS_EVENT = "grade_import_progress"
+_ACTIVE_STATUSES = ("Queued", "Running")
+
+
+def _job_active() -> bool:
+    """True si hay un job de importación en la cola o corriendo (no basta el status: el worker pudo morir)."""
+    from frappe.utils.background_jobs import is_job_enqueued
+
+    return is_job_enqueued(_JOB_ID)
+
+
+def _signature(file_url: str, grading_scale: Optional[str]) -> Optional[str]:
+    """Identifica archivo + escala; un checkpoint de otro archivo (o del mismo modificado) no se reutiliza."""
+    from edtools_core.grade_import import _resolve_file_path
+
+    path = _resolve_file_path(file_url)
+    if not path:
+        return None
+    st = os.stat(path)
+    return f"{file_url}|{grading_scale or ''}|{st.st_size}|{int(st.st_mtime)}"
+
+
+def _load_checkpoint(raw: Optional[str]) -> Optional[Dict[str, Any]]:
+    try:
+        checkpoint = json.loads(raw) if raw else None
+    except ValueError:
+        return None
+    return checkpoint if isinstance(checkpoint, dict) and "done" in checkpoint else None
+
+
+def has_resumable_checkpoint() -> bool:
+    """True si la última importación quedó interrumpida con un checkpoint que se puede reanudar."""
+    return not _job_active() and bool(_load_checkpoint(frappe.db.get_single_value(SETTINGS_DOCTYPE, "checkpoint")))
+
+
+def _publish(data: Dict[str, Any], user: Optional[str]) -> None:
+    frappe.publish_realtime(_PROGRESS_EVENT, data, user=user)
+
+
+def _should_cancel() -> bool:
+    return bool(cint(frappe.db.get_single_value(SETTINGS_DOCTYPE, "cancel_requested", cache=False)))
+
+
+def run_import(user: Optional[str] = None) -> Dict[str, Any]:
+    """Job: importa el archivo del Single "Grade Import", continuando desde el checkpoint si coincide."""
+    from edtools_core.edtools_core.doctype.grade_import.grade_import import render_import_results
+    from edtools_core.grade_import import _resolve_file_path, new_grade_import_checkpoint, process_grades
+
+    settings = frappe.get_doc(SETTINGS_DOCTYPE)
+    if cint(settings.cancel_requested):
+        # Cancelado mientras estaba en la cola
+        frappe.db.set_single_value(
+            SETTINGS_DOCTYPE,
+            {"import_status": "Cancelled", "finished_on": now_datetime(), "progress_message": "Cancelado"},
+        )
+        frappe.db.commit()
+        _publish({"progress": settings.progress or 0, "message": "Cancelado", "finished": True}, user)
+        return {"cancelled": True}
+
+    file_url = (settings.excel_file or "").strip()
+    grading_scale = (settings.grading_scale or "").strip() or None
+    file_path = _resolve_file_path(file_url)
+    signature = _signature(file_url, grading_scale)
+
+    checkpoint = _load_checkpoint(settings.checkpoint)
+    if not checkpoint or checkpoint.get("signature") != signature:
+        checkpoint = new_grade_import_checkpoint()
+        checkpoint["signature"] = signature
+    resumed = bool(checkpoint["done"])
+
+    frappe.db.set_single_value(
+        SETTINGS_DOCTYPE,
+        {
+            "import_status": "Running",
+            "started_on": now_datetime(),
+            "finished_on": None,
+            "progress_message": "Reanudando importación" if resumed else "Validando archivo",
+        },
+    )
+    frappe.db.commit()
+
+    last = {"percent": -1}
+
+    def _progress(current, total, message):
+        percent = min(99, int(current * 100 / total)) if total else 0
+        # Un evento por punto porcentual: process_grades avisa en cada fila
+        if percent != last["percent"]:
+            last["percent"] = percent
+            _publish({"progress": percent, "message": message or "", "current": current, "total": total}, user)
+
+    def _on_checkpoint(cp):
+        frappe.db.set_single_value(
+            SETTINGS_DOCTYPE,
+            {
+                "checkpoint": json.dumps(cp),
+                "rows_done": cp["processed"],
+                "progress": max(last["percent"], 0),
+                "progress_message": _("Filas aplicadas: {0}").format(cp["processed"]),
+            },
+        )
+        frappe.db.commit()
+
+    try:
+        if not file_path:
+            frappe.throw(_("No se encontró el archivo en el servidor. Vuelve a adjuntarlo."))
+        result = process_grades(
+            file_path,
+            grading_scale,
+            progress_callback=_progress,
+            checkpoint=checkpoint,
+            on_checkpoint=_on_checkpoint,
+            should_cancel=_should_cancel,
+        )
+    except Exception:
+        frappe.db.rollback()
+        frappe.log_error(title="Grade Import", message=frappe.get_traceback())
+        # El checkpoint ya confirmado se conserva para reanudar
+        frappe.db.set_single_value(
+            SETTINGS_DOCTYPE,
+            {"import_status": "Failed", "finished_on": now_datetime(), "progress_message": "Error (se puede reanudar)"},
+        )
+        frappe.db.commit()
+        _publish({"progress": 100, "message": "Error", "failed": True, "finished": True}, user)
+        raise
+
+    summary_html, errors_html = render_import_results(result)
+    if result.get("cancelled"):
+        status = "Cancelled"
+    elif result.get("validation_errors"):
+        status = "Failed"
+    elif result.get("errors"):
+        status = "Completed with Errors"
+    else:
+        status = "Completed"
+    values = {
+        "import_status": status,
+        "finished_on": now_datetime(),
+        "cancel_requested": 0,
+        "result_summary": summary_html,
+        "result_errors": errors_html,
+        "rows_done": (result.get("summary") or {}).get("rows_processed", 0),
+        "progress_message": "Cancelado (se puede reanudar)" if status == "Cancelled" else "Terminado",
+    }
+    if status != "Cancelled":
+        # Terminado: el próximo proceso arranca de cero
+        values.update({"checkpoint": "", "progress": 100})
+    frappe.db.set_single_value(SETTINGS_DOCTYPE, values)
+    frappe.db.commit()
+    _publish({"progress": 100, "message": values["progress_message"], "status": status, "finished": True}, user)
+    return {
+        "status": status,
+        "summary": result.get("summary"),
+        "validation_errors": result.get("validation_errors"),
+        "errors": result.get("errors"),
+    }
+
+
+def _enqueue(user: Optional[str]) -> None:
+    frappe.enqueue(
+        "edtools_core.grade_import_job.run_import",
+        queue="long",
+        timeout=3600,
+        job_id=_JOB_ID,
+        deduplicate=True,
+        enqueue_after_commit=True,
+        user=user,
+    )
+
+
+def start_import(file_url: str, grading_scale: Optional[str] = None) -> Dict[str, Any]:
+    """Guarda archivo/escala en el Single y encola una importación nueva (descarta el checkpoint)."""
+    from edtools_core.grade_import import _resolve_file_path
+
+    if _job_active():
+        frappe.throw(_("Ya hay una importación de notas en curso."))
+    file_url = (file_url or "").strip()
+    if not file_url:
+        frappe.throw(_("Por favor adjunta un archivo Excel (.xlsx) o CSV."))
+    if not _resolve_file_path(file_url):
+        frappe.throw(_("No se encontró el archivo en el servidor (soporta /files/ y /private/files/)."))
+
+    frappe.db.set_single_value(
+        SETTINGS_DOCTYPE,
+        {
+            "excel_file": file_url,
+            "grading_scale": (grading_scale or "").strip() or None,
+            "import_status": "Queued",
+            "progress": 0,
+            "progress_message": "",
+            "started_on": None,
+            "finished_on": None,
+            "rows_done": 0,
+            "cancel_requested": 0,
+            "checkpoint": "",
+            "result_summary": "",
+            "result_errors": "",
+        },
+    )
+    _enqueue(frappe.session.user)
+    return {"queued": True, "job_id": _JOB_ID}
+
+
+def resume_import() -> Dict[str, Any]:
+    """Vuelve a encolar la última importación desde su checkpoint."""
+    if _job_active():
+        frappe.throw(_("Ya hay una importación de notas en curso."))
+    settings = frappe.get_doc(SETTINGS_DOCTYPE)
+    if not _load_checkpoint(settings.checkpoint):
+        frappe.throw(_("No hay una importación interrumpida para reanudar."))
+    frappe.db.set_single_value(
+        SETTINGS_DOCTYPE,
+        {"import_status": "Queued", "cancel_requested": 0, "finished_on": None, "progress_message": ""},
+    )
+    _enqueue(frappe.session.user)
+    return {"queued": True, "job_id": _JOB_ID, "rows_done": settings.rows_done}
+
+
+def cancel_import() -> Dict[str, Any]:
+    """Pide al job que se detenga en el próximo checkpoint (lo aplicado queda y se puede reanudar)."""
+    status = frappe.db.get_single_value(SETTINGS_DOCTYPE, "import_status")
+    if status not in _ACTIVE_STATUSES:
+        frappe.throw(_("No hay una importación en curso."))
+    if not _job_active():
+        # El worker murió con el status en Running/Queued: no hay a quién avisar
+        frappe.db.set_single_value(
+            SETTINGS_DOCTYPE,
+            {"import_status": "Cancelled", "finished_on": now_datetime(), "progress_message": "Cancelado"},
+        )
+        return {"cancelled": True}
+    frappe.db.set_single_value(SETTINGS_DOCTYPE, "cancel_requested", 1)
+    return {"cancel_requested": True}
+
+
+@frappe.whitelist()
+def get_import_status():
+    """Estado de la última importación en background (para integradores de `api.upload_grades_file`)."""
+    frappe.only_for(("System Manager", "Education Manager"))
+    settings = frappe.get_doc(SETTINGS_DOCTYPE)
+    status = settings.import_status
+    active = _job_active()
+    return {
+        "status": status,
+        # Running/Queued sin job: el worker murió; se puede reanudar
+        "stale": status in _ACTIVE_STATUSES and not active,
+        "progress": settings.progress,
+        "progress_message": settings.progress_message,
+        "rows_done": settings.rows_done,
+        "started_on": settings.started_on,
+        "finished_on": settings.finished_on,
+        "can_resume": has_resumable_checkpoint(),
+    }
@@ -0,0 +1,95 @@
+"""
+Escalas de calificación precompiladas y cacheadas por nombre.
+
+El import de notas consultaba Grading Scale Interval por fila (`letter_to_percentage`,
+validación de letras) y Education relee la escala en cada guardado de Assessment Result
+(`get_grade`). Aquí cada escala se lee una vez y queda en el hash Redis `edtools_grading_scale`
+(con caché local por request):
+
+- intervals: [{"grade_code", "threshold"}] por umbral descendente.
+- letters: {CÓDIGO EN MAYÚSCULAS: [umbrales descendentes]}.
+
+Se invalida al guardar o borrar una Grading Scale.
+"""
+
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import cstr, flt
+
+_CACHE_KEY = "edtools_grading_scale"
+
+
+def _build(grading_scale: str) -> Optional[Dict[str, Any]]:
+    if not frappe.db.exists("Grading Scale", grading_scale):
+        return None
+    rows = frappe.get_all(
+        "Grading Scale Interval",
+        filters={"parent": grading_scale, "parenttype": "Grading Scale"},
+        fields=["grade_code", "threshold"],
+        order_by="threshold desc",
+    )
+    intervals = [{"grade_code": r.grade_code, "threshold": flt(r.threshold)} for r in rows]
+    letters: Dict[str, List[float]] = {}
+    for d in intervals:
+        letters.setdefault(cstr(d["grade_code"]).strip().upper(), []).append(d["threshold"])
+    return {"name": grading_scale, "intervals": intervals, "letters": letters}
+
+
+def get_scale(grading_scale: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Escala precompilada (None si no existe). No modificar el resultado: es compartido."""
+    grading_scale = (grading_scale or "").strip()
+    if not grading_scale:
+        return None
+    scale = frappe.cache.hget(_CACHE_KEY, grading_scale)
+    if scale is None:
+        scale = _build(grading_scale)
+        if scale is None:
+            return None
+        frappe.cache.hset(_CACHE_KEY, grading_scale, scale)
+    return scale
+
+
+def get_intervals(grading_scale: Optional[str]) -> List[Dict[str, Any]]:
+    """[{"grade_code", "threshold"}] por umbral descendente (vacío si no hay escala)."""
+    scale = get_scale(grading_scale)
+    return [frappe._dict(d) for d in scale["intervals"]] if scale else []
+
+
+def get_grade(grading_scale: Optional[str], percentage: float) -> str:
+    """Letra para un porcentaje: el mayor umbral <= porcentaje (misma regla que education.api.get_grade)."""
+    scale = get_scale(grading_scale)
+    if not scale:
+        return ""
+    percentage = flt(percentage)
+    for d in scale["intervals"]:
+        if percentage >= d["threshold"]:
+            return d["grade_code"]
+    return ""
+
+
+def has_letter(grading_scale: Optional[str], letter: str) -> bool:
+    scale = get_scale(grading_scale)
+    return bool(scale) and cstr(letter).strip().upper() in scale["letters"]
+
+
+def letter_to_percentage(grading_scale: Optional[str], letter: str) -> Optional[float]:
+    """Umbral de la letra (el mayor si la letra aparece en varios intervalos)."""
+    scale = get_scale(grading_scale)
+    thresholds = scale["letters"].get(cstr(letter).strip().upper()) if scale else None
+    return flt(thresholds[0], 2) if thresholds else None
+
+
+def letter_min_threshold(grading_scale: Optional[str], letter: str) -> Optional[float]:
+    """Umbral mínimo de la letra (puntaje mínimo para obtenerla)."""
+    scale = get_scale(grading_scale)
+    thresholds = scale["letters"].get(cstr(letter).strip().upper()) if scale else None
+    return flt(thresholds[-1]) if thresholds else None
+
+
+def invalidate(doc=None, method=None):
+    """doc_event de Grading Scale (on_update / on_trash): descarta la escala cacheada."""
+    if doc is not None and doc.get("name"):
+        frappe.cache.hdel(_CACHE_KEY, doc.name)
+    else:
+        frappe.cache.delete_value(_CACHE_KEY)
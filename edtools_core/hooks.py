@@ -51,7 +51,7 @@ doctype_js = {
 	"Course Enrollment": "public/js/course_enrollment.js",
 	"Fees": "public/js/fees_stripe_desk.js",
 }
-# doctype_list_js = {"doctype" : "public/js/doctype_list.js"}
+doctype_list_js = {"Student": "public/js/student_list.js"}
 # doctype_tree_js = {"doctype" : "public/js/doctype_tree.js"}
 # doctype_calendar_js = {"doctype" : "public/js/doctype_calendar.js"}
 
@@ -147,6 +147,7 @@ override_doctype_class = {
 	"User": "edtools_core.overrides.user.User",
 	"Fees": "edtools_core.overrides.fees.Fees",
 	"Fee Schedule": "edtools_core.overrides.fee_schedule.FeeSchedule",
+	"Assessment Result": "edtools_core.overrides.assessment_result.AssessmentResult",
 }
 
 # Document Events
@@ -175,18 +176,29 @@ doc_events = {
 	},
 	"Student": {
 		"before_save": "edtools_core.validations.student.track_status_change",
-		"on_update": [
-			"edtools_core.moodle_sync.sync_student_status_to_moodle",
-			"edtools_core.azure_provisioning.sync_student_azure_license_by_status",
-		],
-		"after_insert": [
-			"edtools_core.moodle_sync.sync_student_status_to_moodle",
-			"edtools_core.azure_provisioning.sync_student_azure_license_by_status",
-		],
+		# Moodle + Azure en background (student_status_sync): el guardado no espera HTTP externo
+		"on_update": "edtools_core.student_status_sync.enqueue_student_status_sync",
+		"after_insert": "edtools_core.student_status_sync.enqueue_student_status_sync",
 	},
 	"Fee Schedule": {
 		"before_validate": "edtools_core.fees_events.ensure_local_lang_for_num2words",
 	},
+	# Índice de claves de curso para los imports (course_key_index)
+	"Course": {
+		"on_update": "edtools_core.course_key_index.on_course_update",
+		"on_trash": "edtools_core.course_key_index.on_course_trash",
+		"after_rename": "edtools_core.course_key_index.on_course_rename",
+	},
+	"Grading Scale": {
+		"on_update": "edtools_core.grading_scale_cache.invalidate",
+		"on_trash": "edtools_core.grading_scale_cache.invalidate",
+	},
+	# Caché de metadatos del período (fechas, categoría YYYYMM) usada por la integración Moodle
+	"Academic Term": {
+		"on_update": "edtools_core.academic_term_meta.invalidate",
+		"on_trash": "edtools_core.academic_term_meta.invalidate",
+		"after_rename": "edtools_core.academic_term_meta.invalidate",
+	},
 }
 
 # Scheduled Tasks
@@ -210,6 +222,20 @@ doc_events = {
 # 	],
 # }
 
+scheduler_events = {
+	"cron": {
+		"* * * * *": [
+			"edtools_core.integration_outbox.scheduled_dispatch",
+		],
+	},
+	"daily": [
+		"edtools_core.moodle_course_index.scheduled_rebuild",
+		"edtools_core.course_key_index.scheduled_rebuild",
+		"edtools_core.integration_outbox.purge_done",
+		"edtools_core.moodle_reconciliation.scheduled_reconcile",
+	],
+}
+
 # Testing
 # -------
 
@@ -0,0 +1,427 @@
+"""
+Outbox de integraciones (DocType "Integration Outbox").
+
+Los hooks registran operaciones contra sistemas externos (Moodle, Azure Graph) como filas en la
+misma transacción del documento que las origina; un dispatcher las reparte en jobs de background
+que las ejecutan con reintentos y backoff exponencial. Entrega al-menos-una-vez: los handlers
+deben ser idempotentes.
+
+Clave de idempotencia (`idempotency_key`, única):
+- Si ya existe una fila Pending/Failed con la misma clave, se actualiza el payload (no se duplica).
+- Si está Processing, se marca `rerun_requested` y vuelve a Pending al terminar.
+- Si está Done/Dead, se re-arma (nueva intención sobre el mismo objeto).
+
+Estados: Pending -> Processing -> Done | Failed (reintenta en next_attempt_at) | Dead (agotó intentos).
+"""
+
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+from edtools_core.service_guard import ServiceUnavailable
+
+DOCTYPE = "Integration Outbox"
+
+# operation -> handler(payload: dict). Registrar aquí cada operación nueva.
+HANDLERS = {
+    "moodle.student_status": "edtools_core.student_status_sync.run_moodle_student_status",
+    "azure.student_license": "edtools_core.student_status_sync.run_azure_student_license",
+    "moodle.unenrol": "edtools_core.moodle_sync.run_outbox_unenrol",
+}
+
+_DISPATCH_JOB_ID = "edtools_integration_outbox_dispatch"
+_BATCH_SIZE = 20
+_MAX_CLAIM = 500
+_STALE_PROCESSING_MINUTES = 30
+_BACKOFF_BASE_SECONDS = 30
+_BACKOFF_MAX_SECONDS = 6 * 3600
+_DONE_RETENTION_DAYS = 30
+
+
+# ------------------------------------------------------------
+# Encolar
+# ------------------------------------------------------------
+
+def enqueue_operation(
+    operation: str,
+    idempotency_key: str,
+    payload: Dict[str, Any],
+    *,
+    reference_doctype: Optional[str] = None,
+    reference_name: Optional[str] = None,
+    merge: Optional[Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]] = None,
+    not_before: Optional[datetime] = None,
+) -> str:
+    """
+    Registra una operación en el outbox (en la transacción actual) y programa el dispatcher
+    para después del commit. `merge(payload_pendiente, payload_nuevo)` permite combinar con una
+    intención aún no procesada (ej. conservar el estado previo original).
+
+    `not_before`: la fila no se despacha antes de ese momento. Lo usa un proceso en bloque que
+    aplica la operación por su cuenta y luego la cierra con `mark_done_deferred`; si no llega a
+    hacerlo (worker caído, timeout), el outbox la ejecuta al vencer.
+
+    Retorna el name de la fila.
+    """
+    if operation not in HANDLERS:
+        frappe.throw(f"Operación de outbox desconocida: {operation}")
+
+    existing = frappe.db.get_value(
+        DOCTYPE,
+        {"idempotency_key": idempotency_key},
+        ["name", "status", "payload"],
+        as_dict=True,
+    )
+    if not existing:
+        frappe.db.savepoint("integration_outbox_insert")
+        try:
+            name = (
+                frappe.get_doc(
+                    {
+                        "doctype": DOCTYPE,
+                        "operation": operation,
+                        "idempotency_key": idempotency_key,
+                        "status": "Pending",
+                        "next_attempt_at": not_before,
+                        "payload": json.dumps(payload, default=str),
+                        "reference_doctype": reference_doctype,
+                        "reference_name": reference_name,
+                    }
+                )
+                .insert(ignore_permissions=True)
+                .name
+            )
+            _kick_after_commit()
+            return name
+        except frappe.DuplicateEntryError:
+            # Otra transacción insertó la misma clave en paralelo: actualizar esa fila
+            frappe.db.rollback(save_point="integration_outbox_insert")
+            existing = frappe.db.get_value(
+                DOCTYPE,
+                {"idempotency_key": idempotency_key},
+                ["name", "status", "payload"],
+                as_dict=True,
+            )
+
+    values: Dict[str, Any] = {"operation": operation}
+    if existing.status in ("Pending", "Failed") and merge:
+        payload = merge(_load_payload(existing.payload), payload)
+    values["payload"] = json.dumps(payload, default=str)
+
+    if existing.status == "Processing":
+        values["rerun_requested"] = 1
+    elif existing.status in ("Done", "Dead"):
+        values.update({"status": "Pending", "attempts": 0, "next_attempt_at": not_before, "lock_token": None})
+    else:
+        values.update({"status": "Pending", "next_attempt_at": not_before})
+    frappe.db.set_value(DOCTYPE, existing.name, values)
+    _kick_after_commit()
+    return existing.name
+
+
+def mark_done_deferred(idempotency_keys: List[str]) -> int:
+    """
+    Cierra como Done las filas aún diferidas (`not_before` futuro) de esas claves: la operación ya
+    se aplicó por otra vía. Las que recibieron una intención nueva sin diferir (o ya se están
+    procesando) no se tocan. Retorna cuántas se cerraron.
+    """
+    if not idempotency_keys:
+        return 0
+    now = now_datetime()
+    names = frappe.get_all(
+        DOCTYPE,
+        filters={
+            "idempotency_key": ["in", list(idempotency_keys)],
+            "status": ["in", ["Pending", "Failed"]],
+            "next_attempt_at": [">", now],
+        },
+        pluck="name",
+    )
+    if names:
+        frappe.db.set_value(
+            DOCTYPE,
+            {"name": ["in", names]},
+            {"status": "Done", "processed_at": now, "next_attempt_at": None, "lock_token": None, "last_error": None},
+            update_modified=False,
+        )
+    return len(names)
+
+
+def _load_payload(raw: Optional[str]) -> Dict[str, Any]:
+    try:
+        return json.loads(raw or "{}")
+    except (TypeError, ValueError):
+        return {}
+
+
+def _kick_after_commit() -> None:
+    """Un kick por transacción: el flag se limpia al commit (tras encolar) y también al rollback."""
+    if frappe.flags.get("integration_outbox_kick_registered"):
+        return
+    frappe.flags.integration_outbox_kick_registered = True
+    frappe.db.after_commit.add(_after_commit_kick)
+    frappe.db.after_rollback.add(_reset_kick_flag)
+
+
+def _reset_kick_flag() -> None:
+    frappe.flags.integration_outbox_kick_registered = False
+
+
+def _after_commit_kick() -> None:
+    _reset_kick_flag()
+    kick()
+
+
+def kick() -> None:
+    """Encola el dispatcher (deduplicado: como máximo uno en cola/ejecución)."""
+    frappe.enqueue(
+        "edtools_core.integration_outbox.dispatch",
+        queue="short",
+        job_id=_DISPATCH_JOB_ID,
+        deduplicate=True,
+    )
+
+
+# ------------------------------------------------------------
+# Dispatcher y workers
+# ------------------------------------------------------------
+
+def dispatch(max_rounds: int = 10) -> int:
+    """
+    Reclama filas vencidas y las reparte en jobs de `_BATCH_SIZE` (los workers RQ las procesan en
+    paralelo). Repite mientras queden filas listas. Retorna el total repartido.
+    """
+    _reclaim_stale_processing()
+    total = 0
+    for _round in range(max_rounds):
+        token, names = _claim_due()
+        if not names:
+            break
+        for start in range(0, len(names), _BATCH_SIZE):
+            frappe.enqueue(
+                "edtools_core.integration_outbox.process_batch",
+                queue="short",
+                timeout=1500,
+                names=names[start : start + _BATCH_SIZE],
+                lock_token=token,
+            )
+        total += len(names)
+        if len(names) < _MAX_CLAIM:
+            break
+    return total
+
+
+def scheduled_dispatch() -> None:
+    """Scheduler (cada minuto): reintentos vencidos aunque nadie haya encolado nada nuevo."""
+    if frappe.db.exists(DOCTYPE, {"status": ["in", ["Pending", "Failed", "Processing"]]}):
+        kick()
+
+
+def _claim_due() -> tuple[Optional[str], List[str]]:
+    """Reclama filas vencidas con un lock_token nuevo. Retorna (token, names)."""
+    now = now_datetime()
+    due = frappe.get_all(
+        DOCTYPE,
+        filters={"status": ["in", ["Pending", "Failed"]]},
+        or_filters=[["next_attempt_at", "is", "not set"], ["next_attempt_at", "<=", now]],
+        pluck="name",
+        order_by="creation asc",
+        limit=_MAX_CLAIM,
+    )
+    if not due:
+        return None, []
+    token = frappe.generate_hash(length=12)
+    frappe.db.set_value(
+        DOCTYPE,
+        {"name": ["in", due], "status": ["in", ["Pending", "Failed"]]},
+        {"status": "Processing", "lock_token": token, "locked_at": now},
+        update_modified=False,
+    )
+    frappe.db.commit()
+    return token, frappe.get_all(DOCTYPE, filters={"lock_token": token}, pluck="name", order_by="creation asc")
+
+
+def _reclaim_stale_processing() -> None:
+    """Filas Processing abandonadas (worker caído / timeout) vuelven a Failed para reintentarse."""
+    cutoff = add_to_date(now_datetime(), minutes=-_STALE_PROCESSING_MINUTES)
+    stale = frappe.get_all(
+        DOCTYPE,
+        filters={"status": "Processing", "locked_at": ["<", cutoff]},
+        fields=["name", "lock_token"],
+    )
+    for row in stale:
+        # Sin lock_token: si el worker original termina después, ya no puede escribir su resultado
+        _mark_failed(row.name, "Processing abandonado (worker caído o timeout); se reintenta.", row.lock_token)
+    if stale:
+        frappe.db.commit()
+
+
+def process_batch(names: List[str], lock_token: Optional[str] = None) -> None:
+    for name in names:
+        process_one(name, lock_token)
+
+
+def process_one(name: str, lock_token: Optional[str] = None) -> None:
+    """
+    Ejecuta una fila reclamada con `lock_token`. Si la fila se re-reclamó (lock vencido) con otro
+    token, este worker ya no es el dueño: no la ejecuta ni escribe su resultado.
+    """
+    row = frappe.db.get_value(
+        DOCTYPE, name, ["name", "operation", "status", "payload", "lock_token"], as_dict=True
+    )
+    if not row or row.status != "Processing" or (lock_token and row.lock_token != lock_token):
+        return
+    lock_token = row.lock_token
+    try:
+        handler = frappe.get_attr(HANDLERS[row.operation])
+        handler(_load_payload(row.payload))
+        frappe.db.commit()
+    except ServiceUnavailable as e:
+        # Servicio externo caído/limitado (circuito abierto): se difiere sin consumir un intento
+        frappe.db.rollback()
+        _mark_deferred(name, e, lock_token)
+        frappe.db.commit()
+        return
+    except Exception:
+        frappe.db.rollback()
+        _mark_failed(name, frappe.get_traceback(), lock_token)
+        frappe.db.commit()
+        return
+    _mark_done(name, lock_token)
+    frappe.db.commit()
+
+
+def _owned(name: str, lock_token: Optional[str]) -> Dict[str, Any]:
+    """Filtro de la fila solo si sigue bajo el lock de este worker (sin token: solo por name)."""
+    return {"name": name, "lock_token": lock_token} if lock_token else {"name": name}
+
+
+def _mark_done(name: str, lock_token: Optional[str] = None) -> None:
+    if frappe.db.get_value(DOCTYPE, name, "rerun_requested"):
+        # Llegó una intención nueva mientras se procesaba: vuelve a la cola con el payload nuevo
+        values = {"status": "Pending", "rerun_requested": 0, "next_attempt_at": None, "lock_token": None}
+    else:
+        values = {"status": "Done", "processed_at": now_datetime(), "lock_token": None, "last_error": None}
+    frappe.db.set_value(DOCTYPE, _owned(name, lock_token), values, update_modified=False)
+
+
+def _backoff_seconds(attempts: int) -> int:
+    delay = min(_BACKOFF_MAX_SECONDS, _BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return int(delay * random.uniform(0.8, 1.2))
+
+
+def _mark_failed(name: str, error: str, lock_token: Optional[str] = None) -> None:
+    attempts, max_attempts = frappe.db.get_value(DOCTYPE, name, ["attempts", "max_attempts"])
+    attempts = int(attempts or 0) + 1
+    values: Dict[str, Any] = {
+        "attempts": attempts,
+        "last_error": (error or "")[-10000:],
+        "lock_token": None,
+    }
+    if attempts >= int(max_attempts or 8):
+        values["status"] = "Dead"
+    else:
+        values["status"] = "Failed"
+        values["next_attempt_at"] = now_datetime() + timedelta(seconds=_backoff_seconds(attempts))
+    frappe.db.set_value(DOCTYPE, _owned(name, lock_token), values, update_modified=False)
+
+
+def _mark_deferred(name: str, error: ServiceUnavailable, lock_token: Optional[str] = None) -> None:
+    delay = max(_BACKOFF_BASE_SECONDS, int(error.retry_after or 0) + 1)
+    frappe.db.set_value(
+        DOCTYPE,
+        _owned(name, lock_token),
+        {
+            "status": "Failed",
+            "last_error": f"Diferido: {error}",
+            "lock_token": None,
+            "next_attempt_at": now_datetime() + timedelta(seconds=int(delay * random.uniform(1.0, 1.5))),
+        },
+        update_modified=False,
+    )
+
+
+def purge_done() -> None:
+    """Scheduler diario: elimina filas Done antiguas."""
+    cutoff = add_to_date(now_datetime(), days=-_DONE_RETENTION_DAYS)
+    frappe.db.delete(DOCTYPE, {"status": "Done", "processed_at": ["<", cutoff]})
+    frappe.db.commit()
+
+
+# ------------------------------------------------------------
+# Consola (list view)
+# ------------------------------------------------------------
+
+@frappe.whitelist()
+def replay(names) -> Dict[str, int]:
+    """Re-encola filas (Failed/Dead/Done) inmediatamente, con contador de intentos en cero."""
+    frappe.only_for(("System Manager", "Education Manager"))
+    if isinstance(names, str):
+        names = json.loads(names)
+    names = [n for n in names or [] if n]
+    if not names:
+        return {"replayed": 0}
+    replayable = frappe.get_all(
+        DOCTYPE,
+        filters={"name": ["in", names], "status": ["in", ["Failed", "Dead", "Done", "Pending"]]},
+        pluck="name",
+    )
+    if replayable:
+        frappe.db.set_value(
+            DOCTYPE,
+            {"name": ["in", replayable]},
+            {"status": "Pending", "attempts": 0, "next_attempt_at": None, "lock_token": None},
+        )
+        _kick_after_commit()
+    return {"replayed": len(replayable)}
+
+
+@frappe.whitelist()
+def replay_failed(operation: Optional[str] = None) -> Dict[str, int]:
+    """Re-encola todas las filas Failed/Dead (opcionalmente de una operación)."""
+    frappe.only_for(("System Manager", "Education Manager"))
+    filters: Dict[str, Any] = {"status": ["in", ["Failed", "Dead"]]}
+    if operation:
+        filters["operation"] = operation
+    return replay(frappe.get_all(DOCTYPE, filters=filters, pluck="name"))
+
+
+@frappe.whitelist()
+def process_now() -> Dict[str, bool]:
+    frappe.only_for(("System Manager", "Education Manager"))
+    kick()
+    return {"queued": True}
+
+
+@frappe.whitelist()
+def get_summary() -> Dict[str, Any]:
+    """Backlog por estado, fallas por operación y antigüedad de la fila pendiente más vieja."""
+    frappe.only_for(("System Manager", "Education Manager"))
+    by_status = {
+        r.status: r.count
+        for r in frappe.get_all(DOCTYPE, fields=["status", "count(name) as count"], group_by="status")
+    }
+    failures = frappe.get_all(
+        DOCTYPE,
+        filters={"status": ["in", ["Failed", "Dead"]]},
+        fields=["operation", "status", "count(name) as count"],
+        group_by="operation, status",
+        order_by="operation asc",
+    )
+    oldest = frappe.get_all(
+        DOCTYPE,
+        filters={"status": ["in", ["Pending", "Failed"]]},
+        fields=["creation"],
+        order_by="creation asc",
+        limit=1,
+    )
+    oldest_age = (now_datetime() - oldest[0].creation).total_seconds() if oldest else 0
+    return {
+        "by_status": by_status,
+        "failures": failures,
+        "oldest_pending_seconds": int(oldest_age),
+    }
@@ -0,0 +1,464 @@
+"""Índice local de cursos Moodle (DocType "Moodle Course Index").
+
+Moodle no permite buscar cursos por coincidencia parcial ni sin distinguir mayúsculas, por lo
+que `find_moodle_course_for_enrollment` recorría categorías completas con
+`core_course_get_courses_by_field`. Este módulo mantiene una copia local de los cursos
+(id, idnumber, shortname, fullname, categoryid) con claves normalizadas precalculadas, de modo
+que todas las estrategias de búsqueda se resuelven con una consulta SQL.
+
+Refresco (siempre fuera de la búsqueda, que solo lee):
+- Incremental por categoría (`refresh_category`): una llamada a Moodle. En background cuando una
+  búsqueda no encuentra el curso en el índice (`_enqueue_category_refresh`).
+- Completo (`rebuild_index`): job diario (scheduler) o manual (`enqueue_rebuild`).
+- Cursos creados desde EdTools se registran al crearlos (`remember_course`).
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterable, List
+
+import frappe
+from frappe.utils import now_datetime
+
+DOCTYPE = "Moodle Course Index"
+
+_REBUILD_JOB_ID = "edtools_moodle_course_index_rebuild"
+
+# YYYYMM::CODE (idnumber del formato nuevo / Monitor)
+_NEW_IDNUMBER_RE = re.compile(r"^(\d{6})::(.+)$")
+# "YYYYMM,CODE, 1, TITULO ..." (shortname con el formato fullname de EdTools)
+_COMMA_SHORTNAME_RE = re.compile(r"^(\d{6})\s*,\s*([^,]+?)\s*,")
+# TERMID-CODE o TERMID-CODE-1 (formato antiguo, pre Spring B 2026)
+_OLD_FORMAT_RE = re.compile(r"^(\d{6})-(.+?)(?:-\d+)?$")
+
+
+def _norm(value: Any) -> str:
+    return str(value or "").strip().lower()
+
+
+def _compact(value: Any) -> str:
+    return _norm(value).replace(" ", "")
+
+
+def _split_term_and_code(value: str) -> tuple[str, str]:
+    """Extrae (term_key, course_code_key) de un idnumber/shortname en cualquiera de los formatos."""
+    raw = (value or "").strip()
+    for regex in (_NEW_IDNUMBER_RE, _COMMA_SHORTNAME_RE, _OLD_FORMAT_RE):
+        m = regex.match(raw)
+        if m:
+            return m.group(1), _compact(m.group(2))
+    return "", ""
+
+
+def compute_keys(course: Dict[str, Any]) -> Dict[str, Any]:
+    """Campos del índice para un curso tal como lo devuelve Moodle."""
+    idnumber = (course.get("idnumber") or "").strip()
+    shortname = (course.get("shortname") or "").strip()
+    term_key, code_key = _split_term_and_code(idnumber)
+    if not code_key:
+        term_key, code_key = _split_term_and_code(shortname)
+    try:
+        category_id = int(course.get("categoryid") or course.get("category") or 0)
+    except (TypeError, ValueError):
+        category_id = 0
+    return {
+        "moodle_course_id": int(course.get("id")),
+        "idnumber": idnumber[:255],
+        "shortname": shortname[:255],
+        "fullname": (course.get("fullname") or "").strip()[:255],
+        "category_id": category_id,
+        "idnumber_key": _norm(idnumber)[:255],
+        "shortname_key": _norm(shortname)[:255],
+        "shortname_compact": _compact(shortname)[:255],
+        "course_code_key": code_key[:140],
+        "term_key": term_key,
+    }
+
+
+# ------------------------------------------------------------
+# Escritura
+# ------------------------------------------------------------
+
+_COMPARED_FIELDS = (
+    "idnumber",
+    "shortname",
+    "fullname",
+    "category_id",
+    "idnumber_key",
+    "shortname_key",
+    "shortname_compact",
+    "course_code_key",
+    "term_key",
+)
+
+
+def _upsert_rows(courses: Iterable[Dict[str, Any]]) -> List[int]:
+    """Inserta/actualiza filas del índice. Retorna los moodle_course_id procesados."""
+    rows = []
+    for c in courses or []:
+        if not c or c.get("id") in (None, ""):
+            continue
+        try:
+            rows.append(compute_keys(c))
+        except (TypeError, ValueError):
+            continue
+    if not rows:
+        return []
+
+    ids = [r["moodle_course_id"] for r in rows]
+    existing = {
+        int(e.moodle_course_id): e
+        for e in frappe.get_all(
+            DOCTYPE,
+            filters={"moodle_course_id": ["in", ids]},
+            fields=["name", "moodle_course_id", *_COMPARED_FIELDS],
+        )
+    }
+
+    now = now_datetime()
+    for row in rows:
+        current = existing.get(row["moodle_course_id"])
+        if current:
+            changes = {f: row[f] for f in _COMPARED_FIELDS if (current.get(f) or "") != (row[f] or "")}
+            changes["last_synced_on"] = now
+            frappe.db.set_value(DOCTYPE, current.name, changes, update_modified=False)
+            continue
+
+        # Otro worker puede haber insertado el mismo curso en paralelo (moodle_course_id es único).
+        frappe.db.savepoint("moodle_course_index_insert")
+        try:
+            frappe.get_doc({"doctype": DOCTYPE, **row, "last_synced_on": now}).insert(
+                ignore_permissions=True
+            )
+        except frappe.DuplicateEntryError:
+            frappe.db.rollback(save_point="moodle_course_index_insert")
+    return ids
+
+
+def index_category_courses(category_id: int, courses: List[Dict[str, Any]]) -> None:
+    """Sincroniza el índice con el listado completo de cursos de una categoría.
+
+    Elimina las filas de la categoría que ya no vienen en el listado (cursos movidos o borrados).
+    """
+    seen = set(_upsert_rows(courses))
+    stale = frappe.get_all(
+        DOCTYPE,
+        filters={"category_id": int(category_id)},
+        fields=["name", "moodle_course_id"],
+    )
+    for row in stale:
+        if int(row.moodle_course_id) not in seen:
+            frappe.delete_doc(DOCTYPE, row.name, ignore_permissions=True, force=True)
+
+
+def refresh_category(category_id: int) -> List[Dict[str, Any]]:
+    """Descarga los cursos de una categoría (1 llamada a Moodle) y actualiza el índice."""
+    from edtools_core.moodle_integration import get_courses_by_field
+
+    courses = get_courses_by_field(field="category", value=str(int(category_id))) or []
+    index_category_courses(category_id, courses)
+    return courses
+
+
+def remember_course(course: Dict[str, Any]) -> None:
+    """Registra (o actualiza) un curso individual; no falla si el índice no está disponible."""
+    try:
+        _upsert_rows([course])
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "Moodle Course Index: remember_course")
+
+
+def rebuild_index() -> Dict[str, int]:
+    """Refresco completo: recorre todas las categorías (job en background, commit por categoría)."""
+    from edtools_core.moodle_integration import get_all_categories
+
+    categories = get_all_categories(refresh=True)
+    category_ids = set()
+    errors = 0
+    for cat in categories:
+        try:
+            cat_id = int(cat.get("id"))
+        except (TypeError, ValueError):
+            continue
+        category_ids.add(cat_id)
+        try:
+            refresh_category(cat_id)
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            errors += 1
+            frappe.log_error(frappe.get_traceback(), f"Moodle Course Index: categoría {cat_id}")
+
+    # Cursos de categorías que ya no existen en Moodle
+    orphans = 0
+    for row in frappe.get_all(DOCTYPE, fields=["name", "category_id"]):
+        if int(row.category_id or 0) not in category_ids:
+            frappe.delete_doc(DOCTYPE, row.name, ignore_permissions=True, force=True)
+            orphans += 1
+    frappe.db.commit()
+
+    return {"categories": len(category_ids), "errors": errors, "orphans_removed": orphans}
+
+
+@frappe.whitelist()
+def enqueue_rebuild() -> Dict[str, Any]:
+    """Encola el refresco completo del índice (deduplicado: un solo job a la vez)."""
+    frappe.only_for(("System Manager", "Education Manager"))
+    _enqueue_rebuild()
+    return {"queued": True}
+
+
+def _enqueue_rebuild() -> None:
+    frappe.enqueue(
+        "edtools_core.moodle_course_index.rebuild_index",
+        queue="long",
+        timeout=3600,
+        job_id=_REBUILD_JOB_ID,
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
+
+
+def refresh_categories(category_ids: List[int]) -> None:
+    """Job: refresca el índice de varias categorías (commit por categoría)."""
+    for cat_id in category_ids:
+        try:
+            refresh_category(int(cat_id))
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), f"Moodle Course Index: categoría {cat_id}")
+
+
+def _enqueue_category_refresh(category_ids: List[int]) -> None:
+    frappe.enqueue(
+        "edtools_core.moodle_course_index.refresh_categories",
+        queue="long",
+        job_id=f"{_REBUILD_JOB_ID}_{'_'.join(map(str, category_ids))}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        category_ids=list(category_ids),
+    )
+
+
+def scheduled_rebuild() -> None:
+    """Scheduler diario. No hace nada si Moodle no está configurado."""
+    from edtools_core.moodle_integration import _get_moodle_config
+
+    try:
+        _get_moodle_config()
+    except Exception:
+        return
+    _enqueue_rebuild()
+
+
+# ------------------------------------------------------------
+# Lectura
+# ------------------------------------------------------------
+
+
+def is_populated() -> bool:
+    return bool(frappe.get_all(DOCTYPE, fields=["name"], limit=1))
+
+
+def _first_id(filters: Dict[str, Any] | List[Any], or_filters: List[Any] | None = None) -> int | None:
+    rows = frappe.get_all(
+        DOCTYPE,
+        filters=filters,
+        or_filters=or_filters,
+        fields=["moodle_course_id"],
+        order_by="moodle_course_id asc",
+        limit=1,
+    )
+    return int(rows[0].moodle_course_id) if rows else None
+
+
+def _find_by_keys(field: str, values: List[str]) -> int | None:
+    """Primer curso cuyo `field` coincide con alguno de `values` (respeta el orden de prioridad)."""
+    for value in values:
+        if not value:
+            continue
+        found = _first_id({field: value})
+        if found is not None:
+            return found
+    return None
+
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _find_in_categories(category_ids: List[int], exact_keys: List[str], code_compact: str) -> int | None:
+    """Equivalente local a `_find_course_in_category_case_insensitive` sobre varias categorías."""
+    if not category_ids:
+        return None
+    exact_keys = [k for k in exact_keys if k]
+    or_filters = []
+    if exact_keys:
+        or_filters += [["idnumber_key", "in", exact_keys], ["shortname_key", "in", exact_keys]]
+    if code_compact:
+        or_filters.append(["shortname_compact", "like", f"%{_like_escape(code_compact)}%"])
+    if not or_filters:
+        return None
+
+    rows = frappe.get_all(
+        DOCTYPE,
+        filters={"category_id": ["in", category_ids]},
+        or_filters=or_filters,
+        fields=["moodle_course_id", "category_id"],
+        order_by="moodle_course_id asc",
+    )
+    # Prioridad por el orden de las categorías (término, hermanas, subcategorías del año).
+    position = {cat_id: i for i, cat_id in enumerate(category_ids)}
+    rows.sort(key=lambda r: position.get(int(r.category_id or 0), len(position)))
+    return int(rows[0].moodle_course_id) if rows else None
+
+
+def _term_search_category_ids(academic_term: str | None) -> List[int]:
+    """Categoría del término, sus hermanas y las subcategorías del año (sin crear nada en Moodle)."""
+    from edtools_core.moodle_integration import (
+        get_categories_by_idnumber,
+        get_category,
+        get_child_category_ids,
+    )
+
+    if not academic_term:
+        return []
+    term_label = academic_term.strip()
+    year_name = term_label.split("(")[0].strip()
+    try:
+        year_ids = [
+            int(c["id"]) for c in get_categories_by_idnumber(year_name) if int(c.get("parent") or 0) == 0
+        ]
+        term_ids = [
+            int(c["id"])
+            for c in get_categories_by_idnumber(term_label)
+            if not year_ids or int(c.get("parent") or 0) in year_ids
+        ]
+    except Exception:
+        return []
+
+    ordered: List[int] = []
+    for cat_id in term_ids:
+        ordered.append(cat_id)
+        current = get_category(cat_id)
+        if current:
+            ordered += get_child_category_ids(int(current.get("parent") or 0))
+    for year_id in year_ids:
+        ordered += get_child_category_ids(year_id)
+    return list(dict.fromkeys(ordered))
+
+
+def find_course_for_enrollment(
+    *,
+    course_name: str,
+    course_shortcode: str,
+    academic_term: str | None,
+    term_code: str | None,
+    old_term_id: str | None,
+    fullname_shortname: str | None = None,
+) -> int | None:
+    """Resuelve las estrategias de `find_moodle_course_for_enrollment` contra el índice.
+
+    Si no hay coincidencia, revisa en Moodle la categoría del término (1 llamada, sin escribir el
+    índice: el curso pudo crearse fuera de EdTools) y encola el refresco de esa categoría.
+    """
+    category_ids = _term_search_category_ids(academic_term)
+    keys = dict(
+        course_name=course_name,
+        course_shortcode=course_shortcode,
+        term_code=term_code,
+        old_term_id=old_term_id,
+        fullname_shortname=fullname_shortname,
+    )
+    found = _lookup(**keys, category_ids=category_ids)
+    if found is not None or not category_ids:
+        return found
+
+    from edtools_core.moodle_integration import get_courses_by_field
+
+    try:
+        courses = get_courses_by_field(field="category", value=str(int(category_ids[0]))) or []
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "Moodle Course Index: cursos de la categoría del término")
+        return None
+    _enqueue_category_refresh(category_ids[:1])
+    return _match_courses(courses, **keys)
+
+
+def _match_courses(
+    courses: List[Dict[str, Any]],
+    *,
+    course_name: str,
+    course_shortcode: str,
+    term_code: str | None,
+    old_term_id: str | None,
+    fullname_shortname: str | None,
+) -> int | None:
+    """Estrategias de `_lookup` sobre cursos recién descargados de Moodle (en memoria)."""
+    rows = []
+    for c in courses:
+        try:
+            rows.append(compute_keys(c))
+        except (TypeError, ValueError):
+            continue
+    rows.sort(key=lambda r: r["moodle_course_id"])
+
+    code_norm = _norm(course_shortcode)
+    code_compact = _compact(course_shortcode)
+    name_norm = _norm(course_name)
+    fullname_key = _norm(fullname_shortname)
+    idnumbers = [k for k in (f"{term_code}::{code_norm}" if term_code and code_norm else "", name_norm) if k]
+    exact_keys = [k for k in (name_norm, code_norm) if k]
+    checks = [
+        lambda r: r["idnumber_key"] in idnumbers,
+        lambda r: bool(old_term_id and code_compact)
+        and (r["term_key"], r["course_code_key"]) == (old_term_id, code_compact),
+        lambda r: bool(fullname_key) and r["shortname_key"] == fullname_key,
+        lambda r: r["idnumber_key"] in exact_keys or r["shortname_key"] in exact_keys,
+        lambda r: bool(code_compact) and code_compact in r["shortname_compact"],
+    ]
+    for check in checks:
+        for row in rows:
+            if check(row):
+                return row["moodle_course_id"]
+    return None
+
+
+def _lookup(
+    *,
+    course_name: str,
+    course_shortcode: str,
+    term_code: str | None,
+    old_term_id: str | None,
+    fullname_shortname: str | None,
+    category_ids: List[int],
+) -> int | None:
+    code_norm = _norm(course_shortcode)
+    code_compact = _compact(course_shortcode)
+    name_norm = _norm(course_name)
+
+    # 1. idnumber YYYYMM::code  /  2. idnumber = Course.name
+    found = _find_by_keys(
+        "idnumber_key",
+        [f"{term_code}::{code_norm}" if term_code and code_norm else "", name_norm],
+    )
+    if found is not None:
+        return found
+
+    # 2b. Formato antiguo: idnumber TERMID-CODE, shortname TERMID-CODE-1
+    if old_term_id and code_compact:
+        found = _first_id({"term_key": old_term_id, "course_code_key": code_compact})
+        if found is not None:
+            return found
+
+    # 3. shortname con formato fullname de EdTools
+    if fullname_shortname:
+        found = _find_by_keys("shortname_key", [_norm(fullname_shortname)])
+        if found is not None:
+            return found
+
+    # 4. Categoría del periodo, hermanas y subcategorías del año (incluye shortname que contenga el
+    # código). No hay búsqueda global: el curso de menor id con ese código suele ser de otro período.
+    return _find_in_categories(category_ids, [name_norm, code_norm], code_compact)
@@ -0,0 +1,115 @@
+"""
+Datos de matrícula y usuarios Moodle del lado EdTools, compartidos por la reconciliación, la
+descarga de notas y el cambio masivo de estado.
+
+- `expected_enrolments`: Course Enrollments enviados agrupados por curso Moodle.
+- `load_students`: estado, User y moodle_user_id de varios Students en una consulta.
+- `resolve_missing_user_ids`: completa en bloque los moodle_user_id que falten.
+"""
+
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import cint
+
+
+def expected_enrolments(
+    academic_term: Optional[str],
+    moodle_course_id: Optional[int],
+) -> tuple[Dict[int, Dict[str, str]], int]:
+    """
+    Course Enrollments enviados del alcance -> ({moodle_course_id: {student: course}}, sin_mapear).
+
+    Los que no tienen `moodle_course_id` no se pueden reconciliar (ver backfill en moodle_sync).
+    """
+    from edtools_core.moodle_sync import _has_field
+
+    filters: Dict[str, Any] = {"docstatus": 1}
+    if academic_term:
+        if _has_field("Course Enrollment", "custom_academic_term"):
+            filters["custom_academic_term"] = academic_term
+        else:
+            filters["program_enrollment"] = [
+                "in",
+                frappe.get_all(
+                    "Program Enrollment",
+                    filters={"academic_term": academic_term, "docstatus": 1},
+                    pluck="name",
+                )
+                or [""],
+            ]
+    if moodle_course_id:
+        filters["moodle_course_id"] = int(moodle_course_id)
+
+    expected: Dict[int, Dict[str, str]] = defaultdict(dict)
+    unmapped = 0
+    for ce in frappe.get_all(
+        "Course Enrollment",
+        filters=filters,
+        fields=["student", "course", "moodle_course_id"],
+    ):
+        cid = cint(ce.moodle_course_id)
+        if not cid:
+            unmapped += 1
+            continue
+        expected[cid][ce.student] = ce.course
+    return expected, unmapped
+
+
+def load_students(student_names: List[str]) -> Dict[str, Dict[str, Any]]:
+    """{student: {"status", "user", "moodle_user_id"}} en una consulta."""
+    from edtools_core.moodle_sync import _has_field
+
+    if not student_names:
+        return {}
+    fields = ["name", "user", "student_status"]
+    if _has_field("Student", "moodle_user_id"):
+        fields.append("moodle_user_id")
+    return {
+        s.name: {
+            "status": (s.student_status or "").strip(),
+            "user": s.user,
+            "moodle_user_id": cint(s.get("moodle_user_id")),
+        }
+        for s in frappe.get_all("Student", filters={"name": ["in", student_names]}, fields=fields)
+    }
+
+
+def resolve_missing_user_ids(students: Dict[str, Dict[str, Any]], *, create: bool) -> Dict[str, str]:
+    """
+    Completa moodle_user_id de los estudiantes que no lo tienen guardado (en bloque).
+
+    create=True: `ensure_moodle_users` (busca y crea los que falten). Si no, solo busca por email.
+    Retorna {student: error} de los que no se pudieron resolver.
+    """
+    from edtools_core.moodle_sync import remember_student_moodle_user_id
+    from edtools_core.moodle_users import ensure_moodle_users, get_users_by_emails
+
+    pending = [name for name, s in students.items() if not s["moodle_user_id"] and s["user"]]
+    errors = {name: "Student sin User vinculado" for name, s in students.items() if not s["user"]}
+    if not pending:
+        return errors
+
+    if create:
+        results = ensure_moodle_users([frappe.get_doc("Student", name) for name in pending])
+        for name, result in results.items():
+            if result.get("user"):
+                students[name]["moodle_user_id"] = int(result["user"]["id"])
+            else:
+                errors[name] = result.get("error") or "Usuario Moodle no resuelto"
+        return errors
+
+    email_by_student = {
+        name: (frappe.db.get_value("User", students[name]["user"], "email") or "").strip().lower()
+        for name in pending
+    }
+    found = get_users_by_emails([e for e in email_by_student.values() if e])
+    for name, email in email_by_student.items():
+        user = found.get(email)
+        if user:
+            students[name]["moodle_user_id"] = int(user["id"])
+            remember_student_moodle_user_id(name, int(user["id"]))
+        else:
+            errors[name] = "Usuario no existe en Moodle"
+    return errors
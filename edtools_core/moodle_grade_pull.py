@@ -0,0 +1,214 @@
+"""
+Importación de notas por pull desde Moodle (reemplaza el push registro a registro a
+`api.import_grade_single`).
+
+Por cada curso Moodle mapeado (Course Enrollment.moodle_course_id) de un Academic Term:
+
+1. Una llamada a `get_course_final_grades` trae el total del curso de todos los estudiantes.
+2. moodle_user_id -> Student con los Course Enrollments del curso (una consulta).
+3. Se resuelven una sola vez grupo de evaluación, Student Group y Assessment Plan (mismo
+   pipeline que `grade_import`) y se comparan las notas contra los Assessment Results existentes.
+4. Solo las filas nuevas o con nota distinta pasan por `create_or_update_assessment_result`.
+
+Un job por curso (`pull_course_grades`); `start_grade_pull` encola los del período.
+"""
+
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import cint, flt
+
+from edtools_core import tracing
+from edtools_core.moodle_metrics import moodle_operation
+
+
+def _mapped_courses(academic_term: str, moodle_course_id: Optional[int] = None) -> Dict[int, Dict[str, str]]:
+    """{moodle_course_id: {student: course}} de los Course Enrollments enviados del período."""
+    from edtools_core.moodle_enrolment_data import expected_enrolments
+
+    expected, _unmapped = expected_enrolments(academic_term, moodle_course_id)
+    return expected
+
+
+def _existing_scores(student_group_name: str, assessment_group_name: str) -> tuple[Optional[str], Dict[str, Dict[str, Any]]]:
+    """(assessment_plan, {student: {"score", "docstatus"}}) si el plan ya existe; si no (None, {})."""
+    if not frappe.db.exists("Student Group", student_group_name):
+        return None, {}
+    plans = frappe.get_all(
+        "Assessment Plan",
+        filters={
+            "student_group": student_group_name,
+            "assessment_group": assessment_group_name,
+            "docstatus": ["!=", 2],
+        },
+        pluck="name",
+        limit=1,
+    )
+    if not plans:
+        return None, {}
+    existing: Dict[str, Dict[str, Any]] = {}
+    for r in frappe.get_all(
+        "Assessment Result",
+        filters={"assessment_plan": plans[0], "docstatus": ["!=", 2]},
+        fields=["student", "total_score", "docstatus"],
+        order_by="docstatus desc",
+    ):
+        # Si hay borrador y presentado, manda el presentado (primero por el order_by)
+        existing.setdefault(r.student, {"score": flt(r.total_score, 2), "docstatus": cint(r.docstatus)})
+    return plans[0], existing
+
+
+def _changed_grades(
+    grades_by_student: Dict[str, float],
+    existing: Dict[str, Dict[str, Any]],
+) -> Dict[str, float]:
+    """Notas que hay que escribir: sin resultado presentado o con score distinto."""
+    changed = {}
+    for student, score in grades_by_student.items():
+        current = existing.get(student)
+        if current and current["docstatus"] == 1 and current["score"] == flt(score, 2):
+            continue
+        changed[student] = flt(score, 2)
+    return changed
+
+
+@moodle_operation("grade_pull")
+def pull_course_grades(
+    moodle_course_id: int,
+    academic_term: str,
+    students: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """
+    Job: importa las notas finales de un curso Moodle al Assessment Plan del período.
+
+    students: {student: course} (si no se pasa, se lee de los Course Enrollments).
+    Retorna {"moodle_course_id", "course", "graded", "unchanged", "created", "updated", "errors"}.
+    """
+    from edtools_core.academic_term_meta import get_term_meta
+    from edtools_core.grade_import import (
+        _get_default_grading_scale,
+        create_or_update_assessment_result,
+        get_or_create_assessment_group_leaf,
+        get_or_create_assessment_plan,
+        get_or_create_student_group,
+    )
+    from edtools_core.moodle_integration import get_course_final_grades
+    from edtools_core.moodle_enrolment_data import load_students, resolve_missing_user_ids
+    from edtools_core.notifications.grades import flush_grade_notifications
+
+    moodle_course_id = int(moodle_course_id)
+    if students is None:
+        students = _mapped_courses(academic_term, moodle_course_id).get(moodle_course_id, {})
+    out: Dict[str, Any] = {
+        "moodle_course_id": moodle_course_id,
+        "course": None,
+        "graded": 0,
+        "unchanged": 0,
+        "created": 0,
+        "updated": 0,
+        "errors": [],
+    }
+    if not students:
+        return out
+
+    with tracing.trace_context("moodle.grade_pull", moodle_course_id=moodle_course_id, academic_term=academic_term):
+        # Un curso Moodle corresponde a un Course por período; si hubiera mezcla, manda el mayoritario
+        courses = list(students.values())
+        course = max(set(courses), key=courses.count)
+        out["course"] = course
+
+        grades_by_uid = get_course_final_grades(moodle_course_id)
+        loaded = load_students([s for s, c in students.items() if c == course])
+        resolve_missing_user_ids(loaded, create=False)
+        student_by_uid = {info["moodle_user_id"]: name for name, info in loaded.items() if info["moodle_user_id"]}
+        grades = {student_by_uid[uid]: score for uid, score in grades_by_uid.items() if uid in student_by_uid}
+        out["graded"] = len(grades)
+        if not grades:
+            tracing.info("grade_pull", "Sin notas en Moodle", course=course)
+            return out
+
+        term = get_term_meta(academic_term)
+        if not term or not term.academic_year or not term.term_name:
+            out["errors"].append(f"Academic Term {academic_term} sin año o nombre de término")
+            return out
+        year, term_label = str(term.academic_year), term.term_name
+
+        leaf = get_or_create_assessment_group_leaf(year, term_label)
+        if not leaf:
+            out["errors"].append(f"No se pudo crear el grupo de evaluación para {academic_term}")
+            return out
+        ap_name, existing = _existing_scores(f"Grades - {course} - {academic_term}", leaf)
+        changed = _changed_grades(grades, existing)
+        out["unchanged"] = len(grades) - len(changed)
+        if not changed:
+            tracing.info("grade_pull", "Sin cambios", course=course, graded=out["graded"])
+            return out
+
+        sg_name = get_or_create_student_group(course, year, academic_term, list(changed))
+        if not sg_name:
+            out["errors"].append("No se pudo crear el grupo de estudiantes")
+            return out
+        course_doc = frappe.get_cached_doc("Course", course)
+        scale = getattr(course_doc, "default_grading_scale", None) or _get_default_grading_scale()
+        if not ap_name:
+            ap_name = get_or_create_assessment_plan(sg_name, leaf, course, scale, academic_term_name=academic_term)
+        if not ap_name:
+            out["errors"].append("No se pudo crear el plan de evaluación")
+            return out
+
+        frappe.flags.in_grade_import = True
+        try:
+            for student, score in changed.items():
+                ar_name, err, created, _updated_submitted = create_or_update_assessment_result(
+                    ap_name, student, score, scale
+                )
+                if err:
+                    out["errors"].append(f"{student}: {err}")
+                elif created:
+                    out["created"] += 1
+                else:
+                    out["updated"] += 1
+        finally:
+            frappe.flags.in_grade_import = False
+            flush_grade_notifications()
+
+        tracing.info(
+            "grade_pull",
+            "Notas importadas",
+            course=course,
+            **{k: out[k] for k in ("graded", "unchanged", "created", "updated")},
+            errors=len(out["errors"]),
+        )
+        if out["errors"]:
+            tracing.warning("grade_pull", "Errores al importar notas", course=course, errors=out["errors"][:20])
+    return out
+
+
+def enqueue_grade_pull(academic_term: str, moodle_course_id: Optional[int] = None) -> List[int]:
+    """Encola un job por curso Moodle mapeado del período. Retorna los moodle_course_id encolados."""
+    mapped = _mapped_courses(academic_term, moodle_course_id)
+    for cid, students in mapped.items():
+        frappe.enqueue(
+            "edtools_core.moodle_grade_pull.pull_course_grades",
+            queue="long",
+            timeout=1800,
+            job_id=f"edtools_grade_pull::{academic_term}::{cid}",
+            deduplicate=True,
+            enqueue_after_commit=True,
+            moodle_course_id=cid,
+            academic_term=academic_term,
+            students=students,
+        )
+    return list(mapped)
+
+
+@frappe.whitelist()
+def start_grade_pull(academic_term, moodle_course_id=None):
+    """Encola la importación de notas desde Moodle del período (o de un curso). Retorna cuántos cursos."""
+    frappe.only_for(("System Manager", "Education Manager"))
+    if not academic_term:
+        frappe.throw("Academic Term es obligatorio")
+    courses = enqueue_grade_pull(academic_term, cint(moodle_course_id) or None)
+    if not courses:
+        frappe.throw("No hay Course Enrollments con curso Moodle en ese período")
+    return {"courses": len(courses)}
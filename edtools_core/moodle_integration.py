@@ -4,17 +4,26 @@ Objetivo (fase 1): asegurar que exista la categoría padre del Academic Year en
 sin duplicarla, usando `idnumber` como clave.
 
 Nota: Moodle no ofrece (según la configuración actual) un endpoint de búsqueda por idnumber,
-por lo que se consulta el listado completo de categorías y se filtra localmente.
+por lo que se consulta el listado completo de categorías y se filtra localmente. El listado
+se cachea en Redis (ver `get_category_tree`) para no descargarlo en cada matrícula.
 """
 
 from __future__ import annotations
 
 import os
+import random
 import re
+import threading
+import time
 from typing import Any, Dict, List
 
 import frappe
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from edtools_core import moodle_metrics, service_guard, tracing
+from edtools_core.academic_term_meta import get_old_moodle_term_id, parse_term_label
 
 
 def _get_moodle_config() -> tuple[str, str]:
@@ -38,31 +47,206 @@ def _get_moodle_config() -> tuple[str, str]:
     return str(url), str(token)
 
 
-def _moodle_post(wsfunction: str, data: Dict[str, Any] | None = None, *, timeout: int = 20) -> Any:
-    url, token = _get_moodle_config()
-    payload: Dict[str, Any] = {
-        "wstoken": token,
-        "wsfunction": wsfunction,
-        "moodlewsrestformat": "json",
-    }
-    if data:
-        payload.update(data)
+# ------------------------------------------------------------
+# Transporte HTTP: sesión con keep-alive, pool acotado y reintentos
+# ------------------------------------------------------------
+
+# Timeouts (segundos) de lectura por wsfunction. Se pueden sobrescribir en site_config
+# con `moodle_timeouts` = {"core_course_create_courses": 90, ...}.
+_DEFAULT_TIMEOUTS: Dict[str, int] = {
+    "core_course_get_categories": 30,
+    "core_course_get_courses_by_field": 30,
+    "core_course_create_courses": 60,
+    "core_enrol_get_enrolled_users": 30,
+    "core_enrol_get_users_courses": 30,
+}
+_DEFAULT_READ_TIMEOUT = 20
+_CONNECT_TIMEOUT = 5
+
+# Reintentos. Lecturas (`*_get_*`): cualquier fallo de conexión y 502/503/504. Escrituras
+# (create/update/enrol...): solo si la petición seguro no llegó a Moodle, es decir, fallo al abrir
+# la conexión y 502/503. Un 504 o una conexión cortada tras enviar el cuerpo pueden venir de una
+# escritura ya aplicada, y reenviar core_user_create_users / core_course_create_* la duplica.
+_RETRY_STATUS = frozenset({502, 503, 504})
+_WRITE_RETRY_STATUS = frozenset({502, 503})
+
+_session: requests.Session | None = None
+_session_pid: int | None = None
+_session_lock = threading.Lock()
+
+
+def _get_int_setting(env_key: str, conf_key: str, default: int) -> int:
+    raw = os.getenv(env_key) or frappe.conf.get(conf_key)
+    try:
+        return int(raw) if raw not in (None, "") else default
+    except (TypeError, ValueError):
+        return default
 
+
+def _get_moodle_session() -> requests.Session:
+    """Sesión HTTP reutilizada por proceso (gunicorn/RQ worker).
+
+    Mantiene conexiones keep-alive al host de Moodle para no repetir el handshake TCP+TLS
+    en cada llamada. Se recrea tras un fork (cambia el pid) para no compartir sockets.
+    Tamaño del pool: MOODLE_HTTP_POOL_SIZE / moodle_http_pool_size (por defecto 10).
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            pool_size = max(1, _get_int_setting("MOODLE_HTTP_POOL_SIZE", "moodle_http_pool_size", 10))
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=pool_size,
+                pool_block=True,
+                max_retries=0,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+            _session_pid = pid
+    return _session
+
+
+def _get_timeout(wsfunction: str, timeout: int | None) -> tuple[int, int]:
+    """(connect, read) timeout. Prioridad: site_config `moodle_timeouts` > argumento > tabla por defecto."""
+    custom = frappe.conf.get("moodle_timeouts") or {}
+    read_timeout = None
+    if isinstance(custom, dict) and custom.get(wsfunction):
+        try:
+            read_timeout = int(custom[wsfunction])
+        except (TypeError, ValueError):
+            read_timeout = None
+    if read_timeout is None:
+        read_timeout = timeout or _DEFAULT_TIMEOUTS.get(wsfunction) or _DEFAULT_READ_TIMEOUT
+    return _CONNECT_TIMEOUT, int(read_timeout)
+
+
+def _retry_delay(attempt: int) -> float:
+    """Backoff exponencial con jitter completo: uniforme en [0, base * 2^attempt], máx. 8 s."""
+    return random.uniform(0, min(8.0, 0.5 * (2 ** attempt)))
+
+
+def _is_read_only(wsfunction: str) -> bool:
+    return "_get_" in (wsfunction or "")
+
+
+def _is_connect_failure(e: requests.ConnectionError) -> bool:
+    """True si falló al abrir la conexión (timeout de conexión, DNS, rechazo): nada se envió."""
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _post_with_retries(
+    session: requests.Session,
+    url: str,
+    payload: Dict[str, Any],
+    request_timeout: tuple[int, int],
+    max_retries: int,
+) -> requests.Response:
+    """POST con reintentos (sin frappe: usable desde hilos del pool, ver `enrol_users_concurrently`)."""
+    read_only = _is_read_only(payload.get("wsfunction"))
+    retry_status = _RETRY_STATUS if read_only else _WRITE_RETRY_STATUS
+    attempt = 0
+    while True:
+        try:
+            r = session.post(url, data=payload, timeout=request_timeout)
+        except requests.ConnectionError as e:
+            # ConnectionError también cubre conexiones cortadas después de enviar el cuerpo: en
+            # escrituras solo se reintenta si no se llegó a conectar. ReadTimeout no hereda de
+            # ConnectionError y nunca se reintenta.
+            if attempt < max_retries and (read_only or _is_connect_failure(e)):
+                time.sleep(_retry_delay(attempt))
+                attempt += 1
+                continue
+            raise
+
+        if r.status_code in retry_status and attempt < max_retries:
+            time.sleep(_retry_delay(attempt))
+            attempt += 1
+            continue
+        return r
+
+
+def _moodle_post(wsfunction: str, data: Dict[str, Any] | None = None, *, timeout: int | None = None) -> Any:
+    http = _snapshot_http_config(wsfunction, timeout)
+    # Circuito abierto / límite de tasa: falla rápido con service_guard.ServiceUnavailable
+    service_guard.before_call("moodle")
+    sample = _new_sample(http)
     try:
-        r = requests.post(url, data=payload, timeout=timeout)
+        return _send(http, data, sample)
     except Exception as e:
-        frappe.log_error(message=str(e), title="Moodle request failed")
+        if "response_text" in sample:
+            frappe.log_error(message=sample["response_text"], title=f"Moodle non-JSON response ({wsfunction})")
+        else:
+            frappe.log_error(message=str(e), title="Moodle request failed")
         raise
+    finally:
+        _record_sample(sample)
+
+
+def _new_sample(http: Dict[str, Any]) -> Dict[str, Any]:
+    return {"wsfunction": http["wsfunction"], "operation": http["operation"], "at": time.time()}
+
 
+def _send(http: Dict[str, Any], data: Dict[str, Any] | None, sample: Dict[str, Any]) -> Any:
+    """
+    Una llamada REST a Moodle sin contexto frappe (usable desde hilos del pool).
+
+    `http` viene de `_snapshot_http_config`. Completa `sample` (latencia, tamaños, error_code,
+    transport_failure) para que el hilo principal lo registre con `_record_sample`.
+    """
+    payload: Dict[str, Any] = {
+        "wstoken": http["token"],
+        "wsfunction": http["wsfunction"],
+        "moodlewsrestformat": "json",
+        **(data or {}),
+    }
+    started = time.monotonic()
     try:
-        return r.json()
-    except Exception:
-        frappe.log_error(message=r.text, title=f"Moodle non-JSON response ({wsfunction})")
+        r = _post_with_retries(http["session"], http["url"], payload, http["timeout"], http["max_retries"])
+        sample["reached"] = True
+        sample.update(_payload_sizes(r))
+        sample["transport_failure"] = service_guard.is_transport_failure(r)
+        try:
+            resp = r.json()
+        except Exception:
+            sample["error_code"] = f"http_{r.status_code}"
+            sample["response_text"] = r.text
+            raise
+        sample["error_code"] = moodle_metrics.response_error_code(resp)
+        return resp
+    except Exception as e:
+        sample.setdefault("error_code", type(e).__name__)
+        sample.setdefault("transport_failure", service_guard.is_transport_failure(exc=e))
         raise
+    finally:
+        sample["latency_ms"] = (time.monotonic() - started) * 1000
 
 
-def get_all_categories() -> List[Dict[str, Any]]:
-    """Obtiene todas las categorías visibles para el token."""
+def _record_sample(sample: Dict[str, Any]) -> None:
+    """Métricas y circuito de una llamada (hilo principal). Errores fuera del transporte no cuentan."""
+    if sample.get("transport_failure"):
+        service_guard.record_failure("moodle")
+    elif sample.get("reached"):
+        service_guard.record_success("moodle")
+    moodle_metrics.record_samples([sample])
+
+
+def _payload_sizes(r: requests.Response) -> Dict[str, int]:
+    body = r.request.body if r.request is not None else None
+    return {"bytes_out": len(body or b""), "bytes_in": len(r.content or b"")}
+
+
+def _fetch_all_categories() -> List[Dict[str, Any]]:
+    """Descarga todas las categorías visibles para el token (sin caché)."""
     resp = _moodle_post("core_course_get_categories")
 
     # Moodle devuelve lista en éxito, dict con 'exception' en error.
@@ -77,6 +261,90 @@ def get_all_categories() -> List[Dict[str, Any]]:
     return resp
 
 
+# ------------------------------------------------------------
+# Caché del árbol de categorías (Redis)
+# ------------------------------------------------------------
+
+_CATEGORY_CACHE_KEY = "edtools_moodle_category_tree"
+_CATEGORY_CACHE_TTL = 900
+
+
+def _get_category_cache_ttl() -> int:
+    return max(1, _get_int_setting("MOODLE_CATEGORY_CACHE_TTL", "moodle_category_cache_ttl", _CATEGORY_CACHE_TTL))
+
+
+def _build_category_tree(categories: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Indexa el listado por id, idnumber y parent (mismo orden que devuelve Moodle)."""
+    tree: Dict[str, Any] = {"ids": [], "by_id": {}, "by_idnumber": {}, "by_parent": {}}
+    for c in categories:
+        _add_category_to_tree(tree, c)
+    return tree
+
+
+def _add_category_to_tree(tree: Dict[str, Any], category: Dict[str, Any]) -> None:
+    try:
+        cat_id = int(category.get("id"))
+        parent_id = int(category.get("parent") or 0)
+    except (TypeError, ValueError):
+        return
+    if cat_id in tree["by_id"]:
+        return
+    tree["ids"].append(cat_id)
+    tree["by_id"][cat_id] = category
+    tree["by_idnumber"].setdefault(str(category.get("idnumber") or ""), []).append(cat_id)
+    tree["by_parent"].setdefault(parent_id, []).append(cat_id)
+
+
+def get_category_tree(*, refresh: bool = False) -> Dict[str, Any]:
+    """Árbol de categorías cacheado en Redis con TTL (moodle_category_cache_ttl, 900 s por defecto).
+
+    `refresh=True` fuerza la descarga completa (ej. tras "Duplicate idnumber").
+    """
+    if not refresh:
+        tree = frappe.cache.get_value(_CATEGORY_CACHE_KEY)
+        if tree:
+            return tree
+
+    tree = _build_category_tree(_fetch_all_categories())
+    frappe.cache.set_value(_CATEGORY_CACHE_KEY, tree, expires_in_sec=_get_category_cache_ttl())
+    return tree
+
+
+def invalidate_category_cache() -> None:
+    frappe.cache.delete_value(_CATEGORY_CACHE_KEY)
+
+
+def _remember_created_category(cat_id: int, name: str, idnumber: str, parent: int) -> None:
+    """Agrega al árbol cacheado la categoría recién creada (evita una descarga completa)."""
+    tree = frappe.cache.get_value(_CATEGORY_CACHE_KEY)
+    if not tree:
+        return
+    _add_category_to_tree(
+        tree,
+        {"id": int(cat_id), "name": name, "idnumber": idnumber, "parent": int(parent)},
+    )
+    frappe.cache.set_value(_CATEGORY_CACHE_KEY, tree, expires_in_sec=_get_category_cache_ttl())
+
+
+def get_all_categories(*, refresh: bool = False) -> List[Dict[str, Any]]:
+    """Obtiene todas las categorías visibles para el token (desde la caché si está vigente)."""
+    tree = get_category_tree(refresh=refresh)
+    return [tree["by_id"][cat_id] for cat_id in tree["ids"]]
+
+
+def get_categories_by_idnumber(idnumber: str, *, refresh: bool = False) -> List[Dict[str, Any]]:
+    tree = get_category_tree(refresh=refresh)
+    return [tree["by_id"][cat_id] for cat_id in tree["by_idnumber"].get(str(idnumber or ""), [])]
+
+
+def get_category(category_id: int) -> Dict[str, Any] | None:
+    return get_category_tree()["by_id"].get(int(category_id))
+
+
+def get_child_category_ids(parent_id: int) -> List[int]:
+    return list(get_category_tree()["by_parent"].get(int(parent_id), []))
+
+
 def ensure_academic_year_category(academic_year_name: str) -> int:
     """Asegura (idempotente) la categoría padre del Academic Year.
 
@@ -94,9 +362,7 @@ def ensure_academic_year_category(academic_year_name: str) -> int:
     if not year:
         frappe.throw("Academic Year vacío: no se puede sincronizar con Moodle")
 
-    categories = get_all_categories()
-
-    same_idnumber = [c for c in categories if str(c.get("idnumber") or "") == year]
+    same_idnumber = get_categories_by_idnumber(year)
     for c in same_idnumber:
         # Queremos específicamente la categoría padre
         try:
@@ -128,9 +394,8 @@ def ensure_academic_year_category(academic_year_name: str) -> int:
 
         # Idempotencia: si Moodle respondió "Duplicate idnumber" reconsultamos y devolvemos.
         if "Duplicate idnumber" in msg:
-            categories = get_all_categories()
-            for c in categories:
-                if str(c.get("idnumber") or "") == year and int(c.get("parent") or 0) == 0:
+            for c in get_categories_by_idnumber(year, refresh=True):
+                if int(c.get("parent") or 0) == 0:
                     return int(c["id"])
 
             frappe.throw("Moodle reportó Duplicate idnumber pero no se pudo ubicar la categoría padre")
@@ -139,22 +404,13 @@ def ensure_academic_year_category(academic_year_name: str) -> int:
         frappe.throw(f"Moodle error (create_categories): {msg or resp.get('errorcode')}")
 
     if isinstance(resp, list) and resp and isinstance(resp[0], dict) and resp[0].get("id"):
+        _remember_created_category(int(resp[0]["id"]), year, year, 0)
         return int(resp[0]["id"])
 
     frappe.log_error(message=str(resp), title="Moodle create_categories unexpected response")
     frappe.throw("Respuesta inesperada de Moodle en core_course_create_categories")
 
 
-_TERM_CODE_BY_LABEL = {
-    "Spring A": "01",
-    "Spring B": "02",
-    "Summer A": "03",
-    "Summer B": "04",
-    "Fall A": "05",
-    "Fall B": "06",
-}
-
-
 def get_term_category_name(term_label: str) -> str:
     """Retorna el `name` esperado para la categoría hija en Moodle (YYYYMM).
 
@@ -174,17 +430,13 @@ def _parse_academic_term(term_label: str) -> tuple[str, str]:
     - nombre Moodle para categoría hija = YYYY + code (ej: 202601)
     """
 
-    raw = (term_label or "").strip()
-    m = re.fullmatch(r"(\d{4})\s*\((Spring A|Spring B|Summer A|Summer B|Fall A|Fall B)\)", raw)
-    if not m:
+    parsed = parse_term_label(term_label)
+    if not parsed:
         frappe.throw(
             "Academic Term debe tener formato 'YYYY (Spring A|Spring B|Summer A|Summer B|Fall A|Fall B)'. "
-            f"Recibido: {raw}"
+            f"Recibido: {(term_label or '').strip()}"
         )
-
-    year = m.group(1)
-    season = m.group(2)
-    return year, _TERM_CODE_BY_LABEL[season]
+    return parsed.year, parsed.code
 
 
 def ensure_academic_term_category(
@@ -213,9 +465,7 @@ def ensure_academic_term_category(
     except Exception:
         frappe.throw("parent_year_category_id inválido")
 
-    categories = get_all_categories()
-
-    same_idnumber = [c for c in categories if str(c.get("idnumber") or "") == term_label]
+    same_idnumber = get_categories_by_idnumber(term_label)
     for c in same_idnumber:
         try:
             if int(c.get("parent") or 0) == parent_id:
@@ -245,9 +495,8 @@ def ensure_academic_term_category(
 
         # Idempotencia: si Moodle respondió "Duplicate idnumber" reconsultamos.
         if "Duplicate idnumber" in msg:
-            categories = get_all_categories()
-            for c in categories:
-                if str(c.get("idnumber") or "") == term_label and int(c.get("parent") or 0) == parent_id:
+            for c in get_categories_by_idnumber(term_label, refresh=True):
+                if int(c.get("parent") or 0) == parent_id:
                     return int(c["id"])
             frappe.throw("Moodle reportó Duplicate idnumber pero no se pudo ubicar la categoría hija")
 
@@ -255,6 +504,7 @@ def ensure_academic_term_category(
         frappe.throw(f"Moodle error (create term): {msg or resp.get('errorcode')}")
 
     if isinstance(resp, list) and resp and isinstance(resp[0], dict) and resp[0].get("id"):
+        _remember_created_category(int(resp[0]["id"]), moodle_name, term_label, parent_id)
         return int(resp[0]["id"])
 
     frappe.log_error(message=str(resp), title="Moodle create_term unexpected response")
@@ -292,7 +542,7 @@ def _find_course_in_category_case_insensitive(
 
     def _search_in_category(cat_id: int) -> int | None:
         try:
-            courses = get_courses_by_field(field="category", value=str(cat_id))
+            courses = _fetch_category_courses(cat_id)
             for c in courses or []:
                 if _match(c):
                     return int(c.get("id"))
@@ -307,11 +557,10 @@ def _find_course_in_category_case_insensitive(
 
     # 2. Buscar en categorías hermanas (mismo padre, ej. 2026)
     try:
-        categories = get_all_categories()
-        current = next((c for c in categories if int(c.get("id") or 0) == category_id), None)
+        current = get_category(category_id)
         if current:
             parent_id = int(current.get("parent") or 0)
-            sibling_ids = [int(c["id"]) for c in categories if int(c.get("parent") or 0) == parent_id]
+            sibling_ids = get_child_category_ids(parent_id)
             for sid in sibling_ids:
                 if sid != category_id:
                     found = _search_in_category(sid)
@@ -346,12 +595,11 @@ def _find_course_in_year_categories(
             return True
         return False
 
-    categories = get_all_categories()
     # Subcategorías del año: parent == year_category_id
-    child_ids = [int(c["id"]) for c in categories if int(c.get("parent") or 0) == year_category_id]
+    child_ids = get_child_category_ids(year_category_id)
     for cat_id in child_ids:
         try:
-            courses = get_courses_by_field(field="category", value=str(cat_id))
+            courses = _fetch_category_courses(cat_id)
             for c in courses or []:
                 if _match(c):
                     return int(c.get("id"))
@@ -374,7 +622,7 @@ def _find_course_by_shortname_contains(course_shortcode: str, course_idnumber: s
         if not cat_id:
             continue
         try:
-            courses = get_courses_by_field(field="category", value=str(cat_id))
+            courses = _fetch_category_courses(cat_id)
             for c in courses or []:
                 cid = c.get("id")
                 if not cid or cid in seen_course_ids:
@@ -389,6 +637,11 @@ def _find_course_by_shortname_contains(course_shortcode: str, course_idnumber: s
     return None
 
 
+def _fetch_category_courses(category_id: int) -> List[Dict[str, Any]]:
+    """Cursos de una categoría (solo lectura; el índice local se refresca en background)."""
+    return get_courses_by_field(field="category", value=str(int(category_id)))
+
+
 def get_courses_by_field(*, field: str, value: str) -> List[Dict[str, Any]]:
     """Wrapper para `core_course_get_courses_by_field`.
 
@@ -420,6 +673,92 @@ def get_courses_by_field(*, field: str, value: str) -> List[Dict[str, Any]]:
     frappe.throw("Respuesta inesperada de Moodle en core_course_get_courses_by_field")
 
 
+def _course_create_fields(
+    i: int,
+    *,
+    fullname: str,
+    shortname: str,
+    categoryid: int,
+    idnumber: str,
+    startdate: int | None = None,
+    enddate: int | None = None,
+) -> Dict[str, Any]:
+    """Campos courses[i][...] de core_course_create_courses (formato y opciones fijos de EdTools)."""
+    fields: Dict[str, Any] = {
+        "fullname": fullname,
+        "shortname": shortname,
+        "categoryid": int(categoryid),
+        "idnumber": idnumber,
+        "summaryformat": 1,
+        "format": "topics",
+        "showgrades": 1,
+        "newsitems": 5,
+        "maxbytes": 0,
+        "showreports": 0,
+        "visible": 1,
+        "groupmode": 0,
+        "groupmodeforce": 0,
+        "defaultgroupingid": 0,
+    }
+    if startdate is not None:
+        fields["startdate"] = int(startdate)
+    if enddate is not None:
+        fields["enddate"] = int(enddate)
+    return {f"courses[{i}][{k}]": v for k, v in fields.items()}
+
+
+# Cursos por llamada a core_course_create_courses (Moodle crea el arreglo en una transacción).
+_CREATE_COURSES_CHUNK_SIZE = 50
+
+
+def create_courses(courses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Creación masiva (core_course_create_courses con varios cursos por llamada).
+
+    courses: [{"fullname", "shortname", "categoryid", "idnumber", "startdate", "enddate"}].
+    Bloques de 50; si Moodle rechaza un bloque (un curso inválido revierte todo el bloque) se
+    reintenta curso por curso para aislar el error.
+    Retorna, en el mismo orden: [{"idnumber", "id"} | {"idnumber", "error"}]
+    """
+    from edtools_core.moodle_course_index import remember_course
+
+    def _created(course: Dict[str, Any], course_id: int) -> Dict[str, Any]:
+        remember_course({**course, "id": course_id})
+        return {"idnumber": course["idnumber"], "id": int(course_id)}
+
+    results: List[Dict[str, Any]] = []
+    for start in range(0, len(courses), _CREATE_COURSES_CHUNK_SIZE):
+        chunk = courses[start : start + _CREATE_COURSES_CHUNK_SIZE]
+        data: Dict[str, Any] = {}
+        for i, course in enumerate(chunk):
+            data.update(_course_create_fields(i, **course))
+        try:
+            resp = _moodle_post("core_course_create_courses", data, timeout=120)
+        except service_guard.ServiceUnavailable:
+            raise
+        except Exception as e:
+            resp = {"exception": type(e).__name__, "message": str(e)}
+
+        if isinstance(resp, list) and len(resp) == len(chunk):
+            # Moodle devuelve [{id, shortname}] en el orden enviado
+            results += [_created(course, created["id"]) for course, created in zip(chunk, resp)]
+            continue
+
+        for course in chunk:
+            try:
+                single = _moodle_post("core_course_create_courses", _course_create_fields(0, **course), timeout=60)
+            except service_guard.ServiceUnavailable:
+                raise
+            except Exception as e:
+                single = {"exception": type(e).__name__, "message": str(e)}
+            if isinstance(single, list) and single and single[0].get("id"):
+                results.append(_created(course, single[0]["id"]))
+            else:
+                message = single.get("message") if isinstance(single, dict) else str(single)
+                results.append({"idnumber": course["idnumber"], "error": f"Moodle error (create_courses): {message}"})
+    return results
+
+
 def ensure_course(
     *,
     category_id: int,
@@ -445,6 +784,8 @@ def ensure_course(
       - fullname = "{term_category_name},{course_shortname}, 1,{TITLE} {term_idnumber} {term_start_date_str}"
     """
 
+    from edtools_core.moodle_course_index import remember_course
+
     if not course_idnumber or not course_idnumber.strip():
         frappe.throw("course_idnumber vacío (se usa para validar en Moodle)")
 
@@ -463,6 +804,7 @@ def ensure_course(
                 f"(categoryid={existing_category}). Esperado: {int(category_id)}."
             )
 
+        remember_course(c)
         return int(c.get("id"))
 
     # No encontrado por idnumber: buscar por shortname con el formato idnumber (YYYYMM::course_name).
@@ -470,6 +812,7 @@ def ensure_course(
     courses_by_shortname_idnumber = get_courses_by_field(field="shortname", value=course_idnumber.strip())
     if courses_by_shortname_idnumber:
         c = courses_by_shortname_idnumber[0]
+        remember_course(c)
         return int(c.get("id"))
 
     # Buscar por shortname con el formato fullname (202602,ACG 200, 1, ...).
@@ -478,6 +821,7 @@ def ensure_course(
         courses_by_shortname = get_courses_by_field(field="shortname", value=course_shortname.strip())
         if courses_by_shortname:
             c = courses_by_shortname[0]
+            remember_course(c)
             return int(c.get("id"))
 
     # Fallback: buscar en la categoría y hacer match case-insensitive por idnumber/shortname.
@@ -493,24 +837,15 @@ def ensure_course(
     # Crear
     resp = _moodle_post(
         "core_course_create_courses",
-        {
-            "courses[0][fullname]": course_fullname,
-            "courses[0][shortname]": course_shortname,
-            "courses[0][categoryid]": int(category_id),
-            "courses[0][idnumber]": course_idnumber,
-            "courses[0][summaryformat]": 1,
-            "courses[0][format]": "topics",
-            "courses[0][showgrades]": 1,
-            "courses[0][newsitems]": 5,
-            "courses[0][maxbytes]": 0,
-            "courses[0][showreports]": 0,
-            "courses[0][visible]": 1,
-            "courses[0][groupmode]": 0,
-            "courses[0][groupmodeforce]": 0,
-            "courses[0][defaultgroupingid]": 0,
-            **({"courses[0][startdate]": int(startdate)} if startdate is not None else {}),
-            **({"courses[0][enddate]": int(enddate)} if enddate is not None else {}),
-        },
+        _course_create_fields(
+            0,
+            fullname=course_fullname,
+            shortname=course_shortname,
+            categoryid=category_id,
+            idnumber=course_idnumber,
+            startdate=startdate,
+            enddate=enddate,
+        ),
         timeout=60,
     )
 
@@ -539,6 +874,15 @@ def ensure_course(
 
     # Moodle retorna lista de cursos creados
     if isinstance(resp, list) and resp and isinstance(resp[0], dict) and resp[0].get("id"):
+        remember_course(
+            {
+                "id": resp[0]["id"],
+                "shortname": resp[0].get("shortname") or course_shortname,
+                "idnumber": course_idnumber,
+                "fullname": course_fullname,
+                "categoryid": int(category_id),
+            }
+        )
         return int(resp[0]["id"])
 
     frappe.log_error(message=str(resp), title="Moodle create_courses unexpected response")
@@ -569,27 +913,23 @@ def get_user_enrolled_course_ids(user_id: int) -> List[int]:
             )
         except Exception as e:
             if wsfunc == "core_enrol_get_users_courses":
-                frappe.log_error(
-                    title="Moodle LOA trace: core_enrol_get_users_courses falló",
-                    message=f"userid={user_id} | error={e}",
-                )
+                tracing.warning("moodle", "core_enrol_get_users_courses falló", userid=user_id, error=str(e))
             continue
         if isinstance(resp, dict) and resp.get("exception"):
             if wsfunc == "core_enrol_get_users_courses":
-                frappe.log_error(
-                    title="Moodle LOA trace: core_enrol_get_users_courses exception",
-                    message=f"userid={user_id} | {resp.get('message')} | code={resp.get('errorcode')}",
+                tracing.warning(
+                    "moodle",
+                    "core_enrol_get_users_courses exception",
+                    userid=user_id,
+                    message=resp.get("message"),
+                    errorcode=resp.get("errorcode"),
                 )
             continue
-        courses = resp if isinstance(resp, list) else (resp.get("courses") or [])
-        if not isinstance(courses, list):
+        ids = _course_ids_from_response(resp)
+        if ids is None:
             continue
-        ids = [int(c.get("id")) for c in courses if c and c.get("id") is not None]
         if not ids and wsfunc == "core_enrol_get_users_courses":
-            frappe.log_error(
-                title="Moodle LOA trace: core_enrol retornó 0 cursos",
-                message=f"userid={user_id} | resp_type={type(resp).__name__} | len(courses)={len(courses) if isinstance(courses, list) else 0}",
-            )
+            tracing.debug("moodle", "core_enrol_get_users_courses retornó 0 cursos", userid=user_id)
         return ids
     return []
 
@@ -614,6 +954,72 @@ def get_enrolled_user_ids(course_id: int) -> set:
     return {int(u["id"]) for u in resp if u.get("id") is not None}
 
 
+def get_course_enrolment_states(course_id: int) -> Dict[int, Dict[str, Any]]:
+    """
+    Estado de todas las matrículas de un curso: {userid: {"roleids": set, "active": bool}}.
+
+    Dos llamadas a core_enrol_get_enrolled_users (todas y onlyactive=1): la respuesta no trae el
+    estado de la matrícula, así que "suspendida" = matriculado y no activo.
+    """
+    def _fetch(options: Dict[str, Any]) -> List[Dict[str, Any]]:
+        resp = _moodle_post("core_enrol_get_enrolled_users", {"courseid": course_id, **options}, timeout=60)
+        if isinstance(resp, dict) and resp.get("exception"):
+            frappe.log_error(message=str(resp), title="Moodle get_enrolled_users error")
+            frappe.throw(
+                f"Moodle error (get_enrolled_users): {resp.get('message') or resp.get('errorcode')}"
+            )
+        return resp if isinstance(resp, list) else []
+
+    fields = {"options[0][name]": "userfields", "options[0][value]": "id,roles"}
+    users = _fetch(fields)
+    active_ids = {
+        int(u["id"])
+        for u in _fetch({**fields, "options[1][name]": "onlyactive", "options[1][value]": 1})
+        if u.get("id") is not None
+    }
+    states: Dict[int, Dict[str, Any]] = {}
+    for u in users:
+        if u.get("id") is None:
+            continue
+        uid = int(u["id"])
+        states[uid] = {
+            "roleids": {int(r["roleid"]) for r in (u.get("roles") or []) if r.get("roleid") is not None},
+            "active": uid in active_ids,
+        }
+    return states
+
+
+def get_course_final_grades(course_id: int) -> Dict[int, float]:
+    """
+    Nota final (total del curso, 0-100) de todos los usuarios calificados de un curso:
+    {userid: porcentaje}. Una sola llamada a gradereport_user_get_grade_items (sin userid = todos).
+
+    Los usuarios sin nota en el total (graderaw vacío) no se incluyen.
+    """
+    resp = _moodle_post("gradereport_user_get_grade_items", {"courseid": course_id}, timeout=120)
+    if isinstance(resp, dict) and resp.get("exception"):
+        frappe.log_error(message=str(resp), title="Moodle get_grade_items error")
+        frappe.throw(f"Moodle error (get_grade_items): {resp.get('message') or resp.get('errorcode')}")
+
+    grades: Dict[int, float] = {}
+    for usergrade in (resp or {}).get("usergrades") or []:
+        if usergrade.get("userid") is None:
+            continue
+        total = next((i for i in usergrade.get("gradeitems") or [] if i.get("itemtype") == "course"), None)
+        if not total or total.get("graderaw") in (None, ""):
+            continue
+        try:
+            raw = float(total["graderaw"])
+            grademin = float(total.get("grademin") or 0)
+            grademax = float(total.get("grademax") or 100)
+        except (TypeError, ValueError):
+            continue
+        if grademax <= grademin:
+            continue
+        grades[int(usergrade["userid"])] = round((raw - grademin) * 100 / (grademax - grademin), 2)
+    return grades
+
+
 def enrol_user_in_course(
     user_id: int,
     course_id: int,
@@ -627,20 +1033,313 @@ def enrol_user_in_course(
 
     Retorna {"enrolled": True} si se matriculó, {"already_enrolled": True} si ya estaba.
     """
-    payload = {
-        "enrolments[0][userid]": user_id,
-        "enrolments[0][courseid]": course_id,
-        "enrolments[0][roleid]": roleid,
-        "enrolments[0][suspend]": int(suspend),
+    result = _enrol_batches(
+        {None: [(user_id, course_id, roleid, suspend)]},
+        _sequential_transport("enrol_manual_enrol_users", timeout=20),
+    )[None][0]
+    if result.get("error"):
+        frappe.log_error(message=result["error"], title="Moodle enrol_user error")
+        frappe.throw(result["error"])
+    return {"already_enrolled": True} if result.get("already_enrolled") else {"enrolled": True}
+
+
+# Filas por llamada a enrol_manual_enrol_users (Moodle procesa el arreglo en una transacción).
+_ENROL_CHUNK_SIZE = 100
+
+
+def _enrolments_payload(rows: List[tuple]) -> Dict[str, Any]:
+    """rows: [(user_id, course_id, roleid, suspend)] -> enrolments[i][...]"""
+    payload: Dict[str, Any] = {}
+    for i, (user_id, course_id, roleid, suspend) in enumerate(rows):
+        payload[f"enrolments[{i}][userid]"] = int(user_id)
+        payload[f"enrolments[{i}][courseid]"] = int(course_id)
+        payload[f"enrolments[{i}][roleid]"] = int(roleid)
+        payload[f"enrolments[{i}][suspend]"] = int(suspend)
+    return payload
+
+
+def _is_already_enrolled_error(resp: Dict[str, Any]) -> bool:
+    msg = (resp.get("message") or "").lower()
+    return "already" in msg or "enrolled" in msg or "duplicate" in msg
+
+
+def _is_invalid_user_error(resp: Dict[str, Any]) -> bool:
+    """El userid no existe en Moodle (usuario borrado o recreado): dml_missing_record sobre la tabla user."""
+    errorcode = resp.get("errorcode")
+    if errorcode == "invaliduser":
+        return True
+    text = f"{resp.get('message') or ''} {resp.get('debuginfo') or ''}".lower()
+    return errorcode == "invalidrecord" and re.search(r"\buser\b", text) is not None
+
+
+def _enrol_row_result(row: tuple, resp: Any) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"user_id": int(row[0]), "course_id": int(row[1])}
+    if isinstance(resp, dict) and resp.get("exception"):
+        if _is_invalid_user_error(resp):
+            result["invalid_user"] = True
+            result["error"] = f"Moodle error (enrol_user): {resp.get('message') or resp.get('errorcode')}"
+        elif _is_already_enrolled_error(resp):
+            result["already_enrolled"] = True
+        else:
+            result["error"] = f"Moodle error (enrol_user): {resp.get('message') or resp.get('errorcode')}"
+    else:
+        result["enrolled"] = True
+    return result
+
+
+def _enrol_batches(
+    jobs: Dict[Any, List[tuple]],
+    transport,
+    *,
+    build_payload=_enrolments_payload,
+    row_result=_enrol_row_result,
+) -> Dict[Any, List[Dict[str, Any]]]:
+    """
+    Núcleo de la matrícula / desmatriculación masiva, común al flujo secuencial y al concurrente.
+
+    jobs: {clave: [fila]} (por defecto filas de matrícula (user_id, course_id, roleid, suspend);
+    `unenrol_users` pasa su `build_payload` / `row_result`). Bloques de _ENROL_CHUNK_SIZE filas por
+    llamada; si Moodle rechaza un bloque (una fila inválida revierte el bloque completo), se
+    reintenta fila por fila para aislar el error. `transport(payloads)` hace las llamadas y retorna
+    una respuesta por payload (`_sequential_transport` o `_post_many`); una respuesta con
+    "unavailable" (servicio no disponible) no se reintenta por fila.
+    """
+    chunks = [
+        (key, rows[start : start + _ENROL_CHUNK_SIZE])
+        for key, rows in jobs.items()
+        for start in range(0, len(rows), _ENROL_CHUNK_SIZE)
+    ]
+    responses = transport([build_payload(chunk) for _key, chunk in chunks])
+
+    out: Dict[Any, List[Dict[str, Any]]] = {key: [] for key in jobs}
+    pending = []  # (clave, posición, fila) a reintentar solas
+    for (key, chunk), resp in zip(chunks, responses):
+        rejected = isinstance(resp, dict) and resp.get("exception")
+        if rejected and len(chunk) > 1 and not resp.get("unavailable"):
+            frappe.logger().info(
+                f"Moodle matrícula masiva: bloque de {len(chunk)} rechazado ({resp.get('message')}); reintento por fila"
+            )
+            for row in chunk:
+                pending.append((key, len(out[key]), row))
+                out[key].append(None)
+        else:
+            out[key] += [row_result(row, resp) for row in chunk]
+    if pending:
+        responses = transport([build_payload([row]) for _key, _pos, row in pending])
+        for (key, pos, row), resp in zip(pending, responses):
+            out[key][pos] = row_result(row, resp)
+    return out
+
+
+def enrol_users(rows: List[tuple]) -> List[Dict[str, Any]]:
+    """
+    Matrícula masiva (enrol_manual_enrol_users con varias filas por llamada).
+
+    rows: [(user_id, course_id, roleid, suspend)]. Se envían en bloques de 100; si Moodle
+    rechaza un bloque (una fila inválida revierte el bloque completo), se reintenta fila por
+    fila para aislar el error.
+
+    Retorna un resultado por fila, en el mismo orden:
+    {"user_id", "course_id", "enrolled"|"already_enrolled"|"error": ...}; con "invalid_user" si el
+    userid ya no existe en Moodle (ver `course_enrollment_moodle.refresh_stale_student_users`).
+    """
+    if not rows:
+        return []
+    results = _enrol_batches({None: rows}, _sequential_transport("enrol_manual_enrol_users", timeout=60))[None]
+    failed = [r for r in results if r.get("error")]
+    if failed:
+        frappe.log_error(
+            title="Moodle enrol_users error",
+            message=f"{len(failed)} fila(s) con error | {failed[:10]}",
+        )
+    return results
+
+
+def enrol_users_in_course(course_id: int, rows: List[tuple]) -> List[Dict[str, Any]]:
+    """Matricula varios usuarios en un curso. rows: [(user_id, roleid, suspend)]."""
+    return enrol_users([(user_id, course_id, roleid, suspend) for user_id, roleid, suspend in rows])
+
+
+# ------------------------------------------------------------
+# Matrícula concurrente (imports grandes)
+# ------------------------------------------------------------
+
+_DEFAULT_IMPORT_CONCURRENCY = 4
+
+
+def get_import_concurrency() -> int:
+    """Hilos para llamadas Moodle en imports: MOODLE_IMPORT_CONCURRENCY / moodle_import_concurrency.
+
+    1 = secuencial. Nunca supera el tamaño del pool HTTP (moodle_http_pool_size).
+    """
+    cap = _get_int_setting("MOODLE_IMPORT_CONCURRENCY", "moodle_import_concurrency", _DEFAULT_IMPORT_CONCURRENCY)
+    pool_size = _get_int_setting("MOODLE_HTTP_POOL_SIZE", "moodle_http_pool_size", 10)
+    return max(1, min(cap, pool_size))
+
+
+def _snapshot_http_config(wsfunction: str, timeout: int | None = None) -> Dict[str, Any]:
+    """Config resuelta en el hilo principal (los hilos del pool no tienen contexto frappe)."""
+    url, token = _get_moodle_config()
+    return {
+        "session": _get_moodle_session(),
+        "url": url,
+        "token": token,
+        "wsfunction": wsfunction,
+        "timeout": _get_timeout(wsfunction, timeout),
+        "max_retries": max(0, _get_int_setting("MOODLE_HTTP_RETRIES", "moodle_http_retries", 3)),
+        "operation": moodle_metrics.current_operation(),
+        "samples": [],
     }
-    resp = _moodle_post("enrol_manual_enrol_users", data=payload, timeout=20)
+
+
+def _post_unbound(config: Dict[str, Any], data: Dict[str, Any]) -> Any:
+    # Métricas: se acumulan en config["samples"] y se registran desde el hilo principal
+    sample = _new_sample(config)
+    try:
+        return _send(config, data, sample)
+    finally:
+        config["samples"].append(sample)
+
+
+def _record_unbound_samples(config: Dict[str, Any]) -> None:
+    """Registra (desde el hilo principal) métricas y estado del circuito de las llamadas en hilos."""
+    samples = config["samples"]
+    # pop() es atómico: las muestras que agreguen otros hilos mientras tanto quedan para la próxima
+    for _i in range(len(samples)):
+        _record_sample(samples.pop(0))
+
+
+def _error_response(e: BaseException) -> Dict[str, Any]:
+    return {"exception": type(e).__name__, "message": str(e)}
+
+
+def _sequential_transport(wsfunction: str, timeout: int | None = None):
+    """Transporte de `_enrol_batches` por `_moodle_post` (una llamada tras otra, en el hilo actual)."""
+
+    def transport(payloads: List[Dict[str, Any]]) -> List[Any]:
+        responses = []
+        for data in payloads:
+            try:
+                responses.append(_moodle_post(wsfunction, data=data, timeout=timeout))
+            except service_guard.ServiceUnavailable:
+                raise
+            except Exception as e:
+                responses.append(_error_response(e))
+        return responses
+
+    return transport
+
+
+def _post_many(config: Dict[str, Any], payloads: List[Dict[str, Any]], workers: int) -> List[Any]:
+    """
+    Transporte en paralelo: un `_post_unbound` por payload en un pool de `workers` hilos.
+    Retorna una respuesta por payload, en orden (errores como {"exception", "message"}).
+
+    Cada llamada pasa por `service_guard.before_call` (circuito + una ficha del token bucket) en el
+    hilo principal antes de entrar al pool, y el circuito se actualiza a medida que terminan. Si se
+    abre o no hay fichas, las llamadas que faltan no se envían: retornan con "unavailable".
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    responses: List[Any] = [None] * len(payloads)
+    in_flight: Dict[Any, int] = {}
+
+    def _collect(done) -> None:
+        for future in done:
+            index = in_flight.pop(future)
+            try:
+                responses[index] = future.result()
+            except Exception as e:
+                responses[index] = _error_response(e)
+        _record_unbound_samples(config)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="moodle-http") as pool:
+        for index, data in enumerate(payloads):
+            if len(in_flight) >= workers:
+                _collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            try:
+                service_guard.before_call("moodle")
+            except service_guard.ServiceUnavailable as e:
+                for rest in range(index, len(payloads)):
+                    responses[rest] = {**_error_response(e), "unavailable": True, "retry_after": e.retry_after}
+                break
+            in_flight[pool.submit(_post_unbound, config, data)] = index
+        _collect(wait(in_flight).done)
+    return responses
+
+
+def enrol_users_concurrently(
+    jobs: Dict[Any, List[tuple]],
+    *,
+    max_workers: int | None = None,
+) -> Dict[Any, List[Dict[str, Any]]]:
+    """
+    Ejecuta varias matrículas masivas en paralelo (un job por curso/grupo).
+
+    jobs: {clave: [(user_id, course_id, roleid, suspend)]}. Solo HTTP en los hilos; el llamador
+    sigue escribiendo en la BD desde el hilo principal. Concurrencia: `get_import_concurrency()`.
+    Los bloques de todos los jobs comparten el pool (mismo núcleo que `enrol_users`).
+    """
+    jobs = {key: rows for key, rows in jobs.items() if rows}
+    if not jobs:
+        return {}
+    workers = max(1, min(max_workers or get_import_concurrency(), len(jobs)))
+    if workers == 1:
+        return {key: enrol_users(rows) for key, rows in jobs.items()}
+
+    config = _snapshot_http_config("enrol_manual_enrol_users", 60)
+    out = _enrol_batches(jobs, lambda payloads: _post_many(config, payloads, workers))
+    for key, results in out.items():
+        failed = [r for r in results if r.get("error")]
+        if failed:
+            frappe.log_error(
+                title="Moodle enrol_users (concurrente)",
+                message=f"{key}: {len(failed)} fila(s) con error | {failed[:10]}",
+            )
+    return out
+
+
+def _course_ids_from_response(resp: Any) -> List[int] | None:
+    """IDs de curso de una respuesta de core_enrol_get_users_courses (None si es un error)."""
     if isinstance(resp, dict) and resp.get("exception"):
-        msg = (resp.get("message") or "").lower()
-        if "already" in msg or "enrolled" in msg or "duplicate" in msg:
-            return {"already_enrolled": True}
-        frappe.log_error(message=str(resp), title="Moodle enrol_user error")
-        frappe.throw(f"Moodle error (enrol_user): {resp.get('message') or resp.get('errorcode')}")
-    return {"enrolled": True}
+        return None
+    courses = resp if isinstance(resp, list) else (resp.get("courses") or [])
+    if not isinstance(courses, list):
+        return None
+    return [int(c.get("id")) for c in courses if c and c.get("id") is not None]
+
+
+def get_users_enrolled_course_ids(user_ids: List[int], *, max_workers: int | None = None) -> Dict[int, List[int]]:
+    """
+    Variante masiva de `get_user_enrolled_course_ids`: {user_id: [course_id]} (solo matrículas activas).
+
+    Moodle no tiene una lectura de cursos de varios usuarios a la vez; las llamadas
+    core_enrol_get_users_courses van en paralelo (`get_import_concurrency()`, con rate limit y
+    circuito por llamada, ver `_post_many`). Si la de un usuario falla, se reintenta con
+    `get_user_enrolled_course_ids` (mismo fallback que el flujo individual). Si Moodle deja de
+    estar disponible a mitad de camino se lanza ServiceUnavailable (no se asume "sin cursos").
+    """
+    user_ids = list(dict.fromkeys(int(uid) for uid in user_ids if uid))
+    if not user_ids:
+        return {}
+    workers = max(1, min(max_workers or get_import_concurrency(), len(user_ids)))
+    if workers == 1:
+        return {uid: get_user_enrolled_course_ids(uid) for uid in user_ids}
+
+    config = _snapshot_http_config("core_enrol_get_users_courses", 60)
+    responses = _post_many(config, [{"userid": uid, "returnusercount": 0} for uid in user_ids], workers)
+    unavailable = next((r for r in responses if isinstance(r, dict) and r.get("unavailable")), None)
+    if unavailable:
+        raise service_guard.ServiceUnavailable(
+            f"moodle: {unavailable.get('message')}",
+            endpoint="moodle",
+            retry_after=unavailable.get("retry_after") or 0,
+        )
+    out: Dict[int, List[int]] = {}
+    for uid, resp in zip(user_ids, responses):
+        ids = _course_ids_from_response(resp)
+        out[uid] = ids if ids is not None else get_user_enrolled_course_ids(uid)
+    return out
 
 
 def suspend_user_enrolment_in_course(
@@ -663,6 +1362,12 @@ def suspend_user_enrolment_in_course(
     return {"suspended": suspend, **result}
 
 
+def suspend_user_enrolments(user_id: int, course_ids: List[int], suspend: int = 1) -> List[Dict[str, Any]]:
+    """Variante masiva de `suspend_user_enrolment_in_course`: un usuario, varios cursos."""
+    results = enrol_users([(user_id, cid, MOODLE_ROLE_STUDENT, int(suspend)) for cid in course_ids])
+    return [{"suspended": suspend, **r} for r in results]
+
+
 def unenrol_user_from_course(user_id: int, course_id: int) -> Dict[str, Any]:
     """Desmatricula un usuario de un curso Moodle (enrol_manual_unenrol_users)."""
     payload = {
@@ -677,45 +1382,78 @@ def unenrol_user_from_course(user_id: int, course_id: int) -> Dict[str, Any]:
     return {"unenrolled": True}
 
 
-# Sufijos del formato antiguo de Moodle (pre Spring B 2026).
-# Ej: 202532=Spring A, 202545=Summer B, 202622=Fall A (año siguiente para Fall).
-_OLD_TERM_SUFFIX_BY_LABEL = {
-    "Spring A": "32",
-    "Spring B": "35",
-    "Summer A": "42",
-    "Summer B": "45",
-    "Fall A": "22",   # usa año+1: 2025 Fall A -> 202622
-    "Fall B": "25",   # usa año+1: 2025 Fall B -> 202625
-}
+def unenrol_users(rows: List[tuple]) -> List[Dict[str, Any]]:
+    """
+    Desmatriculación masiva (enrol_manual_unenrol_users). rows: [(user_id, course_id)].
+
+    Mismo núcleo que `enrol_users` (`_enrol_batches`): bloques de 100 y fallback fila por fila si
+    Moodle rechaza el bloque. Retorna [{"user_id", "course_id", "unenrolled"|"error"}].
+    """
+    if not rows:
+        return []
+    results = _enrol_batches(
+        {None: rows},
+        _sequential_transport("enrol_manual_unenrol_users", timeout=60),
+        build_payload=_unenrolments_payload,
+        row_result=_unenrol_row_result,
+    )[None]
+    failed = [r for r in results if r.get("error")]
+    if failed:
+        frappe.log_error(
+            title="Moodle unenrol_users error",
+            message=f"{len(failed)} fila(s) con error | {failed[:10]}",
+        )
+    return results
+
+
+def _unenrolments_payload(rows: List[tuple]) -> Dict[str, Any]:
+    """rows: [(user_id, course_id)] -> enrolments[i][...] de enrol_manual_unenrol_users."""
+    payload: Dict[str, Any] = {}
+    for i, (user_id, course_id) in enumerate(rows):
+        payload[f"enrolments[{i}][userid]"] = int(user_id)
+        payload[f"enrolments[{i}][courseid]"] = int(course_id)
+    return payload
+
+
+def _unenrol_row_result(row: tuple, resp: Any) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"user_id": int(row[0]), "course_id": int(row[1])}
+    if isinstance(resp, dict) and resp.get("exception"):
+        result["error"] = f"Moodle error (unenrol_user): {resp.get('message') or resp.get('errorcode')}"
+    else:
+        result["unenrolled"] = True
+    return result
 
 
 def _get_old_moodle_term_id(academic_term: str | None) -> str | None:
     """Obtiene el term ID antiguo de Moodle para un período académico.
 
-    Regla computable:
+    Regla computable (`academic_term_meta.OLD_TERM_SUFFIX_BY_LABEL`):
     - Spring A=32, Spring B=35, Summer A=42, Summer B=45, Fall A=22, Fall B=25
     - Spring/Summer: YYYY + sufijo (ej. 2025 Summer B -> 202545)
     - Fall A/B: (YYYY+1) + sufijo (ej. 2025 Fall A -> 202622)
 
     Prioridad: moodle_old_term_ids en site_config (override por período).
     """
-    if not academic_term or not str(academic_term).strip():
-        return None
-    term = str(academic_term).strip()
-    custom = frappe.conf.get("moodle_old_term_ids") or {}
-    if isinstance(custom, dict) and term in custom:
-        return str(custom[term]).strip()
-    m = re.fullmatch(r"(\d{4})\s*\((Spring A|Spring B|Summer A|Summer B|Fall A|Fall B)\)", term)
-    if not m:
-        return None
-    year = int(m.group(1))
-    season = m.group(2)
-    suffix = _OLD_TERM_SUFFIX_BY_LABEL.get(season)
-    if not suffix:
+    return get_old_moodle_term_id(academic_term)
+
+
+def _get_enrollment_fullname_shortname(
+    course_doc, course_shortcode: str, term_code: str | None, academic_term: str | None
+) -> str | None:
+    """Shortname con formato fullname de EdTools: "YYYYMM,CODE, 1, TITULO TERM M/D/YYYY"."""
+    if not (term_code and course_shortcode and academic_term):
         return None
-    if season in ("Fall A", "Fall B"):
-        year += 1
-    return f"{year}{suffix}"
+    course_title = (
+        course_doc.course_name.split(" - ", 1)[1].strip()
+        if " - " in (course_doc.course_name or "")
+        else (course_doc.course_name or "")
+    )
+    try:
+        from edtools_core.moodle_sync import _get_term_start_date_mdy
+        term_start_mdy = _get_term_start_date_mdy(academic_term)
+    except Exception:
+        term_start_mdy = ""
+    return f"{term_code},{course_shortcode}, 1, {course_title} {academic_term} {term_start_mdy}".strip()
 
 
 def find_moodle_course_for_enrollment(
@@ -749,6 +1487,25 @@ def find_moodle_course_for_enrollment(
             term_code = get_term_category_name(academic_term)
         except Exception:
             pass
+    old_term_id = _get_old_moodle_term_id(academic_term)
+    fullname_shortname = _get_enrollment_fullname_shortname(
+        course_doc, course_shortcode, term_code, academic_term
+    )
+
+    # Índice local (Moodle Course Index): todas las estrategias con 0-1 llamadas a Moodle.
+    # Mientras el índice no esté construido se usa la cascada remota y se encola su construcción.
+    from edtools_core import moodle_course_index
+
+    if moodle_course_index.is_populated():
+        return moodle_course_index.find_course_for_enrollment(
+            course_name=course_doc.name,
+            course_shortcode=course_shortcode,
+            academic_term=academic_term,
+            term_code=term_code,
+            old_term_id=old_term_id,
+            fullname_shortname=fullname_shortname,
+        )
+    moodle_course_index._enqueue_rebuild()
 
     # 1. Buscar por idnumber = YYYYMM::course_shortcode (formato Monitor de César)
     if term_code and course_shortcode:
@@ -763,7 +1520,6 @@ def find_moodle_course_for_enrollment(
         return int(courses[0].get("id"))
 
     # 2b. Formato ANTIGUO (pre Spring B 2026): idnumber TERMID-CODE, shortname TERMID-CODE-1
-    old_term_id = _get_old_moodle_term_id(academic_term)
     if old_term_id and course_shortcode:
         code_normalized = course_shortcode.replace(" ", "").strip()
         for idnumber_val, shortname_val in [
@@ -778,24 +1534,10 @@ def find_moodle_course_for_enrollment(
                 return int(courses[0].get("id"))
 
     # 3. Buscar por shortname con formato fullname de EdTools
-    if term_code and course_shortcode:
-        course_title = (
-            course_doc.course_name.split(" - ", 1)[1].strip()
-            if " - " in (course_doc.course_name or "")
-            else (course_doc.course_name or "")
-        )
-        if academic_term:
-            try:
-                from edtools_core.moodle_sync import _get_term_start_date_mdy
-                term_start_mdy = _get_term_start_date_mdy(academic_term)
-            except Exception:
-                term_start_mdy = ""
-            fullname_shortname = (
-                f"{term_code},{course_shortcode}, 1, {course_title} {academic_term} {term_start_mdy}"
-            )
-            courses = get_courses_by_field(field="shortname", value=fullname_shortname.strip())
-            if courses:
-                return int(courses[0].get("id"))
+    if fullname_shortname:
+        courses = get_courses_by_field(field="shortname", value=fullname_shortname)
+        if courses:
+            return int(courses[0].get("id"))
 
     # 4. Buscar en categoría del periodo, hermanas y subcategorías del año (case-insensitive + shortname contains)
     if academic_term:
@@ -0,0 +1,215 @@
+"""
+Métricas de llamadas a la API de Moodle (por wsfunction y por operación de alto nivel).
+
+Cada llamada de `_moodle_post` suma en Redis, en un bucket por minuto:
+llamadas, errores (por código), latencia (suma + histograma) y bytes enviados/recibidos.
+Las ventanas (5, 15, 60 min, ...) se calculan sumando los buckets del rango; los buckets
+expiran solos (`_RETENTION_MINUTES`).
+
+La operación que originó la llamada (Course Enrollment Tool, import, sync LOA, unenrol, ...) se
+marca con `moodle_operation("...")`, como `with` o como decorador.
+
+Consulta: `get_moodle_metrics` (whitelisted) y el Script Report "Moodle API Metrics".
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+import frappe
+
+_KEY_PREFIX = "edtools_moodle_metrics::"
+_RETENTION_MINUTES = 24 * 60
+# Límites superiores (ms) de los buckets del histograma de latencia; el último es abierto.
+_LATENCY_BUCKETS_MS = (25, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 20000, 30000, 60000)
+_DEFAULT_OPERATION = "other"
+
+_current_operation: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "edtools_moodle_operation", default=_DEFAULT_OPERATION
+)
+
+
+@contextmanager
+def moodle_operation(name: str):
+    """Etiqueta las llamadas a Moodle hechas dentro del bloque (o de la función decorada)."""
+    token = _current_operation.set(name)
+    try:
+        yield
+    finally:
+        _current_operation.reset(token)
+
+
+def current_operation() -> str:
+    return _current_operation.get()
+
+
+def _bucket_index(latency_ms: float) -> int:
+    for i, upper in enumerate(_LATENCY_BUCKETS_MS):
+        if latency_ms <= upper:
+            return i
+    return len(_LATENCY_BUCKETS_MS)
+
+
+def _minute_key(minute: int) -> str:
+    return frappe.cache.make_key(f"{_KEY_PREFIX}{minute}")
+
+
+def record_call(
+    wsfunction: str,
+    latency_ms: float,
+    *,
+    error_code: Optional[str] = None,
+    bytes_out: int = 0,
+    bytes_in: int = 0,
+    operation: Optional[str] = None,
+    at: Optional[float] = None,
+) -> None:
+    """Suma una llamada a las métricas. Nunca lanza: las métricas no deben romper la llamada."""
+    try:
+        op = operation or current_operation()
+        prefix = f"{op}|{wsfunction}|"
+        key = _minute_key(int((at or time.time()) // 60))
+        pipe = frappe.cache.pipeline()
+        pipe.hincrby(key, prefix + "calls", 1)
+        pipe.hincrbyfloat(key, prefix + "lat_sum", float(latency_ms))
+        pipe.hincrby(key, f"{prefix}h{_bucket_index(latency_ms)}", 1)
+        if bytes_out:
+            pipe.hincrby(key, prefix + "bytes_out", int(bytes_out))
+        if bytes_in:
+            pipe.hincrby(key, prefix + "bytes_in", int(bytes_in))
+        if error_code:
+            pipe.hincrby(key, prefix + "errors", 1)
+            pipe.hincrby(key, f"{prefix}err:{error_code}", 1)
+        pipe.expire(key, _RETENTION_MINUTES * 60)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def record_samples(samples: Iterable[Dict[str, Any]]) -> None:
+    """Registra muestras tomadas fuera del contexto frappe (hilos de `enrol_users_concurrently`)."""
+    for s in samples:
+        record_call(
+            s["wsfunction"],
+            s["latency_ms"],
+            error_code=s.get("error_code"),
+            bytes_out=s.get("bytes_out", 0),
+            bytes_in=s.get("bytes_in", 0),
+            operation=s.get("operation"),
+            at=s.get("at"),
+        )
+
+
+def response_error_code(response: Any) -> Optional[str]:
+    """Código de error de una respuesta JSON de Moodle (exception/errorcode), o None."""
+    if isinstance(response, dict) and response.get("exception"):
+        return str(response.get("errorcode") or response.get("exception"))
+    return None
+
+
+# ------------------------------------------------------------
+# Lectura
+# ------------------------------------------------------------
+
+def _percentile(histogram: List[int], total: int, q: float) -> Optional[float]:
+    """Percentil aproximado (interpolación lineal dentro del bucket)."""
+    if not total:
+        return None
+    target = q * total
+    seen = 0
+    for i, count in enumerate(histogram):
+        if not count:
+            continue
+        if seen + count >= target:
+            lower = _LATENCY_BUCKETS_MS[i - 1] if i > 0 else 0
+            upper = _LATENCY_BUCKETS_MS[i] if i < len(_LATENCY_BUCKETS_MS) else lower * 2
+            return round(lower + (upper - lower) * (target - seen) / count, 1)
+        seen += count
+    return float(_LATENCY_BUCKETS_MS[-1])
+
+
+def collect(window_minutes: int = 15, *, by_operation: bool = True) -> List[Dict[str, Any]]:
+    """
+    Agrega los buckets de los últimos `window_minutes` minutos.
+
+    Retorna una fila por (operation, wsfunction) —o solo wsfunction si by_operation=False—
+    ordenadas por llamadas: calls, errors, error_rate, avg_ms, p50_ms, p95_ms, p99_ms,
+    bytes_out, bytes_in, calls_per_min, error_codes {código: n}.
+    """
+    window_minutes = max(1, min(int(window_minutes), _RETENTION_MINUTES))
+    now_minute = int(time.time() // 60)
+    keys = [_minute_key(m) for m in range(now_minute - window_minutes + 1, now_minute + 1)]
+    pipe = frappe.cache.pipeline()
+    for key in keys:
+        pipe.hgetall(key)
+
+    n_buckets = len(_LATENCY_BUCKETS_MS) + 1
+    rows: Dict[tuple, Dict[str, Any]] = {}
+    for bucket in pipe.execute():
+        for raw_field, raw_value in (bucket or {}).items():
+            field = raw_field.decode() if isinstance(raw_field, bytes) else raw_field
+            value = float(raw_value)
+            op, wsfunction, metric = field.split("|", 2)
+            group = (op if by_operation else "", wsfunction)
+            row = rows.setdefault(
+                group,
+                {
+                    "operation": group[0],
+                    "wsfunction": wsfunction,
+                    "calls": 0,
+                    "errors": 0,
+                    "lat_sum": 0.0,
+                    "bytes_out": 0,
+                    "bytes_in": 0,
+                    "histogram": [0] * n_buckets,
+                    "error_codes": {},
+                },
+            )
+            if metric.startswith("err:"):
+                code = metric[4:]
+                row["error_codes"][code] = row["error_codes"].get(code, 0) + int(value)
+            elif metric.startswith("h"):
+                row["histogram"][int(metric[1:])] += int(value)
+            elif metric == "lat_sum":
+                row["lat_sum"] += value
+            else:
+                row[metric] += int(value)
+
+    out = []
+    for row in rows.values():
+        calls = row["calls"]
+        histogram = row.pop("histogram")
+        lat_sum = row.pop("lat_sum")
+        row.update(
+            {
+                "error_rate": round(row["errors"] / calls, 4) if calls else 0,
+                "avg_ms": round(lat_sum / calls, 1) if calls else None,
+                "p50_ms": _percentile(histogram, calls, 0.50),
+                "p95_ms": _percentile(histogram, calls, 0.95),
+                "p99_ms": _percentile(histogram, calls, 0.99),
+                "calls_per_min": round(calls / window_minutes, 2),
+            }
+        )
+        out.append(row)
+    out.sort(key=lambda r: r["calls"], reverse=True)
+    return out
+
+
+@frappe.whitelist()
+def get_moodle_metrics(window_minutes=15, by_operation=1):
+    """Métricas de la API de Moodle en la ventana indicada (minutos)."""
+    frappe.only_for(("System Manager", "Education Manager"))
+    return {
+        "window_minutes": int(window_minutes),
+        "rows": collect(int(window_minutes), by_operation=bool(int(by_operation))),
+    }
+
+
+@frappe.whitelist()
+def reset_moodle_metrics():
+    frappe.only_for("System Manager")
+    now_minute = int(time.time() // 60)
+    keys = [_minute_key(m) for m in range(now_minute - _RETENTION_MINUTES, now_minute + 1)]
+    for start in range(0, len(keys), 500):
+        frappe.cache.delete(*keys[start : start + 500])
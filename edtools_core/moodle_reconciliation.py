@@ -0,0 +1,321 @@
+"""
+Reconciliación de matrículas EdTools (Course Enrollment) <-> Moodle.
+
+Por período (Academic Term) o por curso Moodle: una lectura de matrículas por curso
+(`get_course_enrolment_states`), diferencia de conjuntos en memoria contra los Course Enrollments
+y correcciones masivas (`enrol_users` / `unenrol_users`). El resultado queda en un
+"Moodle Enrolment Drift Report":
+
+- Missing: Course Enrollment sin matrícula en Moodle -> se matricula (suspendida si el estudiante
+  no está Active).
+- Wrongly Suspended / Wrongly Active: el estado de la matrícula no coincide con student_status
+  (Active = activa; LOA, Inactive, etc. = suspendida). Withdrawn no se revisa: ahí se suspende el
+  usuario completo, no las matrículas.
+- Extra: estudiante (rol 5) matriculado en Moodle sin Course Enrollment. Solo se reporta, salvo
+  `unenrol_extra` (puede haber matrículas manuales legítimas en Moodle).
+
+Corre cada noche para los períodos en curso (`scheduled_reconcile`).
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import cint, getdate, now_datetime, nowdate
+
+from edtools_core.moodle_enrolment_data import expected_enrolments, load_students, resolve_missing_user_ids
+from edtools_core.moodle_metrics import moodle_operation
+
+DOCTYPE = "Moodle Enrolment Drift Report"
+
+_STATUS_WITHDRAWN = frozenset({"Withdrawn", "Retired", "Retirado"})
+# Filas de detalle guardadas por reporte (los contadores siempre son completos)
+_MAX_ITEMS = 5000
+
+
+# ------------------------------------------------------------
+# Diferencias y correcciones
+# ------------------------------------------------------------
+
+def _diff_course(
+    moodle_course_id: int,
+    expected: Dict[str, str],
+    students: Dict[str, Dict[str, Any]],
+    actual: Dict[int, Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """Compara un curso: Course Enrollments esperados vs. matrículas reales de Moodle."""
+    from edtools_core.moodle_integration import MOODLE_ROLE_STUDENT
+
+    items: List[Dict[str, Any]] = []
+    expected_uids = set()
+    for student, course in expected.items():
+        info = students.get(student) or {}
+        uid = info.get("moodle_user_id")
+        if not uid:
+            continue
+        expected_uids.add(uid)
+        status = info.get("status") or ""
+        want_active = status == "Active"
+        base = {"moodle_course_id": moodle_course_id, "course": course, "student": student, "moodle_user_id": uid}
+
+        state = actual.get(uid)
+        if state is None:
+            suspend = 1 if status and not want_active else 0
+            items.append({**base, "drift_type": "Missing", "suspend": suspend, "status": status})
+            continue
+        # Withdrawn: usuario suspendido completo; vacío: sin estado que comparar
+        if not status or status in _STATUS_WITHDRAWN:
+            continue
+        if want_active and not state["active"]:
+            items.append({**base, "drift_type": "Wrongly Suspended", "suspend": 0})
+        elif not want_active and state["active"]:
+            items.append({**base, "drift_type": "Wrongly Active", "suspend": 1})
+
+    for uid, state in actual.items():
+        if uid in expected_uids or MOODLE_ROLE_STUDENT not in state["roleids"]:
+            continue
+        items.append({"moodle_course_id": moodle_course_id, "moodle_user_id": uid, "drift_type": "Extra"})
+    return items
+
+
+def _apply_fixes(items: List[Dict[str, Any]], *, unenrol_extra: bool) -> None:
+    """Aplica las correcciones en Moodle (llamadas masivas) y anota `action`/`detail` en cada item."""
+    from edtools_core.moodle_integration import MOODLE_ROLE_STUDENT, enrol_users, unenrol_users
+
+    enrol_items = []
+    for item in items:
+        if item["drift_type"] == "Missing" and item.get("status") in _STATUS_WITHDRAWN:
+            item["action"] = "Reported"
+            item["detail"] = "Estudiante retirado: no se matricula"
+        elif item["drift_type"] in ("Missing", "Wrongly Suspended", "Wrongly Active"):
+            enrol_items.append(item)
+        elif item["drift_type"] == "Extra" and not unenrol_extra:
+            item["action"] = "Reported"
+
+    if enrol_items:
+        results = enrol_users(
+            [(i["moodle_user_id"], i["moodle_course_id"], MOODLE_ROLE_STUDENT, i["suspend"]) for i in enrol_items]
+        )
+        for item, result in zip(enrol_items, results):
+            if result.get("error"):
+                item["action"] = "Error"
+                item["detail"] = str(result["error"])[:500]
+            elif item["drift_type"] == "Missing":
+                item["action"] = "Enrolled"
+                item["detail"] = "Matrícula suspendida" if item["suspend"] else ""
+            else:
+                item["action"] = "Suspended" if item["suspend"] else "Reactivated"
+
+    extra_items = [i for i in items if i["drift_type"] == "Extra" and unenrol_extra]
+    if extra_items:
+        results = unenrol_users([(i["moodle_user_id"], i["moodle_course_id"]) for i in extra_items])
+        for item, result in zip(extra_items, results):
+            if result.get("error"):
+                item["action"] = "Error"
+                item["detail"] = str(result["error"])[:500]
+            else:
+                item["action"] = "Unenrolled"
+
+
+def _students_by_moodle_user_id(uids: List[int]) -> Dict[int, str]:
+    from edtools_core.moodle_sync import _has_field
+
+    if not uids or not _has_field("Student", "moodle_user_id"):
+        return {}
+    return {
+        cint(s.moodle_user_id): s.name
+        for s in frappe.get_all(
+            "Student",
+            filters={"moodle_user_id": ["in", list(set(uids))]},
+            fields=["name", "moodle_user_id"],
+        )
+    }
+
+
+@moodle_operation("reconciliation")
+def reconcile(
+    *,
+    academic_term: Optional[str] = None,
+    moodle_course_id: Optional[int] = None,
+    apply_fixes: bool = True,
+    unenrol_extra: bool = False,
+) -> Dict[str, Any]:
+    """
+    Reconcilia el alcance indicado y devuelve el resultado (sin persistir):
+    {"items", "courses_checked", "unmapped", "errors"}.
+    """
+    from edtools_core.moodle_integration import get_course_enrolment_states
+
+    expected, unmapped = expected_enrolments(academic_term, moodle_course_id)
+    students = load_students(list({s for by_student in expected.values() for s in by_student}))
+    user_errors = resolve_missing_user_ids(students, create=apply_fixes)
+
+    items: List[Dict[str, Any]] = []
+    errors: List[str] = [f"Student {name}: {err}" for name, err in user_errors.items()]
+    courses_checked = 0
+    for cid, by_student in expected.items():
+        try:
+            actual = get_course_enrolment_states(cid)
+        except Exception as e:
+            errors.append(f"Moodle course {cid}: {e}")
+            continue
+        courses_checked += 1
+        items += _diff_course(cid, by_student, students, actual)
+
+    if apply_fixes and items:
+        _apply_fixes(items, unenrol_extra=unenrol_extra)
+
+    extra_students = _students_by_moodle_user_id([i["moodle_user_id"] for i in items if i["drift_type"] == "Extra"])
+    for item in items:
+        if item["drift_type"] == "Extra":
+            item["student"] = extra_students.get(item["moodle_user_id"])
+    return {"items": items, "courses_checked": courses_checked, "unmapped": unmapped, "errors": errors}
+
+
+# ------------------------------------------------------------
+# Reporte (DocType) y jobs
+# ------------------------------------------------------------
+
+def run_report(report_name: str) -> None:
+    """Job: ejecuta la reconciliación de un Moodle Enrolment Drift Report y guarda el resultado."""
+    report = frappe.get_doc(DOCTYPE, report_name)
+    report.db_set({"status": "Running", "started_on": now_datetime(), "finished_on": None}, commit=True)
+    try:
+        result = reconcile(
+            academic_term=report.academic_term,
+            moodle_course_id=cint(report.moodle_course_id) or None,
+            apply_fixes=bool(report.apply_fixes),
+            unenrol_extra=bool(report.unenrol_extra),
+        )
+    except Exception:
+        frappe.db.rollback()
+        frappe.log_error(title="Moodle reconciliación", message=frappe.get_traceback())
+        report.reload()
+        report.db_set(
+            {"status": "Failed", "finished_on": now_datetime(), "error_log": frappe.get_traceback()[-5000:]},
+            commit=True,
+        )
+        return
+
+    items = result["items"]
+    report.reload()
+    report.set("items", [])
+    for item in items[:_MAX_ITEMS]:
+        report.append(
+            "items",
+            {
+                "drift_type": item["drift_type"],
+                "moodle_course_id": item["moodle_course_id"],
+                "course": item.get("course"),
+                "student": item.get("student"),
+                "moodle_user_id": item.get("moodle_user_id"),
+                "action": item.get("action") or "",
+                "detail": item.get("detail") or "",
+            },
+        )
+    report.courses_checked = result["courses_checked"]
+    report.unmapped_enrollments = result["unmapped"]
+    report.missing_count = sum(1 for i in items if i["drift_type"] == "Missing")
+    report.extra_count = sum(1 for i in items if i["drift_type"] == "Extra")
+    report.suspension_count = sum(1 for i in items if i["drift_type"] in ("Wrongly Suspended", "Wrongly Active"))
+    report.fixed_count = sum(
+        1 for i in items if i.get("action") in ("Enrolled", "Unenrolled", "Suspended", "Reactivated")
+    )
+    report.error_count = len(result["errors"]) + sum(1 for i in items if i.get("action") == "Error")
+    if len(items) > _MAX_ITEMS:
+        result["errors"].append(f"Detalle truncado: {_MAX_ITEMS} de {len(items)} filas")
+    report.error_log = "\n".join(result["errors"])[-20000:]
+    report.status = "Completed"
+    report.finished_on = now_datetime()
+    report.save(ignore_permissions=True)
+    frappe.db.commit()
+
+
+def enqueue_report(report_name: str) -> None:
+    frappe.db.set_value(DOCTYPE, report_name, "status", "Queued", update_modified=False)
+    frappe.enqueue(
+        "edtools_core.moodle_reconciliation.run_report",
+        queue="long",
+        timeout=3600,
+        job_id=f"edtools_moodle_reconcile::{report_name}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        report_name=report_name,
+    )
+
+
+def _create_report(
+    *,
+    academic_term: Optional[str],
+    moodle_course_id: Optional[int],
+    apply_fixes: bool,
+    unenrol_extra: bool,
+) -> str:
+    report = frappe.get_doc(
+        {
+            "doctype": DOCTYPE,
+            "academic_term": academic_term,
+            "moodle_course_id": moodle_course_id,
+            "apply_fixes": 1 if apply_fixes else 0,
+            "unenrol_extra": 1 if unenrol_extra else 0,
+        }
+    ).insert(ignore_permissions=True)
+    enqueue_report(report.name)
+    return report.name
+
+
+@frappe.whitelist()
+def start_reconciliation(academic_term=None, moodle_course_id=None, apply_fixes=1, unenrol_extra=0):
+    """Crea un Moodle Enrolment Drift Report y encola la reconciliación. Retorna el name del reporte."""
+    frappe.only_for(("System Manager", "Education Manager"))
+    if not academic_term and not cint(moodle_course_id):
+        frappe.throw("Indica un Academic Term o un Moodle Course ID")
+    return _create_report(
+        academic_term=academic_term or None,
+        moodle_course_id=cint(moodle_course_id) or None,
+        apply_fixes=bool(cint(apply_fixes)),
+        unenrol_extra=bool(cint(unenrol_extra)),
+    )
+
+
+def _current_academic_terms() -> List[str]:
+    today = getdate(nowdate())
+    return frappe.get_all(
+        "Academic Term",
+        filters={"term_start_date": ["<=", today], "term_end_date": [">=", today]},
+        pluck="name",
+    )
+
+
+def scheduled_reconcile() -> None:
+    """
+    Scheduler (diario): un reporte por período en curso.
+
+    Desactivar: MOODLE_RECONCILE_NIGHTLY=0 / moodle_reconcile_nightly: false. Correcciones:
+    moodle_reconcile_apply_fixes (por defecto sí); desmatricular extras:
+    moodle_reconcile_unenrol_extra (por defecto no).
+    """
+    enabled = os.getenv("MOODLE_RECONCILE_NIGHTLY")
+    if enabled is not None and str(enabled).strip().lower() in ("0", "false", "no"):
+        return
+    if frappe.conf.get("moodle_reconcile_nightly") is False:
+        return
+    try:
+        from edtools_core.moodle_integration import _get_moodle_config
+
+        url, token = _get_moodle_config()
+    except Exception:
+        return
+    if not url or not token:
+        return
+
+    apply_fixes = frappe.conf.get("moodle_reconcile_apply_fixes", True) is not False
+    unenrol_extra = bool(frappe.conf.get("moodle_reconcile_unenrol_extra", False))
+    for term in _current_academic_terms():
+        _create_report(
+            academic_term=term,
+            moodle_course_id=None,
+            apply_fixes=apply_fixes,
+            unenrol_extra=unenrol_extra,
+        )
+    frappe.db.commit()
@@ -0,0 +1,283 @@
+"""
+Cambio y sincronización masiva de estado de estudiantes con Moodle (olas de LOA / retiros de
+fin de período).
+
+Guardar cada Student dispara `sync_student_status_to_moodle` por separado (búsqueda del usuario,
+suspended, cursos activos y una matrícula por curso). Aquí, para una lista de estudiantes:
+
+1. Se aplica el estado pedido a cada Student. Cada guardado registra el sync de Moodle en el
+   Integration Outbox en su misma transacción, pero diferido (`bulk_status_sync_not_before`,
+   pasado el timeout del job); Azure sigue igual.
+2. Usuarios Moodle en bloque (`load_students` / `resolve_missing_user_ids`).
+3. suspended de todos los usuarios con `update_users_suspended` (una llamada por bloque de 100).
+4. Cursos a suspender/reactivar (cursos activos en Moodle, suspensiones LOA guardadas y
+   Course Enrollments, igual que el flujo individual) y una sola matrícula masiva
+   (`enrol_users`, bloques de 100 filas).
+
+Al terminar, las filas del outbox de los estudiantes sincronizados se cierran (Done) y las de los
+que fallaron o se omitieron quedan listas para que el flujo individual las reintente. Si el job
+muere antes, las filas diferidas se ejecutan solas al vencer. El resumen por estudiante se publica por realtime (`student_bulk_status_sync`).
+"""
+
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+from edtools_core import tracing
+from edtools_core.moodle_metrics import moodle_operation
+
+_DONE_EVENT = "student_bulk_status_sync"
+_JOB_TIMEOUT = 3600
+# Las filas del outbox escritas por el cambio masivo esperan a que termine el job (timeout + margen)
+_OUTBOX_DEFER = timedelta(seconds=_JOB_TIMEOUT + 600)
+
+
+def _stored_loa_course_ids(students: List[str]) -> Dict[str, List[int]]:
+    """{student: [moodle_course_id]} de las suspensiones LOA abiertas (una consulta)."""
+    from edtools_core.moodle_sync import LOA_SUSPENSION_DOCTYPE
+
+    out: Dict[str, List[int]] = {}
+    if not students:
+        return out
+    for row in frappe.get_all(
+        LOA_SUSPENSION_DOCTYPE,
+        filters={"student": ["in", students], "status": "Suspended"},
+        fields=["student", "moodle_course_id"],
+        order_by="suspended_on asc",
+    ):
+        out.setdefault(row.student, []).append(int(row.moodle_course_id))
+    return out
+
+
+def _edtools_course_ids(students: List[str]) -> Dict[str, List[int]]:
+    """
+    {student: [moodle_course_id]} de los Course Enrollments.
+
+    Los que ya tienen moodle_course_id salen de una consulta; solo los estudiantes con algún
+    Course Enrollment sin mapear pasan por `_get_moodle_course_ids_from_edtools_enrollments`
+    (busca en Moodle y persiste el id).
+    """
+    from edtools_core.moodle_sync import _get_moodle_course_ids_from_edtools_enrollments, _has_field
+
+    out: Dict[str, List[int]] = {}
+    if not students:
+        return out
+    if not _has_field("Course Enrollment", "moodle_course_id"):
+        return {s: _get_moodle_course_ids_from_edtools_enrollments(s) for s in students}
+
+    unmapped = set()
+    for row in frappe.get_all(
+        "Course Enrollment",
+        filters={"student": ["in", students]},
+        fields=["student", "moodle_course_id"],
+    ):
+        if cint(row.moodle_course_id):
+            ids = out.setdefault(row.student, [])
+            if int(row.moodle_course_id) not in ids:
+                ids.append(int(row.moodle_course_id))
+        else:
+            unmapped.add(row.student)
+    for student in unmapped:
+        out[student] = _get_moodle_course_ids_from_edtools_enrollments(student)
+    return out
+
+
+def _merge(*lists: List[int]) -> List[int]:
+    return list(dict.fromkeys(cid for ids in lists for cid in ids))
+
+
+@moodle_operation("bulk_status_sync")
+def sync_students_status_to_moodle(students: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Aplica en Moodle el estado ACTUAL de varios Students (mismas reglas que `sync_student_status_to_moodle`).
+
+    Retorna {student: {"status", "moodle_user_id", "user_suspended", "courses", "failed_courses",
+    "error" | "skipped"}}.
+    """
+    from edtools_core.moodle_integration import MOODLE_ROLE_STUDENT, enrol_users, get_users_enrolled_course_ids
+    from edtools_core.moodle_enrolment_data import load_students, resolve_missing_user_ids
+    from edtools_core.moodle_sync import STATUS_WITHDRAWN, _clear_loa_course_ids, _store_loa_course_ids
+    from edtools_core.moodle_users import update_users_suspended
+
+    students = list(dict.fromkeys(s for s in students if s))
+    loaded = load_students(students)
+    results: Dict[str, Dict[str, Any]] = {
+        name: {"status": loaded[name]["status"]} if name in loaded else {"skipped": "Student no existe"}
+        for name in students
+    }
+    for name, error in resolve_missing_user_ids(loaded, create=False).items():
+        results[name]["skipped"] = error
+    ready = {name: info for name, info in loaded.items() if info["moodle_user_id"] and "skipped" not in results[name]}
+    if not ready:
+        return results
+
+    # 1. suspended del usuario: Withdrawn/Retirado = 1, el resto = 0
+    suspended_by_student = {name: int(info["status"] in STATUS_WITHDRAWN) for name, info in ready.items()}
+    failed_users = update_users_suspended(
+        [(info["moodle_user_id"], suspended_by_student[name]) for name, info in ready.items()]
+    )
+    for name, info in ready.items():
+        results[name]["moodle_user_id"] = info["moodle_user_id"]
+        if info["moodle_user_id"] in failed_users:
+            results[name]["error"] = failed_users[info["moodle_user_id"]]
+        else:
+            results[name]["user_suspended"] = suspended_by_student[name]
+
+    # 2. Matrículas de curso: Active = reactivar, otros (no retirados) = suspender
+    pending = {
+        name: info
+        for name, info in ready.items()
+        if not suspended_by_student[name] and "error" not in results[name]
+    }
+    if not pending:
+        return results
+    reactivate = {name for name, info in pending.items() if info["status"] == "Active"}
+    active_ids = get_users_enrolled_course_ids([info["moodle_user_id"] for info in pending.values()])
+    stored_ids = _stored_loa_course_ids(list(reactivate))
+    # Fallback a Course Enrollments al suspender solo si Moodle no devolvió cursos (como el flujo individual)
+    ce_ids = _edtools_course_ids(
+        [n for n, i in pending.items() if n in reactivate or not active_ids.get(i["moodle_user_id"])]
+    )
+
+    rows: List[tuple] = []
+    owners: List[str] = []
+    for name, info in pending.items():
+        uid = info["moodle_user_id"]
+        if name in reactivate:
+            course_ids = _merge(stored_ids.get(name, []), active_ids.get(uid, []), ce_ids.get(name, []))
+        else:
+            course_ids = active_ids.get(uid) or ce_ids.get(name, [])
+        results[name].update({"courses": len(course_ids), "failed_courses": []})
+        suspend = 0 if name in reactivate else 1
+        rows += [(uid, cid, MOODLE_ROLE_STUDENT, suspend) for cid in course_ids]
+        owners += [name] * len(course_ids)
+
+    succeeded: Dict[str, List[int]] = {}
+    for name, row in zip(owners, enrol_users(rows)):
+        if row.get("error"):
+            results[name]["failed_courses"].append(row["course_id"])
+        else:
+            succeeded.setdefault(name, []).append(row["course_id"])
+
+    for name in pending:
+        if name not in reactivate and succeeded.get(name):
+            _store_loa_course_ids(name, succeeded[name])
+        elif name in reactivate and not results[name]["failed_courses"]:
+            _clear_loa_course_ids(name)
+    return results
+
+
+def _apply_statuses(changes: List[Dict[str, str]]) -> Dict[str, str]:
+    """Guarda el estado pedido en cada Student. Retorna {student: error} de los que fallaron."""
+    errors: Dict[str, str] = {}
+    frappe.flags.bulk_status_sync_not_before = now_datetime() + _OUTBOX_DEFER
+    try:
+        for change in changes:
+            student, status = change["student"], change.get("status")
+            if not status:
+                continue
+            try:
+                doc = frappe.get_doc("Student", student)
+                if (doc.student_status or "").strip() != status:
+                    doc.student_status = status
+                    doc.save()
+                frappe.db.commit()
+            except Exception as e:
+                frappe.db.rollback()
+                errors[student] = str(e)
+    finally:
+        frappe.flags.bulk_status_sync_not_before = None
+    return errors
+
+
+def run_bulk_status_sync(changes: List[Dict[str, str]], user: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Job: aplica los estados y sincroniza Moodle en bloque.
+
+    changes: [{"student", "status"}] (sin status = solo re-sincronizar el estado actual).
+    Retorna y publica {"total", "ok", "failed", "results": {student: {...}}}.
+    """
+    from edtools_core.integration_outbox import mark_done_deferred
+    from edtools_core.moodle_sync import student_status_sync_disabled_reason
+    from edtools_core.student_status_sync import enqueue_moodle_student_status, moodle_student_status_key
+
+    with tracing.trace_context("moodle.bulk_status_sync", students=len(changes)):
+        save_errors = _apply_statuses(changes)
+        students = [c["student"] for c in changes if c["student"] not in save_errors]
+
+        disabled = student_status_sync_disabled_reason()
+        if disabled:
+            results = {s: {"skipped": disabled} for s in students}
+        else:
+            try:
+                results = sync_students_status_to_moodle(students)
+            except Exception as e:
+                frappe.db.rollback()
+                frappe.log_error(title="Moodle bulk status sync", message=frappe.get_traceback())
+                results = {s: {"error": str(e)} for s in students}
+
+        # Sincronizados u omitidos (el flujo individual también los omitiría): se cierra su fila
+        # diferida. Los que fallaron quedan listos ya en el outbox: el flujo individual los reintenta
+        # con backoff.
+        retry = [s for s, r in results.items() if r.get("error") or r.get("failed_courses")]
+        mark_done_deferred([moodle_student_status_key(s) for s in results if s not in retry])
+        for student in retry:
+            enqueue_moodle_student_status(student)
+        frappe.db.commit()
+        if retry:
+            sample = {s: results[s] for s in retry[:20]}
+            frappe.log_error(
+                title="Moodle bulk status sync",
+                message=f"{len(retry)} estudiante(s) con error (reintento por outbox) | {sample}",
+            )
+
+        for student, error in save_errors.items():
+            results[student] = {"error": f"No se pudo guardar el estado: {error}"}
+
+        failed = [s for s, r in results.items() if r.get("error") or r.get("failed_courses")]
+        summary = {
+            "total": len(changes),
+            "ok": len(results) - len(failed) - sum(1 for r in results.values() if r.get("skipped")),
+            "skipped": sum(1 for r in results.values() if r.get("skipped")),
+            "failed": len(failed),
+            "results": results,
+        }
+        tracing.info(
+            "bulk_status_sync",
+            "Sync masivo de estado",
+            **{k: summary[k] for k in ("total", "ok", "skipped", "failed")},
+        )
+    frappe.publish_realtime(_DONE_EVENT, summary, user=user)
+    return summary
+
+
+@frappe.whitelist()
+def start_bulk_status_sync(students, status=None):
+    """
+    Encola el cambio/sync masivo de estado.
+
+    students: lista de names o de {"student", "status"}; `status` aplica a los que no traen uno propio
+    (vacío = solo re-sincronizar con Moodle el estado actual).
+    """
+    frappe.only_for(("System Manager", "Education Manager"))
+    students = frappe.parse_json(students) if isinstance(students, str) else students
+    changes = []
+    for entry in students or []:
+        change = entry if isinstance(entry, dict) else {"student": entry}
+        if not change.get("student"):
+            continue
+        changes.append({"student": change["student"], "status": change.get("status") or status or None})
+    if not changes:
+        frappe.throw("Selecciona al menos un estudiante")
+
+    frappe.enqueue(
+        "edtools_core.moodle_status_bulk.run_bulk_status_sync",
+        queue="long",
+        timeout=_JOB_TIMEOUT,
+        enqueue_after_commit=True,
+        changes=changes,
+        user=frappe.session.user,
+    )
+    return {"students": len(changes)}
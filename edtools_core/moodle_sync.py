@@ -15,7 +15,11 @@ import os
 from typing import List
 
 import frappe
+from frappe.utils import cint, now_datetime
 
+from edtools_core import tracing
+from edtools_core.academic_term_meta import get_term_meta
+from edtools_core.moodle_metrics import moodle_operation
 from edtools_core.moodle_users import ensure_moodle_user, get_user_by_email, update_moodle_user_suspended
 from edtools_core.moodle_integration import (
     ensure_academic_year_category,
@@ -27,12 +31,13 @@ from edtools_core.moodle_integration import (
     find_moodle_course_for_enrollment,
     get_enrolled_user_ids,
     get_user_enrolled_course_ids,
-    suspend_user_enrolment_in_course,
+    suspend_user_enrolments,
     MOODLE_ROLE_STUDENT,
 )
 
 
 
+@moodle_operation("enrollment_sync")
 def sync_student_enrollment_to_moodle(
     *,
     student: str,
@@ -73,6 +78,7 @@ def sync_student_enrollment_to_moodle(
 
     moodle_user = ensure_moodle_user(student_doc)
     moodle_user_id = moodle_user["id"]
+    remember_student_moodle_user_id(student, moodle_user_id)
 
     # ===============================
     # 3️⃣ Categorías académicas
@@ -149,66 +155,81 @@ def sync_student_enrollment_to_moodle(
     }
 
 
-def sync_student_status_to_moodle(doc, method=None):
+# Estados que suspenden el usuario Moodle completo (no solo las matrículas)
+STATUS_WITHDRAWN = frozenset({"Withdrawn", "Retired", "Retirado"})
+
+
+def student_status_sync_disabled_reason() -> str | None:
+    """Motivo por el que el sync de estado a Moodle está apagado (None si está activo)."""
+    sync_enabled = os.getenv("MOODLE_SYNC_STUDENT_STATUS")
+    if sync_enabled is not None and str(sync_enabled).strip().lower() in ("0", "false", "no"):
+        return "MOODLE_SYNC_STUDENT_STATUS desactivado"
+    if frappe.conf.get("moodle_sync_student_status") is False:
+        return "moodle_sync_student_status=False en site config"
+    try:
+        from edtools_core.moodle_integration import _get_moodle_config
+        url, token = _get_moodle_config()
+    except Exception as ex:
+        frappe.log_error(title="Moodle sync config", message=f"Error al obtener config: {ex}")
+        return "error al obtener la config de Moodle"
+    if not url or not token:
+        return "MOODLE_URL o MOODLE_TOKEN no configurados"
+    return None
+
+
+@moodle_operation("student_status_sync")
+@tracing.trace_context("moodle.student_status")
+def sync_student_status_to_moodle(doc, method=None, *, raise_errors: bool = False):
     """
     Sincroniza el estado del estudiante (student_status) con Moodle:
     - Active: usuario Moodle activo (suspended=0) + reactivar todas las matrículas de curso.
     - Withdrawn (Retirado): usuario Moodle suspendido (suspended=1).
     - LOA, Inactive, Suspended, etc.: usuario activo (suspended=0) + suspender todas las matrículas de curso.
 
-    Se invoca desde doc_events (Student on_update y after_insert).
-    Si Moodle falla, se registra el error pero no se bloquea el guardado en EdTools.
+    Se invoca desde el Integration Outbox (student_status_sync) con raise_errors=True para que
+    los fallos de Moodle se reintenten; llamado directo, el error solo se registra.
     """
     status = (getattr(doc, "student_status", None) or "").strip()
     # Trace solo para LOA/Inactive/Suspended (evita spam en cada guardado de Active)
     if status and status not in ("Active", "Withdrawn", "Retired", "Retirado"):
         _log_moodle_sync_trace("ENTRY (hook llamado)", student=doc.name, status=status)
 
-    sync_enabled = os.getenv("MOODLE_SYNC_STUDENT_STATUS")
-    if sync_enabled is not None and str(sync_enabled).strip().lower() in ("0", "false", "no"):
-        _log_moodle_sync_trace("sync EXIT: MOODLE_SYNC_STUDENT_STATUS desactivado", student=doc.name)
-        return
-    if frappe.conf.get("moodle_sync_student_status") is False:
-        _log_moodle_sync_trace("sync EXIT: moodle_sync_student_status=False en site config", student=doc.name)
-        return
-
-    try:
-        from edtools_core.moodle_integration import _get_moodle_config
-        url, token = _get_moodle_config()
-        if not url or not token:
-            _log_moodle_sync_trace("sync EXIT: MOODLE_URL o MOODLE_TOKEN no configurados", student=doc.name)
-            return
-    except Exception as ex:
-        frappe.log_error(title="Moodle sync config", message=f"Error al obtener config: {ex}")
+    disabled = student_status_sync_disabled_reason()
+    if disabled:
+        _log_moodle_sync_trace(f"sync EXIT: {disabled}", student=doc.name)
         return
 
     if not getattr(doc, "user", None) or not str(doc.user).strip():
         _log_moodle_sync_trace("sync EXIT: Student sin User vinculado", student=doc.name)
         return
 
-    email = frappe.db.get_value("User", doc.user, "email")
-    if not email or not str(email).strip():
-        _log_moodle_sync_trace("sync EXIT: User sin email", student=doc.name)
-        return
+    moodle_user_id = cint(doc.get("moodle_user_id"))
+    if not moodle_user_id:
+        email = frappe.db.get_value("User", doc.user, "email")
+        if not email or not str(email).strip():
+            _log_moodle_sync_trace("sync EXIT: User sin email", student=doc.name)
+            return
 
-    try:
-        moodle_user = get_user_by_email(email.strip().lower())
-    except Exception as e:
-        frappe.log_error(
-            title="Moodle sync student status",
-            message=f"Student {doc.name} | Error al buscar usuario en Moodle: {e}",
-        )
-        return
+        try:
+            moodle_user = get_user_by_email(email.strip().lower())
+        except Exception as e:
+            frappe.log_error(
+                title="Moodle sync student status",
+                message=f"Student {doc.name} | Error al buscar usuario en Moodle: {e}",
+            )
+            if raise_errors:
+                raise
+            return
 
-    if not moodle_user:
-        _log_moodle_sync_trace("sync EXIT: Usuario no existe en Moodle", student=doc.name, email=email)
-        return
+        if not moodle_user:
+            _log_moodle_sync_trace("sync EXIT: Usuario no existe en Moodle", student=doc.name, email=email)
+            return
 
-    moodle_user_id = int(moodle_user["id"])
+        moodle_user_id = int(moodle_user["id"])
+        remember_student_moodle_user_id(doc.name, moodle_user_id)
     status = (getattr(doc, "student_status", None) or "").strip()
 
     # Withdrawn / Retired / Retirado: suspender usuario completo
-    STATUS_WITHDRAWN = frozenset({"Withdrawn", "Retired", "Retirado"})
     if status in STATUS_WITHDRAWN:
         try:
             update_moodle_user_suspended(moodle_user_id, 1)
@@ -220,6 +241,8 @@ def sync_student_status_to_moodle(doc, method=None):
                 title="Moodle sync student status",
                 message=f"Student {doc.name} | status={status!r} | Error al suspender usuario: {e}",
             )
+            if raise_errors:
+                raise
         return
 
     # Active, LOA, Inactive, Suspended, etc.: usuario activo; matrículas según status
@@ -230,6 +253,8 @@ def sync_student_status_to_moodle(doc, method=None):
             title="Moodle sync student status",
             message=f"Student {doc.name} | Error al reactivar usuario: {e}",
         )
+        if raise_errors:
+            raise
         return
 
     # Sincronizar matrículas: Active = reactivar, otros = suspender
@@ -240,20 +265,21 @@ def sync_student_status_to_moodle(doc, method=None):
         moodle_user_id=moodle_user_id,
         suspend=suspend_enrolments,
     )
-    _sync_student_course_enrolments_status(
+    failed = _sync_student_course_enrolments_status(
         student=doc.name,
         moodle_user_id=moodle_user_id,
         suspend=suspend_enrolments,
     )
+    if failed and raise_errors:
+        frappe.throw(
+            f"Moodle: no se pudo {'suspender' if suspend_enrolments else 'reactivar'} "
+            f"la matrícula en los cursos {failed}"
+        )
 
 
 def _log_moodle_sync_trace(msg: str, **kwargs):
-    """Registra traza de diagnóstico en Error Log para depurar LOA. Siempre activo."""
-    parts = [f"{k}={v}" for k, v in kwargs.items()]
-    frappe.log_error(
-        title=f"Moodle LOA trace: {msg}",
-        message=" | ".join(parts) if parts else msg,
-    )
+    """Traza de diagnóstico del sync de estado/LOA (tracing, no Error Log)."""
+    tracing.debug("moodle_sync", msg, **kwargs)
 
 
 def _sync_student_course_enrolments_status(
@@ -261,24 +287,23 @@ def _sync_student_course_enrolments_status(
     student: str,
     moodle_user_id: int,
     suspend: bool,
-) -> None:
+) -> list[int]:
     """
     Suspende o reactiva las matrículas de curso del estudiante en Moodle.
+    Retorna los IDs de curso que fallaron (vacío si todo OK).
 
     SUSPENDER (LOA):
       1. core_enrol_get_users_courses (cursos activos desde Moodle, incluye antiguos).
       2. Fallback: Course Enrollments de EdTools.
-      3. Guarda los IDs suspendidos en un Comment para poder reactivarlos después
+      3. Registra los IDs suspendidos en Moodle LOA Suspension para poder reactivarlos después
          (core_enrol solo devuelve matrículas activas; las suspendidas desaparecen).
 
     REACTIVAR (Active):
-      1. Lee los IDs guardados del Comment de la suspensión anterior.
+      1. Lee los IDs registrados en Moodle LOA Suspension por la suspensión anterior.
       2. Complementa con core_enrol_get_users_courses (por si hay nuevos cursos activos).
       3. Complementa con Course Enrollments de EdTools.
-      4. Reactiva todos, borra el Comment.
+      4. Reactiva todos y, si no hubo fallos, borra los registros de Moodle LOA Suspension.
     """
-    import json
-
     course_ids_to_update: list[int] = []
 
     if suspend:
@@ -336,145 +361,248 @@ def _sync_student_course_enrolments_status(
             student=student,
             suspend=suspend,
         )
-        return
+        return []
 
+    # Una llamada para todos los cursos (fallback fila por fila solo si Moodle rechaza el bloque)
     succeeded_ids: list[int] = []
-    for moodle_course_id in course_ids_to_update:
-        try:
-            result = suspend_user_enrolment_in_course(
-                user_id=moodle_user_id,
-                course_id=moodle_course_id,
-                suspend=1 if suspend else 0,
-            )
-            succeeded_ids.append(moodle_course_id)
-            _log_moodle_sync_trace(
-                "suspend_user_enrolment_in_course OK",
-                student=student,
-                moodle_course_id=moodle_course_id,
-                suspend=suspend,
-                result=str(result),
-            )
-        except Exception as e:
+    results = suspend_user_enrolments(
+        user_id=moodle_user_id,
+        course_ids=course_ids_to_update,
+        suspend=1 if suspend else 0,
+    )
+    for result in results:
+        moodle_course_id = result["course_id"]
+        if result.get("error"):
             frappe.log_error(
                 title="Moodle sync course enrolment status",
                 message=(
                     f"Student {student} | Moodle course id {moodle_course_id} | "
-                    f"suspend={suspend} | Error: {e}"
+                    f"suspend={suspend} | Error: {result['error']}"
                 ),
             )
+            continue
+        succeeded_ids.append(moodle_course_id)
+    _log_moodle_sync_trace(
+        "suspend_user_enrolments OK",
+        student=student,
+        suspend=suspend,
+        ok=len(succeeded_ids),
+        total=len(results),
+    )
 
+    failed_ids = [r["course_id"] for r in results if r.get("error")]
     if suspend and succeeded_ids:
+        # Solo agrega los que faltan: un reintento parcial no pierde cursos suspendidos antes
         _store_loa_course_ids(student, succeeded_ids)
-    elif not suspend:
+    elif not suspend and not failed_ids:
         _clear_loa_course_ids(student)
+    return failed_ids
 
 
-_LOA_COMMENT_MARKER = "moodle_loa_suspended_courses"
+LOA_SUSPENSION_DOCTYPE = "Moodle LOA Suspension"
 
 
 def _store_loa_course_ids(student: str, course_ids: list[int]) -> None:
-    """Persiste los IDs de cursos suspendidos como Comment en el Student."""
-    import json
-    _clear_loa_course_ids(student)
-    payload = json.dumps({_LOA_COMMENT_MARKER: course_ids})
-    frappe.get_doc({
-        "doctype": "Comment",
-        "comment_type": "Info",
-        "reference_doctype": "Student",
-        "reference_name": student,
-        "content": payload,
-    }).insert(ignore_permissions=True)
+    """Registra como suspendidos (LOA) los cursos Moodle que aún no lo estén para el Student.
+
+    Se hace commit de inmediato: la suspensión ya se aplicó en Moodle y no debe perderse aunque
+    el resto del sync falle y se haga rollback.
+    """
+    already = set(_get_stored_loa_course_ids(student))
+    now = now_datetime()
+    for course_id in dict.fromkeys(int(cid) for cid in course_ids):
+        if course_id in already:
+            continue
+        frappe.get_doc({
+            "doctype": LOA_SUSPENSION_DOCTYPE,
+            "student": student,
+            "moodle_course_id": course_id,
+            "status": "Suspended",
+            "suspended_on": now,
+        }).insert(ignore_permissions=True)
     frappe.db.commit()
 
 
 def _get_stored_loa_course_ids(student: str) -> list[int]:
-    """Recupera los IDs de cursos suspendidos guardados previamente."""
-    import json
-    comments = frappe.get_all(
-        "Comment",
-        filters={
-            "reference_doctype": "Student",
-            "reference_name": student,
-            "comment_type": "Info",
-            "content": ["like", f"%{_LOA_COMMENT_MARKER}%"],
-        },
-        fields=["content"],
-        order_by="creation desc",
-        limit=1,
-    )
-    if not comments:
-        return []
-    try:
-        data = json.loads(comments[0].content)
-        return [int(cid) for cid in data.get(_LOA_COMMENT_MARKER, [])]
-    except (json.JSONDecodeError, TypeError, ValueError):
-        return []
+    """IDs de cursos Moodle suspendidos por LOA y aún no reactivados (índice student + status)."""
+    return [
+        int(cid)
+        for cid in frappe.get_all(
+            LOA_SUSPENSION_DOCTYPE,
+            filters={"student": student, "status": "Suspended"},
+            pluck="moodle_course_id",
+            order_by="suspended_on asc",
+        )
+    ]
 
 
 def _clear_loa_course_ids(student: str) -> None:
-    """Elimina los Comments de cursos LOA suspendidos del Student."""
-    old = frappe.get_all(
-        "Comment",
-        filters={
-            "reference_doctype": "Student",
-            "reference_name": student,
-            "comment_type": "Info",
-            "content": ["like", f"%{_LOA_COMMENT_MARKER}%"],
-        },
-        fields=["name"],
+    """Marca como reactivadas las suspensiones abiertas del Student (se conserva el historial)."""
+    if not _get_stored_loa_course_ids(student):
+        return
+    frappe.db.set_value(
+        LOA_SUSPENSION_DOCTYPE,
+        {"student": student, "status": "Suspended"},
+        {"status": "Reactivated", "reactivated_on": now_datetime()},
+        update_modified=False,
     )
-    for c in old:
-        frappe.delete_doc("Comment", c.name, ignore_permissions=True, force=True)
-    if old:
-        frappe.db.commit()
+    frappe.db.commit()
 
 
 def _get_moodle_course_ids_from_edtools_enrollments(student: str) -> List[int]:
-    """Obtiene los moodle_course_id a partir de los Course Enrollments de EdTools."""
+    """Obtiene los moodle_course_id a partir de los Course Enrollments de EdTools.
+
+    Usa `Course Enrollment.moodle_course_id` (guardado al matricular); solo busca en Moodle
+    los registros que aún no lo tienen, y lo persiste para la próxima vez.
+    """
+    has_course_id = _has_field("Course Enrollment", "moodle_course_id")
+    fields = ["name", "course", "program_enrollment"]
+    if _has_field("Course Enrollment", "custom_academic_term"):
+        fields.append("custom_academic_term")
+    if has_course_id:
+        fields.append("moodle_course_id")
     ce_list = frappe.get_all(
         "Course Enrollment",
         filters={"student": student},
-        fields=["course", "program_enrollment", "custom_academic_term"],
+        fields=fields,
     )
     if not ce_list:
         return []
 
-    ce_meta = frappe.get_meta("Course Enrollment")
-    has_custom_term = ce_meta.has_field("custom_academic_term") if ce_meta else False
-
     ids = []
     for ce in ce_list:
-        academic_term = None
-        if has_custom_term and ce.get("custom_academic_term"):
-            academic_term = ce.get("custom_academic_term")
-        elif ce.get("program_enrollment"):
-            academic_term = frappe.db.get_value(
-                "Program Enrollment", ce.program_enrollment, "academic_term"
+        moodle_course_id = cint(ce.get("moodle_course_id")) or None
+        if moodle_course_id is None:
+            moodle_course_id = find_moodle_course_for_enrollment(
+                course_name=ce.course,
+                academic_term=_get_course_enrollment_term(ce),
             )
-        moodle_course_id = find_moodle_course_for_enrollment(
-            course_name=ce.course,
-            academic_term=academic_term,
-        )
-        if moodle_course_id is not None:
+            if moodle_course_id is not None and has_course_id:
+                frappe.db.set_value(
+                    "Course Enrollment", ce.name, "moodle_course_id", moodle_course_id, update_modified=False
+                )
+        if moodle_course_id is not None and moodle_course_id not in ids:
             ids.append(moodle_course_id)
     return ids
 
 
+def _get_course_enrollment_term(ce) -> str | None:
+    """Periodo del Course Enrollment: custom_academic_term o el del Program Enrollment."""
+    if ce.get("custom_academic_term"):
+        return ce.get("custom_academic_term")
+    if ce.get("program_enrollment"):
+        return frappe.db.get_value("Program Enrollment", ce.program_enrollment, "academic_term")
+    return None
+
+
+# ---------------------------------------------------------------------
+# IDs de Moodle persistidos (Course Enrollment.moodle_course_id, Student.moodle_user_id)
+# ---------------------------------------------------------------------
+
+def _has_field(doctype: str, fieldname: str) -> bool:
+    meta = frappe.get_meta(doctype)
+    return bool(meta and meta.has_field(fieldname))
+
+
+def remember_student_moodle_user_id(student: str, moodle_user_id: int | None) -> None:
+    """Guarda Student.moodle_user_id si cambió (sin disparar hooks del Student)."""
+    if not moodle_user_id or not _has_field("Student", "moodle_user_id"):
+        return
+    current = cint(frappe.db.get_value("Student", student, "moodle_user_id"))
+    if current != int(moodle_user_id):
+        frappe.db.set_value("Student", student, "moodle_user_id", int(moodle_user_id), update_modified=False)
+
+
+def get_student_moodle_user_id(student: str, email: str | None = None) -> int | None:
+    """Student.moodle_user_id; si no está guardado, busca por email en Moodle y lo persiste."""
+    if _has_field("Student", "moodle_user_id"):
+        stored = cint(frappe.db.get_value("Student", student, "moodle_user_id"))
+        if stored:
+            return stored
+    if not email:
+        user = frappe.db.get_value("Student", student, "user")
+        email = frappe.db.get_value("User", user, "email") if user else None
+    if not email or not str(email).strip():
+        return None
+    moodle_user = get_user_by_email(email.strip().lower())
+    if not moodle_user:
+        return None
+    remember_student_moodle_user_id(student, int(moodle_user["id"]))
+    return int(moodle_user["id"])
+
+
+def backfill_moodle_course_ids() -> dict:
+    """Job: completa Course Enrollment.moodle_course_id en matrículas históricas.
+
+    Agrupa por (curso, periodo) para resolver cada curso de Moodle una sola vez.
+    """
+    if not _has_field("Course Enrollment", "moodle_course_id"):
+        return {"updated": 0, "not_found": 0}
+
+    fields = ["name", "course", "program_enrollment"]
+    if _has_field("Course Enrollment", "custom_academic_term"):
+        fields.append("custom_academic_term")
+    pending = frappe.get_all(
+        "Course Enrollment",
+        filters={"docstatus": ["<", 2], "moodle_course_id": ["in", [0, None]]},
+        fields=fields,
+    )
+
+    groups: dict[tuple, list[str]] = {}
+    for ce in pending:
+        groups.setdefault((ce.course, _get_course_enrollment_term(ce)), []).append(ce.name)
+
+    updated = not_found = 0
+    for (course, academic_term), names in groups.items():
+        try:
+            moodle_course_id = find_moodle_course_for_enrollment(course_name=course, academic_term=academic_term)
+        except Exception:
+            frappe.log_error(frappe.get_traceback(), f"Moodle ID backfill: {course} / {academic_term}")
+            moodle_course_id = None
+        if moodle_course_id is None:
+            not_found += len(names)
+            continue
+        frappe.db.set_value(
+            "Course Enrollment",
+            {"name": ["in", names]},
+            "moodle_course_id",
+            moodle_course_id,
+            update_modified=False,
+        )
+        updated += len(names)
+        frappe.db.commit()
+
+    return {"updated": updated, "not_found": not_found}
+
+
+def enqueue_moodle_id_backfill_job() -> None:
+    frappe.enqueue(
+        "edtools_core.moodle_sync.backfill_moodle_course_ids",
+        queue="long",
+        timeout=3600,
+        job_id="edtools_moodle_course_id_backfill",
+        deduplicate=True,
+    )
+
+
+@frappe.whitelist()
+def enqueue_moodle_id_backfill():
+    """Lanza manualmente el backfill de Course Enrollment.moodle_course_id."""
+    frappe.only_for(("System Manager", "Education Manager"))
+    enqueue_moodle_id_backfill_job()
+    return {"queued": True}
+
+
 # ---------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------
 
 def _get_term_start_date(academic_term: str) -> str:
     """
-    Obtiene la fecha de inicio del periodo académico.
+    Obtiene la fecha de inicio del periodo académico (metadatos cacheados).
     Devuelve string YYYY-MM-DD (requerido por Moodle)
     """
-    term = frappe.get_doc("Academic Term", academic_term)
-    if not term.term_start_date:
-        raise ValueError(
-            f"El Academic Term {academic_term} no tiene fecha de inicio"
-        )
-    return term.term_start_date.strftime("%Y-%m-%d")
+    return _get_term_meta_with_start(academic_term).start_ymd
 
 
 def _get_term_start_date_mdy(academic_term: str) -> str:
@@ -482,38 +610,43 @@ def _get_term_start_date_mdy(academic_term: str) -> str:
     Fecha de inicio en formato M/D/YY para el shortname del curso (formato cliente).
     Ej: 1/5/26
     """
-    term = frappe.get_doc("Academic Term", academic_term)
-    if not term.term_start_date:
+    return _get_term_meta_with_start(academic_term).start_mdy
+
+
+def _get_term_meta_with_start(academic_term: str):
+    term = get_term_meta(academic_term)
+    if not term:
+        frappe.throw(f"Academic Term {academic_term} no encontrado", frappe.DoesNotExistError)
+    if not term.start:
         raise ValueError(
             f"El Academic Term {academic_term} no tiene fecha de inicio"
         )
-    d = term.term_start_date
-    return f"{d.month}/{d.day}/{str(d.year)[2:]}"
+    return term
 
 
 # =====================================================================
 # Desmatriculación de Moodle
 # =====================================================================
 
+@moodle_operation("unenrol")
 def unenrol_student_from_moodle_course(
     *,
     student: str,
     course: str,
     academic_term: str | None = None,
+    moodle_course_id: int | None = None,
 ) -> dict:
     """Desmatricula un estudiante de un curso en Moodle.
 
     Pasos:
     1. Obtener email del estudiante (dominio @cucusa.org)
-    2. Buscar usuario en Moodle por email
-    3. Buscar curso en Moodle (prioridad: Course ID number)
+    2. Usuario Moodle: Student.moodle_user_id o búsqueda por email
+    3. Curso Moodle: `moodle_course_id` (del Course Enrollment) o búsqueda (prioridad: Course ID number)
     4. Verificar que el estudiante está matriculado
     5. Desmatricular
 
     Retorna dict con detalles del resultado para logging.
     """
-    from edtools_core.moodle_users import get_user_by_email
-
     student_doc = frappe.get_doc("Student", student)
     if not student_doc.user or not str(student_doc.user).strip():
         raise ValueError(f"El estudiante {student} no tiene User vinculado.")
@@ -531,8 +664,8 @@ def unenrol_student_from_moodle_course(
         "academic_term": academic_term,
     }
 
-    moodle_user = get_user_by_email(email)
-    if not moodle_user:
+    moodle_user_id = get_student_moodle_user_id(student, email)
+    if not moodle_user_id:
         log_details["status"] = "user_not_found"
         _log_moodle_unenrol(log_details)
         frappe.throw(
@@ -540,13 +673,13 @@ def unenrol_student_from_moodle_course(
             "Puede que el estudiante no exista en Moodle o que el correo no coincida."
         )
 
-    moodle_user_id = int(moodle_user["id"])
     log_details["moodle_user_id"] = moodle_user_id
 
-    moodle_course_id = find_moodle_course_for_enrollment(
-        course_name=course,
-        academic_term=academic_term,
-    )
+    if not moodle_course_id:
+        moodle_course_id = find_moodle_course_for_enrollment(
+            course_name=course,
+            academic_term=academic_term,
+        )
     if moodle_course_id is None:
         log_details["status"] = "course_not_found"
         _log_moodle_unenrol(log_details)
@@ -586,8 +719,8 @@ def unenrol_student_from_moodle_course(
 def on_course_enrollment_trash(doc, method=None):
     """doc_event on_trash para Course Enrollment: desmatricula automáticamente de Moodle.
 
-    Si Moodle no está configurado o falla, se registra el error
-    pero NO se bloquea la eliminación en EdTools.
+    La desmatrícula se registra en el Integration Outbox (se ejecuta en background con reintentos);
+    si Moodle no está configurado no se registra nada. NO bloquea la eliminación en EdTools.
     """
     sync_enabled = os.getenv("MOODLE_SYNC_STUDENT_STATUS")
     if sync_enabled is not None and str(sync_enabled).strip().lower() in ("0", "false", "no"):
@@ -603,37 +736,43 @@ def on_course_enrollment_trash(doc, method=None):
     except Exception:
         return
 
-    try:
-        result = unenrol_student_from_moodle_course(
-            student=doc.student,
-            course=doc.course,
-            academic_term=getattr(doc, "custom_academic_term", None) or getattr(doc, "academic_term", None),
-        )
-        frappe.logger().info(
-            f"Moodle unenrol (on_trash): Course Enrollment {doc.name} -> {result.get('status', result.get('message', ''))}"
-        )
-    except Exception as e:
-        frappe.log_error(
-            title="Moodle unenrol on Course Enrollment delete",
-            message=(
-                f"Course Enrollment: {doc.name}\n"
-                f"Student: {doc.student}\n"
-                f"Course: {doc.course}\n"
-                f"Error: {e}"
-            ),
-        )
-        frappe.msgprint(
-            f"Aviso: No se pudo desmatricular automáticamente de Moodle. "
-            f"Error: {e}<br>El registro en EdTools se eliminará de igual forma.",
-            indicator="orange",
-            alert=True,
-        )
+    from edtools_core.integration_outbox import enqueue_operation
+
+    academic_term = getattr(doc, "custom_academic_term", None) or getattr(doc, "academic_term", None)
+    enqueue_operation(
+        "moodle.unenrol",
+        f"unenrol:{doc.student}:{doc.course}:{academic_term or ''}",
+        {
+            "student": doc.student,
+            "course": doc.course,
+            "academic_term": academic_term,
+            "moodle_course_id": cint(doc.get("moodle_course_id")) or None,
+            "course_enrollment": doc.name,
+        },
+        reference_doctype="Student",
+        reference_name=doc.student,
+    )
 
 
-def _log_moodle_unenrol(details: dict):
-    """Registra un log detallado de la operación de desmatriculación en Moodle."""
-    import json
-    frappe.log_error(
-        title=f"Moodle Unenrol Log: {details.get('status', 'unknown')}",
-        message=json.dumps(details, indent=2, default=str),
+def run_outbox_unenrol(payload: dict) -> None:
+    """Handler del outbox para `moodle.unenrol` (idempotente: "no estaba matriculado" es éxito)."""
+    result = unenrol_student_from_moodle_course(
+        student=payload["student"],
+        course=payload["course"],
+        academic_term=payload.get("academic_term"),
+        moodle_course_id=payload.get("moodle_course_id"),
     )
+    frappe.logger().info(
+        f"Moodle unenrol (outbox): Course Enrollment {payload.get('course_enrollment')} -> "
+        f"{result.get('status', result.get('message', ''))}"
+    )
+
+
+_UNENROL_OK_STATUSES = frozenset({"unenrolled", "not_enrolled"})
+
+
+def _log_moodle_unenrol(details: dict):
+    """Traza de la desmatriculación (sin Error Log: los fallos reales se propagan como excepción)."""
+    status = details.get("status", "unknown")
+    log = tracing.info if status in _UNENROL_OK_STATUSES else tracing.warning
+    log("moodle_unenrol", status, **details)
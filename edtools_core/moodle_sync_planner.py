@@ -0,0 +1,453 @@
+"""
+Planificador (dry-run) de sincronizaciones con Moodle.
+
+Calcula, sin llamar a Moodle ni escribir en la BD, qué llamadas haría:
+
+- `sync_student_enrollment_to_moodle` (un estudiante/curso)
+- `prepare_moodle_course_for_enrollment_tool` (categorías + curso del Course Enrollment Tool)
+- `process_enrollments` (Course Enrollment Import)
+
+Resuelve lo que puede con lo que ya está local: árbol de categorías cacheado en Redis, Moodle
+Course Index (cursos), caché de usuarios Moodle por email y Course Enrollments existentes. Lo que
+depende de la respuesta de Moodle se marca como condicional ("hasta N llamadas"), y los recorridos
+de categorías completas (`_find_course_in_category_case_insensitive`) se marcan como fallback.
+
+La duración estimada usa la latencia media registrada por wsfunction (`moodle_metrics`, última
+hora); sin datos se usa `_DEFAULT_CALL_MS`. Las matrículas del import corren en paralelo
+(`get_import_concurrency`), así que su tiempo se divide entre los hilos.
+"""
+
+from collections import defaultdict
+from math import ceil
+from typing import Any, Dict, List, Optional
+
+import frappe
+
+_DEFAULT_CALL_MS = 400
+_METRICS_WINDOW_MINUTES = 60
+
+
+def _new_plan() -> Dict[str, Any]:
+    return {
+        "operations": [],
+        "warnings": [],
+        # Estado simulado compartido entre pasos (categorías/cursos "creados" en este plan)
+        "categories": {},
+        "courses": {},
+        "category_tree_fetched": False,
+    }
+
+
+def _add(
+    plan: Dict[str, Any],
+    wsfunction: str,
+    reason: str,
+    *,
+    calls: int = 1,
+    conditional: bool = False,
+    fallback: bool = False,
+    parallel: bool = False,
+) -> None:
+    if calls <= 0:
+        return
+    plan["operations"].append(
+        {
+            "wsfunction": wsfunction,
+            "reason": reason,
+            "calls": int(calls),
+            "conditional": conditional,
+            "fallback": fallback,
+            "parallel": parallel,
+        }
+    )
+
+
+# ------------------------------------------------------------
+# Categorías y cursos
+# ------------------------------------------------------------
+
+def _cached_category_tree(plan: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from edtools_core.moodle_integration import _CATEGORY_CACHE_KEY
+
+    tree = frappe.cache.get_value(_CATEGORY_CACHE_KEY)
+    if tree is None and not plan["category_tree_fetched"]:
+        plan["category_tree_fetched"] = True
+        _add(plan, "core_course_get_categories", "Árbol de categorías no está en caché")
+        plan["warnings"].append("Árbol de categorías no cacheado: no se puede saber si faltan categorías")
+    return tree
+
+
+def _plan_categories(plan: Dict[str, Any], academic_year: str, academic_term: str) -> Optional[Any]:
+    """Categorías año/término. Retorna el id de la categoría del término (o una marca si se crearía)."""
+    from edtools_core.academic_term_meta import parse_term_label
+
+    key = (str(academic_year), str(academic_term))
+    if key in plan["categories"]:
+        return plan["categories"][key]
+    # Mismo formato que exige _parse_academic_term (sin frappe.throw: el plan no debe fallar)
+    if not parse_term_label(str(academic_term or "")):
+        plan["warnings"].append(f"{academic_term}: formato de Academic Term no válido para Moodle")
+        plan["categories"][key] = None
+        return None
+
+    tree = _cached_category_tree(plan)
+    if tree is None:
+        plan["categories"][key] = None
+        return None
+
+    by_id = tree["by_id"]
+    year_id = next(
+        (cid for cid in tree["by_idnumber"].get(str(academic_year), []) if int(by_id[cid].get("parent") or 0) == 0),
+        None,
+    )
+    if year_id is None:
+        _add(plan, "core_course_create_categories", f"Crear categoría del año {academic_year}")
+        year_id = f"nueva:{academic_year}"
+    term_id = next(
+        (
+            cid
+            for cid in tree["by_idnumber"].get(str(academic_term), [])
+            if int(by_id[cid].get("parent") or 0) == year_id
+        ),
+        None,
+    )
+    if term_id is None:
+        _add(plan, "core_course_create_categories", f"Crear categoría del término {academic_term}")
+        term_id = f"nueva:{academic_term}"
+    plan["categories"][key] = term_id
+    return term_id
+
+
+def _plan_course(plan: Dict[str, Any], academic_term: str, course: str, term_category_id: Any) -> Optional[Any]:
+    """
+    Simula `ensure_course` con el índice local. Retorna el moodle_course_id conocido, una marca
+    "nuevo:..." si se crearía, o None si no se pudo calcular el payload.
+    """
+    from edtools_core.course_enrollment_moodle import build_moodle_course_payload
+    from edtools_core.moodle_course_index import _find_by_keys, _norm
+    from edtools_core.moodle_integration import get_child_category_ids, get_category
+
+    try:
+        payload = build_moodle_course_payload(str(academic_term), course)
+    except Exception as e:
+        plan["warnings"].append(f"{course} ({academic_term}): {e}")
+        return None
+    if payload["idnumber"] in plan["courses"]:
+        return plan["courses"][payload["idnumber"]]
+
+    label = f"{payload.get('course_shortcode') or course} ({academic_term})"
+    lookups = [
+        ("idnumber_key", _norm(payload["idnumber"])),
+        ("shortname_key", _norm(payload["idnumber"])),
+        ("shortname_key", _norm(payload["shortname"])),
+    ]
+    for calls, (field, value) in enumerate(lookups, 1):
+        found = _find_by_keys(field, [value])
+        if found:
+            _add(plan, "core_course_get_courses_by_field", f"Ubicar curso {label}", calls=calls)
+            plan["courses"][payload["idnumber"]] = found
+            return found
+
+    # Sin rastro en el índice: 3 búsquedas exactas + recorrido de la categoría y sus hermanas + creación
+    _add(plan, "core_course_get_courses_by_field", f"Buscar curso {label} (no está en el índice)", calls=3)
+    scan = 1
+    if isinstance(term_category_id, int):
+        current = get_category(term_category_id) or {}
+        siblings = get_child_category_ids(int(current.get("parent") or 0)) if current else []
+        scan = max(1, len(siblings))
+    _add(
+        plan,
+        "core_course_get_courses_by_field",
+        f"Recorrer categoría del término y hermanas buscando {label}",
+        calls=scan,
+        fallback=True,
+    )
+    _add(plan, "core_course_create_courses", f"Crear curso {label}")
+    plan["warnings"].append(f"{label}: no está en el Moodle Course Index; se recorrerán {scan} categoría(s)")
+    marker = f"nuevo:{payload['idnumber']}"
+    plan["courses"][payload["idnumber"]] = marker
+    return marker
+
+
+# ------------------------------------------------------------
+# Usuarios y matrículas
+# ------------------------------------------------------------
+
+def _cached_user(email: str) -> Optional[Dict[str, Any]]:
+    from edtools_core.moodle_users import _USER_CACHE_PREFIX, _normalize_email
+
+    return frappe.cache.get_value(f"{_USER_CACHE_PREFIX}{_normalize_email(email or '')}")
+
+
+def _plan_bulk_users(plan: Dict[str, Any], entries: List[tuple], label: str) -> int:
+    """Simula `_ensure_users`: entries [(key, fields)]. Retorna cuántos usuarios quedan por resolver."""
+    from edtools_core.moodle_users import _USER_LOOKUP_CHUNK
+
+    pending = []
+    for _key, fields in entries:
+        cached = _cached_user(fields["email"])
+        if not (cached and cached.get("idnumber") == fields["idnumber"]):
+            pending.append(fields["email"])
+    if not pending:
+        return 0
+    _add(
+        plan,
+        "core_user_get_users_by_field",
+        f"Buscar {len(pending)} {label} por email ({len(entries) - len(pending)} en caché)",
+        calls=ceil(len(set(pending)) / _USER_LOOKUP_CHUNK),
+    )
+    _add(plan, "core_user_update_users", f"Corregir idnumber de {label} (si difiere)", conditional=True)
+    _add(plan, "core_user_create_users", f"Crear {label} que no existan", conditional=True)
+    return len(pending)
+
+
+def _plan_instructors(plan: Dict[str, Any], student_group: Optional[str], label: str) -> None:
+    """Simula `enroll_moodle_instructors_from_student_group`."""
+    from edtools_core.moodle_users import _instructor_user_fields
+
+    _add(plan, "core_enrol_get_enrolled_users", f"Matriculados actuales de {label}")
+    if not student_group or not frappe.db.exists("Student Group", student_group):
+        return
+    instructors = frappe.get_all(
+        "Student Group Instructor",
+        filters={"parent": student_group, "parenttype": "Student Group"},
+        pluck="instructor",
+    )
+    entries = []
+    for name in dict.fromkeys(i for i in instructors if i):
+        try:
+            entries.append((name, _instructor_user_fields(frappe.get_doc("Instructor", name))))
+        except Exception as e:
+            plan["warnings"].append(f"Instructor {name}: {e}")
+    if not entries:
+        return
+    _plan_bulk_users(plan, entries, "instructor(es)")
+    _add(plan, "enrol_manual_enrol_users", f"Matricular instructores en {label} (si faltan)", conditional=True)
+
+
+# ------------------------------------------------------------
+# Resumen
+# ------------------------------------------------------------
+
+def _latency_by_wsfunction() -> Dict[str, float]:
+    from edtools_core.moodle_metrics import collect
+
+    try:
+        rows = collect(_METRICS_WINDOW_MINUTES, by_operation=False)
+    except Exception:
+        return {}
+    return {r["wsfunction"]: r["avg_ms"] for r in rows if r.get("avg_ms")}
+
+
+def summarize(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Agrupa el plan por wsfunction con duración estimada.
+
+    Retorna {"by_wsfunction": [...], "operations": [...], "warnings": [...],
+    "total_calls", "max_calls", "fallback_calls", "estimated_seconds", "max_estimated_seconds"}.
+    Las llamadas condicionales solo cuentan en los máximos.
+    """
+    from edtools_core.moodle_integration import get_import_concurrency
+
+    latency = _latency_by_wsfunction()
+    concurrency = max(1, get_import_concurrency())
+    grouped: Dict[str, Dict[str, Any]] = defaultdict(
+        lambda: {"calls": 0, "max_calls": 0, "fallback_calls": 0, "estimated_ms": 0.0, "max_estimated_ms": 0.0}
+    )
+    for op in plan["operations"]:
+        avg_ms = latency.get(op["wsfunction"], _DEFAULT_CALL_MS)
+        ms = op["calls"] * avg_ms / (concurrency if op["parallel"] else 1)
+        row = grouped[op["wsfunction"]]
+        row["avg_ms"] = avg_ms
+        row["measured"] = op["wsfunction"] in latency
+        row["max_calls"] += op["calls"]
+        row["max_estimated_ms"] += ms
+        if op["fallback"]:
+            row["fallback_calls"] += op["calls"]
+        if not op["conditional"]:
+            row["calls"] += op["calls"]
+            row["estimated_ms"] += ms
+
+    by_wsfunction = [
+        {
+            "wsfunction": ws,
+            **row,
+            "estimated_ms": round(row["estimated_ms"], 1),
+            "max_estimated_ms": round(row["max_estimated_ms"], 1),
+        }
+        for ws, row in grouped.items()
+    ]
+    by_wsfunction.sort(key=lambda r: r["max_estimated_ms"], reverse=True)
+    return {
+        "by_wsfunction": by_wsfunction,
+        "operations": plan["operations"],
+        "warnings": plan["warnings"],
+        "total_calls": sum(r["calls"] for r in by_wsfunction),
+        "max_calls": sum(r["max_calls"] for r in by_wsfunction),
+        "fallback_calls": sum(r["fallback_calls"] for r in by_wsfunction),
+        "estimated_seconds": round(sum(r["estimated_ms"] for r in by_wsfunction) / 1000, 1),
+        "max_estimated_seconds": round(sum(r["max_estimated_ms"] for r in by_wsfunction) / 1000, 1),
+    }
+
+
+# ------------------------------------------------------------
+# Planes por operación
+# ------------------------------------------------------------
+
+def plan_course_preparation(academic_year: str, academic_term: str, course: str) -> Dict[str, Any]:
+    """Plan de `prepare_moodle_course_for_enrollment_tool`."""
+    plan = _new_plan()
+    term_category_id = _plan_categories(plan, academic_year, academic_term)
+    _plan_course(plan, academic_term, course, term_category_id)
+    return summarize(plan)
+
+
+def plan_enrollment_sync(*, student: str, academic_year: str, academic_term: str, course: str) -> Dict[str, Any]:
+    """Plan de `sync_student_enrollment_to_moodle` (usuario, categorías, curso y matrícula)."""
+    from edtools_core.moodle_users import _student_user_fields
+
+    plan = _new_plan()
+    student_doc = frappe.get_doc("Student", student)
+    if not student_doc.user:
+        plan["warnings"].append(f"El estudiante {student} no tiene User vinculado: la sincronización fallaría")
+        return summarize(plan)
+
+    # ensure_moodle_user siempre consulta por email (core_user_get_users), con o sin caché
+    _add(plan, "core_user_get_users", f"Buscar usuario de {student} por email")
+    try:
+        fields = _student_user_fields(student_doc)
+    except Exception as e:
+        plan["warnings"].append(f"{student}: {e}")
+        fields = None
+    cached = _cached_user(fields["email"]) if fields else None
+    if not cached:
+        _add(plan, "core_user_create_users", f"Crear usuario de {student} (si no existe)", conditional=True)
+    if not cached or cached.get("idnumber") != fields["idnumber"]:
+        _add(plan, "core_user_update_users", f"Corregir idnumber de {student} (si difiere)", conditional=True)
+
+    term_category_id = _plan_categories(plan, academic_year, academic_term)
+    _plan_course(plan, academic_term, course, term_category_id)
+    _add(plan, "enrol_manual_enrol_users", f"Matricular {student}")
+    return summarize(plan)
+
+
+def plan_enrollment_import(file_path: str, default_enrollment_date: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Plan de `process_enrollments` para un archivo: mismas validaciones y agrupación, sin crear
+    Student Groups, Course Enrollments ni nada en Moodle.
+
+    Además de la suma de llamadas retorna "groups" (curso/período con filas pendientes) y
+    "rows": {"pending", "duplicates", "errors"}.
+    """
+    from edtools_core.course_enrollment_import import (
+        _unique_preserve_order,
+        build_import_student_group_name,
+        coerce_enrollment_date_str,
+        get_unique_program_enrollment,
+        group_import_rows,
+        parse_import_file,
+        validate_import_format,
+    )
+    from edtools_core.grade_import import _resolve_file_path
+    from edtools_core.moodle_integration import _ENROL_CHUNK_SIZE
+    from edtools_core.moodle_users import _student_user_fields
+
+    ok, validation_errors = validate_import_format(file_path)
+    resolved = _resolve_file_path(file_path) if ok else None
+    if not resolved:
+        plan = _new_plan()
+        plan["warnings"] += [e.get("message", "") for e in validation_errors] or ["No se pudo leer el archivo."]
+        return {**summarize(plan), "groups": [], "rows": {"pending": 0, "duplicates": 0, "errors": len(validation_errors)}}
+
+    _col_index, data_rows = parse_import_file(resolved)
+    default_date = coerce_enrollment_date_str(default_enrollment_date) or frappe.utils.nowdate()
+    groups, row_errors = group_import_rows(data_rows, default_date)
+    has_custom_term = frappe.get_meta("Course Enrollment").has_field("custom_academic_term")
+
+    plan = _new_plan()
+    plan["warnings"] += [f"Fila {e['row']}: {e['message']}" for e in row_errors[:50]]
+    group_rows: List[Dict[str, Any]] = []
+    all_pending: List[str] = []
+    duplicates = errors = 0
+    for (course, year, term_label), rows in groups.items():
+        term_name = f"{year} ({term_label})"
+        label = f"{course} ({term_name})"
+        term_category_id = _plan_categories(plan, year, term_name)
+        moodle_course = _plan_course(plan, term_name, course, term_category_id)
+        sg_name = build_import_student_group_name(frappe.get_cached_doc("Course", course), year, term_label)
+        _plan_instructors(plan, sg_name, label)
+
+        pending = []
+        for student in dict.fromkeys(r[1] for r in rows):
+            pe_name, _pe_year, pe_err = get_unique_program_enrollment(student, year)
+            if pe_err or not pe_name:
+                errors += 1
+                continue
+            filters: Dict[str, Any] = {"student": student, "course": course, "docstatus": 1}
+            if has_custom_term:
+                filters["custom_academic_term"] = term_name
+            else:
+                filters["program_enrollment"] = pe_name
+            if frappe.db.exists("Course Enrollment", filters):
+                duplicates += 1
+                continue
+            pending.append(student)
+        if pending:
+            _add(
+                plan,
+                "enrol_manual_enrol_users",
+                f"Matricular {len(pending)} estudiante(s) en {label}",
+                calls=ceil(len(pending) / _ENROL_CHUNK_SIZE),
+                parallel=True,
+            )
+        all_pending += pending
+        group_rows.append(
+            {
+                "course": course,
+                "academic_term": term_name,
+                "student_group": sg_name,
+                "moodle_course_id": moodle_course if isinstance(moodle_course, int) else None,
+                "creates_course": isinstance(moodle_course, str),
+                "rows": len(rows),
+                "pending": len(pending),
+            }
+        )
+
+    entries = []
+    for student in _unique_preserve_order(all_pending):
+        try:
+            entries.append((student, _student_user_fields(frappe.get_doc("Student", student))))
+        except Exception as e:
+            plan["warnings"].append(f"{student}: {e}")
+    _plan_bulk_users(plan, entries, "estudiante(s)")
+
+    return {
+        **summarize(plan),
+        "groups": group_rows,
+        "rows": {"pending": len(all_pending), "duplicates": duplicates, "errors": len(row_errors) + errors},
+    }
+
+
+@frappe.whitelist()
+def get_sync_plan(action, **kwargs):
+    """
+    Plan (dry-run) de una acción de sincronización con Moodle.
+
+    action: "enrollment_sync" (student, academic_year, academic_term, course),
+    "course_preparation" (academic_year, academic_term, course) o
+    "enrollment_import" (file_path, default_enrollment_date).
+    """
+    frappe.only_for(("System Manager", "Education Manager"))
+    kwargs.pop("cmd", None)
+    if action == "enrollment_sync":
+        return plan_enrollment_sync(
+            student=kwargs.get("student"),
+            academic_year=kwargs.get("academic_year"),
+            academic_term=kwargs.get("academic_term"),
+            course=kwargs.get("course"),
+        )
+    if action == "course_preparation":
+        return plan_course_preparation(kwargs.get("academic_year"), kwargs.get("academic_term"), kwargs.get("course"))
+    if action == "enrollment_import":
+        return plan_enrollment_import(kwargs.get("file_path"), kwargs.get("default_enrollment_date"))
+    frappe.throw(f"Acción desconocida: {action}")
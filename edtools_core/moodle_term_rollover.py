@@ -0,0 +1,245 @@
+"""
+Term Rollover: pre-aprovisiona en Moodle todos los cursos de un Academic Term antes de matricular.
+
+Sin esto, la primera matrícula de cada curso (Course Enrollment Tool / import) crea el curso
+en Moodle mientras el operador espera. El rollover:
+
+1. Arma la lista de cursos: Student Groups del período (group_based_on = Course) o el plan
+   de un Program (Program Course).
+2. Asegura las categorías año/término una sola vez.
+3. Calcula el payload de cada curso (`build_moodle_course_payload`, mismo formato que la matrícula).
+4. Compara en bloque contra Moodle: una lectura de la categoría del término (que además refresca el
+   Moodle Course Index) y, para lo que falte, el índice local (cursos en otra categoría).
+5. Crea los faltantes con `create_courses` (varios cursos por llamada).
+
+Corre como job en background; progreso en el Single "Moodle Term Rollover" y por realtime
+(`moodle_term_rollover_progress`).
+"""
+
+from typing import Any, Dict, List, Optional
+
+import frappe
+from frappe.utils import now_datetime
+
+SETTINGS_DOCTYPE = "Moodle Term Rollover"
+_JOB_ID = "edtools_moodle_term_rollover"
+_PROGRESS_EVENT = "moodle_term_rollover_progress"
+
+
+def _job_active() -> bool:
+    """True si hay un rollover en la cola o corriendo."""
+    from frappe.utils.background_jobs import is_job_enqueued
+
+    return is_job_enqueued(_JOB_ID)
+
+
+def get_rollover_courses(academic_term: str, source: str = "Student Groups", program: Optional[str] = None) -> List[str]:
+    """Courses a aprovisionar: de los Student Groups del período o del plan de un Program."""
+    if source == "Program":
+        if not program:
+            frappe.throw("Selecciona un Program")
+        courses = frappe.get_all(
+            "Program Course",
+            filters={"parent": program, "parenttype": "Program"},
+            pluck="course",
+            order_by="idx asc",
+        )
+    else:
+        courses = frappe.get_all(
+            "Student Group",
+            filters={"academic_term": academic_term, "group_based_on": "Course", "disabled": 0},
+            pluck="course",
+        )
+    return list(dict.fromkeys(c for c in courses if c))
+
+
+def _progress(step: str, done: int, total: int, user: Optional[str]) -> None:
+    percent = round(done * 100 / total, 1) if total else 100
+    frappe.db.set_single_value(SETTINGS_DOCTYPE, {"progress": percent, "progress_message": step})
+    frappe.db.commit()
+    frappe.publish_realtime(
+        _PROGRESS_EVENT,
+        {"progress": percent, "message": step, "done": done, "total": total},
+        user=user,
+    )
+
+
+def _existing_by_key(courses: List[Dict[str, Any]]) -> Dict[str, int]:
+    """{clave normalizada (idnumber/shortname): moodle_course_id}"""
+    from edtools_core.moodle_course_index import _norm
+
+    out: Dict[str, int] = {}
+    for c in courses:
+        if c.get("id") is None:
+            continue
+        for value in (c.get("idnumber"), c.get("shortname")):
+            key = _norm(value)
+            if key:
+                out.setdefault(key, int(c["id"]))
+    return out
+
+
+def plan_rollover(academic_term: str, courses: List[str]) -> Dict[str, Any]:
+    """
+    Calcula qué cursos existen y cuáles faltan en Moodle (asegura las categorías del período).
+
+    Retorna {"term_category_id", "existing": {course: moodle_id}, "missing": [payload], "errors": {course: msg}}
+    """
+    from edtools_core.course_enrollment_moodle import build_moodle_course_payload, get_term_dates
+    from edtools_core.moodle_course_index import _find_by_keys, _norm
+    from edtools_core.moodle_integration import (
+        _fetch_category_courses,
+        ensure_academic_term_category,
+        ensure_academic_year_category,
+    )
+
+    from edtools_core.academic_term_meta import get_term_meta
+
+    academic_year = (get_term_meta(academic_term) or {}).get("academic_year")
+    if not academic_year:
+        frappe.throw(f"El Academic Term {academic_term} no tiene Academic Year")
+    year_category_id = ensure_academic_year_category(str(academic_year))
+    term_category_id = ensure_academic_term_category(
+        academic_term_label=str(academic_term),
+        parent_year_category_id=year_category_id,
+    )
+
+    term_dates = get_term_dates(academic_term)
+    in_category = _existing_by_key(_fetch_category_courses(term_category_id))
+
+    existing: Dict[str, int] = {}
+    missing: List[Dict[str, Any]] = []
+    errors: Dict[str, str] = {}
+    for course in courses:
+        try:
+            payload = build_moodle_course_payload(academic_term, course, term_dates=term_dates)
+        except Exception as e:
+            errors[course] = str(e)
+            continue
+        keys = [_norm(payload["idnumber"]), _norm(payload["shortname"])]
+        moodle_id = next((in_category[k] for k in keys if k in in_category), None)
+        if moodle_id is None:
+            # En otra categoría (ensure_course también lo reutilizaría): índice local, sin API
+            moodle_id = _find_by_keys("idnumber_key", keys[:1]) or _find_by_keys("shortname_key", keys)
+        if moodle_id:
+            existing[course] = int(moodle_id)
+        else:
+            missing.append({**payload, "categoryid": term_category_id})
+    return {"term_category_id": term_category_id, "existing": existing, "missing": missing, "errors": errors}
+
+
+def run_rollover(academic_term: str, courses: List[str], user: Optional[str] = None) -> Dict[str, Any]:
+    """Job: aprovisiona los cursos del período; guarda resumen y log en el Single."""
+    from edtools_core.moodle_integration import create_courses
+    from edtools_core.moodle_metrics import moodle_operation
+
+    frappe.db.set_single_value(
+        SETTINGS_DOCTYPE,
+        {"status": "Running", "started_on": now_datetime(), "finished_on": None, "log": ""},
+    )
+    _progress("Comparando con Moodle", 0, len(courses), user)
+    log: List[str] = []
+    try:
+        with moodle_operation("term_rollover"):
+            plan = plan_rollover(academic_term, courses)
+            missing = plan["missing"]
+            log += [f"ERROR {course}: {msg}" for course, msg in plan["errors"].items()]
+            log += [f"Existe {course}: id={cid}" for course, cid in plan["existing"].items()]
+
+            created = failed = 0
+            done = len(plan["existing"]) + len(plan["errors"])
+            _progress(f"Creando {len(missing)} curso(s)", done, len(courses), user)
+            # Bloques del tamaño de una llamada para reportar progreso entre llamadas
+            from edtools_core.moodle_integration import _CREATE_COURSES_CHUNK_SIZE
+
+            for start in range(0, len(missing), _CREATE_COURSES_CHUNK_SIZE):
+                chunk = missing[start : start + _CREATE_COURSES_CHUNK_SIZE]
+                results = create_courses(
+                    [
+                        {k: p[k] for k in ("fullname", "shortname", "categoryid", "idnumber", "startdate", "enddate")}
+                        for p in chunk
+                    ]
+                )
+                for payload, result in zip(chunk, results):
+                    if result.get("error"):
+                        failed += 1
+                        log.append(f"ERROR {payload['course']}: {result['error']}")
+                    else:
+                        created += 1
+                        log.append(f"Creado {payload['course']}: id={result['id']}")
+                frappe.db.commit()
+                done += len(chunk)
+                _progress(f"Creados {created} de {len(missing)}", done, len(courses), user)
+    except Exception:
+        frappe.db.rollback()
+        frappe.log_error(title="Moodle Term Rollover", message=frappe.get_traceback())
+        log.append(frappe.get_traceback())
+        frappe.db.set_single_value(
+            SETTINGS_DOCTYPE,
+            {"status": "Failed", "finished_on": now_datetime(), "log": "\n".join(log)[-60000:]},
+        )
+        frappe.db.commit()
+        frappe.publish_realtime(_PROGRESS_EVENT, {"progress": 100, "message": "Error", "failed": True}, user=user)
+        raise
+
+    summary = {
+        "courses": len(courses),
+        "existing": len(plan["existing"]),
+        "created": created,
+        "failed": failed + len(plan["errors"]),
+    }
+    frappe.db.set_single_value(
+        SETTINGS_DOCTYPE,
+        {
+            "status": "Completed" if not summary["failed"] else "Completed with Errors",
+            "finished_on": now_datetime(),
+            "total_courses": summary["courses"],
+            "existing_courses": summary["existing"],
+            "created_courses": summary["created"],
+            "failed_courses": summary["failed"],
+            "log": "\n".join(log)[-60000:],
+        },
+    )
+    frappe.db.commit()
+    _progress("Terminado", len(courses), len(courses), user)
+    return summary
+
+
+@frappe.whitelist()
+def start_rollover(academic_term, source="Student Groups", program=None):
+    """Encola el rollover del período. Retorna la cantidad de cursos a revisar."""
+    frappe.only_for(("System Manager", "Education Manager"))
+    if not academic_term:
+        frappe.throw("Academic Term es obligatorio")
+    # Antes de tocar el Single: el deduplicate del enqueue omitiría el job nuevo, pero el progreso
+    # del rollover en curso ya habría quedado en cero
+    if _job_active():
+        frappe.throw("Ya hay un rollover en curso")
+    courses = get_rollover_courses(academic_term, source, program)
+    if not courses:
+        frappe.throw("No hay cursos para aprovisionar con esos criterios")
+
+    frappe.db.set_single_value(
+        SETTINGS_DOCTYPE,
+        {
+            "status": "Queued",
+            "progress": 0,
+            "progress_message": "",
+            "total_courses": len(courses),
+            "existing_courses": 0,
+            "created_courses": 0,
+            "failed_courses": 0,
+        },
+    )
+    frappe.enqueue(
+        "edtools_core.moodle_term_rollover.run_rollover",
+        queue="long",
+        timeout=3600,
+        job_id=_JOB_ID,
+        deduplicate=True,
+        enqueue_after_commit=True,
+        academic_term=academic_term,
+        courses=courses,
+        user=frappe.session.user,
+    )
+    return {"courses": len(courses)}
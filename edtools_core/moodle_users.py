@@ -1,9 +1,10 @@
 # edtools_core/moodle_users.py
 
 import os
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 import frappe
 
+from edtools_core import tracing
 from edtools_core.moodle_integration import _moodle_post
 
 
@@ -141,6 +142,8 @@ def get_user_by_email(email: str) -> Optional[Dict]:
         )
     
     users = response.get("users", [])
+    if users:
+        _cache_user(users[0])
     return users[0] if users else None
 
 
@@ -151,28 +154,7 @@ def create_moodle_user(student) -> Dict:
     - username: correo electrónico completo (no solo la parte antes del @).
     Con auth=manual se crea contraseña y se envía por correo; con oidc el usuario inicia sesión por el IdP.
     """
-    email = _get_student_email(student)
-    username = email  # Usar el correo completo como nombre de usuario
-    auth = _get_moodle_user_auth()
-
-    firstname = _build_firstname(
-        student.first_name,
-        getattr(student, "middle_name", None)
-    )
-
-    payload = {
-        "users[0][username]": username,
-        "users[0][auth]": auth,
-        "users[0][firstname]": firstname,
-        "users[0][lastname]": student.last_name,
-        "users[0][email]": email,
-        "users[0][idnumber]": _get_student_idnumber(student),
-        "users[0][lang]": "es",
-        "users[0][timezone]": "99",
-        "users[0][mailformat]": 1,
-    }
-    if auth == "manual":
-        payload["users[0][createpassword]"] = 1
+    payload = _users_payload([_student_user_fields(student)])
 
     response = _moodle_post(
         wsfunction="core_user_create_users",
@@ -186,6 +168,34 @@ def create_moodle_user(student) -> Dict:
     return response[0]
 
 
+def _student_user_fields(student) -> Dict:
+    """Campos de core_user_create_users para un estudiante (username = email completo)."""
+    email = _get_student_email(student)
+    fields = {
+        "username": email,  # Usar el correo completo como nombre de usuario
+        "auth": _get_moodle_user_auth(),
+        "firstname": _build_firstname(student.first_name, getattr(student, "middle_name", None)),
+        "lastname": student.last_name,
+        "email": email,
+        "idnumber": _get_student_idnumber(student),
+        "lang": "es",
+        "timezone": "99",
+        "mailformat": 1,
+    }
+    if fields["auth"] == "manual":
+        fields["createpassword"] = 1
+    return fields
+
+
+def _users_payload(users: List[Dict]) -> Dict:
+    """[{campo: valor}] -> users[i][campo] (core_user_create_users / core_user_update_users)."""
+    payload = {}
+    for i, fields in enumerate(users):
+        for key, value in fields.items():
+            payload[f"users[{i}][{key}]"] = value
+    return payload
+
+
 def update_user_idnumber(user_id: int, new_idnumber: str) -> None:
     """
     Actualiza únicamente el campo idnumber (Número de ID)
@@ -242,20 +252,11 @@ def ensure_moodle_user(student) -> Dict:
 
     # Caso 1: no existe → crear
     if not user:
-        frappe.log_error(
-            title="Moodle: crear usuario",
-            message=f"Estudiante {student.name} | Email {email} no existe en Moodle → creando usuario."
-        )
+        tracing.info("moodle_users", "crear usuario", student=student.name, email=email)
         return create_moodle_user(student)
 
     # Caso 2: existe en Moodle (mismo email) → reutilizar, no se crea uno nuevo
-    frappe.log_error(
-        title="Moodle: reutilizar usuario",
-        message=(
-            f"Estudiante {student.name} | Email {email} ya existe en Moodle (id={user.get('id')}). "
-            "No se crea usuario nuevo; se usa el existente. Si esperabas uno nuevo, verifica que el User del estudiante tenga un email distinto a los ya registrados en Moodle."
-        ),
-    )
+    tracing.debug("moodle_users", "reutilizar usuario", student=student.name, email=email, moodle_user_id=user.get("id"))
     # Caso 2: validar idnumber
     current_idnumber = (user.get("idnumber") or "").strip()
     expected_idnumber = _get_student_idnumber(student)
@@ -282,26 +283,7 @@ def create_moodle_user_instructor(instructor) -> Dict:
     - username: correo electrónico completo (no solo la parte antes del @).
     Con auth=manual se crea contraseña y se envía por correo; con oidc el usuario inicia sesión por el IdP.
     """
-    email = _get_instructor_email(instructor)
-    username = email  # Usar el correo completo como nombre de usuario
-    auth = _get_moodle_user_auth()
-    firstname, lastname = _parse_instructor_name(
-        getattr(instructor, "instructor_name", None) or ""
-    )
-
-    payload = {
-        "users[0][username]": username,
-        "users[0][auth]": auth,
-        "users[0][firstname]": firstname,
-        "users[0][lastname]": lastname,
-        "users[0][email]": email,
-        "users[0][idnumber]": _get_instructor_idnumber(instructor),
-        "users[0][lang]": "es",
-        "users[0][timezone]": "99",
-        "users[0][mailformat]": 1,
-    }
-    if auth == "manual":
-        payload["users[0][createpassword]"] = 1
+    payload = _users_payload([_instructor_user_fields(instructor)])
 
     response = _moodle_post(
         wsfunction="core_user_create_users",
@@ -314,6 +296,28 @@ def create_moodle_user_instructor(instructor) -> Dict:
     return response[0]
 
 
+def _instructor_user_fields(instructor) -> Dict:
+    """Campos de core_user_create_users para un instructor (username = email completo)."""
+    email = _get_instructor_email(instructor)
+    firstname, lastname = _parse_instructor_name(
+        getattr(instructor, "instructor_name", None) or ""
+    )
+    fields = {
+        "username": email,  # Usar el correo completo como nombre de usuario
+        "auth": _get_moodle_user_auth(),
+        "firstname": firstname,
+        "lastname": lastname,
+        "email": email,
+        "idnumber": _get_instructor_idnumber(instructor),
+        "lang": "es",
+        "timezone": "99",
+        "mailformat": 1,
+    }
+    if fields["auth"] == "manual":
+        fields["createpassword"] = 1
+    return fields
+
+
 def ensure_moodle_user_instructor(instructor) -> Dict:
     """
     Garantiza que el instructor tenga usuario en Moodle.
@@ -338,6 +342,225 @@ def ensure_moodle_user_instructor(instructor) -> Dict:
     return user
 
 
+# ------------------------------------------------------------
+# Resolución masiva (imports / grupos completos)
+# ------------------------------------------------------------
+
+# Valores por llamada a core_user_get_users_by_field (límite práctico de la URL/POST en Moodle).
+_USER_LOOKUP_CHUNK = 100
+# Caché email -> {"id", "idnumber"} de usuarios ya resueltos (evita la consulta en la siguiente matrícula).
+_USER_CACHE_PREFIX = "edtools_moodle_user::"
+_USER_CACHE_TTL = 86400
+
+
+def _cache_user(user: Dict) -> None:
+    email = _normalize_email(user.get("email") or "")
+    if email and user.get("id"):
+        frappe.cache.set_value(
+            f"{_USER_CACHE_PREFIX}{email}",
+            {"id": int(user["id"]), "email": email, "idnumber": (user.get("idnumber") or "").strip()},
+            expires_in_sec=_USER_CACHE_TTL,
+        )
+
+
+def get_cached_moodle_user_id(email: str) -> Optional[int]:
+    """moodle user id cacheado para el email (None si no se ha resuelto recientemente)."""
+    cached = frappe.cache.get_value(f"{_USER_CACHE_PREFIX}{_normalize_email(email or '')}")
+    return int(cached["id"]) if cached else None
+
+
+def get_users_by_emails(emails: List[str]) -> Dict[str, Dict]:
+    """
+    Busca muchos usuarios por email con core_user_get_users_by_field (bloques de 100 valores).
+    Retorna {email_normalizado: usuario}; los que no existen en Moodle no aparecen.
+    """
+    wanted = list(dict.fromkeys(_normalize_email(e) for e in emails if e and e.strip()))
+    found: Dict[str, Dict] = {}
+    for start in range(0, len(wanted), _USER_LOOKUP_CHUNK):
+        chunk = wanted[start : start + _USER_LOOKUP_CHUNK]
+        payload = {"field": "email"}
+        for i, email in enumerate(chunk):
+            payload[f"values[{i}]"] = email
+        response = _moodle_post(wsfunction="core_user_get_users_by_field", data=payload)
+        if isinstance(response, dict) and response.get("exception"):
+            frappe.throw(
+                f"Error de API Moodle en 'core_user_get_users_by_field': "
+                f"{response.get('message')} ({response.get('errorcode')})"
+            )
+        for user in response or []:
+            email = _normalize_email(user.get("email") or "")
+            if email and email not in found:
+                found[email] = user
+                _cache_user(user)
+    return found
+
+
+def create_moodle_users(users: List[Dict]) -> Dict[str, Dict]:
+    """
+    Crea varios usuarios en una llamada a core_user_create_users.
+    Si Moodle rechaza el lote (un usuario inválido revierte todos), reintenta uno por uno.
+
+    Retorna {email: usuario creado | {"error": mensaje}}.
+    """
+    if not users:
+        return {}
+    out: Dict[str, Dict] = {}
+    response = _moodle_post(wsfunction="core_user_create_users", data=_users_payload(users))
+    if isinstance(response, list):
+        # Moodle retorna [{id, username}]; username == email
+        fields_by_username = {fields["username"]: fields for fields in users}
+        for created in response:
+            fields = fields_by_username.get(created.get("username"))
+            if fields:
+                user = {**fields, "id": int(created["id"])}
+                _cache_user(user)
+                out[fields["email"]] = user
+        return out
+
+    for fields in users:
+        if len(users) == 1:
+            single = response
+        else:
+            single = _moodle_post(wsfunction="core_user_create_users", data=_users_payload([fields]))
+        if isinstance(single, list) and single:
+            user = {**fields, "id": int(single[0]["id"])}
+            _cache_user(user)
+            out[fields["email"]] = user
+        else:
+            message = single.get("message") if isinstance(single, dict) else str(single)
+            out[fields["email"]] = {"error": f"Moodle error (create_user): {message}"}
+    return out
+
+
+def update_users_idnumbers(changes: List[tuple]) -> None:
+    """Corrige idnumber de varios usuarios en una llamada. changes: [(user_id, idnumber)]."""
+    if not changes:
+        return
+    response = _moodle_post(
+        wsfunction="core_user_update_users",
+        data=_users_payload([{"id": int(uid), "idnumber": idnumber} for uid, idnumber in changes]),
+    )
+    if isinstance(response, dict) and response.get("exception"):
+        frappe.throw(f"Moodle error (update_user): {response.get('message')}")
+
+
+def update_users_suspended(changes: List[tuple]) -> Dict[int, str]:
+    """
+    Suspende/reactiva varios usuarios con core_user_update_users (bloques de 100).
+
+    changes: [(user_id, suspended)]. Si Moodle rechaza un bloque, se reintenta usuario por usuario
+    para aislar el error. Retorna {user_id: error} de los que fallaron (vacío si todo OK).
+    """
+    failed: Dict[int, str] = {}
+    for start in range(0, len(changes), _USER_LOOKUP_CHUNK):
+        chunk = changes[start : start + _USER_LOOKUP_CHUNK]
+        response = _moodle_post(
+            wsfunction="core_user_update_users",
+            data=_users_payload([{"id": int(uid), "suspended": int(suspended)} for uid, suspended in chunk]),
+        )
+        if not (isinstance(response, dict) and response.get("exception")):
+            continue
+        if len(chunk) == 1:
+            failed[int(chunk[0][0])] = f"Moodle error (update_user suspended): {response.get('message')}"
+            continue
+        for uid, suspended in chunk:
+            try:
+                update_moodle_user_suspended(int(uid), suspended)
+            except Exception as e:
+                failed[int(uid)] = str(e)
+    return failed
+
+
+def _ensure_users(entries: List[tuple], *, refresh: bool = False) -> Dict[str, Dict]:
+    """
+    Núcleo de ensure_moodle_users / ensure_moodle_users_instructor.
+
+    entries: [(key, fields_de_creación)]. Con usuarios cacheados cuyo idnumber coincide no se consulta
+    Moodle; el resto se resuelve en ~3 llamadas: búsqueda por email, creación y corrección de idnumber.
+    refresh=True descarta la caché de esos emails (el id cacheado ya no existe en Moodle).
+    """
+    out: Dict[str, Dict] = {}
+    pending: List[tuple] = []
+    for key, fields in entries:
+        if refresh:
+            frappe.cache.delete_value(f"{_USER_CACHE_PREFIX}{fields['email']}")
+            pending.append((key, fields))
+            continue
+        cached = frappe.cache.get_value(f"{_USER_CACHE_PREFIX}{fields['email']}")
+        if cached and cached.get("idnumber") == fields["idnumber"]:
+            out[key] = {"user": cached}
+        else:
+            pending.append((key, fields))
+    if not pending:
+        return out
+
+    existing = get_users_by_emails([fields["email"] for _key, fields in pending])
+
+    to_create: Dict[str, Dict] = {}
+    idnumber_changes: List[tuple] = []
+    for key, fields in pending:
+        user = existing.get(fields["email"])
+        if not user:
+            to_create.setdefault(fields["email"], fields)
+            continue
+        if (user.get("idnumber") or "").strip() != fields["idnumber"]:
+            idnumber_changes.append((int(user["id"]), fields["idnumber"]))
+            user["idnumber"] = fields["idnumber"]
+        out[key] = {"user": user}
+
+    if idnumber_changes:
+        try:
+            update_users_idnumbers(idnumber_changes)
+            for key, _fields in pending:
+                if out.get(key):
+                    _cache_user(out[key]["user"])
+        except Exception as e:
+            # El usuario existe igual; se registra y se sigue (igual que antes no bloquea la matrícula)
+            frappe.log_error(title="Moodle: update idnumber masivo", message=f"{idnumber_changes[:20]}: {e}")
+
+    created = create_moodle_users(list(to_create.values()))
+    for key, fields in pending:
+        if key in out:
+            continue
+        user = created.get(fields["email"]) or {"error": "Usuario no creado en Moodle"}
+        out[key] = {"error": user["error"]} if user.get("error") else {"user": user}
+    return out
+
+
+def ensure_moodle_users(students: List, *, refresh: bool = False) -> Dict[str, Dict]:
+    """
+    Variante masiva de `ensure_moodle_user`: Student docs -> {student.name: {"user": ...} | {"error": ...}}.
+    Además guarda Student.moodle_user_id. refresh=True ignora la caché de usuarios (ver `_ensure_users`).
+    """
+    from edtools_core.moodle_sync import remember_student_moodle_user_id
+
+    out: Dict[str, Dict] = {}
+    entries = []
+    for student in students:
+        try:
+            entries.append((student.name, _student_user_fields(student)))
+        except Exception as e:
+            out[student.name] = {"error": str(e)}
+    out.update(_ensure_users(entries, refresh=refresh))
+    for name, result in out.items():
+        if result.get("user"):
+            remember_student_moodle_user_id(name, int(result["user"]["id"]))
+    return out
+
+
+def ensure_moodle_users_instructor(instructors: List, *, refresh: bool = False) -> Dict[str, Dict]:
+    """Variante masiva de `ensure_moodle_user_instructor`: {instructor.name: {"user"} | {"error"}}."""
+    out: Dict[str, Dict] = {}
+    entries = []
+    for instructor in instructors:
+        try:
+            entries.append((instructor.name, _instructor_user_fields(instructor)))
+        except Exception as e:
+            out[instructor.name] = {"error": str(e)}
+    out.update(_ensure_users(entries, refresh=refresh))
+    return out
+
+
 @frappe.whitelist()
 def manual_sync_student(student_id: str):
     """
@@ -358,16 +581,18 @@ def ensure_moodle_users_for_student_group_instructors(doc, method=None):
     """
     if not doc.get("instructors"):
         return
-    for row in doc.instructors:
-        if not row.get("instructor"):
-            continue
-        try:
-            instructor = frappe.get_doc("Instructor", row.instructor)
-            ensure_moodle_user_instructor(instructor)
-        except Exception as e:
+    names = list(dict.fromkeys(row.instructor for row in doc.instructors if row.get("instructor")))
+    if not names:
+        return
+    try:
+        results = ensure_moodle_users_instructor([frappe.get_doc("Instructor", n) for n in names])
+    except Exception as e:
+        results = {n: {"error": str(e)} for n in names}
+    for name, result in results.items():
+        if result.get("error"):
             frappe.log_error(
                 title="Moodle: error al asegurar usuario de instructor",
-                message=f"Student Group {doc.name} | Instructor {row.instructor}: {e}",
+                message=f"Student Group {doc.name} | Instructor {name}: {result['error']}",
             )
 
 
@@ -58,6 +58,24 @@ def queue_grade_entry(
 	)
 
 
+def pending_grade_notifications() -> dict[str, list[dict]]:
+	"""Copia del buffer (serializable a JSON) para guardarla en el checkpoint del Grade Import."""
+	return {student: [dict(entry) for entry in entries] for student, entries in _get_buffer().items()}
+
+
+def restore_grade_notifications(pending: dict[str, list[dict]] | None) -> None:
+	"""Vuelve a cargar en el buffer lo guardado con `pending_grade_notifications` (al reanudar)."""
+	for student, entries in (pending or {}).items():
+		for entry in entries:
+			queue_grade_entry(
+				student,
+				entry.get("course") or "",
+				entry.get("term") or "",
+				entry.get("grade") or "",
+				is_correction=bool(entry.get("is_correction")),
+			)
+
+
 def schedule_grade_flush() -> None:
 	if getattr(frappe.local, _FLUSH_REGISTERED, False):
 		return
@@ -79,6 +97,12 @@ def flush_grade_notifications() -> None:
 		setattr(frappe.local, _FLUSH_REGISTERED, False)
 
 
+def discard_grade_notifications() -> None:
+	"""Descarta los correos acumulados sin enviarlos (sus filas se revirtieron)."""
+	_clear_buffer()
+	setattr(frappe.local, _FLUSH_REGISTERED, False)
+
+
 def _flush_grade_notifications_impl() -> None:
 	if getattr(frappe.flags, "mute_emails", False):
 		_clear_buffer()
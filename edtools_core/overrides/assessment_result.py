@@ -0,0 +1,32 @@
+# Copyright (c) 2026, EdTools and contributors
+# Assessment Result: letras desde la escala cacheada (grading_scale_cache) en lugar de releer
+# Grading Scale Interval en cada guardado (imports de notas de miles de filas).
+
+from __future__ import annotations
+
+from frappe.utils import flt
+
+try:
+	from education.education.education.doctype.assessment_result.assessment_result import (
+		AssessmentResult as EducationAssessmentResult,
+	)
+except ImportError:
+	from education.education.doctype.assessment_result.assessment_result import (
+		AssessmentResult as EducationAssessmentResult,
+	)
+
+from edtools_core.grading_scale_cache import get_grade
+
+
+class AssessmentResult(EducationAssessmentResult):
+	def validate_grade(self):
+		"""Misma regla que Education (letra por criterio y total), con la escala precompilada."""
+		self.total_score = 0.0
+		for d in self.details:
+			d.grade = get_grade(self.grading_scale, (flt(d.score) / d.maximum_score) * 100) if flt(d.maximum_score) else ""
+			self.total_score += flt(d.score)
+		self.grade = (
+			get_grade(self.grading_scale, (self.total_score / self.maximum_score) * 100)
+			if flt(self.maximum_score)
+			else ""
+		)
@@ -0,0 +1,41 @@
+# Copyright (c) EdTools
+# IDs de Moodle persistidos al sincronizar: evita volver a buscar curso/usuario en Moodle
+# (suspensión LOA, desmatrícula al borrar Course Enrollment).
+
+import frappe
+
+FIELDS = (
+	{
+		"dt": "Course Enrollment",
+		"fieldname": "moodle_course_id",
+		"label": "Moodle Course ID",
+		"fieldtype": "Int",
+		"insert_after": "course",
+		"read_only": 1,
+		"no_copy": 1,
+		"allow_on_submit": 1,
+		"search_index": 1,
+		"description": "ID del curso en Moodle, guardado al matricular.",
+	},
+	{
+		"dt": "Student",
+		"fieldname": "moodle_user_id",
+		"label": "Moodle User ID",
+		"fieldtype": "Int",
+		"insert_after": "user",
+		"read_only": 1,
+		"no_copy": 1,
+		"description": "ID del usuario en Moodle, guardado al sincronizar.",
+	},
+)
+
+
+def execute():
+	for field in FIELDS:
+		label = f"{field['dt']}.{field['fieldname']}"
+		if frappe.db.exists("Custom Field", {"dt": field["dt"], "fieldname": field["fieldname"]}):
+			print(f"✓ {label}: already exists")
+			continue
+		frappe.get_doc({"doctype": "Custom Field", **field}).insert(ignore_permissions=True)
+		print(f"✓ {label}: created")
+	frappe.db.commit()
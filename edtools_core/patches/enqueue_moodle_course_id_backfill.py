@@ -0,0 +1,13 @@
+# Copyright (c) EdTools
+# Encola (una vez) el backfill de Course Enrollment.moodle_course_id para matrículas históricas.
+
+def execute():
+	from edtools_core.moodle_sync import enqueue_moodle_id_backfill_job
+
+	try:
+		enqueue_moodle_id_backfill_job()
+		print("✓ Moodle ID backfill: queued")
+	except Exception as e:
+		# Sin Redis/worker durante migrate: se puede lanzar luego con
+		# edtools_core.moodle_sync.enqueue_moodle_id_backfill
+		print(f"⚠ Moodle ID backfill: not queued ({e})")
@@ -0,0 +1,58 @@
+# Copyright (c) EdTools
+# Mueve los IDs de cursos LOA suspendidos guardados como JSON en Comment
+# ("moodle_loa_suspended_courses") a la DocType Moodle LOA Suspension y borra los Comments.
+
+import json
+
+import frappe
+
+_MARKER = "moodle_loa_suspended_courses"
+
+
+def execute():
+	from edtools_core.moodle_sync import LOA_SUSPENSION_DOCTYPE
+
+	comments = frappe.get_all(
+		"Comment",
+		filters={
+			"reference_doctype": "Student",
+			"comment_type": "Info",
+			"content": ["like", f"%{_MARKER}%"],
+		},
+		fields=["name", "reference_name", "content", "creation"],
+		order_by="creation desc",
+	)
+	migrated = 0
+	seen_students = set()
+	for c in comments:
+		# Solo el más reciente por estudiante es el vigente (igual que el lector anterior)
+		if c.reference_name in seen_students or not frappe.db.exists("Student", c.reference_name):
+			frappe.delete_doc("Comment", c.name, ignore_permissions=True, force=True)
+			continue
+		seen_students.add(c.reference_name)
+		try:
+			course_ids = [int(cid) for cid in json.loads(c.content).get(_MARKER, [])]
+		except (json.JSONDecodeError, TypeError, ValueError, AttributeError):
+			course_ids = []
+		existing = set(
+			frappe.get_all(
+				LOA_SUSPENSION_DOCTYPE,
+				filters={"student": c.reference_name, "status": "Suspended"},
+				pluck="moodle_course_id",
+			)
+		)
+		for course_id in dict.fromkeys(course_ids):
+			if course_id in existing:
+				continue
+			frappe.get_doc({
+				"doctype": LOA_SUSPENSION_DOCTYPE,
+				"student": c.reference_name,
+				"moodle_course_id": course_id,
+				"status": "Suspended",
+				"suspended_on": c.creation,
+			}).insert(ignore_permissions=True)
+			migrated += 1
+		frappe.delete_doc("Comment", c.name, ignore_permissions=True, force=True)
+
+	frappe.db.commit()
+	print(f"✓ Moodle LOA: {migrated} suspension(s) migrated from {len(comments)} comment(s)")
@@ -0,0 +1,87 @@
+// Copyright (c) 2026, EdTools and contributors
+// For license information, please see license.txt
+
+frappe.listview_settings["Student"] = frappe.listview_settings["Student"] || {};
+
+const edtools_student_list_onload = frappe.listview_settings["Student"].onload;
+
+frappe.listview_settings["Student"].onload = function (listview) {
+	if (edtools_student_list_onload) {
+		edtools_student_list_onload(listview);
+	}
+	if (!frappe.user.has_role(["System Manager", "Education Manager"])) {
+		return;
+	}
+
+	listview.page.add_action_item(__("Cambiar estado / sincronizar Moodle"), function () {
+		const students = listview.get_checked_items(true);
+		if (!students.length) {
+			frappe.msgprint(__("Selecciona al menos un estudiante."));
+			return;
+		}
+		const field = frappe.meta.get_docfield("Student", "student_status");
+		const dialog = new frappe.ui.Dialog({
+			title: __("Estado de {0} estudiante(s)", [students.length]),
+			fields: [
+				{
+					fieldname: "status",
+					fieldtype: "Select",
+					label: __("Nuevo estado"),
+					options: ["", ...((field && field.options) || "").split("\n").filter(Boolean)],
+					description: __("Vacío = solo re-sincronizar con Moodle el estado actual."),
+				},
+			],
+			primary_action_label: __("Aplicar"),
+			primary_action: function (values) {
+				dialog.hide();
+				frappe.call({
+					method: "edtools_core.moodle_status_bulk.start_bulk_status_sync",
+					args: { students: students, status: values.status || null },
+					freeze: true,
+					callback: function (r) {
+						const n = (r.message && r.message.students) || 0;
+						frappe.show_alert({
+							message: __("Sync de estado encolado: {0} estudiante(s)", [n]),
+							indicator: "blue",
+						});
+					},
+				});
+			},
+		});
+		dialog.show();
+	});
+
+	if (!listview._bulk_status_listener) {
+		listview._bulk_status_listener = true;
+		frappe.realtime.on("student_bulk_status_sync", function (data) {
+			show_bulk_status_summary(data);
+			listview.refresh();
+		});
+	}
+};
+
+function show_bulk_status_summary(data) {
+	const rows = Object.entries(data.results || {})
+		.filter(([, r]) => r.error || r.skipped || (r.failed_courses || []).length)
+		.map(([student, r]) => {
+			const detail = r.error || r.skipped || __("Cursos con error: {0}", [r.failed_courses.join(", ")]);
+			return `<tr><td>${frappe.utils.escape_html(student)}</td><td>${frappe.utils.escape_html(String(detail))}</td></tr>`;
+		})
+		.join("");
+	let html = `<p>${__("Total: {0} · OK: {1} · Omitidos: {2} · Con error: {3}", [
+		data.total,
+		data.ok,
+		data.skipped,
+		data.failed,
+	])}</p>`;
+	if (rows) {
+		html += `<table class="table table-bordered table-sm"><thead><tr><th>${__("Student")}</th><th>${__("Detalle")}</th></tr></thead><tbody>${rows}</tbody></table>`;
+		html += `<p class="text-muted small">${__("Los errores de Moodle se reintentan por el Integration Outbox.")}</p>`;
+	}
+	frappe.msgprint({
+		title: __("Sincronización de estado con Moodle"),
+		message: html,
+		indicator: data.failed ? "orange" : "green",
+		wide: true,
+	});
+}
@@ -0,0 +1,248 @@
+"""
+Rate limiter (token bucket) y circuit breaker para APIs externas (Moodle, Microsoft Graph).
+
+El estado vive en Redis, compartido por todos los procesos (gunicorn y workers RQ):
+
+- Token bucket por endpoint: `rate` fichas/seg, ráfaga máx. `burst`. Si no hay ficha se espera
+  hasta `max_wait` segundos; pasado eso se falla rápido con `ServiceThrottled`.
+- Circuit breaker por endpoint:
+  closed -> (N fallos de transporte seguidos: conexión, timeout, HTTP 5xx/429) -> open
+  open -> (pasados `open_seconds`) -> half-open: una sola llamada de prueba
+  half-open -> éxito: closed | fallo: open de nuevo.
+  Con el circuito abierto se falla de inmediato con `CircuitOpenError` (sin esperar el timeout).
+
+Los errores de aplicación (Moodle responde JSON con "exception", Graph 4xx) no abren el circuito.
+El Integration Outbox difiere las operaciones que fallan con `ServiceUnavailable` sin consumir
+intentos (ver `integration_outbox.process_one`).
+
+Config (env o site_config), por endpoint (`moodle`, `graph`):
+  <ENDPOINT>_RATE_LIMIT_PER_SEC / <endpoint>_rate_limit_per_sec
+  <ENDPOINT>_RATE_LIMIT_BURST / <endpoint>_rate_limit_burst
+  <ENDPOINT>_RATE_LIMIT_MAX_WAIT / <endpoint>_rate_limit_max_wait (seg)
+  <ENDPOINT>_CIRCUIT_FAILURES / <endpoint>_circuit_failures
+  <ENDPOINT>_CIRCUIT_OPEN_SECONDS / <endpoint>_circuit_open_seconds
+Si Redis no responde, no se limita (fail-open).
+"""
+
+import os
+import time
+from typing import Any, Callable, Dict
+
+import frappe
+
+_DEFAULTS: Dict[str, Dict[str, float]] = {
+    "moodle": {"rate_limit_per_sec": 20, "rate_limit_burst": 40, "rate_limit_max_wait": 5,
+               "circuit_failures": 5, "circuit_open_seconds": 30},
+    "graph": {"rate_limit_per_sec": 10, "rate_limit_burst": 20, "rate_limit_max_wait": 5,
+              "circuit_failures": 5, "circuit_open_seconds": 60},
+}
+_FALLBACK = {"rate_limit_per_sec": 10, "rate_limit_burst": 20, "rate_limit_max_wait": 5,
+             "circuit_failures": 5, "circuit_open_seconds": 30}
+
+_BUCKET_PREFIX = "edtools_ratelimit::"
+_CIRCUIT_PREFIX = "edtools_circuit::"
+
+# Devuelve 0 si tomó una ficha; si no, los ms a esperar para la siguiente.
+_TOKEN_BUCKET_LUA = """
+local key = KEYS[1]
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now_ms = tonumber(ARGV[3])
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+  tokens = burst
+  ts = now_ms
+end
+tokens = math.min(burst, tokens + (now_ms - ts) * rate / 1000.0)
+local wait_ms = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait_ms = math.ceil((1 - tokens) * 1000.0 / rate)
+end
+redis.call('HSET', key, 'tokens', tokens, 'ts', now_ms)
+redis.call('PEXPIRE', key, math.ceil(burst * 1000.0 / rate) + 1000)
+return wait_ms
+"""
+
+
+class ServiceUnavailable(frappe.ValidationError):
+    """Servicio externo no disponible por ahora (circuito abierto o límite de tasa)."""
+
+    def __init__(self, message: str, *, endpoint: str, retry_after: float):
+        super().__init__(message)
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(ServiceUnavailable):
+    pass
+
+
+class ServiceThrottled(ServiceUnavailable):
+    pass
+
+
+def _setting(endpoint: str, name: str) -> float:
+    raw = os.getenv(f"{endpoint}_{name}".upper())
+    if raw is None or not str(raw).strip():
+        raw = frappe.conf.get(f"{endpoint}_{name}")
+    try:
+        return float(raw)
+    except (TypeError, ValueError):
+        return float(_DEFAULTS.get(endpoint, _FALLBACK)[name])
+
+
+# ------------------------------------------------------------
+# Token bucket
+# ------------------------------------------------------------
+
+def acquire(endpoint: str) -> None:
+    """Toma una ficha del bucket del endpoint (esperando hasta max_wait); si no, ServiceThrottled."""
+    rate = _setting(endpoint, "rate_limit_per_sec")
+    if rate <= 0:
+        return
+    burst = max(1.0, _setting(endpoint, "rate_limit_burst"))
+    deadline = time.monotonic() + max(0.0, _setting(endpoint, "rate_limit_max_wait"))
+    key = frappe.cache.make_key(_BUCKET_PREFIX + endpoint)
+    while True:
+        try:
+            wait_ms = int(frappe.cache.eval(_TOKEN_BUCKET_LUA, 1, key, rate, burst, int(time.time() * 1000)))
+        except Exception:
+            return
+        if wait_ms <= 0:
+            return
+        if time.monotonic() + wait_ms / 1000 > deadline:
+            raise ServiceThrottled(
+                f"{endpoint}: límite de solicitudes alcanzado; reintentar más tarde",
+                endpoint=endpoint,
+                retry_after=wait_ms / 1000,
+            )
+        time.sleep(wait_ms / 1000)
+
+
+# ------------------------------------------------------------
+# Circuit breaker
+# ------------------------------------------------------------
+
+def _circuit_key(endpoint: str) -> str:
+    return frappe.cache.make_key(_CIRCUIT_PREFIX + endpoint)
+
+
+def _redis(*commands) -> list:
+    """Ejecuta comandos Redis crudos (sin el prefijo/pickle de RedisWrapper) en un pipeline."""
+    pipe = frappe.cache.pipeline()
+    for name, *args in commands:
+        getattr(pipe, name)(*args)
+    return pipe.execute()
+
+
+def get_state(endpoint: str) -> Dict[str, Any]:
+    """{"state": closed|open|half-open, "failures", "opened_at", "retry_after"}"""
+    try:
+        raw = _redis(("hgetall", _circuit_key(endpoint)))[0] or {}
+    except Exception:
+        raw = {}
+    data = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+            for k, v in raw.items()}
+    failures = int(data.get("failures") or 0)
+    opened_at = float(data.get("opened_at") or 0)
+    if not opened_at:
+        return {"state": "closed", "failures": failures, "opened_at": None, "retry_after": 0}
+    remaining = opened_at + _setting(endpoint, "circuit_open_seconds") - time.time()
+    return {
+        "state": "open" if remaining > 0 else "half-open",
+        "failures": failures,
+        "opened_at": opened_at,
+        "retry_after": max(0.0, remaining),
+    }
+
+
+def before_call(endpoint: str) -> None:
+    """Falla rápido si el circuito está abierto; en half-open deja pasar una sola prueba. Luego rate limit."""
+    state = get_state(endpoint)
+    if state["state"] == "open":
+        raise CircuitOpenError(
+            f"{endpoint}: servicio no disponible (circuito abierto); reintentar en {int(state['retry_after']) + 1} s",
+            endpoint=endpoint,
+            retry_after=state["retry_after"],
+        )
+    if state["state"] == "half-open":
+        probe_ttl = max(5, int(_setting(endpoint, "circuit_open_seconds")))
+        try:
+            got_probe = _redis(("set", _circuit_key(endpoint) + "::probe", 1, probe_ttl, None, True))[0]
+        except Exception:
+            got_probe = True
+        if not got_probe:
+            raise CircuitOpenError(
+                f"{endpoint}: servicio en recuperación (prueba en curso); reintentar en unos segundos",
+                endpoint=endpoint,
+                retry_after=5,
+            )
+    acquire(endpoint)
+
+
+def record_success(endpoint: str) -> None:
+    """Cierra el circuito y reinicia el contador de fallos seguidos."""
+    try:
+        key = _circuit_key(endpoint)
+        _redis(("delete", key, key + "::probe"))
+    except Exception:
+        pass
+
+
+def record_failure(endpoint: str) -> None:
+    try:
+        key = _circuit_key(endpoint)
+        threshold = max(1, int(_setting(endpoint, "circuit_failures")))
+        was_open, failures = _redis(("hget", key, "opened_at"), ("hincrby", key, "failures", 1))
+        commands = [("expire", key, 24 * 3600)]
+        if was_open or failures >= threshold:
+            # Abre (o re-abre tras una prueba fallida en half-open)
+            commands += [("hset", key, "opened_at", time.time()), ("delete", key + "::probe")]
+            if not was_open:
+                frappe.logger().warning(f"Circuit breaker {endpoint}: abierto tras {failures} fallos seguidos")
+        _redis(*commands)
+    except Exception:
+        pass
+
+
+def is_transport_failure(response: Any = None, exc: BaseException | None = None) -> bool:
+    """Fallos que cuentan para el circuito: conexión/timeout, HTTP 5xx y 429."""
+    if exc is not None:
+        import requests
+
+        return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+    status = getattr(response, "status_code", 200)
+    return status >= 500 or status == 429
+
+
+def call(endpoint: str, fn: Callable[[], Any]) -> Any:
+    """Ejecuta `fn()` (una llamada HTTP que retorna requests.Response) con rate limit y circuito."""
+    before_call(endpoint)
+    try:
+        response = fn()
+    except Exception as e:
+        if is_transport_failure(exc=e):
+            record_failure(endpoint)
+        raise
+    if is_transport_failure(response):
+        record_failure(endpoint)
+    else:
+        record_success(endpoint)
+    return response
+
+
+@frappe.whitelist()
+def get_circuit_states():
+    frappe.only_for(("System Manager", "Education Manager"))
+    return {endpoint: get_state(endpoint) for endpoint in _DEFAULTS}
+
+
+@frappe.whitelist()
+def reset_circuit(endpoint):
+    frappe.only_for("System Manager")
+    record_success(endpoint)
+    return get_state(endpoint)
@@ -11,6 +11,8 @@ from frappe import _
 from frappe.query_builder.functions import Sum
 from frappe.utils import flt, getdate, today
 
+from edtools_core import tracing
+
 
 def _get_program_for_fee(fee_name):
 	"""Get program name from Fee -> Fee Schedule -> program."""
@@ -426,12 +428,14 @@ def _create_payment_entry_for_stripe(student_name, payment_intent_id, paid_amoun
 
 	Idempotent: if a PE already exists with reference_no = payment_intent_id (draft or submitted), return it.
 	"""
-	# DEBUG: entrada
-	frappe.log_error(
-		title="Stripe PE DEBUG _create_payment_entry_for_stripe entry",
-		message=f"student_name={student_name!r} payment_intent_id={payment_intent_id!r} paid_amount={paid_amount} starting_fee_name={starting_fee_name!r}",
+	tracing.debug(
+		"stripe",
+		"create payment entry",
+		student_name=student_name,
+		payment_intent_id=payment_intent_id,
+		paid_amount=paid_amount,
+		starting_fee_name=starting_fee_name,
 	)
-	frappe.db.commit()
 
 	existing = frappe.db.get_all(
 		"Payment Entry",
@@ -439,19 +443,16 @@ def _create_payment_entry_for_stripe(student_name, payment_intent_id, paid_amoun
 		limit=1,
 	)
 	if existing:
-		frappe.log_error(
-			title="Stripe PE DEBUG idempotent skip",
-			message=f"Ya existe Payment Entry {existing[0].name} con reference_no={payment_intent_id!r}",
+		tracing.info(
+			"stripe",
+			"Payment Entry ya existe (idempotente)",
+			payment_entry=existing[0].name,
+			payment_intent_id=payment_intent_id,
 		)
-		frappe.db.commit()
 		return existing[0].name
 
 	breakdown = get_fee_cascade_breakdown(student_name, paid_amount, starting_fee_name)
-	frappe.log_error(
-		title="Stripe PE DEBUG cascade breakdown",
-		message=f"breakdown len={len(breakdown) if breakdown else 0} items={json.dumps(breakdown, default=str) if breakdown else '[]'}",
-	)
-	frappe.db.commit()
+	tracing.debug("stripe", "cascade breakdown", items=breakdown or [])
 	if not breakdown:
 		frappe.log_error(
 			title="Stripe webhook: no cascade breakdown",
@@ -505,21 +506,16 @@ def _create_payment_entry_for_stripe(student_name, payment_intent_id, paid_amoun
 			"allocated_amount": row["allocated_amount"],
 		})
 
-	# DEBUG: antes de insert
-	frappe.log_error(
-		title="Stripe PE DEBUG before insert",
-		message=(
-			f"party={pe.party} company={pe.company} paid_from={pe.paid_from} paid_to={pe.paid_to} "
-			f"paid_amount={pe.paid_amount} references_count={len(pe.references)}"
-		),
-	)
-	frappe.db.commit()
 	pe.insert(ignore_permissions=True)
-	frappe.log_error(
-		title="Stripe PE DEBUG after insert (draft)",
-		message=f"PE name={pe.name} docstatus={pe.docstatus}",
-	)
 	frappe.db.commit()
+	tracing.info(
+		"stripe",
+		"Payment Entry creado (borrador)",
+		payment_entry=pe.name,
+		party=pe.party,
+		paid_amount=pe.paid_amount,
+		references_count=len(pe.references),
+	)
 	return pe.name
 
 
@@ -599,21 +595,14 @@ def finalize_payment_and_get_volante(fee_name, payment_intent_id):
 
 
 @frappe.whitelist(allow_guest=True)
+@tracing.trace_context("stripe.webhook")
 def stripe_webhook():
 	"""
 	Stripe webhook endpoint. Configure in Stripe Dashboard:
 	URL: https://cucuniversity.edtools.co/api/method/edtools_core.stripe_payment.stripe_webhook
 	Events: payment_intent.succeeded
 	"""
-	try:
-		# Primera línea: confirmar que la petición llegó (buscar "Stripe webhook ENTRY" en Error Log)
-		frappe.log_error(
-			title="Stripe webhook ENTRY",
-			message=f"Webhook endpoint called. Site: {getattr(frappe.local, 'site', None)}",
-		)
-		frappe.db.commit()
-	except Exception:
-		pass  # si falla el log, seguir para no ocultar el error real
+	tracing.info("stripe", "webhook recibido")
 
 	import stripe
 
@@ -674,17 +663,14 @@ def stripe_webhook():
 			student_name = metadata.get("student_name")
 			amount_received = (pi.get("amount_received") or pi.get("amount")) / 100.0  # cents to units
 
-			# DEBUG: ver en Error Log que el webhook llegó y qué metadata trae
-			frappe.log_error(
-				title="Stripe webhook DEBUG received",
-				message=(
-					f"event_id={event.get('id')} type={event.get('type')}\n"
-					f"payment_intent_id={payment_intent_id}\n"
-					f"metadata={json.dumps(metadata)}\n"
-					f"fee_name={fee_name!r} student_name={student_name!r} amount_received={amount_received}"
-				),
+			tracing.info(
+				"stripe",
+				"payment_intent.succeeded",
+				event_id=event.get("id"),
+				payment_intent_id=payment_intent_id,
+				metadata=metadata,
+				amount_received=amount_received,
 			)
-			frappe.db.commit()
 
 			if not student_name or not fee_name:
 				frappe.log_error(
@@ -697,11 +683,13 @@ def stripe_webhook():
 					pe_name = _create_payment_entry_for_stripe(
 						student_name, payment_intent_id, amount_received, fee_name
 					)
-					frappe.log_error(
-						title="Stripe webhook success",
-						message=f"Payment Entry {pe_name} for student {student_name} amount={amount_received}",
+					tracing.info(
+						"stripe",
+						"webhook procesado",
+						payment_entry=pe_name,
+						student_name=student_name,
+						amount_received=amount_received,
 					)
-					frappe.db.commit()
 				except Exception:
 					frappe.log_error(
 						title="Stripe webhook create PE failed",
@@ -710,11 +698,7 @@ def stripe_webhook():
 					frappe.db.commit()
 					frappe.db.rollback()
 		else:
-			frappe.log_error(
-				title="Stripe webhook DEBUG event ignored",
-				message=f"event_id={event.get('id')} type={event.get('type')} (solo procesamos payment_intent.succeeded)",
-			)
-			frappe.db.commit()
+			tracing.debug("stripe", "evento ignorado", event_id=event.get("id"), type=event.get("type"))
 
 		frappe.local.response["http_status_code"] = 200
 		return "OK"
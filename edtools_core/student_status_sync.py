@@ -0,0 +1,79 @@
+"""
+Sincronización del estado del estudiante (Moodle + Azure) fuera del guardado.
+
+Los doc_events de Student solo registran la intención en el Integration Outbox (misma transacción
+del guardado); los workers del outbox la ejecutan con reintentos. Si se acumulan varios guardados
+antes de que se procese, la fila pendiente se actualiza en lugar de duplicarse: se aplica el
+último estado, conservando el estado previo más antiguo (es el que importa para las transiciones
+de licencia en Azure).
+"""
+
+import frappe
+
+from edtools_core.integration_outbox import enqueue_operation
+
+
+def _keep_first_old_status(pending: dict, new: dict) -> dict:
+    return {**new, "old_status": pending.get("old_status", new.get("old_status"))}
+
+
+def moodle_student_status_key(student: str) -> str:
+    return f"moodle_status:{student}"
+
+
+def enqueue_moodle_student_status(student: str, status: str | None = None, not_before=None) -> str:
+    """Registra en el outbox el sync de estado a Moodle del Student (se aplica su estado actual)."""
+    return enqueue_operation(
+        "moodle.student_status",
+        moodle_student_status_key(student),
+        {"student": student, "status": status},
+        reference_doctype="Student",
+        reference_name=student,
+        not_before=not_before,
+    )
+
+
+def enqueue_student_status_sync(doc, method=None):
+    """doc_event (Student on_update / after_insert): registra Moodle y Azure en el outbox."""
+    old_status = getattr(frappe.flags, "student_old_status_before_save", None)
+    new_status = getattr(doc, "student_status", None)
+
+    # Cambio masivo (moodle_status_bulk): la fila se escribe igual, diferida hasta después del sync
+    # en bloque, que la cierra; si el job muere antes, el outbox la ejecuta al vencer.
+    enqueue_moodle_student_status(doc.name, new_status, not_before=frappe.flags.bulk_status_sync_not_before)
+    if (old_status or "").strip() != (new_status or "").strip():
+        enqueue_operation(
+            "azure.student_license",
+            f"azure_license:{doc.name}",
+            {"student": doc.name, "old_status": old_status, "new_status": new_status},
+            reference_doctype="Student",
+            reference_name=doc.name,
+            merge=_keep_first_old_status,
+        )
+
+
+def run_moodle_student_status(payload: dict) -> None:
+    """Handler del outbox: aplica en Moodle el estado ACTUAL del Student (no el del payload)."""
+    from edtools_core.moodle_sync import sync_student_status_to_moodle
+
+    student = payload.get("student")
+    if not student or not frappe.db.exists("Student", student):
+        return
+    sync_student_status_to_moodle(frappe.get_doc("Student", student), raise_errors=True)
+
+
+def run_azure_student_license(payload: dict) -> None:
+    """Handler del outbox: transición de licencia M365 (estado previo original -> estado actual)."""
+    from edtools_core.azure_provisioning import sync_student_azure_license
+
+    student = payload.get("student")
+    if not student or not frappe.db.exists("Student", student):
+        return
+    user, status = frappe.db.get_value("Student", student, ["user", "student_status"])
+    sync_student_azure_license(
+        student=student,
+        user=user,
+        old_status=payload.get("old_status"),
+        new_status=status,
+        raise_errors=True,
+    )
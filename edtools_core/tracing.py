@@ -0,0 +1,117 @@
+"""
+Trazas de diagnóstico estructuradas (JSON por línea) fuera del Error Log.
+
+Error Log queda para errores reales: cada `frappe.log_error` es un INSERT (y a menudo un commit)
+dentro del request. Las trazas de depuración van a `logs/edtools_trace.log` del bench vía
+`frappe.logger` (escritura a archivo, sin BD).
+
+- Niveles: DEBUG < INFO < WARNING < ERROR. Mínimo: EDTOOLS_TRACE_LEVEL / edtools_trace_level
+  (por defecto INFO).
+- Muestreo por operación: EDTOOLS_TRACE_SAMPLE_RATE / edtools_trace_sample_rate (0..1, por
+  defecto 1). Se decide al abrir `trace_context`, así una operación se traza completa o nada.
+  WARNING y ERROR se escriben siempre.
+- Correlation id: `trace_context("operacion", **campos)` (como `with` o decorador) asigna un id
+  que llevan todas las trazas emitidas dentro; los contextos anidados heredan el del padre.
+
+Uso:
+    with trace_context("moodle.student_status", student=doc.name):
+        tracing.debug("moodle_sync", "suspend_user_enrolments OK", ok=3)
+"""
+
+import contextvars
+import json
+import os
+import random
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import frappe
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+_LOGGER_NAME = "edtools_trace"
+
+_context: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "edtools_trace_context", default=None
+)
+
+
+def _setting(env_key: str, conf_key: str, default: str) -> str:
+    raw = os.getenv(env_key)
+    if raw is None or not str(raw).strip():
+        raw = frappe.conf.get(conf_key) if getattr(frappe.local, "conf", None) is not None else None
+    return str(raw).strip() if raw is not None and str(raw).strip() else default
+
+
+def _min_level() -> int:
+    return LEVELS.get(_setting("EDTOOLS_TRACE_LEVEL", "edtools_trace_level", "INFO").upper(), LEVELS["INFO"])
+
+
+def _sample_rate() -> float:
+    try:
+        return min(1.0, max(0.0, float(_setting("EDTOOLS_TRACE_SAMPLE_RATE", "edtools_trace_sample_rate", "1"))))
+    except ValueError:
+        return 1.0
+
+
+@contextmanager
+def trace_context(operation: str, **fields):
+    """Abre (o hereda) un correlation id para las trazas de la operación."""
+    parent = _context.get()
+    if parent:
+        ctx = {**parent, "fields": {**parent["fields"], **fields}}
+    else:
+        ctx = {
+            "correlation_id": uuid.uuid4().hex[:16],
+            "operation": operation,
+            "sampled": random.random() < _sample_rate(),
+            "fields": fields,
+        }
+    token = _context.set(ctx)
+    try:
+        yield ctx["correlation_id"]
+    finally:
+        _context.reset(token)
+
+
+def correlation_id() -> Optional[str]:
+    ctx = _context.get()
+    return ctx["correlation_id"] if ctx else None
+
+
+def emit(component: str, message: str, level: str = "DEBUG", **fields) -> None:
+    """Escribe una traza JSON si pasa el nivel mínimo y el muestreo. Nunca lanza."""
+    try:
+        levelno = LEVELS.get(level, LEVELS["DEBUG"])
+        if levelno < _min_level():
+            return
+        ctx = _context.get()
+        if ctx and not ctx["sampled"] and levelno < LEVELS["WARNING"]:
+            return
+        record = {
+            "level": level,
+            "component": component,
+            "msg": message,
+            "correlation_id": ctx["correlation_id"] if ctx else None,
+            "operation": ctx["operation"] if ctx else None,
+            "site": getattr(frappe.local, "site", None),
+            "user": getattr(getattr(frappe.local, "session", None), "user", None),
+            **(ctx["fields"] if ctx else {}),
+            **fields,
+        }
+        logger = frappe.logger(_LOGGER_NAME, allow_site=True, file_count=10)
+        logger.log(levelno, json.dumps(record, default=str, ensure_ascii=False))
+    except Exception:
+        pass
+
+
+def debug(component: str, message: str, **fields) -> None:
+    emit(component, message, "DEBUG", **fields)
+
+
+def info(component: str, message: str, **fields) -> None:
+    emit(component, message, "INFO", **fields)
+
+
+def warning(component: str, message: str, **fields) -> None:
+    emit(component, message, "WARNING", **fields)